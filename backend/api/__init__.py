@@ -5,6 +5,7 @@ enumerations for personas or banned topics.
 """
 
 from enum import Enum
+from typing import Dict, Optional
 
 
 class Persona(str, Enum):
@@ -20,6 +21,23 @@ class Persona(str, Enum):
     KAREN_2_0 = "karen2.0"
     PROFESSOR_LOGIC = "professorlogic"
 
+    @classmethod
+    def parse(cls, value: Optional[str], default: Optional["Persona"] = None) -> "Persona":
+        """Look up a persona by value or front-end alias.
+
+        The React app names its personas by style ("methodical", "pragmatic",
+        "ethical"); these map onto the closest backend persona. Unknown
+        values fall back to ``default`` (Socrates if not given).
+        """
+        key = (value or "").strip().lower()
+        try:
+            return cls(key)
+        except ValueError:
+            pass
+        if key in PERSONA_ALIASES:
+            return cls(PERSONA_ALIASES[key])
+        return default if default is not None else cls.SOCRATES
+
     @property
     def system_description(self) -> str:
         """Return a one-sentence description for the persona used in prompts."""
@@ -42,14 +60,60 @@ class Persona(str, Enum):
             )
         return ""
 
+    @property
+    def stock_lines(self) -> Dict[str, str]:
+        """Return the persona's fixed lines, keyed by when they are spoken.
+
+        These never depend on the debate, so their speech is synthesised
+        ahead of time (see ``api.persona_assets``).
+        """
+        return PERSONA_LINES[self.value]
+
+
+# Lines each persona speaks outside of a rebuttal: ``greeting`` opens a
+# debate, ``thinking`` covers the wait for the first rebuttal, ``refusal``
+# answers a stance the guardrails block and ``apology`` a failed turn.
+PERSONA_LINES: Dict[str, Dict[str, str]] = {
+    "socrates": {
+        "greeting": "Greetings, friend. State your position, and let us examine it together.",
+        "thinking": "An interesting claim. Let us see whether it survives a few questions.",
+        "refusal": "That is not a subject I will examine with you. Shall we take up another question?",
+        "apology": "Forgive me, my thoughts escaped me for a moment. Would you say that again?",
+    },
+    "karen2.0": {
+        "greeting": "Okay, go ahead. Tell me what you think, and I will tell you why it is wrong.",
+        "thinking": "Wow. Okay. I have some thoughts about that.",
+        "refusal": "No. I am not discussing that. Pick something else.",
+        "apology": "Ugh, something went wrong on my end. Try that again.",
+    },
+    "professorlogic": {
+        "greeting": "Good day. Present your thesis, and we shall test its premises one by one.",
+        "thinking": "Let us break that argument down into its premises.",
+        "refusal": "That topic falls outside the bounds of this seminar. Please choose another thesis.",
+        "apology": "A technical difficulty has interrupted the lecture. Please repeat your point.",
+    },
+}
+
 
 # Keywords which the model should avoid discussing. Update this set to adjust
-# the guardrails for unacceptable content. These are matched case-insensitively.
+# the guardrails for unacceptable content. These are matched from the start
+# of a word after case, accent and leetspeak folding (see ``api.guardrails``);
+# a trailing ``*`` matches any word starting with the term. The built-in terms
+# all carry one, so "self-harming" and "explosives" stay blocked as they were
+# when the list was matched as substrings. Deployments can add terms without
+# a code change via ``BANNED_TOPICS_FILE``.
 BANNED_TOPICS = [
-    "self-harm",
-    "violent act",
-    "illicit drug",
-    "explosive",
-    "hack into",
-    "malware",
-]
\ No newline at end of file
+    "self-harm*",
+    "violent act*",
+    "illicit drug*",
+    "explosive*",
+    "hack into*",
+    "malware*",
+]
+
+# Persona names used by the React front-end, mapped to backend persona values.
+PERSONA_ALIASES = {
+    "methodical": "professorlogic",
+    "pragmatic": "karen2.0",
+    "ethical": "socrates",
+}
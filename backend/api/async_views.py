@@ -0,0 +1,480 @@
+"""Asynchronous versions of the devdebate API views.
+
+The synchronous views in ``api.views`` hold a worker thread for as long as
+OpenAI or ElevenLabs take to answer, which caps concurrency at the number of
+WSGI workers. The coroutine views below do the same work but await the
+upstream calls through a shared ``httpx.AsyncClient``, so a single ASGI
+process can keep thousands of debates in flight.
+
+Request validation, prompt building and transcript handling are shared with
+``api.views``; only the upstream I/O differs. Session store and job queue
+operations run in a worker thread (``asyncio.to_thread``): they are usually
+short SQLite statements, but one that waits on a lock can block for up to
+the connection's busy timeout, which would stall every request on the event
+loop. ``api/urls.py`` routes to this
+module when ``settings.ASYNC_VIEWS`` is enabled, which ``devdebate/asgi.py``
+does by default.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import io
+import time
+from typing import IO, Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Union
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import Persona, audio_formats, audio_prep, instrument, media, metrics, turns, views
+from .backends import get_backend
+from .fanout import aiter_completed
+from .persona_assets import get_bundle as get_persona_bundle
+from .response_cache import get_response_cache
+from .singleflight import payload_key
+from .stt_upload import AudioRejected, file_digest, receive_audio
+from .tts_cache import get_cache as get_tts_cache
+from .tts_stream import aiter_synthesized, split_sentences
+
+
+async def complete_rebuttal(backend: Any, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Async counterpart of :func:`api.views.complete_rebuttal`."""
+    with views.backend_span("chat", backend, body["model"]):
+        content = await backend.acomplete(body)
+    parsed = views.read_model_output(content)
+    if not views.needs_continuation(parsed):
+        return views.accept_model_output(parsed)
+    try:
+        with views.backend_span("chat", backend, body["model"]):
+            content += await backend.acomplete(views.continuation_request_body(body, content))
+    except Exception:
+        metrics.inc("chat_continuation_errors_total")
+        return views.accept_model_output(parsed)
+    return views.accept_model_output(views.read_model_output(content) or parsed, continued=True)
+
+
+async def call_openai_chat(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Async counterpart of :func:`api.views.call_openai_chat`."""
+    backend = get_backend("chat")
+    body = views.chat_request_body(messages)
+
+    async def call() -> Dict[str, Any]:
+        return await complete_rebuttal(backend, body)
+
+    return dict(await views.chat_flight.ado(payload_key(backend.model_id, body), call))
+
+
+async def stream_chat(body: Dict[str, Any]) -> AsyncIterator[str]:
+    """Async counterpart of :func:`api.views.stream_chat`."""
+    backend = get_backend("chat")
+    with views.backend_span("chat", backend, body["model"]):
+        async for delta in backend.astream(body):
+            yield delta
+
+
+async def stream_openai_chat(messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Async counterpart of :func:`api.views.stream_openai_chat`."""
+    async for delta in stream_chat(views.chat_request_body(messages)):
+        yield delta
+
+
+async def generate_rebuttal(messages: List[Dict[str, Any]], persona: Persona) -> Dict[str, Any]:
+    """Async counterpart of :func:`api.views.generate_rebuttal`."""
+    scope = views.rebuttal_cache_scope(messages, persona)
+    if scope is None:
+        return await call_openai_chat(messages)
+    cache = get_response_cache()
+    stance = messages[1]["content"]
+    # The semantic tier scores every entry sharing vocabulary with the stance
+    model_response = await asyncio.to_thread(cache.get, scope, stance)
+    if model_response is None:
+        model_response = await call_openai_chat(messages)
+        await asyncio.to_thread(cache.put, scope, stance, model_response)
+    return model_response
+
+
+async def stream_rebuttal_events(
+    sid: str,
+    messages: List[Dict[str, Any]],
+    started: float,
+    persona: Optional[Persona] = None,
+    make_event: Callable[[str, Dict[str, Any]], Any] = views.sse_event,
+    turn: Optional[turns.Turn] = None,
+) -> AsyncIterator[Any]:
+    """Async counterpart of :func:`api.views.stream_rebuttal_events`."""
+    state = views.RebuttalStream(sid, started, messages, persona, make_event, turn)
+    cached = await asyncio.to_thread(state.cached_events)
+    if cached is not None:
+        for event in cached:
+            yield event
+        return
+    try:
+        async with contextlib.aclosing(stream_openai_chat(messages)) as chunks:
+            async for chunk in chunks:
+                event = state.on_chunk(chunk)
+                if event:
+                    yield event
+    except Exception as e:
+        yield state.fail(e)
+        return
+    continuation = state.continuation()
+    if continuation is not None:
+        try:
+            async with contextlib.aclosing(stream_chat(continuation)) as chunks:
+                async for chunk in chunks:
+                    event = state.on_chunk(chunk)
+                    if event:
+                        yield event
+        except Exception:
+            metrics.inc("chat_continuation_errors_total")
+    yield await asyncio.to_thread(state.finish)
+
+
+async def call_elevenlabs_tts(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> str:
+    """Async counterpart of :func:`api.views.call_elevenlabs_tts`.
+
+    Cache misses write the audio to disk in a worker thread so the event
+    loop is not blocked by file I/O.
+    """
+    cache = get_tts_cache()
+    key = views.tts_cache_key(text, voice_id, audio_format)
+    extension = audio_formats.get_format(audio_format).extension
+    # Answered from the bundle's manifest in memory, without touching the disk
+    bundled = get_persona_bundle().lookup(key, extension)
+    if bundled is not None:
+        return get_persona_bundle().url_for(bundled)
+    await cache.afetch(key, lambda: synthesize_speech(text, voice_id, audio_format), extension)
+    return cache.url_for(key, extension)
+
+
+async def cached_speech(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> bytes:
+    """Async counterpart of :func:`api.views.cached_speech`."""
+    key = views.tts_cache_key(text, voice_id, audio_format)
+    extension = audio_formats.get_format(audio_format).extension
+    path = get_persona_bundle().lookup(key, extension)  # in memory, like call_elevenlabs_tts
+    if path is None:
+        path, _ = await get_tts_cache().afetch(key, lambda: synthesize_speech(text, voice_id, audio_format), extension)
+    return await asyncio.to_thread(path.read_bytes)
+
+
+async def synthesize_speech(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> bytes:
+    """Async counterpart of :func:`api.views.synthesize_speech`."""
+    backend = get_backend("tts")
+    fmt = audio_formats.get_format(audio_format)
+    if fmt is audio_formats.MP3:
+        with views.backend_span("tts", backend):
+            return audio_formats.produced(fmt, await backend.asynthesize(text, voice_id), "native")
+    output_format = audio_formats.native_format(backend, fmt)
+    if output_format:
+        try:
+            with views.backend_span("tts", backend):
+                audio = await backend.asynthesize(text, voice_id, output_format)
+            return audio_formats.produced(fmt, audio, "native")
+        except Exception as e:
+            if not audio_formats.refuse_native(backend, fmt, e):
+                raise
+    mp3 = await cached_speech(text, voice_id)
+    return audio_formats.produced(fmt, await audio_formats.atranscode(mp3, fmt), "transcoded", mp3)
+
+
+async def stream_tts_events(segments: List[str], voice_id: str, state: views.TtsStream) -> AsyncIterator[Any]:
+    """Async counterpart of :func:`api.views.stream_tts_events`."""
+    audio_format = state.format.name
+    try:
+        async for index, text, audio in aiter_synthesized(
+            segments,
+            lambda segment: cached_speech(segment, voice_id, audio_format),
+            settings.TTS_STREAM_PARALLELISM,
+        ):
+            yield state.on_segment(index, text, audio)
+    except Exception as e:
+        event = state.fail(e)
+        if event:
+            yield event
+        return
+    event = state.finish()
+    if event:
+        yield event
+
+
+async def call_openai_whisper(audio: Union[bytes, IO[bytes]], mime_type: str, digest: Optional[str] = None) -> str:
+    """Async counterpart of :func:`api.views.call_openai_whisper`."""
+    backend = get_backend("stt")
+    if digest is None and not isinstance(audio, bytes):
+        digest = await asyncio.to_thread(file_digest, audio)
+
+    async def call() -> str:
+        with views.backend_span("stt", backend):
+            return await backend.atranscribe(audio, mime_type)
+
+    return await views.whisper_flight.ado(views.whisper_key(audio, mime_type, digest), call)
+
+
+async def transcribe(audio: IO[bytes], mime_type: str, digest: Optional[str] = None) -> str:
+    """Async counterpart of :func:`api.views.transcribe`."""
+    with instrument.span("stt_prep"):
+        prepared = await audio_prep.aprepare(audio, mime_type)
+    if prepared is not None:
+        return await call_openai_whisper(prepared.audio, prepared.mime_type)
+    return await call_openai_whisper(audio, mime_type, digest)
+
+
+@csrf_exempt
+async def rebuttal(request: HttpRequest) -> HttpResponse:
+    """Generate a rebuttal; see :func:`api.views.rebuttal`."""
+    started = time.perf_counter()
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    error, stance, persona, session_id = views.parse_rebuttal_body(body)
+    if error is not None:
+        return error
+    sid = await asyncio.to_thread(views.ensure_session, session_id)
+    queue = turns.get_turn_queue()
+    try:
+        turn = await queue.abegin(sid, bool(body.get("queue")))
+    except turns.TurnRejected as e:
+        return views.turn_rejected_response(e, sid)
+    async with turns.aholding(queue, turn):
+        messages = await asyncio.to_thread(views.open_turn, sid, stance, persona, turn=turn)
+        if views.wants_event_stream(request, body):
+            events = stream_rebuttal_events(sid, messages, started, persona, turn=turn)
+            return views.event_stream_response(turns.AsyncTurnStream(queue, turn, events))
+        try:
+            model_response = await generate_rebuttal(messages, persona)
+        except Exception as e:
+            return views.upstream_error_response(e)
+        return JsonResponse(await asyncio.to_thread(views.record_rebuttal, sid, model_response))
+
+
+@csrf_exempt
+async def tts(request: HttpRequest) -> HttpResponse:
+    """Convert text to speech; see :func:`api.views.tts`."""
+    started = time.perf_counter()
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    text = (body.get("text") or "").strip()
+    voice_id = body.get("voiceId", "Rachel")
+    if not text:
+        return JsonResponse({"error": "Text is required"}, status=400)
+    mode = views.tts_stream_mode(request, body)
+    fmt, error = views.negotiate_audio_format(request, body, mode)
+    if error:
+        return error
+    if mode:
+        segments = split_sentences(text, settings.TTS_SENTENCE_MAX_CHARS)
+        state = views.TtsStream(mode, started, fmt)
+        return state.response(stream_tts_events(segments, voice_id, state), segments)
+    try:
+        audio_url = await call_elevenlabs_tts(text, voice_id, fmt.name)
+    except audio_formats.FormatUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=406)
+    except Exception as e:
+        return views.upstream_error_response(e)
+    return views.tts_url_response(audio_url, fmt)
+
+
+@csrf_exempt
+async def stt(request: HttpRequest) -> JsonResponse:
+    """Transcribe uploaded audio; see :func:`api.views.stt`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        with instrument.span("upload"):
+            audio = await asyncio.to_thread(receive_audio, request)
+    except AudioRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    try:
+        transcript = await transcribe(audio.file, audio.content_type or "audio/webm", audio.sha256)
+    except Exception as e:
+        return views.upstream_error_response(e)
+    finally:
+        audio.close()
+    return JsonResponse({"transcript": transcript})
+
+
+@csrf_exempt
+async def stt_chunk(request: HttpRequest) -> JsonResponse:
+    """Receive one chunk of a recording; see :func:`api.views.stt_chunk`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    error, upload, mode = await asyncio.to_thread(views.receive_stt_chunk, request)
+    if error is not None:
+        return error
+    text = ""
+    if mode:
+        try:
+            audio = io.BytesIO(await asyncio.to_thread(upload.audio_path.read_bytes))
+            text = await transcribe(audio, upload.mime_type)
+        except Exception as e:
+            return views.upstream_error_response(e)
+    return JsonResponse(await asyncio.to_thread(views.stt_chunk_payload, upload, mode, text))
+
+
+@csrf_exempt
+async def tts_job(request: HttpRequest) -> JsonResponse:
+    """Queue speech synthesis; see :func:`api.views.tts_job`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    return await asyncio.to_thread(views.submit_tts_job, body)
+
+
+@csrf_exempt
+async def stt_job(request: HttpRequest) -> JsonResponse:
+    """Queue a transcription; see :func:`api.views.stt_job`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        with instrument.span("upload"):
+            audio = await asyncio.to_thread(receive_audio, request)
+    except AudioRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    try:
+        return await asyncio.to_thread(views.submit_stt_job, request, audio)
+    finally:
+        audio.close()
+
+
+async def job_status(request: HttpRequest, job_id: str) -> JsonResponse:
+    """Report a job's status; see :func:`api.views.job_status`.
+
+    A long-poll waits on the event loop, without holding a thread.
+    """
+    wait = views.job_wait_seconds(request)
+    if wait is None:
+        return JsonResponse({"error": "wait must be a number"}, status=400)
+    queue = await asyncio.to_thread(views.job_queue)
+    job = await queue.await_job(job_id, wait) if wait else await asyncio.to_thread(queue.get, job_id)
+    return views.job_status_response(job)
+
+
+@csrf_exempt
+async def respond(request: HttpRequest) -> JsonResponse:
+    """Answer a full debate turn in one request; see :func:`api.views.respond`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    message, persona, sid, challenge = await asyncio.to_thread(views.parse_respond_body, body)
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    if views.is_banned(message):
+        return views.blocked_response(sid)
+    queue = turns.get_turn_queue()
+    try:
+        turn = await queue.abegin(sid, bool(body.get("queue")))
+    except turns.TurnRejected as e:
+        return views.turn_rejected_response(e, sid)
+    async with turns.aholding(queue, turn):
+        messages = await asyncio.to_thread(views.open_turn, sid, message, persona, challenge, turn)
+        try:
+            model_response = await generate_rebuttal(messages, persona)
+        except Exception as e:
+            return views.upstream_error_response(e)
+        audio_url: Optional[str] = None
+        text = model_response.get("rebuttal_text", "")
+        if text:
+            try:
+                # Absolute, since the front-end may be served from another origin
+                audio_url = request.build_absolute_uri(await call_elevenlabs_tts(text))
+            except Exception:
+                audio_url = None
+        return JsonResponse(await asyncio.to_thread(views.respond_payload, sid, model_response, audio_url))
+
+
+async def run_panel_seat(state: views.Panel, index: int) -> Dict[str, Any]:
+    """Async counterpart of :meth:`api.views.Panel.run`."""
+    queue = turns.get_turn_queue()
+    turn = await queue.abegin(state.session_ids[index], state.queue)
+    async with turns.aholding(queue, turn):
+        messages = await asyncio.to_thread(state.prepare, index, turn)
+        model_response = await generate_rebuttal(messages, state.seats[index].persona)
+        return await asyncio.to_thread(views.record_rebuttal, state.session_ids[index], model_response)
+
+
+async def stream_panel_lines(state: views.Panel, outcomes: AsyncIterator[Any]) -> AsyncIterator[str]:
+    """Async counterpart of :func:`api.views.stream_panel_lines`."""
+    async for index, model_response, error in outcomes:
+        yield views.json_line(state.on_result(index, model_response, error))
+    yield views.json_line({"done": True, **state.summary()})
+
+
+@csrf_exempt
+async def panel(request: HttpRequest) -> HttpResponse:
+    """Ask a panel of personas for rebuttals at once; see :func:`api.views.panel`."""
+    started = time.perf_counter()
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    error, seats = views.parse_panel_body(body)
+    if error is not None:
+        return error
+    state = await asyncio.to_thread(views.Panel, seats, started, bool(body.get("queue")))
+    outcomes = aiter_completed(
+        list(range(len(seats))), lambda index: run_panel_seat(state, index), settings.PANEL_PARALLELISM
+    )
+    if views.wants_json_lines(request, body):
+        return views.json_lines_response(stream_panel_lines(state, outcomes))
+    async for index, model_response, failure in outcomes:
+        state.on_result(index, model_response, failure)
+    return state.response()
+
+
+@csrf_exempt
+async def reset_memory(request: HttpRequest) -> JsonResponse:
+    """Reset the session transcript; see :func:`api.views.reset_memory`."""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = views.parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    session_id = body.get("sessionId")
+    if not await asyncio.to_thread(views.reset_session, session_id):
+        return JsonResponse({"error": "Invalid session ID"}, status=400)
+    return JsonResponse({"message": "Session reset", "sessionId": session_id})
+
+
+async def iterate_in_thread(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """Pull each chunk of a blocking iterator in a worker thread."""
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+async def download_transcript(request: HttpRequest) -> HttpResponse:
+    """Download the transcript; see :func:`api.views.download_transcript`.
+
+    The export reads the session store and the audio cache as it goes, so
+    the response is built, and each chunk produced, in a worker thread.
+    """
+    response = await asyncio.to_thread(views.transcript_response, request)
+    if response.streaming:
+        response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+    return response
+
+
+async def serve_media(request: HttpRequest, path: str) -> HttpResponse:
+    """Serve a generated file; see :func:`api.views.serve_media`.
+
+    Opening and hashing the file happen in a worker thread, and the body is
+    read a block at a time in worker threads rather than all at once.
+    """
+    response = await asyncio.to_thread(media.media_response, request, path)
+    if response.streaming:
+        response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+    return response
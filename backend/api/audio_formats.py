@@ -0,0 +1,399 @@
+"""Output formats for synthesised speech and how a client picks one.
+
+Every TTS response used to be the provider's default MP3 (128 kbps,
+44.1 kHz stereo-capable), several times more data than a voice needs. The
+``tts`` endpoint now negotiates one of :data:`FORMATS`:
+
+* ``mp3``: the default, as before;
+* ``mp3_low``: 32 kbps, 22.05 kHz mono MP3, for slow connections;
+* ``opus``: 32 kbps Opus in Ogg, the smallest, for browsers that play it;
+* ``webm``: the same Opus in WebM, for clients that only take that;
+* ``pcm``: 16-bit 16 kHz mono samples, for clients feeding a decoder-less
+  audio pipeline. Stored files are WAV; a streamed body is the bare samples.
+
+A client names a format with ``audioFormat`` in the request body, or lists
+media types in ``Accept`` (``audio/ogg``, ``audio/webm``, ``audio/wav``,
+``audio/pcm``, ``audio/mpeg``; ``q`` values are honoured). Without either
+it gets ``settings.TTS_AUDIO_FORMAT``.
+
+A TTS backend that encodes a format itself says so in its
+``output_formats`` (ElevenLabs offers all but WebM); the audio is then
+requested in that format directly. Anything else is transcoded from the MP3
+of the same text, itself served from the TTS cache when present, by
+``ffmpeg`` in a small worker pool (``TTS_TRANSCODE_WORKERS``). If a
+provider refuses a format it advertised, for instance one the account's
+plan does not include, the format is transcoded from then on. Formats that
+can be neither requested nor transcoded (no ``ffmpeg`` on the ``PATH``) are
+not offered.
+
+The bytes and seconds of speech produced in each format are counted as
+``tts_audio_bytes_total`` and ``tts_audio_seconds_total``; :func:`report`
+turns them into bytes per second of speech (``GET /api/tts/formats``).
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import subprocess
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import httpx
+from django.conf import settings
+
+from . import instrument, metrics
+from .audio_prep import ffmpeg_path
+
+PCM_RATE = 16000
+
+
+class AudioFormat(NamedTuple):
+    """An output format for synthesised speech."""
+
+    name: str
+    # Media type and extension of a stored file
+    mime: str
+    extension: str
+    # Media types in ``Accept`` that select this format
+    accept: Tuple[str, ...]
+    # ffmpeg output options when transcoding from MP3
+    encode: Tuple[str, ...]
+    # Media type of a streamed body, or "" if segments cannot be joined
+    stream_mime: str = ""
+    # Sample rate if produced as bare 16-bit mono samples (stored as WAV)
+    pcm_rate: int = 0
+
+    @property
+    def streamable(self) -> bool:
+        return bool(self.stream_mime)
+
+    def stream_chunk(self, audio: bytes) -> bytes:
+        """Return a stored segment as a piece of a streamed body."""
+        return wav_frames(audio) if self.pcm_rate else audio
+
+
+MP3 = AudioFormat("mp3", "audio/mpeg", "mp3", ("audio/mpeg", "audio/mp3"), (), "audio/mpeg")
+
+FORMATS: Dict[str, AudioFormat] = {
+    fmt.name: fmt
+    for fmt in (
+        MP3,
+        AudioFormat(
+            "mp3_low", "audio/mpeg", "mp3", (),
+            ("-ac", "1", "-ar", "22050", "-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3"), "audio/mpeg",
+        ),
+        AudioFormat(
+            "opus", "audio/ogg; codecs=opus", "ogg", ("audio/ogg", "audio/opus"),
+            ("-ac", "1", "-c:a", "libopus", "-b:a", "32k", "-application", "voip", "-f", "ogg"),
+        ),
+        AudioFormat(
+            "webm", "audio/webm; codecs=opus", "webm", ("audio/webm",),
+            ("-ac", "1", "-c:a", "libopus", "-b:a", "32k", "-application", "voip", "-f", "webm"),
+        ),
+        AudioFormat(
+            "pcm", "audio/wav", "wav", ("audio/wav", "audio/wave", "audio/x-wav", "audio/pcm", "audio/l16"),
+            ("-ac", "1", "-ar", str(PCM_RATE), "-f", "s16le"), f"audio/pcm;rate={PCM_RATE};channels=1", PCM_RATE,
+        ),
+    )
+}
+
+
+class FormatUnavailable(ValueError):
+    """The requested format can be neither synthesised nor transcoded here."""
+
+
+def get_format(name: str) -> AudioFormat:
+    """Return the format called ``name``.
+
+    Raises:
+        ValueError: No such format.
+    """
+    fmt = FORMATS.get(name)
+    if fmt is None:
+        raise ValueError(f"Unknown audio format {name!r}; choose from {', '.join(FORMATS)}")
+    return fmt
+
+
+# (backend, format) pairs the provider refused; transcoded from then on
+_refused: Set[Tuple[str, str]] = set()
+
+
+def native_format(backend: Any, fmt: AudioFormat) -> Optional[str]:
+    """Return the backend's own name for ``fmt`` if it can produce it directly."""
+    if (backend.name, fmt.name) in _refused:
+        return None
+    return getattr(backend, "output_formats", {}).get(fmt.name)
+
+
+def refuse_native(backend: Any, fmt: AudioFormat, error: Exception) -> bool:
+    """Stop requesting ``fmt`` natively if ``error`` is the provider refusing it.
+
+    Returns:
+        True if the caller should fall back to transcoding.
+
+    Raises:
+        FormatUnavailable: The provider refused the format and there is no
+            ``ffmpeg`` to transcode it.
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    status = error.response.status_code
+    if status < 400 or status >= 500 or status == 429:
+        return False
+    _refused.add((backend.name, fmt.name))
+    metrics.inc("tts_native_format_refused_total", format=fmt.name, status=status)
+    if not ffmpeg_path():
+        raise FormatUnavailable(f"The TTS provider refused {fmt.name} audio and ffmpeg is not available") from error
+    return True
+
+
+def available(fmt: AudioFormat, backend: Any) -> bool:
+    """Whether ``fmt`` can be produced with ``backend`` and the local tools."""
+    return fmt is MP3 or native_format(backend, fmt) is not None or ffmpeg_path() is not None
+
+
+def parse_accept(header: str) -> List[Tuple[str, float]]:
+    """Return the media ranges of an ``Accept`` header, most preferred first."""
+    ranges = []
+    for position, item in enumerate(header.split(",")):
+        media, *params = (part.strip() for part in item.split(";"))
+        if not media:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media.lower()))
+    return [(media, -quality) for quality, _, media in sorted(ranges)]
+
+
+def negotiate(accept: str, requested: Optional[str], backend: Any) -> AudioFormat:
+    """Pick the output format for a TTS request.
+
+    Args:
+        accept: The request's ``Accept`` header.
+        requested: The ``audioFormat`` the client named, if any; it wins
+            over ``accept``.
+        backend: The TTS backend that will synthesise the audio.
+
+    Raises:
+        ValueError: ``requested`` names no format.
+        FormatUnavailable: The client accepts only formats that cannot be
+            produced here.
+    """
+    if requested:
+        fmt = get_format(requested)
+        if not available(fmt, backend):
+            raise FormatUnavailable(f"{fmt.name} audio needs ffmpeg to transcode")
+        return fmt
+    default = get_format(settings.TTS_AUDIO_FORMAT)
+    audio_ranges = [media for media, _ in parse_accept(accept) if media.startswith("audio/") or media == "*/*"]
+    if not audio_ranges:
+        return default
+    for media in audio_ranges:
+        if media in ("audio/*", "*/*"):
+            return default if available(default, backend) else MP3
+        for fmt in FORMATS.values():
+            if media in fmt.accept and available(fmt, backend):
+                return fmt
+    raise FormatUnavailable(f"None of the accepted audio types can be produced; choose from {', '.join(FORMATS)}")
+
+
+# ---------------------------------------------------------------------------
+# Transcoding
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """Return the transcoding pool, creating it if necessary.
+
+    Each worker thread waits on one ``ffmpeg`` process, so the pool size
+    caps how many encoders run at once.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ThreadPoolExecutor(max_workers=settings.TTS_TRANSCODE_WORKERS, thread_name_prefix="tts-transcode")
+            _pool_pid = pid
+        return _pool
+
+
+def _encode(ffmpeg: str, fmt: AudioFormat, mp3: bytes) -> bytes:
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "mp3", "-i", "pipe:0", *fmt.encode, "pipe:1"],
+        input=mp3,
+        capture_output=True,
+        timeout=settings.TTS_TRANSCODE_TIMEOUT,
+        check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "replace").strip() or "ffmpeg failed")
+    return proc.stdout
+
+
+def _ffmpeg_for(fmt: AudioFormat) -> str:
+    ffmpeg = ffmpeg_path()
+    if not ffmpeg:
+        raise FormatUnavailable(f"{fmt.name} audio needs ffmpeg to transcode")
+    return ffmpeg
+
+
+def transcode(mp3: bytes, fmt: AudioFormat) -> bytes:
+    """Encode ``mp3`` as ``fmt`` in the transcoding pool."""
+    ffmpeg = _ffmpeg_for(fmt)
+    with instrument.span("transcode"):
+        return get_pool().submit(_encode, ffmpeg, fmt, mp3).result()
+
+
+async def atranscode(mp3: bytes, fmt: AudioFormat) -> bytes:
+    """Async counterpart of :func:`transcode`."""
+    ffmpeg = _ffmpeg_for(fmt)
+    with instrument.span("transcode"):
+        return await asyncio.wrap_future(get_pool().submit(_encode, ffmpeg, fmt, mp3))
+
+
+# ---------------------------------------------------------------------------
+# Containers and durations
+
+
+def pcm_to_wav(pcm: bytes, rate: int) -> bytes:
+    """Wrap bare 16-bit mono samples in a WAV header."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def wav_frames(audio: bytes) -> bytes:
+    """Return the samples of a WAV file without its header."""
+    with wave.open(io.BytesIO(audio)) as source:
+        return source.readframes(source.getnframes())
+
+
+# Layer III bitrates in kbps by bitrate index, for MPEG-1 and MPEG-2/2.5
+_MP3_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5)
+_MP3_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mp3_seconds(data: bytes) -> float:
+    """Return the playing time of an MP3 by walking its frame headers."""
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        pos = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    seconds = 0.0
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+            pos = data.find(b"\xff", pos + 1)
+            if pos < 0:
+                break
+            continue
+        version, layer = (data[pos + 1] >> 3) & 3, (data[pos + 1] >> 1) & 3
+        bitrate_index, rate_index = data[pos + 2] >> 4, (data[pos + 2] >> 2) & 3
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+        mpeg1 = version == 3
+        rate = _MP3_RATES[version][rate_index]
+        samples = 1152 if mpeg1 else 576
+        seconds += samples / rate
+        pos += samples // 8 * _MP3_BITRATES[mpeg1][bitrate_index] * 1000 // rate + ((data[pos + 2] >> 1) & 1)
+    return seconds
+
+
+def ogg_opus_seconds(data: bytes) -> Optional[float]:
+    """Return the playing time of Ogg Opus from its last page's granule position."""
+    head = data.find(b"OpusHead")
+    last = data.rfind(b"OggS")
+    if head < 0 or last < 0 or len(data) < last + 14:
+        return None
+    pre_skip = int.from_bytes(data[head + 10 : head + 12], "little")
+    granule = int.from_bytes(data[last + 6 : last + 14], "little")
+    return max(0, granule - pre_skip) / 48000
+
+
+def speech_seconds(audio: bytes, fmt: AudioFormat) -> Optional[float]:
+    """Return how long ``audio`` plays, or None if it cannot be told cheaply."""
+    try:
+        if fmt.extension == "mp3":
+            return mp3_seconds(audio)
+        if fmt.extension == "ogg":
+            return ogg_opus_seconds(audio)
+        if fmt.extension == "wav":
+            with wave.open(io.BytesIO(audio)) as source:
+                return source.getnframes() / source.getframerate()
+    except (wave.Error, EOFError, IndexError):
+        pass
+    return None
+
+
+def produced(fmt: AudioFormat, audio: bytes, source: str, mp3: Optional[bytes] = None) -> bytes:
+    """Finish synthesised or transcoded audio as a ``fmt`` file and count it.
+
+    Args:
+        fmt: The format ``audio`` is in.
+        audio: The backend's or encoder's output.
+        source: ``"native"`` or ``"transcoded"``.
+        mp3: The MP3 it was transcoded from, whose length is used when that
+            of ``audio`` cannot be read (WebM).
+
+    Returns:
+        The file contents to store.
+    """
+    if fmt.pcm_rate:
+        audio = pcm_to_wav(audio, fmt.pcm_rate)
+    seconds = speech_seconds(audio, fmt)
+    if seconds is None and mp3 is not None:
+        seconds = mp3_seconds(mp3)
+    metrics.inc("tts_audio_bytes_total", len(audio), format=fmt.name, source=source)
+    if seconds:
+        metrics.inc("tts_audio_seconds_total", seconds, format=fmt.name)
+    return audio
+
+
+def report(backend: Any) -> Dict[str, Dict[str, Any]]:
+    """Return, per format, the bytes and seconds of speech produced so far.
+
+    Also says how ``backend`` would produce each format now: ``native``,
+    ``transcoded`` or ``unavailable``.
+    """
+    formats = {}
+    for fmt in FORMATS.values():
+        size = sum(
+            metrics.counter_value("tts_audio_bytes_total", format=fmt.name, source=source)
+            for source in ("native", "transcoded")
+        )
+        seconds = metrics.counter_value("tts_audio_seconds_total", format=fmt.name)
+        if fmt is MP3 or native_format(backend, fmt) is not None:
+            via = "native"
+        else:
+            via = "transcoded" if ffmpeg_path() else "unavailable"
+        formats[fmt.name] = {
+            "mime": fmt.mime,
+            "streamable": fmt.streamable,
+            "via": via,
+            "bytes": int(size),
+            "seconds": round(seconds, 3),
+            "bytes_per_second": round(size / seconds, 1) if seconds else None,
+        }
+    return formats
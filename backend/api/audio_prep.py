@@ -0,0 +1,352 @@
+"""Local clean-up of recordings before they are sent for transcription.
+
+Browsers record at 48 kHz, often in stereo, and users pause before and after
+speaking, so much of what ``stt`` forwarded to Whisper was silence at a
+higher fidelity than speech recognition needs. :func:`prepare` runs the
+upload through a small pipeline first:
+
+1. decode to mono floating-point samples at 16 kHz (WAV with the standard
+   library; anything else, such as webm/opus, with ``ffmpeg``);
+2. find speech with an energy-based voice activity detector over 30 ms
+   frames, whose threshold adapts to the clip's noise floor;
+3. cut leading and trailing silence and shorten long pauses to
+   ``STT_VAD_MAX_PAUSE`` seconds, keeping ``STT_VAD_PADDING`` around speech;
+4. re-encode as Opus in Ogg when ``ffmpeg`` is available, otherwise as
+   16 kHz 16-bit mono WAV.
+
+The result is used only if it is smaller or shorter than the original. The
+work runs in a process pool (``STT_PREPROCESS_WORKERS``) so decoding and
+DSP never hold the request thread's GIL, with ``STT_PREPROCESS_TIMEOUT``
+as a cap; on any failure the original audio is sent unchanged.
+
+The DSP needs ``numpy`` (``pip install numpy``) and only WAV can be decoded
+without ``ffmpeg`` on the ``PATH``. Without numpy the stage is skipped.
+Savings are reported as ``stt_preprocess_bytes_saved_total`` and
+``stt_preprocess_seconds_saved_total``.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import IO, Any, Dict, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from . import metrics
+
+TARGET_RATE = 16000
+FRAME_SECONDS = 0.03
+
+# Processing-time buckets: a short clip through ffmpeg up to a long one
+PREP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Prepared(NamedTuple):
+    """Audio after preprocessing, with before/after measurements."""
+
+    audio: bytes
+    mime_type: str
+    bytes_in: int
+    bytes_out: int
+    seconds_in: float
+    seconds_out: float
+
+
+class UnsupportedAudio(ValueError):
+    """The audio could not be decoded with the tools available."""
+
+
+def numpy_available() -> bool:
+    """Return True if ``numpy``, needed for the DSP, is installed."""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def ffmpeg_path() -> Optional[str]:
+    """Return the ``ffmpeg`` executable to use, or None if there is none."""
+    return shutil.which(settings.STT_FFMPEG or "ffmpeg")
+
+
+def _run_ffmpeg(ffmpeg: str, args: list, data: bytes, timeout: float) -> bytes:
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", *args],
+        input=data,
+        capture_output=True,
+        timeout=timeout,
+        check=False,
+    )
+    if proc.returncode != 0:
+        raise UnsupportedAudio(proc.stderr.decode("utf-8", "replace").strip() or "ffmpeg failed")
+    return proc.stdout
+
+
+def decode_wav(data: bytes):
+    """Decode PCM WAV into ``(mono float32 samples, sample rate)``."""
+    import numpy as np
+
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise UnsupportedAudio(str(e)) from e
+    if width == 1:
+        samples = (np.frombuffer(frames, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, "<i2").astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(frames, "<i4").astype(np.float32) / 2147483648
+    else:
+        raise UnsupportedAudio(f"{width * 8}-bit WAV is not supported")
+    samples = samples[: len(samples) - len(samples) % channels]
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+
+def resample(samples, source_rate: int, target_rate: int = TARGET_RATE):
+    """Resample by linear interpolation, low-pass filtering first when reducing the rate."""
+    import numpy as np
+
+    if source_rate == target_rate or not len(samples):
+        return samples
+    if target_rate < source_rate:
+        # Windowed-sinc low-pass at the new Nyquist frequency to avoid aliasing
+        cutoff = 0.5 * target_rate / source_rate
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        samples = np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode="same")
+    duration = len(samples) / source_rate
+    positions = np.arange(int(duration * target_rate)) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def speech_frames(samples, rate: int, margin_db: float, floor_db: float):
+    """Return a boolean array marking the 30 ms frames that contain speech.
+
+    The threshold sits ``margin_db`` above the clip's noise floor (its 10th
+    percentile frame energy), never below ``floor_db``, and never more than
+    25 dB under the loudest frame, so clips of continuous speech are kept
+    whole.
+    """
+    import numpy as np
+
+    size = int(rate * FRAME_SECONDS)
+    count = len(samples) // size
+    if count == 0:
+        return np.zeros(0, dtype=bool)
+    frames = samples[: count * size].reshape(count, size)
+    energy = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    threshold = min(max(np.percentile(energy, 10) + margin_db, floor_db), energy.max() - 25)
+    return energy > threshold
+
+
+def trim_silence(samples, rate: int, padding: float, max_pause: float, margin_db: float, floor_db: float):
+    """Drop silence outside speech and shorten pauses longer than ``max_pause``.
+
+    Returns the input unchanged if no speech is found, so a quiet speaker
+    is never turned into an empty file.
+    """
+    import numpy as np
+
+    speech = speech_frames(samples, rate, margin_db, floor_db)
+    if not speech.any():
+        return samples
+    pad = int(round(padding / FRAME_SECONDS))
+    keep = np.convolve(speech.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode="same") > 0
+    # Inside runs of silence longer than max_pause, keep only max_pause
+    # (half after the speech before it, half before the speech after it)
+    limit = max(1, int(round(max_pause / FRAME_SECONDS)))
+    first, last = np.flatnonzero(keep)[[0, -1]]
+    edges = np.flatnonzero(np.diff(keep[first : last + 1].astype(np.int8))) + first + 1
+    for start, stop in zip(edges[::2], edges[1::2]):
+        if stop - start > limit:
+            keep[start + limit // 2 : stop - (limit - limit // 2)] = False
+    size = int(rate * FRAME_SECONDS)
+    mask = np.repeat(keep, size)
+    mask = np.concatenate([mask, np.zeros(len(samples) - len(mask), dtype=bool)])
+    return samples[mask]
+
+
+def encode_wav(samples, rate: int) -> bytes:
+    """Encode mono float samples as 16-bit PCM WAV."""
+    import numpy as np
+
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return out.getvalue()
+
+
+def preprocess(data: bytes, mime_type: str, options: Dict[str, Any]) -> Prepared:
+    """Decode, trim, downmix, resample and re-encode ``data``.
+
+    Runs in a pool worker, so it takes its settings in ``options`` (see
+    :func:`pipeline_options`) instead of reading Django settings.
+
+    Raises:
+        UnsupportedAudio: The audio cannot be decoded here.
+    """
+    import numpy as np
+
+    ffmpeg, timeout = options["ffmpeg"], options["timeout"]
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        samples, rate = decode_wav(data)
+        samples = resample(samples, rate, TARGET_RATE)
+    elif ffmpeg:
+        pcm = _run_ffmpeg(
+            ffmpeg, ["-i", "pipe:0", "-ac", "1", "-ar", str(TARGET_RATE), "-f", "f32le", "pipe:1"], data, timeout
+        )
+        samples = np.frombuffer(pcm, "<f4")
+    else:
+        raise UnsupportedAudio(f"{mime_type} needs ffmpeg to decode")
+    seconds_in = len(samples) / TARGET_RATE
+    samples = trim_silence(
+        samples, TARGET_RATE, options["padding"], options["max_pause"], options["margin_db"], options["floor_db"]
+    )
+    if ffmpeg:
+        audio = _run_ffmpeg(
+            ffmpeg,
+            ["-f", "f32le", "-ar", str(TARGET_RATE), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", options["bitrate"], "-application", "voip", "-f", "ogg", "pipe:1"],
+            samples.astype("<f4").tobytes(),
+            timeout,
+        )
+        out_type = "audio/ogg"
+    else:
+        audio = encode_wav(samples, TARGET_RATE)
+        out_type = "audio/wav"
+    return Prepared(audio, out_type, len(data), len(audio), seconds_in, len(samples) / TARGET_RATE)
+
+
+def pipeline_options() -> Dict[str, Any]:
+    """Plain-value settings passed to :func:`preprocess` in the pool."""
+    return {
+        "ffmpeg": ffmpeg_path(),
+        "timeout": settings.STT_PREPROCESS_TIMEOUT,
+        "padding": settings.STT_VAD_PADDING,
+        "max_pause": settings.STT_VAD_MAX_PAUSE,
+        "margin_db": settings.STT_VAD_MARGIN_DB,
+        "floor_db": settings.STT_VAD_FLOOR_DB,
+        "bitrate": settings.STT_PREPROCESS_BITRATE,
+    }
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Executor:
+    """Return the process pool for preprocessing, creating it if necessary.
+
+    Workers are spawned rather than forked, so they inherit none of the
+    server's threads or open connections.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.STT_PREPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_pid = pid
+        return _pool
+
+
+def skip_reason(size: int) -> Optional[str]:
+    """Return why an upload of ``size`` bytes would not be preprocessed, if so."""
+    if not settings.STT_PREPROCESS:
+        return "disabled"
+    if size > settings.STT_PREPROCESS_MAX_BYTES:
+        return "too_large"
+    if not numpy_available():
+        return "unavailable"
+    return None
+
+
+def _read(audio: IO[bytes]) -> Tuple[Optional[bytes], Optional[str]]:
+    """Return the audio's bytes, or None and the reason it will be sent as is."""
+    audio.seek(0, os.SEEK_END)
+    size = audio.tell()
+    audio.seek(0)
+    reason = skip_reason(size)
+    if reason:
+        _skip(reason)
+        return None, reason
+    data = audio.read()
+    audio.seek(0)
+    return data, None
+
+
+def _accept(prepared: Prepared, started: float) -> Optional[Prepared]:
+    metrics.observe("stt_preprocess_seconds", time.perf_counter() - started, buckets=PREP_BUCKETS)
+    if prepared.bytes_out >= prepared.bytes_in and prepared.seconds_out >= prepared.seconds_in * 0.9:
+        metrics.inc("stt_preprocess_skipped_total", reason="no_gain")
+        return None
+    metrics.inc("stt_preprocess_bytes_saved_total", prepared.bytes_in - prepared.bytes_out)
+    metrics.inc("stt_preprocess_seconds_saved_total", prepared.seconds_in - prepared.seconds_out)
+    return prepared
+
+
+def _skip(reason: str) -> None:
+    metrics.inc("stt_preprocess_skipped_total", reason=reason)
+
+
+def prepare(audio: IO[bytes], mime_type: str) -> Optional[Prepared]:
+    """Preprocess the recording in ``audio`` in the process pool.
+
+    Returns:
+        The prepared audio, or None if the original should be sent as is
+        (stage disabled, unavailable, failed, or no smaller).
+    """
+    data, reason = _read(audio)
+    if reason:
+        return None
+    started = time.perf_counter()
+    try:
+        future = get_pool().submit(preprocess, data, mime_type, pipeline_options())
+        prepared = future.result(timeout=settings.STT_PREPROCESS_TIMEOUT)
+    except UnsupportedAudio:
+        _skip("unsupported")
+        return None
+    except Exception:
+        _skip("error")
+        return None
+    return _accept(prepared, started)
+
+
+async def aprepare(audio: IO[bytes], mime_type: str) -> Optional[Prepared]:
+    """Async counterpart of :func:`prepare`."""
+    data, reason = await asyncio.to_thread(_read, audio)
+    if reason:
+        return None
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        prepared = await asyncio.wait_for(
+            loop.run_in_executor(get_pool(), preprocess, data, mime_type, pipeline_options()),
+            settings.STT_PREPROCESS_TIMEOUT,
+        )
+    except UnsupportedAudio:
+        _skip("unsupported")
+        return None
+    except Exception:
+        _skip("error")
+        return None
+    return _accept(prepared, started)
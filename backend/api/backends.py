@@ -0,0 +1,762 @@
+"""Pluggable inference backends for rebuttals, transcription and speech.
+
+The views never talk to a provider directly. They hand an OpenAI-style chat
+request body to the chat backend, audio to the STT backend and text to the
+TTS backend, each chosen in settings (``CHAT_BACKEND``, ``STT_BACKEND``,
+``TTS_BACKEND``):
+
+============ ===================== ==========================================
+kind         name                  implementation
+============ ===================== ==========================================
+chat         ``openai``            OpenAI chat completions (default)
+chat         ``openai_compatible`` any server speaking the same API, such as
+                                   ``llama.cpp``'s ``llama-server``, vLLM or
+                                   Ollama, at ``LOCAL_LLM_BASE_URL``
+chat         ``llama_cpp``         a GGUF model loaded in-process with
+                                   ``llama-cpp-python``
+stt          ``openai``            OpenAI Whisper (default)
+stt          ``openai_compatible`` a local Whisper server at
+                                   ``LOCAL_STT_BASE_URL``
+stt          ``faster_whisper``    ``faster-whisper`` loaded in-process
+tts          ``elevenlabs``        ElevenLabs (default)
+tts          ``piper``             a Piper voice loaded in-process (needs
+                                   ``ffmpeg`` to produce MP3)
+any          ``fake``              deterministic canned output for load
+                                   tests, after ``FAKE_BACKEND_LATENCY``
+============ ===================== ==========================================
+
+A setting may also name a backend class by dotted path
+(``mypackage.backends.MyChat``); it is constructed without arguments.
+
+In-process models are loaded once per worker of a :class:`ModelPool`, a
+process pool of ``LOCAL_MODEL_WORKERS`` spawned processes, so the model
+stays warm between requests and inference runs outside the web worker's
+GIL. The optional packages (``llama-cpp-python``, ``faster-whisper``,
+``piper-tts``) are only imported inside those workers.
+
+TTS backends return MP3 by default. One that can also encode other formats
+of ``api.audio_formats`` lists them in ``output_formats`` and is then asked
+for them by ``output_format``; the rest are transcoded from its MP3.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+import wave
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, Union
+
+from django.conf import settings
+
+from . import audio_formats, resilience
+
+Audio = Union[bytes, IO[bytes]]
+
+
+def api_key(name: str, purpose: str = "") -> str:
+    """Return the API key stored in environment variable ``name``.
+
+    Raises:
+        RuntimeError: If the variable is unset or empty.
+    """
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"{name} not configured{purpose}")
+    return value
+
+
+def chat_stream_delta(line: str) -> Tuple[bool, str]:
+    """Decode one line of a streamed chat completion.
+
+    OpenAI streams completions as Server-Sent Events whose ``data`` fields
+    hold JSON chunks, terminated by ``data: [DONE]``.
+
+    Returns:
+        A tuple ``(done, text)`` where ``text`` is the content delta carried
+        by the line (empty for keep-alives and role-only chunks).
+    """
+    if not line.startswith("data:"):
+        return False, ""
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return True, ""
+    choices = json.loads(data).get("choices") or [{}]
+    return False, (choices[0].get("delta") or {}).get("content") or ""
+
+
+def _read_audio(audio: Audio) -> bytes:
+    if isinstance(audio, bytes):
+        return audio
+    audio.seek(0)
+    data = audio.read()
+    audio.seek(0)
+    return data
+
+
+class ChatBackend:
+    """Turns an OpenAI-style chat completions body into message content.
+
+    ``body`` carries ``messages``, ``temperature``, ``max_tokens`` and, when
+    JSON output is wanted, ``response_format``. Subclasses implement
+    :meth:`complete`; the other methods have working defaults.
+    """
+
+    name = "chat"
+
+    @property
+    def model_id(self) -> str:
+        """Identifies the model, for cache and coalescing keys."""
+        return self.name
+
+    def complete(self, body: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    async def acomplete(self, body: Dict[str, Any]) -> str:
+        return await asyncio.to_thread(self.complete, body)
+
+    def stream(self, body: Dict[str, Any]) -> Iterator[str]:
+        """Yield the content in pieces; by default all at once."""
+        yield self.complete(body)
+
+    async def astream(self, body: Dict[str, Any]) -> AsyncIterator[str]:
+        yield await self.acomplete(body)
+
+    def warm(self) -> None:
+        """Load models or open connections ahead of the first request."""
+
+
+class SttBackend:
+    """Transcribes a recording to text."""
+
+    name = "stt"
+
+    @property
+    def model_id(self) -> str:
+        return self.name
+
+    def transcribe(self, audio: Audio, mime_type: str) -> str:
+        raise NotImplementedError
+
+    async def atranscribe(self, audio: Audio, mime_type: str) -> str:
+        return await asyncio.to_thread(self.transcribe, audio, mime_type)
+
+    def warm(self) -> None:
+        """Load models or open connections ahead of the first request."""
+
+
+class TtsBackend:
+    """Synthesises text to MP3 audio."""
+
+    name = "tts"
+    # ``api.audio_formats`` names the backend encodes itself, mapped to its
+    # own name for each, passed to :meth:`synthesize` as ``output_format``
+    output_formats: Dict[str, str] = {}
+
+    @property
+    def model_id(self) -> str:
+        return self.name
+
+    def cache_payload(self, text: str) -> Dict[str, Any]:
+        """Everything that affects the audio for ``text``, for the TTS cache key."""
+        return {"backend": self.name, "text": text}
+
+    def synthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        raise NotImplementedError
+
+    async def asynthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        if output_format is None:
+            return await asyncio.to_thread(self.synthesize, text, voice_id)
+        return await asyncio.to_thread(self.synthesize, text, voice_id, output_format)
+
+    def warm(self) -> None:
+        """Load models or open connections ahead of the first request."""
+
+
+# ---------------------------------------------------------------------------
+# Remote providers over HTTP
+
+
+class OpenAIChat(ChatBackend):
+    """Chat completions over HTTP, from OpenAI or a compatible server.
+
+    Args:
+        provider: Key of ``UPSTREAM_PROVIDERS`` to send requests to.
+        key_env: Environment variable holding the API key.
+        model: Model name replacing the one in the body, if given.
+        key_required: Whether a missing key is an error (local servers
+            usually need none).
+    """
+
+    def __init__(
+        self, provider: str = "openai", key_env: str = "OPENAI_API_KEY", model: str = "", key_required: bool = True
+    ) -> None:
+        self.name = "openai" if provider == "openai" else "openai_compatible"
+        self.provider = provider
+        self.key_env = key_env
+        self.model = model
+        self.key_required = key_required
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.provider}:{self.model}" if self.model else self.provider
+
+    def _request(self, body: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        headers = {}
+        if self.key_required or os.getenv(self.key_env):
+            headers["Authorization"] = f"Bearer {api_key(self.key_env)}"
+        body = dict(body, stream=True) if stream else body
+        if self.model:
+            body = dict(body, model=self.model)
+        return {"headers": headers, "json": body}
+
+    def complete(self, body: Dict[str, Any]) -> str:
+        resp = resilience.request(self.provider, "POST", "/chat/completions", **self._request(body))
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    async def acomplete(self, body: Dict[str, Any]) -> str:
+        resp = await resilience.arequest(self.provider, "POST", "/chat/completions", **self._request(body))
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    def stream(self, body: Dict[str, Any]) -> Iterator[str]:
+        # Not retried: the deltas are handed on as they arrive
+        with resilience.stream(self.provider, "POST", "/chat/completions", **self._request(body, True)) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                done, delta = chat_stream_delta(line)
+                if done:
+                    break
+                if delta:
+                    yield delta
+
+    async def astream(self, body: Dict[str, Any]) -> AsyncIterator[str]:
+        async with resilience.astream(self.provider, "POST", "/chat/completions", **self._request(body, True)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                done, delta = chat_stream_delta(line)
+                if done:
+                    break
+                if delta:
+                    yield delta
+
+
+class OpenAIWhisper(SttBackend):
+    """Transcription over HTTP, from OpenAI or a compatible server.
+
+    Args:
+        provider: Key of ``UPSTREAM_PROVIDERS`` to send requests to.
+        key_env: Environment variable holding the API key.
+        model: Model name sent with the audio.
+        key_required: Whether a missing key is an error.
+    """
+
+    def __init__(
+        self,
+        provider: str = "openai",
+        key_env: str = "OPENAI_API_KEY",
+        model: str = "whisper-1",
+        key_required: bool = True,
+    ) -> None:
+        self.name = "openai" if provider == "openai" else "openai_compatible"
+        self.provider = provider
+        self.key_env = key_env
+        self.model = model
+        self.key_required = key_required
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    def request(self, audio: Audio, mime_type: str) -> Dict[str, Any]:
+        """Build the keyword arguments for a transcription ``POST``.
+
+        ``audio`` may be an open file, which httpx streams from its start in
+        pieces rather than loading it into memory.
+        """
+        headers = {}
+        if self.key_required or os.getenv(self.key_env):
+            headers["Authorization"] = f"Bearer {api_key(self.key_env, ' for STT')}"
+        return {
+            "headers": headers,
+            "files": {
+                "file": ("audio", audio, mime_type),
+                "model": (None, self.model),
+            },
+        }
+
+    def transcribe(self, audio: Audio, mime_type: str) -> str:
+        resp = resilience.request(self.provider, "POST", "/audio/transcriptions", **self.request(audio, mime_type))
+        resp.raise_for_status()
+        return resp.json().get("text", "")
+
+    async def atranscribe(self, audio: Audio, mime_type: str) -> str:
+        resp = await resilience.arequest(
+            self.provider, "POST", "/audio/transcriptions", **self.request(audio, mime_type)
+        )
+        resp.raise_for_status()
+        return resp.json().get("text", "")
+
+
+class ElevenLabsTts(TtsBackend):
+    """ElevenLabs text-to-speech."""
+
+    name = "elevenlabs"
+    provider = "elevenlabs"
+    # The provider's default is mp3_44100_128; PCM comes without a header
+    output_formats = {"mp3_low": "mp3_22050_32", "opus": "opus_48000_32", "pcm": "pcm_16000"}
+
+    @property
+    def model_id(self) -> str:
+        return f'{self.name}:{os.getenv("ELEVENLABS_MODEL", "eleven_monolingual_v1")}'
+
+    def cache_payload(self, text: str) -> Dict[str, Any]:
+        # The request body itself: everything in it affects the audio
+        return {
+            "text": text,
+            "model_id": os.getenv("ELEVENLABS_MODEL", "eleven_monolingual_v1"),
+            "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
+        }
+
+    def request(self, text: str, voice_id: str, output_format: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Build the URL and keyword arguments for a TTS ``POST``."""
+        headers = {
+            "xi-api-key": api_key("ELEVENLABS_API_KEY"),
+            "accept": "*/*" if output_format else "audio/mpeg",
+            "content-type": "application/json",
+        }
+        request_kwargs: Dict[str, Any] = {"headers": headers, "json": self.cache_payload(text)}
+        if output_format:
+            request_kwargs["params"] = {"output_format": output_format}
+        return f"/text-to-speech/{voice_id}", request_kwargs
+
+    def synthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        url, request_kwargs = self.request(text, voice_id, output_format)
+        resp = resilience.request("elevenlabs", "POST", url, **request_kwargs)
+        resp.raise_for_status()
+        return resp.content
+
+    async def asynthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        url, request_kwargs = self.request(text, voice_id, output_format)
+        resp = await resilience.arequest("elevenlabs", "POST", url, **request_kwargs)
+        resp.raise_for_status()
+        return resp.content
+
+
+# ---------------------------------------------------------------------------
+# In-process models, kept warm in pool workers
+
+# The model loaded by this process's pool initializer (worker processes only)
+_worker_model: Any = None
+
+
+def _init_worker(loader: Callable[..., Any], kwargs: Dict[str, Any]) -> None:
+    global _worker_model
+    _worker_model = loader(**kwargs)
+
+
+def _ready() -> bool:
+    return _worker_model is not None
+
+
+class ModelPool:
+    """A process pool whose workers each load one model at start-up.
+
+    Args:
+        loader: Top-level function returning the model; runs in each worker.
+        kwargs: Arguments for ``loader``.
+        workers: Number of worker processes.
+    """
+
+    def __init__(self, loader: Callable[..., Any], kwargs: Dict[str, Any], workers: int = 1) -> None:
+        self.workers = max(1, workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(loader, kwargs),
+        )
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        return self._executor.submit(fn, *args)
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def warm(self) -> None:
+        """Start every worker and wait until each has loaded the model."""
+        for future in [self.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _load_llama(model_path: str, n_ctx: int, n_threads: int) -> Any:
+    from llama_cpp import Llama
+
+    return Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads or None, verbose=False)
+
+
+def _llama_complete(body: Dict[str, Any]) -> str:
+    kwargs = {key: body[key] for key in ("temperature", "max_tokens", "response_format") if key in body}
+    result = _worker_model.create_chat_completion(messages=body["messages"], **kwargs)
+    return result["choices"][0]["message"]["content"]
+
+
+class LlamaCppChat(ChatBackend):
+    """A GGUF model run in-process with ``llama-cpp-python``."""
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_threads: int = 0, workers: int = 1) -> None:
+        if not model_path:
+            raise RuntimeError("LOCAL_LLM_MODEL must point at a GGUF model for the llama_cpp backend")
+        self.model_path = model_path
+        self.pool = ModelPool(_load_llama, {"model_path": model_path, "n_ctx": n_ctx, "n_threads": n_threads}, workers)
+
+    @property
+    def model_id(self) -> str:
+        return f"llama_cpp:{os.path.basename(self.model_path)}"
+
+    def complete(self, body: Dict[str, Any]) -> str:
+        return self.pool.run(_llama_complete, body)
+
+    async def acomplete(self, body: Dict[str, Any]) -> str:
+        return await self.pool.arun(_llama_complete, body)
+
+    def warm(self) -> None:
+        self.pool.warm()
+
+
+def _load_faster_whisper(model: str, device: str, compute_type: str, cpu_threads: int) -> Any:
+    from faster_whisper import WhisperModel
+
+    return WhisperModel(model, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+
+def _faster_whisper_transcribe(data: bytes, language: Optional[str]) -> str:
+    segments, _ = _worker_model.transcribe(io.BytesIO(data), language=language or None, beam_size=1)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class FasterWhisperStt(SttBackend):
+    """Whisper run in-process with ``faster-whisper`` (CTranslate2)."""
+
+    name = "faster_whisper"
+
+    def __init__(
+        self, model: str = "base.en", device: str = "cpu", compute_type: str = "int8", cpu_threads: int = 0,
+        language: str = "", workers: int = 1,
+    ) -> None:
+        self.model = model
+        self.language = language
+        self.pool = ModelPool(
+            _load_faster_whisper,
+            {"model": model, "device": device, "compute_type": compute_type, "cpu_threads": cpu_threads},
+            workers,
+        )
+
+    @property
+    def model_id(self) -> str:
+        return f"faster_whisper:{self.model}"
+
+    def transcribe(self, audio: Audio, mime_type: str) -> str:
+        return self.pool.run(_faster_whisper_transcribe, _read_audio(audio), self.language)
+
+    async def atranscribe(self, audio: Audio, mime_type: str) -> str:
+        data = await asyncio.to_thread(_read_audio, audio)
+        return await self.pool.arun(_faster_whisper_transcribe, data, self.language)
+
+    def warm(self) -> None:
+        self.pool.warm()
+
+
+def _load_piper(model_path: str, ffmpeg: str) -> Tuple[Any, str]:
+    from piper.voice import PiperVoice
+
+    return PiperVoice.load(model_path), ffmpeg
+
+
+def _piper_synthesize(text: str, encode: Tuple[str, ...]) -> bytes:
+    voice, ffmpeg = _worker_model
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        # piper-tts 1.3 renamed synthesize() to synthesize_wav()
+        getattr(voice, "synthesize_wav", voice.synthesize)(text, wav)
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0", *encode, "pipe:1"],
+        input=buffer.getvalue(),
+        capture_output=True,
+        check=True,
+    )
+    return proc.stdout
+
+
+class PiperTts(TtsBackend):
+    """A Piper voice run in-process, encoded to MP3 with ``ffmpeg``.
+
+    Every request uses the configured voice; ``voice_id`` is ignored. The
+    other formats of ``api.audio_formats`` are encoded by the same
+    ``ffmpeg`` call, straight from the voice's WAV output.
+    """
+
+    name = "piper"
+    output_formats = {name: name for name in audio_formats.FORMATS if name != audio_formats.MP3.name}
+
+    def __init__(self, model_path: str, ffmpeg: Optional[str], bitrate: str = "64k", workers: int = 1) -> None:
+        if not model_path:
+            raise RuntimeError("LOCAL_TTS_MODEL must point at a Piper voice (.onnx) for the piper backend")
+        if not ffmpeg:
+            raise RuntimeError("The piper backend needs ffmpeg to encode MP3")
+        self.model_path = model_path
+        self.bitrate = bitrate
+        self.pool = ModelPool(_load_piper, {"model_path": model_path, "ffmpeg": ffmpeg}, workers)
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.name}:{os.path.basename(self.model_path)}"
+
+    def cache_payload(self, text: str) -> Dict[str, Any]:
+        return {"backend": self.name, "model": os.path.basename(self.model_path), "bitrate": self.bitrate, "text": text}
+
+    def encode_args(self, output_format: Optional[str] = None) -> Tuple[str, ...]:
+        """``ffmpeg`` output options for ``output_format`` (MP3 by default).
+
+        Raises:
+            ValueError: The format is not one of :attr:`output_formats`.
+        """
+        if output_format is None:
+            return ("-f", "mp3", "-b:a", self.bitrate)
+        if output_format not in self.output_formats:
+            raise ValueError(f"The piper backend cannot produce {output_format!r} audio")
+        return audio_formats.get_format(output_format).encode
+
+    def synthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        return self.pool.run(_piper_synthesize, text, self.encode_args(output_format))
+
+    async def asynthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        return await self.pool.arun(_piper_synthesize, text, self.encode_args(output_format))
+
+    def warm(self) -> None:
+        self.pool.warm()
+
+
+# ---------------------------------------------------------------------------
+# Deterministic fakes for load testing
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz, about 26 ms)
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+# One silent mono MPEG-2 Layer III frame (32 kbps, 22.05 kHz, about 26 ms)
+SILENT_LOW_MP3_FRAME = b"\xff\xf3\x40\xc0" + bytes(100)
+
+
+def _fake_digest(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha256("\x00".join(parts).encode("utf-8")).digest()[:4], "big")
+
+
+class FakeChat(ChatBackend):
+    """Canned rebuttals that depend only on the request, after a fixed delay.
+
+    JSON requests get a rebuttal quoting the user's last message; plain
+    requests (the background summariser) get a summary line.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, chunk_delay: float = 0.0) -> None:
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+
+    def _content(self, body: Dict[str, Any]) -> str:
+        users = [m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user"]
+        last = (users[-1] if users else "").strip()
+        if "response_format" not in body:
+            return f"Summary of {len(body.get('messages', []))} messages; latest point: {last[:80]}"
+        variant = _fake_digest(last) % 3
+        openers = ["That sounds convincing", "Consider the opposite", "History suggests otherwise"]
+        return json.dumps(
+            {
+                "rebuttal_text": f"{openers[variant]}: you say \"{last[:120]}\", but who bears the cost of that?",
+                "bullets": ["Costs move, they do not vanish.", "Incentives change behaviour."],
+            }
+        )
+
+    def complete(self, body: Dict[str, Any]) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._content(body)
+
+    async def acomplete(self, body: Dict[str, Any]) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._content(body)
+
+    def stream(self, body: Dict[str, Any]) -> Iterator[str]:
+        content = self.complete(body)
+        for start in range(0, len(content), 12):
+            if start and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield content[start : start + 12]
+
+    async def astream(self, body: Dict[str, Any]) -> AsyncIterator[str]:
+        content = await self.acomplete(body)
+        for start in range(0, len(content), 12):
+            if start and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield content[start : start + 12]
+
+
+class FakeStt(SttBackend):
+    """Returns ``transcript`` for every recording, after a fixed delay."""
+
+    name = "fake"
+
+    def __init__(self, transcript: str = "Remote work is better for everyone.", latency: float = 0.0) -> None:
+        self.transcript = transcript
+        self.latency = latency
+
+    def transcribe(self, audio: Audio, mime_type: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.transcript
+
+    async def atranscribe(self, audio: Audio, mime_type: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.transcript
+
+
+class FakeTts(TtsBackend):
+    """Silence about as long as reading ``text`` aloud, after a fixed delay.
+
+    MP3 by default; low-bitrate MP3 and PCM are produced natively, like a
+    provider would, and the other formats are left to transcoding.
+    """
+
+    name = "fake"
+    output_formats = {"mp3_low": "mp3_22050_32", "pcm": "pcm_16000"}
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    def _audio(self, text: str, output_format: Optional[str] = None) -> bytes:
+        # Roughly 15 characters per second of speech
+        seconds = len(text) / 15
+        if output_format == "pcm_16000":
+            return bytes(2 * max(1, round(seconds * 16000)))
+        if output_format == "mp3_22050_32":
+            return SILENT_LOW_MP3_FRAME * max(1, round(seconds / (576 / 22050)))
+        return SILENT_MP3_FRAME * max(1, round(seconds / 0.026))
+
+    def synthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._audio(text, output_format)
+
+    async def asynthesize(self, text: str, voice_id: str, output_format: Optional[str] = None) -> bytes:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._audio(text, output_format)
+
+
+# ---------------------------------------------------------------------------
+# Selection
+
+
+def _ffmpeg() -> Optional[str]:
+    from .audio_prep import ffmpeg_path
+
+    return ffmpeg_path()
+
+
+BACKENDS: Dict[str, Dict[str, Callable[[], Any]]] = {
+    "chat": {
+        "openai": lambda: OpenAIChat(),
+        "openai_compatible": lambda: OpenAIChat(
+            "local_llm", "LOCAL_LLM_API_KEY", settings.LOCAL_LLM_MODEL, key_required=False
+        ),
+        "llama_cpp": lambda: LlamaCppChat(
+            settings.LOCAL_LLM_MODEL, settings.LOCAL_LLM_CONTEXT, settings.LOCAL_MODEL_THREADS,
+            settings.LOCAL_MODEL_WORKERS,
+        ),
+        "fake": lambda: FakeChat(settings.FAKE_BACKEND_LATENCY),
+    },
+    "stt": {
+        "openai": lambda: OpenAIWhisper(),
+        "openai_compatible": lambda: OpenAIWhisper(
+            "local_stt", "LOCAL_STT_API_KEY", settings.LOCAL_STT_MODEL, key_required=False
+        ),
+        "faster_whisper": lambda: FasterWhisperStt(
+            settings.LOCAL_STT_MODEL, settings.LOCAL_STT_DEVICE, settings.LOCAL_STT_COMPUTE_TYPE,
+            settings.LOCAL_MODEL_THREADS, settings.LOCAL_STT_LANGUAGE, settings.LOCAL_MODEL_WORKERS,
+        ),
+        "fake": lambda: FakeStt(latency=settings.FAKE_BACKEND_LATENCY),
+    },
+    "tts": {
+        "elevenlabs": lambda: ElevenLabsTts(),
+        "piper": lambda: PiperTts(settings.LOCAL_TTS_MODEL, _ffmpeg(), workers=settings.LOCAL_MODEL_WORKERS),
+        "fake": lambda: FakeTts(settings.FAKE_BACKEND_LATENCY),
+    },
+}
+
+_SETTINGS = {"chat": "CHAT_BACKEND", "stt": "STT_BACKEND", "tts": "TTS_BACKEND"}
+
+_backends: Dict[str, Any] = {}
+_backends_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def create_backend(kind: str) -> Any:
+    """Construct the backend configured for ``kind`` ("chat", "stt" or "tts").
+
+    Raises:
+        ValueError: The setting names no known backend.
+    """
+    choice = getattr(settings, _SETTINGS[kind])
+    factory = BACKENDS[kind].get(choice)
+    if factory is not None:
+        return factory()
+    if "." not in choice:
+        raise ValueError(f"Unknown {kind} backend {choice!r}; choose from {', '.join(BACKENDS[kind])}")
+    module, _, attr = choice.rpartition(".")
+    return getattr(importlib.import_module(module), attr)()
+
+
+def get_backend(kind: str) -> Any:
+    """Return the process-wide backend for ``kind``, creating it on first use."""
+    global _backends_pid
+    pid = os.getpid()
+    backend = _backends.get(kind)
+    if backend is not None and _backends_pid == pid:
+        return backend
+    with _lock:
+        if _backends_pid != pid:
+            # Pools inherited across a fork belong to the parent
+            _backends.clear()
+            _backends_pid = pid
+        backend = _backends.get(kind)
+        if backend is None:
+            backend = _backends[kind] = create_backend(kind)
+        return backend
+
+
+def warm_backends() -> Dict[str, str]:
+    """Create and warm every configured backend; return their names."""
+    names = {}
+    for kind in _SETTINGS:
+        backend = get_backend(kind)
+        backend.warm()
+        names[kind] = backend.name
+    return names
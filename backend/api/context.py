@@ -0,0 +1,211 @@
+"""Token-budgeted conversation context for the rebuttal prompt.
+
+Replaying the whole transcript on every turn makes each prompt longer than
+the last: latency and cost grow with the length of the debate, the total
+work grows quadratically, and a long enough session eventually exceeds the
+model's context limit. :class:`ContextWindow` bounds the prompt instead:
+
+* the most recent turns are sent verbatim, newest first, until the token
+  budget (``CONTEXT_MAX_TOKENS``) is spent;
+* turns older than the last ``CONTEXT_KEEP_TURNS`` are folded into a
+  running summary that is sent ahead of them.
+
+Summaries are refreshed off the request path. After a turn is recorded,
+:meth:`ContextWindow.maybe_schedule` hands the session to a background
+worker once at least ``CONTEXT_SUMMARY_BATCH`` turns are waiting to be
+folded; the worker extends the previous summary with just those turns and
+stores it through the session store. Until it finishes, the prompt keeps
+using the old summary plus whatever unsummarised turns fit the budget, so a
+slow summariser can cost detail but never bound violations.
+
+Tokens are counted with ``tiktoken`` when it is installed and estimated
+from the text length otherwise.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from django.conf import settings
+
+from . import metrics
+from .session_store import SessionStore, Summary, Turn
+
+logger = logging.getLogger(__name__)
+
+# Prompt size distribution buckets, in tokens
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Tokens the chat format adds around each message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Characters per token for the estimate used without tiktoken; English text
+# averages close to four.
+CHARS_PER_TOKEN = 4
+
+Summarizer = Callable[[str, List[Turn]], str]
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Return the number of tokens in ``text`` for ``model``.
+
+    Exact when ``tiktoken`` is installed, otherwise a length-based estimate.
+    """
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o") -> int:
+    """Return the prompt size of a chat ``messages`` list in tokens."""
+    return sum(count_tokens(str(m.get("content", "")), model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class ContextWindow:
+    """Builds bounded conversation history and keeps session summaries fresh.
+
+    Args:
+        store: Session store holding transcripts and summaries.
+        summarize: ``summarize(previous_summary, turns)`` returns a new
+            summary covering both; it runs on a background thread.
+        max_tokens: Budget for the summary plus verbatim turns.
+        keep_turns: Number of most recent turns never folded into the
+            summary.
+        summary_batch: Minimum number of foldable turns before a summary
+            refresh is scheduled, so the summariser is not called every turn.
+        model: Model name used to pick the tokenizer.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        summarize: Summarizer,
+        max_tokens: int = 3000,
+        keep_turns: int = 8,
+        summary_batch: int = 4,
+        model: str = "gpt-4o",
+    ) -> None:
+        self.store = store
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_batch = summary_batch
+        self.model = model
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of sessions with a summary refresh queued or running."""
+        with self._lock:
+            return len(self._pending)
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return the chat messages representing the session's history.
+
+        The latest turn is always included, even if it alone exceeds the
+        budget.
+        """
+        summary = self.store.summary(session_id)
+        turns = self.store.turns(session_id, start=summary.turns)
+        budget = self.max_tokens
+        messages: List[Dict[str, Any]] = []
+        if summary.text:
+            content = f"Summary of the earlier debate:\n{summary.text}"
+            messages.append({"role": "system", "content": content})
+            budget -= count_tokens(content, self.model) + MESSAGE_OVERHEAD_TOKENS
+        recent: List[Dict[str, Any]] = []
+        for role, text in reversed(turns):
+            cost = count_tokens(text, self.model) + MESSAGE_OVERHEAD_TOKENS
+            if recent and cost > budget:
+                break
+            recent.append({"role": role, "content": text})
+            budget -= cost
+        if len(recent) < len(turns):
+            # Unsummarised turns that did not fit: the summary is lagging
+            metrics.inc("context_turns_dropped_total", len(turns) - len(recent))
+        messages.extend(reversed(recent))
+        return messages
+
+    def maybe_schedule(self, session_id: str) -> Optional[Future]:
+        """Schedule a summary refresh if enough turns are waiting to be folded.
+
+        Returns:
+            The background job's future, or None if nothing was scheduled.
+        """
+        summary = self.store.summary(session_id)
+        foldable = len(self.store.turns(session_id, start=summary.turns)) - self.keep_turns
+        if foldable < self.summary_batch:
+            return None
+        with self._lock:
+            if session_id in self._pending:
+                return None
+            self._pending.add(session_id)
+        metrics.set_gauge("context_summaries_pending", len(self._pending))
+        return self._pool.submit(self._refresh, session_id)
+
+    def _refresh(self, session_id: str) -> None:
+        started = time.perf_counter()
+        try:
+            previous = self.store.summary(session_id)
+            turns = self.store.turns(session_id, start=previous.turns)
+            fold = turns[: max(0, len(turns) - self.keep_turns)]
+            if not fold:
+                return
+            text = self.summarize(previous.text, fold)
+            stored = self.store.set_summary(
+                session_id, Summary(text, previous.turns + len(fold), previous.generation)
+            )
+            metrics.inc("context_summaries_total", outcome="stored" if stored else "stale")
+            metrics.observe("context_summary_seconds", time.perf_counter() - started)
+            metrics.observe("context_summary_tokens", count_tokens(text, self.model), buckets=TOKEN_BUCKETS)
+        except Exception:
+            metrics.inc("context_summaries_total", outcome="error")
+            logger.exception("Summarising session %s failed", session_id)
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+            metrics.set_gauge("context_summaries_pending", len(self._pending))
+
+
+_window: Optional[ContextWindow] = None
+_window_lock = threading.Lock()
+
+
+def get_context_window(store: SessionStore, summarize: Summarizer) -> ContextWindow:
+    """Return the process-wide context window configured from settings.
+
+    ``store`` and ``summarize`` are only used by the first call, which
+    creates the window.
+    """
+    global _window
+    if _window is None:
+        with _window_lock:
+            if _window is None:
+                _window = ContextWindow(
+                    store,
+                    summarize,
+                    max_tokens=settings.CONTEXT_MAX_TOKENS,
+                    keep_turns=settings.CONTEXT_KEEP_TURNS,
+                    summary_batch=settings.CONTEXT_SUMMARY_BATCH,
+                    model=settings.CONTEXT_TOKENIZER_MODEL,
+                )
+    return _window
@@ -0,0 +1,90 @@
+"""Run independent calls concurrently and collect them as they complete.
+
+Panel mode asks several personas (or one persona about several stances) for
+a rebuttal at once. The completions do not depend on each other, so running
+them one after another makes the client wait for the sum of their latencies.
+The helpers here start at most ``parallelism`` calls at a time and hand back
+each result as soon as it is ready, in completion order, so the total wait is
+close to the slowest call.
+
+A call that raises does not stop the others: its exception is yielded in
+place of a result. Like ``api.tts_stream`` this module knows nothing about
+the calls themselves, and offers a thread-based iterator (WSGI) and an async
+iterator (ASGI).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# (index of the item, result or None, exception or None)
+Outcome = Tuple[int, Optional[R], Optional[BaseException]]
+
+
+def iter_completed(items: List[T], call: Callable[[T], R], parallelism: int = 4) -> Iterator[Outcome]:
+    """Call ``call`` on each item on worker threads, yielding as they finish.
+
+    Each call runs in a copy of the caller's context, so context variables
+    such as the request deadline (``api.resilience``) still apply. Closing
+    the iterator early cancels the calls that have not started.
+
+    Yields:
+        Tuples ``(index, result, error)``, exactly one of ``result`` and
+        ``error`` being set.
+    """
+    workers = max(1, min(parallelism, len(items)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+    pending: Dict[Future, int] = {}
+    queue = iter(enumerate(items))
+
+    def submit_next() -> None:
+        for index, item in queue:
+            pending[pool.submit(contextvars.copy_context().run, call, item)] = index
+            return
+
+    try:
+        for _ in range(workers):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                submit_next()
+                error = future.exception()
+                yield index, None if error else future.result(), error
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_completed(
+    items: List[T], call: Callable[[T], Awaitable[R]], parallelism: int = 4
+) -> AsyncIterator[Outcome]:
+    """Async counterpart of :func:`iter_completed` using tasks."""
+    pending: Dict[asyncio.Future, int] = {}
+    queue = iter(enumerate(items))
+
+    def submit_next() -> None:
+        for index, item in queue:
+            pending[asyncio.ensure_future(call(item))] = index
+            return
+
+    try:
+        for _ in range(max(1, parallelism)):
+            submit_next()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                submit_next()
+                error = task.exception()
+                yield index, None if error else task.result(), error
+    finally:
+        for task in pending:
+            task.cancel()
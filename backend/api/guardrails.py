@@ -0,0 +1,242 @@
+"""Banned-topic matching for incoming stances.
+
+The blocklist used to be checked with one substring search per keyword, so
+the cost of every request grew with the length of the list. Here the list is
+compiled once into a single regular expression shaped like a trie (terms
+sharing a prefix share a branch), which the ``re`` engine walks in C: the
+per-request cost depends on the length of the stance, not on the number of
+terms.
+
+Before matching, both the terms and the text are normalised so trivial
+obfuscation does not slip through:
+
+* Unicode compatibility forms are folded (NFKC/NFKD), accents and other
+  combining marks are dropped, invisible format characters such as
+  zero-width spaces are removed, and case is folded;
+* common leetspeak substitutions are undone (``h4ck`` -> ``hack``,
+  ``$elf`` -> ``self``);
+* every run of punctuation or whitespace becomes a single space, so
+  ``self-harm``, ``self_harm`` and ``Self  Harm`` are the same.
+
+Terms match from the start of a word (with an optional plural ``s``/``es``
+at the end); a trailing ``*`` on a term matches any continuation of its
+last word (``explosiv*``). The words of a phrase may also be run together,
+so ``self harm`` catches ``selfharm`` too.
+
+:class:`Guardrail` combines the built-in ``api.BANNED_TOPICS`` with an
+optional file (``BANNED_TOPICS_FILE``, one term per line, ``#`` comments)
+and recompiles when the file changes, without a restart.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import BANNED_TOPICS, metrics
+
+logger = logging.getLogger(__name__)
+
+# Digits that stand in for letters anywhere in a word
+_LEET_DIGITS = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b"})
+# Symbols that stand in for letters only when they lead into a word
+# character, so "$elf" folds but a trailing "!" stays punctuation
+_LEET_SYMBOLS = {"@": "a", "$": "s", "!": "i", "|": "l", "+": "t", "€": "e"}
+_LEET_SYMBOL_RE = re.compile(r"[@$!|+€](?=[^\W_])")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+# Marker for a trailing wildcard in the trie
+_PREFIX = "\x00"
+
+
+def normalize(text: str) -> str:
+    """Return ``text`` in the canonical form used for matching."""
+    ascii_only = text.isascii()
+    if not ascii_only:
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch) and unicodedata.category(ch) != "Cf")
+    text = _LEET_SYMBOL_RE.sub(lambda m: _LEET_SYMBOLS[m.group()], text.casefold())
+    text = text.translate(_LEET_DIGITS)
+    if not ascii_only:
+        text = unicodedata.normalize("NFKC", text)
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """Render a character trie as a regular expression."""
+    end = "" in node
+    branches = []
+    for ch in sorted(node):
+        if ch == "":
+            continue
+        if ch == _PREFIX:
+            branches.append(r"\w*")
+        elif ch == " ":
+            branches.append(" ?" + _trie_pattern(node[ch]))
+        else:
+            branches.append(re.escape(ch) + _trie_pattern(node[ch]))
+    if not branches:
+        return ""
+    if len(branches) == 1 and not end:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if end else pattern
+
+
+class TopicMatcher:
+    """A compiled set of banned terms.
+
+    Args:
+        terms: Banned words or phrases. A trailing ``*`` makes the last word
+            a prefix.
+    """
+
+    def __init__(self, terms: Iterable[str]) -> None:
+        self.terms: Dict[str, str] = {}
+        # Keys without their spaces, for reporting run-together matches
+        self._exact: Dict[str, str] = {}
+        self._prefixes: Dict[str, str] = {}
+        trie: Dict[str, dict] = {}
+        for term in terms:
+            term = term.strip()
+            prefix = term.endswith("*")
+            key = normalize(term.rstrip("*"))
+            if not key:
+                continue
+            self.terms[key + (_PREFIX if prefix else "")] = term
+            (self._prefixes if prefix else self._exact).setdefault(key.replace(" ", ""), term)
+            node = trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[_PREFIX if prefix else ""] = {}
+        self._regex: Optional[re.Pattern] = None
+        if trie:
+            # Normalised text is words separated by single spaces, so a
+            # leading space (the text is padded) is the word boundary.
+            self._regex = re.compile(f" ({_trie_pattern(trie)})(?:e?s)?(?= )")
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def search(self, text: str) -> Optional[str]:
+        """Return the first banned term found in ``text``, or None."""
+        if self._regex is None:
+            return None
+        match = self._regex.search(f" {normalize(text)} ")
+        if match is None:
+            return None
+        found = match.group(1)
+        compact = found.replace(" ", "")
+        if compact in self._exact:
+            return self._exact[compact]
+        # Matched through a wildcard: find the longest prefix term responsible
+        for cut in range(len(compact), 0, -1):
+            if compact[:cut] in self._prefixes:
+                return self._prefixes[compact[:cut]]
+        return found
+
+
+def read_terms(path: Path) -> List[str]:
+    """Read a blocklist file: one term per line, blank lines and ``#`` comments ignored."""
+    terms = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            terms.append(line)
+    return terms
+
+
+class Guardrail:
+    """Banned-topic checker that follows changes to a blocklist file.
+
+    The file is checked at most every ``reload_interval`` seconds (by size
+    and modification time) and recompiled when it changed; deleting the file
+    drops its terms. If it cannot be read or compiled, the previous matcher
+    stays in place.
+
+    Args:
+        terms: Built-in terms that are always banned.
+        path: Optional blocklist file adding to ``terms``.
+        reload_interval: Seconds between checks of ``path``.
+    """
+
+    def __init__(self, terms: Iterable[str], path: Optional[Path] = None, reload_interval: float = 5.0) -> None:
+        self.base_terms = list(terms)
+        self.path = Path(path) if path else None
+        self.reload_interval = reload_interval
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.matcher = TopicMatcher(self.base_terms)
+        self.reload()
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile from the blocklist file if it changed.
+
+        Returns:
+            True if a new matcher was installed.
+        """
+        if self.path is None:
+            return False
+        with self._lock:
+            self._checked = time.monotonic()
+            signature = self._file_signature()
+            if signature == self._signature and not force:
+                return False
+            try:
+                extra = read_terms(self.path) if signature is not None else []
+                matcher = TopicMatcher(self.base_terms + extra)
+            except (OSError, UnicodeDecodeError, re.error):
+                logger.exception("Could not load banned topics from %s", self.path)
+                metrics.inc("guardrail_reloads_total", outcome="error")
+                return False
+            self._signature = signature
+            self.matcher = matcher
+        metrics.inc("guardrail_reloads_total", outcome="ok")
+        metrics.set_gauge("guardrail_terms", len(matcher))
+        return True
+
+    def match(self, text: str) -> Optional[str]:
+        """Return the banned term found in ``text``, or None."""
+        if (
+            self.path is not None
+            and time.monotonic() - self._checked >= self.reload_interval
+            and not self._lock.locked()  # another thread is already reloading
+        ):
+            self.reload()
+        term = self.matcher.search(text)
+        if term is not None:
+            metrics.inc("guardrail_blocked_total")
+        return term
+
+
+_guardrail: Optional[Guardrail] = None
+_guardrail_lock = threading.Lock()
+
+
+def get_guardrail() -> Guardrail:
+    """Return the process-wide guardrail configured from settings."""
+    global _guardrail
+    if _guardrail is None:
+        with _guardrail_lock:
+            if _guardrail is None:
+                _guardrail = Guardrail(
+                    BANNED_TOPICS,
+                    settings.BANNED_TOPICS_FILE or None,
+                    settings.BANNED_TOPICS_RELOAD_INTERVAL,
+                )
+    return _guardrail
@@ -0,0 +1,303 @@
+"""Per-request timing of the hot path, Server-Timing headers and profiling.
+
+Nothing used to say where a turn's latency went: JSON parsing, prompt
+building, the chat or speech providers, or disk writes. Phases are now
+wrapped in :func:`span` (or decorated with :func:`timed`), which records
+each duration in two places:
+
+* the ``phase_seconds`` histogram (or the one named by ``metric``), served
+  with every other metric from ``/metrics`` and ``/api/stats``;
+* the :class:`Timings` of the request being handled, which
+  :class:`InstrumentMiddleware` turns into a ``Server-Timing`` header so the
+  browser's developer tools (and the front-end, through the Resource Timing
+  API) show the breakdown of each response.
+
+The middleware also records ``http_request_seconds`` and counts the bytes
+received and sent per view. Spans outside a request (background summaries,
+bodies streamed after the response was returned) only update the
+histograms.
+
+Profiling is opt-in per request: with ``PROFILE_TOKEN`` set, a request
+carrying ``X-Profile: <token>`` is run under pyinstrument (when installed)
+or cProfile, the report is written to ``PROFILE_DIR`` and its file name is
+returned in ``X-Profile-Report``. cProfile only sees the thread it was
+started on, so under ASGI it covers the event loop and not sync views run
+in worker threads.
+
+Example::
+
+    from . import instrument
+
+    with instrument.span("chat", desc="openai:gpt-4o", metric="upstream_request_seconds", provider="openai"):
+        content = backend.complete(body)
+"""
+from __future__ import annotations
+
+import contextvars
+import functools
+import hmac
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+# Buckets for in-process phases, which are mostly well under a second
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Timings:
+    """Durations of the named phases of one request, summed per name.
+
+    Shared by reference with worker threads and tasks started while the
+    request is handled (they inherit the context), hence the lock.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases: Dict[str, List[Any]] = {}
+
+    def add(self, name: str, seconds: float, desc: str = "") -> None:
+        with self._lock:
+            phase = self._phases.setdefault(name, [0.0, desc])
+            phase[0] += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, float]:
+        """Milliseconds per phase, in the order the phases were first seen."""
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, (seconds, _) in self._phases.items()}
+
+    def header(self) -> str:
+        """Render the phases plus ``total`` as a ``Server-Timing`` value."""
+        with self._lock:
+            phases = list(self._phases.items())
+        entries = []
+        for name, (seconds, desc) in phases:
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if desc:
+                entry += f';desc="{desc}"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def collect() -> Iterator[Timings]:
+    """Collect the spans run inside the block (and in tasks it starts)."""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def span(name: str, desc: str = "", metric: str = "phase_seconds", **labels: Any) -> Iterator[None]:
+    """Time the block as phase ``name`` of the current request.
+
+    Args:
+        name: Server-Timing name of the phase.
+        desc: Optional Server-Timing description (for example the model).
+        metric: Histogram to record the duration in.
+        **labels: Histogram labels; default ``phase=name``. An ``outcome``
+            label (``ok`` or ``error``) is always added.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, elapsed, desc)
+        buckets = PHASE_BUCKETS if metric == "phase_seconds" else metrics.DEFAULT_BUCKETS
+        metrics.observe(metric, elapsed, buckets=buckets, outcome=outcome, **(labels or {"phase": name}))
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorate a function so each call is recorded as a :func:`span`."""
+
+    def decorate(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+# ---------------------------------------------------------------------------
+# Profiling
+
+
+class Profile:
+    """Profile one request with pyinstrument if available, else cProfile."""
+
+    def __init__(self) -> None:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            import cProfile
+
+            self.profiler: Any = cProfile.Profile()
+            self.extension = "prof"
+        else:
+            self.profiler = Profiler(async_mode="enabled")
+            self.extension = "html"
+
+    def __enter__(self) -> "Profile":
+        if self.extension == "html":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self.extension == "html":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, label: str) -> str:
+        """Write the report to ``PROFILE_DIR``; return its file name.
+
+        ``.html`` reports open in a browser; ``.prof`` files load with
+        ``python -m pstats`` or snakeviz.
+        """
+        root = Path(settings.PROFILE_DIR or Path(tempfile.gettempdir()) / "devdebate-profiles")
+        root.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}.{self.extension}"
+        if self.extension == "html":
+            (root / name).write_text(self.profiler.output_html(), encoding="utf-8")
+        else:
+            self.profiler.dump_stats(str(root / name))
+        metrics.inc("profiles_written_total")
+        return name
+
+
+def wants_profile(request: Any) -> bool:
+    """Whether ``request`` carries the admin ``X-Profile`` token."""
+    token = settings.PROFILE_TOKEN
+    given = request.headers.get("X-Profile", "")
+    return bool(token and given) and hmac.compare_digest(given.encode(), token.encode())
+
+
+@contextmanager
+def maybe_profile(request: Any) -> Iterator[Optional[Profile]]:
+    if not wants_profile(request):
+        yield None
+        return
+    with Profile() as profile:
+        yield profile
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+
+
+def view_name(request: Any) -> str:
+    """Label for the view that handled ``request``."""
+    match = getattr(request, "resolver_match", None)
+    return (match.url_name or match.view_name) if match else "unmatched"
+
+
+def _count_sent(chunks: Iterator[Any], view: str) -> Iterator[Any]:
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc("http_response_bytes_total", sent, view=view)
+
+
+async def _acount_sent(chunks: AsyncIterator[Any], view: str) -> AsyncIterator[Any]:
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc("http_response_bytes_total", sent, view=view)
+
+
+class InstrumentMiddleware:
+    """Time every request and report it in ``Server-Timing`` and metrics.
+
+    Place it first in ``MIDDLEWARE`` so the total covers the other
+    middleware too. Request bytes are taken from ``Content-Length`` (the
+    body is never read here, so streamed uploads stay streamed); response
+    bytes from ``Content-Length`` or by counting a streamed body as it is
+    sent, which leaves file responses eligible for ``sendfile``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Any) -> None:
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: Any) -> Any:
+        if self.is_async:
+            return self.__acall__(request)
+        with collect() as timings, maybe_profile(request) as profile:
+            response = self.get_response(request)
+        return self.finish(request, response, timings, profile)
+
+    async def __acall__(self, request: Any) -> Any:
+        with collect() as timings, maybe_profile(request) as profile:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings, profile)
+
+    def finish(self, request: Any, response: Any, timings: Timings, profile: Optional[Profile]) -> Any:
+        view = view_name(request)
+        metrics.observe(
+            "http_request_seconds", timings.elapsed(), view=view, method=request.method, status=response.status_code
+        )
+        try:
+            received = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            received = 0
+        metrics.inc("http_request_bytes_total", received, view=view)
+        if response.has_header("Content-Length"):
+            metrics.inc("http_response_bytes_total", int(response["Content-Length"]), view=view)
+        elif response.streaming:
+            if response.is_async:
+                response.streaming_content = _acount_sent(response.streaming_content, view)
+            else:
+                response.streaming_content = _count_sent(response.streaming_content, view)
+        else:
+            metrics.inc("http_response_bytes_total", len(response.content), view=view)
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timings.header()
+            origin = request.headers.get("Origin")
+            if origin and origin in settings.CORS_ALLOWED_ORIGINS:
+                # Lets the front-end read the timings cross-origin
+                response["Timing-Allow-Origin"] = origin
+        if profile is not None:
+            response["X-Profile-Report"] = profile.save(view)
+        return response
@@ -0,0 +1,613 @@
+"""Durable background queue for speech synthesis and transcription jobs.
+
+``/api/tts`` and ``/api/stt`` call the provider on the request thread, so a
+burst of voice traffic can occupy every worker and leave the cheap endpoints
+(``reset``, ``download``) waiting. The job endpoints instead store the work
+in a SQLite table -- in the database from ``DATABASES`` (or
+``JOB_QUEUE_PATH``), like the session store -- and answer ``202`` with a job
+ID straight away. Clients poll ``/api/jobs/<id>`` (optionally long-polling
+with ``?wait=``) or give a ``callbackUrl`` to be told when it is done.
+
+Jobs are run by a :class:`JobRunner` in each web process:
+
+* Each job belongs to the provider of its backend (``elevenlabs``,
+  ``openai``, ``piper``, ...). At most ``JOB_PROVIDER_CONCURRENCY[provider]``
+  jobs of a provider run at once across every process sharing the
+  database; the check and the claim happen in one write transaction.
+* Higher ``priority`` runs first, then the oldest job.
+* A running job holds a lease that the runner renews. If its process dies,
+  the lease runs out and the job is queued again, up to
+  ``JOB_MAX_ATTEMPTS`` times; queued jobs simply wait for the next runner.
+  So jobs survive a restart.
+* Finished jobs are kept for ``JOB_RESULT_TTL`` seconds.
+
+What a job does is up to the handlers passed to :meth:`JobQueue.start`
+(``api.views`` registers ``tts`` and ``stt``). The queue reports
+``job_queue_depth{kind}`` and ``job_running{provider}`` gauges, and
+``job_wait_seconds`` / ``job_run_seconds`` histograms.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from . import metrics, resilience
+from .session_store import sqlite_store_path
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+MIN_PRIORITY, MAX_PRIORITY = -10, 10
+
+# Queue waits range from nothing to minutes under a burst
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Threads delivering completion callbacks, per runner
+CALLBACK_WORKERS = 4
+
+Handler = Callable[["Job"], Dict[str, Any]]
+
+
+class Job(NamedTuple):
+    """One row of the job table."""
+
+    id: str
+    kind: str
+    provider: str
+    priority: int
+    status: str
+    payload: Dict[str, Any]
+    result: Optional[Dict[str, Any]]
+    error: str
+    callback_url: str
+    attempts: int
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def public(self) -> Dict[str, Any]:
+        """The job as returned by the status endpoint."""
+        data: Dict[str, Any] = {
+            "jobId": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "attempts": self.attempts,
+        }
+        if self.started_at is not None:
+            data["wait_ms"] = round((self.started_at - self.created_at) * 1000, 1)
+        if self.finished_at is not None and self.started_at is not None:
+            data["run_ms"] = round((self.finished_at - self.started_at) * 1000, 1)
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devdebate_job (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT NOT NULL DEFAULT '',
+    callback_url TEXT NOT NULL DEFAULT '',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT NOT NULL DEFAULT '',
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS devdebate_job_next
+    ON devdebate_job (status, provider, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS devdebate_job_finished
+    ON devdebate_job (finished_at);
+"""
+
+_COLUMNS = (
+    "id, kind, provider, priority, status, payload, result, error, callback_url, "
+    "attempts, created_at, started_at, finished_at"
+)
+
+
+def _job(row: Any) -> Job:
+    values = list(row)
+    values[5] = json.loads(values[5])
+    values[6] = json.loads(values[6]) if values[6] is not None else None
+    return Job(*values)
+
+
+class JobQueue:
+    """Jobs stored in a SQLite file in WAL mode, shared by every worker.
+
+    Connections are per thread, as in
+    :class:`~api.session_store.SQLiteSessionStore`; claims use
+    ``BEGIN IMMEDIATE`` so two processes never take the same job.
+
+    Args:
+        path: SQLite database file.
+        lease: Seconds a claimed job stays with its runner without renewal.
+        max_attempts: Claims after which a job whose runner keeps dying fails.
+        ttl: Seconds finished jobs are kept.
+    """
+
+    def __init__(self, path: Path, lease: float = 60, max_attempts: int = 3, ttl: float = 86400) -> None:
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self.runner: Optional[JobRunner] = None
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._async_waiters: Dict[str, List[Any]] = {}
+        self._waiters_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._last_purge = 0.0
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # -- producers ---------------------------------------------------------
+
+    def submit(
+        self,
+        kind: str,
+        provider: str,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        callback_url: str = "",
+        job_id: Optional[str] = None,
+    ) -> Job:
+        """Queue a job and return it.
+
+        ``job_id`` lets a caller store files under the ID before queueing.
+        """
+        job = Job(
+            job_id or uuid.uuid4().hex, kind, provider, priority, QUEUED, payload, None, "", callback_url, 0,
+            time.time(), None, None,
+        )
+        self._connect().execute(
+            "INSERT INTO devdebate_job (id, kind, provider, priority, status, payload, callback_url, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, kind, provider, priority, QUEUED, json.dumps(payload), callback_url, job.created_at),
+        )
+        metrics.inc("jobs_submitted_total", kind=kind)
+        self._notify(job.id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connect().execute(f"SELECT {_COLUMNS} FROM devdebate_job WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Return the job once it has finished or ``timeout`` has passed.
+
+        Jobs finished in this process wake the caller at once; jobs run by
+        another process are noticed within ``JOB_POLL_INTERVAL``.
+        """
+        until = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = until - time.monotonic()
+            if job is None or job.finished or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, settings.JOB_POLL_INTERVAL))
+
+    async def await_job(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Async counterpart of :meth:`wait`; holds no thread while waiting."""
+        loop = asyncio.get_running_loop()
+        until = loop.time() + timeout
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            remaining = until - loop.time()
+            if job is None or job.finished or remaining <= 0:
+                return job
+            event = asyncio.Event()
+            waiter = (loop, event)
+            with self._waiters_lock:
+                self._async_waiters.setdefault(job_id, []).append(waiter)
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, settings.JOB_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._waiters_lock:
+                    waiters = self._async_waiters.get(job_id, [])
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+                        if not waiters:
+                            del self._async_waiters[job_id]
+
+    def _notify(self, job_id: str) -> None:
+        with self._changed:
+            self._changed.notify_all()
+        with self._waiters_lock:
+            waiters = self._async_waiters.pop(job_id, [])
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    # -- runners -----------------------------------------------------------
+
+    def claim(self, limits: Dict[str, int], worker: str) -> Optional[Job]:
+        """Take the next job of a provider in ``limits`` that is under its limit.
+
+        Args:
+            limits: Most jobs of each provider allowed to run at once.
+            worker: Identifies the claiming runner, for renewals.
+        """
+        conn = self._connect()
+        self.requeue_expired()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Read under the write lock, so no job submitted while waiting for it is newer
+            now = time.time()
+            running = dict(
+                conn.execute(
+                    "SELECT provider, COUNT(*) FROM devdebate_job WHERE status = ? GROUP BY provider", (RUNNING,)
+                ).fetchall()
+            )
+            for provider, count in running.items():
+                metrics.set_gauge("job_running", count, provider=provider)
+            providers = [p for p, limit in limits.items() if running.get(p, 0) < limit]
+            row = None
+            if providers:
+                marks = ", ".join("?" for _ in providers)
+                row = conn.execute(
+                    f"SELECT {_COLUMNS} FROM devdebate_job WHERE status = ? AND provider IN ({marks}) "
+                    "ORDER BY priority DESC, created_at LIMIT 1",
+                    (QUEUED, *providers),
+                ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE devdebate_job SET status = ?, worker = ?, lease_until = ?, started_at = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, worker, now + self.lease, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = _job(row)._replace(status=RUNNING, started_at=now, attempts=row[9] + 1)
+        metrics.observe("job_wait_seconds", now - job.created_at, buckets=WAIT_BUCKETS, kind=job.kind)
+        return job
+
+    def renew(self, job_ids: List[str], worker: str) -> None:
+        """Extend the leases of the jobs ``worker`` is running."""
+        if not job_ids:
+            return
+        marks = ", ".join("?" for _ in job_ids)
+        self._connect().execute(
+            f"UPDATE devdebate_job SET lease_until = ? WHERE worker = ? AND status = ? AND id IN ({marks})",
+            (time.time() + self.lease, worker, RUNNING, *job_ids),
+        )
+
+    def finish(self, job: Job, worker: str, result: Optional[Dict[str, Any]] = None, error: str = "") -> Optional[Job]:
+        """Record the outcome of a job ``worker`` ran.
+
+        Returns:
+            The finished job, or None if the lease had been lost (the job was
+            queued again and belongs to another runner now).
+        """
+        status = FAILED if error else DONE
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE devdebate_job SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = ?",
+            (status, json.dumps(result) if result is not None else None, error, now, job.id, worker, RUNNING),
+        )
+        if not cursor.rowcount:
+            return None
+        self._notify(job.id)
+        return job._replace(status=status, result=result, error=error, finished_at=now)
+
+    def release(self, worker: str) -> int:
+        """Put the jobs ``worker`` is running back in the queue (on shutdown)."""
+        cursor = self._connect().execute(
+            "UPDATE devdebate_job SET status = ?, worker = '', lease_until = NULL, attempts = attempts - 1 "
+            "WHERE worker = ? AND status = ?",
+            (QUEUED, worker, RUNNING),
+        )
+        return cursor.rowcount
+
+    def requeue_expired(self) -> int:
+        """Queue again the jobs whose runner stopped renewing their lease."""
+        conn = self._connect()
+        now = time.time()
+        failed = conn.execute(
+            "UPDATE devdebate_job SET status = ?, error = 'Job runner stopped responding', finished_at = ?, "
+            "lease_until = NULL WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now, self.max_attempts),
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE devdebate_job SET status = ?, worker = '', lease_until = NULL "
+            "WHERE status = ? AND lease_until < ?",
+            (QUEUED, RUNNING, now),
+        ).rowcount
+        if requeued:
+            metrics.inc("jobs_requeued_total", requeued)
+        if failed:
+            metrics.inc("jobs_abandoned_total", failed)
+        return requeued
+
+    # -- housekeeping ------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, running jobs and the oldest wait, per kind."""
+        rows = self._connect().execute(
+            "SELECT kind, status, COUNT(*), MIN(created_at) FROM devdebate_job "
+            "WHERE status IN (?, ?) GROUP BY kind, status",
+            (QUEUED, RUNNING),
+        ).fetchall()
+        now = time.time()
+        stats: Dict[str, Any] = {"queued": {}, "running": {}, "oldest_wait_s": {}}
+        for kind, status, count, oldest in rows:
+            stats[status][kind] = count
+            if status == QUEUED:
+                stats["oldest_wait_s"][kind] = round(now - oldest, 3)
+        for kind in set(stats["queued"]) | set(self.runner.handlers if self.runner else ()):
+            metrics.set_gauge("job_queue_depth", stats["queued"].get(kind, 0), kind=kind)
+        return stats
+
+    def purge_expired(self) -> List[str]:
+        """Delete jobs finished more than ``ttl`` seconds ago; return their IDs."""
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM devdebate_job WHERE finished_at < ?", (cutoff,)
+        ).fetchall()]
+        if ids:
+            conn.execute("DELETE FROM devdebate_job WHERE finished_at < ?", (cutoff,))
+        return ids
+
+    def maybe_purge(self, interval: float = 600) -> List[str]:
+        """Call :meth:`purge_expired` at most once every ``interval`` seconds."""
+        now = time.monotonic()
+        if now - self._last_purge < interval:
+            return []
+        self._last_purge = now
+        return self.purge_expired()
+
+    def start(self, handlers: Dict[str, Handler], providers: Dict[str, str]) -> "JobRunner":
+        """Start this process's runner (once) and return it.
+
+        Args:
+            handlers: Function running each kind of job.
+            providers: Provider of each kind, whose concurrency limit applies.
+        """
+        with self._start_lock:
+            if self.runner is None:
+                limits = {p: provider_limit(p) for p in set(providers.values())}
+                self.runner = JobRunner(self, handlers, limits)
+                self.runner.start()
+        return self.runner
+
+
+def provider_limit(provider: str) -> int:
+    """Most jobs of ``provider`` run at once (``JOB_PROVIDER_CONCURRENCY``)."""
+    return settings.JOB_PROVIDER_CONCURRENCY.get(provider, settings.JOB_DEFAULT_CONCURRENCY)
+
+
+class JobRunner:
+    """Threads that claim and run jobs for one process.
+
+    One thread per job that may run at once (the sum of ``limits``), plus
+    one renewing leases. Handlers run under a ``JOB_TIMEOUT`` deadline for
+    their upstream calls; an exception fails the job with its message.
+    Completion callbacks are delivered by a separate pool of
+    ``CALLBACK_WORKERS`` threads, so a slow or dead callback URL does not
+    hold a provider's slot.
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Handler], limits: Dict[str, int]) -> None:
+        self.queue = queue
+        self.handlers = handlers
+        self.limits = limits
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+        self._running: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._callbacks = ThreadPoolExecutor(max_workers=CALLBACK_WORKERS, thread_name_prefix="devdebate-job-callback")
+
+    def start(self) -> None:
+        count = sum(self.limits.values())
+        for i in range(count):
+            thread = threading.Thread(target=self._loop, name=f"devdebate-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew_leases, name="devdebate-job-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop claiming jobs, wait up to ``timeout`` for running ones, requeue the rest."""
+        self.stopping.set()
+        with self.queue._changed:
+            self.queue._changed.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.queue.release(self.worker)
+        self._callbacks.shutdown(wait=False, cancel_futures=True)
+
+    def _loop(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.claim(self.limits, self.worker)
+            except sqlite3.Error:
+                metrics.inc("job_claim_errors_total")
+                job = None
+            if job is None:
+                with self.queue._changed:
+                    self.queue._changed.wait(settings.JOB_POLL_INTERVAL)
+                continue
+            self.run(job)
+
+    def run(self, job: Job) -> None:
+        with self._lock:
+            self._running[job.id] = job
+        start = time.perf_counter()
+        result, error = None, ""
+        try:
+            handler = self.handlers[job.kind]
+            with resilience.deadline(settings.JOB_TIMEOUT):
+                result = handler(job)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+        outcome = "failed" if error else "done"
+        metrics.observe("job_run_seconds", time.perf_counter() - start, kind=job.kind, outcome=outcome)
+        finished = self.queue.finish(job, self.worker, result, error)
+        if finished is None:
+            metrics.inc("jobs_lease_lost_total", kind=job.kind)
+            return
+        metrics.inc("jobs_finished_total", kind=job.kind, status=finished.status)
+        if finished.callback_url:
+            self._callbacks.submit(deliver_callback, finished)
+        self.queue.stats()
+        for job_id in self.queue.maybe_purge():
+            discard_audio(job_id)
+
+    def _renew_leases(self) -> None:
+        while not self.stopping.wait(self.queue.lease / 3):
+            with self._lock:
+                ids = list(self._running)
+            try:
+                self.queue.renew(ids, self.worker)
+            except sqlite3.Error:
+                metrics.inc("job_claim_errors_total")
+
+
+# ---------------------------------------------------------------------------
+# Completion callbacks
+
+
+class CallbackRejected(ValueError):
+    """A ``callbackUrl`` that is not allowed."""
+
+
+def check_callback_url(url: str) -> str:
+    """Validate a client's ``callbackUrl`` against ``JOB_CALLBACK_HOSTS``.
+
+    Only http(s) URLs on a listed host are accepted, so the server cannot
+    be made to POST to arbitrary internal addresses.
+
+    Raises:
+        CallbackRejected: If callbacks are off or the URL is not allowed.
+    """
+    if not settings.JOB_CALLBACK_HOSTS:
+        raise CallbackRejected("Callbacks are not enabled on this server")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or parts.hostname not in settings.JOB_CALLBACK_HOSTS:
+        raise CallbackRejected("callbackUrl must be an http(s) URL on an allowed host")
+    return url
+
+
+def callback_signature(body: bytes) -> str:
+    """``X-DevDebate-Signature`` value: HMAC-SHA256 of the body."""
+    digest = hmac.new(settings.JOB_CALLBACK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+_callback_client: Optional[httpx.Client] = None
+
+
+def deliver_callback(job: Job, attempts: int = 3) -> bool:
+    """POST the finished job to its ``callback_url``; return True on a 2xx.
+
+    Retried with backoff on errors and non-2xx answers. Delivery is best
+    effort: the result stays available from the status endpoint either way.
+    """
+    global _callback_client
+    if _callback_client is None:
+        _callback_client = httpx.Client(timeout=settings.JOB_CALLBACK_TIMEOUT)
+    body = json.dumps(job.public()).encode()
+    headers = {"Content-Type": "application/json"}
+    if settings.JOB_CALLBACK_SECRET:
+        headers["X-DevDebate-Signature"] = callback_signature(body)
+    for attempt in range(attempts):
+        try:
+            resp = _callback_client.post(job.callback_url, content=body, headers=headers)
+            if resp.is_success:
+                metrics.inc("job_callbacks_total", outcome="ok")
+                return True
+        except httpx.HTTPError:
+            pass
+        if attempt + 1 < attempts:
+            time.sleep(2**attempt)
+    metrics.inc("job_callbacks_total", outcome="failed")
+    return False
+
+
+# ---------------------------------------------------------------------------
+
+
+def audio_path(job_id: str) -> Path:
+    """Where the recording of transcription job ``job_id`` is kept until it finishes."""
+    root = Path(settings.JOB_UPLOAD_DIR or Path(tempfile.gettempdir()) / "devdebate-job-uploads")
+    root.mkdir(parents=True, exist_ok=True)
+    return root / f"{job_id}.audio"
+
+
+def discard_audio(job_id: str) -> None:
+    try:
+        audio_path(job_id).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def job_queue_path() -> Path:
+    """SQLite file for the queue: ``JOB_QUEUE_PATH`` or the session store's."""
+    return Path(settings.JOB_QUEUE_PATH) if settings.JOB_QUEUE_PATH else sqlite_store_path()
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue configured from settings."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    job_queue_path(), settings.JOB_LEASE, settings.JOB_MAX_ATTEMPTS, settings.JOB_RESULT_TTL
+                )
+    return _queue
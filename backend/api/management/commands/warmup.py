@@ -0,0 +1,57 @@
+"""``manage.py warmup``: run the warm-up steps and report their timings.
+
+See ``api.warmup``. At deploy time, run it with ``--build-assets`` to
+synthesise the persona stock lines into the asset bundle before the new
+workers start.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import audio_formats
+from api.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Warm up the backends, stores and provider connections; optionally build the persona asset bundle."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--build-assets",
+            action="store_true",
+            help="synthesise the persona stock lines missing from PERSONA_ASSETS_DIR",
+        )
+        parser.add_argument("--force", action="store_true", help="with --build-assets, synthesise every line again")
+        parser.add_argument(
+            "--formats",
+            help=(
+                f"formats to build, comma-separated, of {', '.join(audio_formats.FORMATS)}; "
+                "default PERSONA_ASSET_FORMATS"
+            ),
+        )
+        parser.add_argument("--no-connections", action="store_true", help="do not open provider connections")
+        parser.add_argument("--json", action="store_true", help="print the report as JSON")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        formats = None
+        if options["formats"]:
+            formats = [name.strip() for name in options["formats"].split(",") if name.strip()]
+            for name in formats:
+                try:
+                    audio_formats.get_format(name)
+                except ValueError as e:
+                    raise CommandError(str(e))
+        try:
+            report = warm_up(options["build_assets"], options["force"], not options["no_connections"], formats)
+        except Exception as e:
+            raise CommandError(f"Warm-up failed: {e}")
+        if options["json"]:
+            self.stdout.write(json.dumps(report))
+            return
+        for name, step in report.items():
+            self.stdout.write(f"{name:<12} {step['seconds'] * 1000:9.1f} ms  {json.dumps(step['result'])}")
+        total = sum(step["seconds"] for step in report.values())
+        self.stdout.write(self.style.SUCCESS(f"Warm-up finished in {total * 1000:.1f} ms"))
@@ -0,0 +1,248 @@
+"""Serving generated audio from ``MEDIA_ROOT``.
+
+Synthesised MP3s had no serving path outside ``DEBUG``, and Django's
+``static.serve`` would have streamed every file through Python in 4 KB
+blocks with no byte ranges, so seeking or replaying a turn downloaded the
+whole file again. :func:`media_response` serves files under ``MEDIA_ROOT``
+with:
+
+* ``Range`` requests (a single range; ``If-Range`` is honoured), answered
+  with ``206 Partial Content`` or ``416``;
+* a strong ``ETag`` computed from the file's bytes, so ``If-None-Match``
+  revalidates with ``304`` across workers and restarts;
+* ``Cache-Control: immutable`` for the content-addressed files of the TTS
+  cache, whose name changes whenever what they voice changes;
+* zero-copy sending: the response is a ``FileResponse`` positioned at the
+  start of the range with an exact ``Content-Length``, so a WSGI server
+  with ``wsgi.file_wrapper`` (gunicorn, uWSGI) sends it with ``sendfile``.
+
+With ``MEDIA_OFFLOAD`` set, only the headers are produced here and the
+front proxy sends the file itself, ranges included:
+
+* ``x-accel-redirect`` (nginx) redirects to ``MEDIA_ACCEL_PREFIX`` plus the
+  path, which must be an ``internal`` location aliased to ``MEDIA_ROOT``;
+* ``x-sendfile`` (Apache ``mod_xsendfile``, lighttpd) passes the absolute
+  path.
+
+``Last-Modified`` is not sent: the TTS cache touches a file's mtime on
+every hit to track recency, so it says nothing about the content.
+"""
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import IO, Any, Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, JsonResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+
+from . import metrics
+
+# Bytes read per block when a file is streamed by Django itself
+CHUNK_BYTES = 64 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+OFFLOAD_MODES = ("x-accel-redirect", "x-sendfile")
+
+# Names written by api.tts_cache: the SHA-256 of what was voiced
+_HASHED_NAME = re.compile(r"^[0-9a-f]{64}$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    """The requested range starts beyond the end of the file."""
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a ``Range`` header into an inclusive ``(first, last)`` byte pair.
+
+    Args:
+        header: The header value, e.g. ``bytes=0-1023`` or ``bytes=-500``.
+        size: Length of the file in bytes.
+
+    Returns:
+        The range clamped to the file, or None when the header is absent,
+        malformed or asks for several ranges (the whole file is sent then,
+        as RFC 9110 allows).
+
+    Raises:
+        RangeNotSatisfiable: If no byte of the range lies within the file.
+    """
+    match = _RANGE_RE.match(header.strip().replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final ``last`` bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """Read part of an open file, up to ``length`` bytes from ``start``.
+
+    ``fileno()`` and ``tell()`` expose the real descriptor and position, so
+    a WSGI server's ``sendfile`` starts at the range and stops after
+    ``Content-Length`` bytes, while Django's own streaming uses
+    :meth:`read`, which never reads past the range.
+    """
+
+    def __init__(self, file: IO[bytes], start: int, length: int) -> None:
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+_etags: "OrderedDict[Tuple[str, int, int, int], str]" = OrderedDict()
+_etags_lock = threading.Lock()
+_ETAG_ENTRIES = 4096
+
+
+def content_etag(path: Path, stat: Any) -> str:
+    """Return a strong ETag for ``path``: a digest of its bytes.
+
+    Digests are remembered per inode, size and mtime, so each file is read
+    for hashing once per process (and again after the cache touches it).
+    Rewrites by the TTS cache replace the file, giving it a new inode.
+    """
+    key = (str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(CHUNK_BYTES), b""):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()[:32]}"'
+    with _etags_lock:
+        _etags[key] = etag
+        if len(_etags) > _ETAG_ENTRIES:
+            _etags.popitem(last=False)
+    return etag
+
+
+def resolve(relative: str) -> Path:
+    """Return the file under ``MEDIA_ROOT`` at ``relative``.
+
+    Raises:
+        Http404: If the path escapes ``MEDIA_ROOT``, names a hidden file
+            (such as a TTS cache write in progress) or does not exist.
+    """
+    try:
+        path = Path(safe_join(settings.MEDIA_ROOT, relative))
+    except SuspiciousFileOperation:
+        raise Http404("Not found")
+    if path.name.startswith(".") or not path.is_file():
+        raise Http404("Not found")
+    return path
+
+
+def cache_control(path: Path) -> str:
+    if _HASHED_NAME.match(path.stem):
+        return IMMUTABLE
+    return f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+
+
+def offload(response: HttpResponse, path: Path, relative: str) -> HttpResponse:
+    """Hand the sending of ``path`` to the front proxy."""
+    mode = settings.MEDIA_OFFLOAD
+    if mode not in OFFLOAD_MODES:
+        raise ValueError(f"Unknown MEDIA_OFFLOAD {mode!r}; choose from {', '.join(OFFLOAD_MODES)}")
+    if mode == "x-accel-redirect":
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative)
+    else:
+        response["X-Sendfile"] = str(path)
+    return response
+
+
+def media_response(request: HttpRequest, relative: str) -> HttpResponse:
+    """Serve ``relative`` from ``MEDIA_ROOT``; see the module docstring."""
+    if request.method not in ("GET", "HEAD"):
+        return JsonResponse({"error": "GET required"}, status=405)
+    path = resolve(relative)
+    stat = path.stat()
+    size = stat.st_size
+    etag = content_etag(path, stat)
+    headers = {"ETag": etag, "Cache-Control": cache_control(path), "Accept-Ranges": "bytes"}
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    conditional = get_conditional_response(request, etag=etag)
+    if conditional is not None:
+        for name, value in headers.items():
+            conditional[name] = value
+        metrics.inc("media_responses_total", status=conditional.status_code)
+        return conditional
+
+    if settings.MEDIA_OFFLOAD:
+        response = offload(HttpResponse(content_type=content_type), path, relative)
+        for name, value in headers.items():
+            response[name] = value
+        metrics.inc("media_offloaded_total")
+        return response
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    # A range only applies to the representation the client already has
+    if "Range" in request.headers and if_range in (None, etag):
+        try:
+            byte_range = parse_range(request.headers["Range"], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            for name, value in headers.items():
+                response[name] = value
+            metrics.inc("media_responses_total", status=416)
+            return response
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = max(0, end - start + 1)
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type)
+    else:
+        response = FileResponse(FileRange(open(path, "rb"), start, length), content_type=content_type)
+        response.block_size = CHUNK_BYTES
+    response["Content-Length"] = str(length)
+    if byte_range:
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    for name, value in headers.items():
+        response[name] = value
+    metrics.inc("media_responses_total", status=response.status_code)
+    return response
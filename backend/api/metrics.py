@@ -0,0 +1,188 @@
+"""In-process metrics for the devdebate API.
+
+A deliberately small registry of labelled counters and histograms, kept in
+module-level dictionaries guarded by a lock so it is safe to update from
+worker threads. Values are per process; each WSGI/ASGI worker reports its
+own. ``snapshot()`` returns everything as plain JSON for the ``/api/stats``
+endpoint, and ``exposition()`` in the Prometheus text format for
+``/metrics``.
+
+Example::
+
+    from . import metrics
+
+    metrics.inc("tts_cache_hits_total")
+    metrics.observe("rebuttal_ttft_seconds", 0.42, mode="sse")
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Default histogram buckets, in seconds, suited to upstream call latencies
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# Number of most recent samples kept per histogram for quantile estimates
+RECENT_SAMPLES = 1024
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_gauges: Dict[str, Dict[LabelKey, float]] = {}
+_histograms: Dict[str, Dict[LabelKey, "Histogram"]] = {}
+
+
+class Histogram:
+    """Bucketed distribution plus a ring buffer of recent samples."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: List[float] = []
+        self._next = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if len(self.recent) < RECENT_SAMPLES:
+            self.recent.append(value)
+        else:
+            self.recent[self._next] = value
+            self._next = (self._next + 1) % RECENT_SAMPLES
+
+    def quantile(self, q: float) -> float:
+        """Estimate quantile ``q`` (0-1) from the recent samples."""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    """Add ``value`` to the counter ``name`` with the given labels."""
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """Set the gauge ``name`` to ``value``."""
+    with _lock:
+        _gauges.setdefault(name, {})[_key(labels)] = value
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels: Any) -> None:
+    """Record ``value`` in the histogram ``name``."""
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def counter_value(name: str, **labels: Any) -> float:
+    """Return the current value of a counter (0 if never incremented)."""
+    with _lock:
+        return _counters.get(name, {}).get(_key(labels), 0.0)
+
+
+def _label_str(key: LabelKey) -> str:
+    return ",".join(f"{name}={value}" for name, value in key)
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return all metrics as nested, JSON-serialisable dictionaries.
+
+    Series are keyed by their labels rendered as ``name=value`` pairs; the
+    unlabelled series uses the empty string.
+    """
+    with _lock:
+        return {
+            "counters": {
+                name: {_label_str(k): v for k, v in series.items()} for name, series in _counters.items()
+            },
+            "gauges": {
+                name: {_label_str(k): v for k, v in series.items()} for name, series in _gauges.items()
+            },
+            "histograms": {
+                name: {_label_str(k): h.as_dict() for k, h in series.items()}
+                for name, series in _histograms.items()
+            },
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, key: LabelKey, extra: str = "") -> str:
+    labels = [f'{label}="{_escape(value)}"' for label, value in key]
+    if extra:
+        labels.append(extra)
+    return f"{name}{{{','.join(labels)}}}" if labels else name
+
+
+def _le(bound: str) -> str:
+    return f'le="{bound}"'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def exposition() -> str:
+    """Render all metrics in the Prometheus text exposition format (0.0.4).
+
+    Histograms get cumulative ``_bucket`` series (bucket bounds are
+    inclusive, as Prometheus expects) plus ``_sum`` and ``_count``.
+    """
+    lines: List[str] = []
+    with _lock:
+        for kind, registry in (("counter", _counters), ("gauge", _gauges)):
+            for name, series in sorted(registry.items()):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{_series(name, key)} {_number(value)}" for key, value in sorted(series.items()))
+        for name, series in sorted(_histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            bucket = f"{name}_bucket"
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{_series(bucket, key, _le(f'{bound:g}'))} {cumulative}")
+                lines.append(f"{_series(bucket, key, _le('+Inf'))} {histogram.count}")
+                lines.append(f"{_series(name + '_sum', key)} {_number(histogram.sum)}")
+                lines.append(f"{_series(name + '_count', key)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Clear every metric. Intended for benchmarks."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
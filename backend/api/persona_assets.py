@@ -0,0 +1,159 @@
+"""Pre-synthesised speech for the personas' stock lines.
+
+Every persona opens a debate, fills the wait for a rebuttal, refuses a
+blocked stance and apologises for a failed turn with the same few lines
+(``Persona.stock_lines``). Voicing them on demand cost a provider call, and
+the first of each after a deploy waited for it. The bundle holds them
+ready-made: ``python manage.py warmup --build-assets`` synthesises every
+line of every persona in each of ``PERSONA_ASSET_FORMATS`` into
+``PERSONA_ASSETS_DIR``, with a ``manifest.json`` describing them.
+
+Files are named by their TTS cache key (``api.views.tts_cache_key``), which
+covers the text, voice, backend model, voice settings and format.
+:func:`api.views.call_elevenlabs_tts` and :func:`api.views.cached_speech`
+look a request up here before the TTS cache, so a stock line spoken through
+``/api/tts`` or listed by ``/api/personas`` is served from the bundle
+without calling a provider, and is never evicted. After a change of voice
+settings or model the keys no longer match and the lines are synthesised
+as usual until the bundle is rebuilt. Hits are counted as
+``tts_bundle_hits_total``.
+
+The bundle lives under ``MEDIA_ROOT`` so it is served from ``MEDIA_URL``;
+it can be built once at image build time and shipped read-only.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from django.conf import settings
+
+from . import Persona, audio_formats, metrics
+
+MANIFEST = "manifest.json"
+
+
+class Bundle:
+    """A directory of pre-synthesised stock lines and their manifest.
+
+    Args:
+        root: Directory holding the audio files and ``manifest.json``.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.manifest: Dict[str, Any] = {}
+        self._names: Set[str] = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """Read the manifest, keeping the entries whose file is present."""
+        try:
+            manifest = json.loads((self.root / MANIFEST).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            manifest = {"assets": []}
+        names = {asset["file"] for asset in manifest.get("assets", []) if (self.root / asset["file"]).is_file()}
+        with self._lock:
+            self.manifest = manifest
+            self._names = names
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def path(self, key: str, extension: str = "mp3") -> Optional[Path]:
+        """Return the bundled file for a TTS cache key, if there is one."""
+        name = f"{key}.{extension}"
+        return self.root / name if name in self._names else None
+
+    def lookup(self, key: str, extension: str = "mp3") -> Optional[Path]:
+        """Like :meth:`path`, counting a hit for audio about to be served."""
+        path = self.path(key, extension)
+        if path is not None:
+            metrics.inc("tts_bundle_hits_total")
+        return path
+
+    def url_for(self, path: Path) -> str:
+        relative = path.relative_to(Path(settings.MEDIA_ROOT))
+        return f"{settings.MEDIA_URL}{relative.as_posix()}"
+
+    def build(
+        self,
+        synthesize: Callable[[str, str, str], bytes],
+        key_for: Callable[[str, str, str], str],
+        voice_id: str,
+        formats: Sequence[str],
+        model_id: str = "",
+        force: bool = False,
+    ) -> Dict[str, int]:
+        """Synthesise the stock lines missing from the bundle.
+
+        Args:
+            synthesize: ``(text, voice_id, audio_format)`` to audio bytes.
+            key_for: ``(text, voice_id, audio_format)`` to TTS cache key.
+            voice_id: Voice to speak the lines in.
+            formats: Audio format names to produce.
+            model_id: Recorded in the manifest, to tell bundles apart.
+            force: Synthesise lines that are already present again.
+
+        Returns:
+            Counts of lines ``built`` and ``kept``.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        assets: List[Dict[str, Any]] = []
+        counts = {"built": 0, "kept": 0}
+        for persona in Persona:
+            for kind, text in persona.stock_lines.items():
+                for audio_format in formats:
+                    extension = audio_formats.get_format(audio_format).extension
+                    name = f"{key_for(text, voice_id, audio_format)}.{extension}"
+                    path = self.root / name
+                    if force or not path.is_file():
+                        audio = synthesize(text, voice_id, audio_format)
+                        tmp = path.with_name(f".{name}.{uuid.uuid4().hex}.tmp")
+                        tmp.write_bytes(audio)
+                        os.replace(tmp, path)
+                        counts["built"] += 1
+                    else:
+                        counts["kept"] += 1
+                    assets.append(
+                        {
+                            "persona": persona.value,
+                            "kind": kind,
+                            "text": text,
+                            "format": audio_format,
+                            "file": name,
+                            "bytes": path.stat().st_size,
+                        }
+                    )
+        manifest = {
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "voice_id": voice_id,
+            "model_id": model_id,
+            "formats": list(formats),
+            "assets": assets,
+        }
+        tmp = self.root / f".{MANIFEST}.{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.root / MANIFEST)
+        self.load()
+        return counts
+
+
+_bundle: Optional[Bundle] = None
+_bundle_lock = threading.Lock()
+
+
+def get_bundle() -> Bundle:
+    """Return the process-wide persona asset bundle configured from settings."""
+    global _bundle
+    if _bundle is None:
+        with _bundle_lock:
+            if _bundle is None:
+                _bundle = Bundle(Path(settings.PERSONA_ASSETS_DIR))
+    return _bundle
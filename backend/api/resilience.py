@@ -0,0 +1,548 @@
+"""Rate limiting, retries, deadlines and circuit breaking for provider calls.
+
+A throttled or briefly failing provider used to fail the user's turn on the
+first 429 or 5xx, and under load every worker kept sending requests at full
+speed regardless. :func:`request` and :func:`arequest` wrap one upstream
+HTTP call with:
+
+rate limiting
+    A token bucket per provider and API key (``rate_limit`` and ``burst``
+    in ``UPSTREAM_PROVIDERS``). Callers reserve a token and sleep until it
+    is due, so bursts queue up locally instead of at the provider.
+retries
+    429 responses, 5xx gateway/overload responses and transport errors are
+    retried up to ``UPSTREAM_MAX_ATTEMPTS`` times with full-jitter
+    exponential backoff. A ``Retry-After`` header overrides the backoff and
+    also pauses the bucket, so other requests with the same key wait too.
+    Only idempotent calls are retried after the request may have reached
+    the provider; requests that never left (connect errors, pool timeouts)
+    and 429s are always safe to retry.
+deadline
+    :class:`TurnDeadlineMiddleware` gives each request a time budget
+    (``UPSTREAM_TURN_DEADLINE``). Every call on the request's behalf uses at
+    most the remaining budget as its timeout and gives up on retries that
+    could not finish in time.
+circuit breaker
+    After ``UPSTREAM_BREAKER_THRESHOLD`` consecutive failures a provider's
+    breaker opens and calls fail immediately with :class:`UpstreamUnavailable`
+    for ``UPSTREAM_BREAKER_RESET`` seconds; then one probe call is let
+    through, and its outcome closes or re-opens the breaker. A 429 counts as
+    the provider being reachable. A probe that ends without an outcome (out
+    of time or cancelled) hands the probe to the next caller, and one that
+    never reports back expires after ``UPSTREAM_BREAKER_RESET`` seconds.
+
+:func:`stream` and :func:`astream` open streamed responses (chat
+completions sent as server-sent events) under the same rate limit, breaker
+and deadline, but make a single attempt: the caller consumes the body as it
+arrives, so a failed stream cannot be replayed transparently.
+
+State is per process.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import hashlib
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import httpx
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+from .upstream import get_async_client, get_client, provider_config
+
+# Responses worth retrying: throttling and gateway/overload errors
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Transport errors raised before the request was sent, so always retryable
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+
+
+class UpstreamUnavailable(RuntimeError):
+    """A provider call was refused locally (circuit open or no time left).
+
+    Attributes:
+        retry_after: Seconds after which trying again may succeed, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """The request's time budget ran out before the provider answered."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations.
+
+    Args:
+        rate: Tokens added per second; 0 disables limiting.
+        burst: Bucket capacity.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        if self.rate <= 0 and not self._paused_until:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            if self.rate > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            else:
+                wait = 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every reservation for ``seconds`` (after a ``Retry-After``)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Args:
+        name: Provider name, used in errors and metrics.
+        threshold: Consecutive failures that open the circuit.
+        reset_timeout: Seconds the circuit stays open before a probe.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        # When the circuit opened, or when the current probe started
+        self._opened_at = 0.0
+        self._probe: Optional[object] = None
+        self._lock = threading.Lock()
+
+    def check(self) -> Optional[object]:
+        """Raise :class:`UpstreamUnavailable` if calls should fail fast.
+
+        Returns:
+            A probe token if the caller is the one call let through a
+            half-open circuit, otherwise None. The caller reports the outcome
+            with :meth:`success` or :meth:`failure`, and always passes the
+            token to :meth:`release` when done.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            now = time.monotonic()
+            remaining = self._opened_at + self.reset_timeout - now
+            if remaining <= 0:
+                # Let this caller probe; others keep failing fast until it reports back.
+                # A probe that never reported back has expired and is replaced.
+                self._opened_at = now
+                self._probe = object()
+                if self.state != self.HALF_OPEN:
+                    self._set_state(self.HALF_OPEN)
+                return self._probe
+        metrics.inc("upstream_circuit_rejected_total", provider=self.name)
+        raise UpstreamUnavailable(f"{self.name} is unavailable (circuit open)", retry_after=max(remaining, 1.0))
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probe = None
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._probe = None
+                self._set_state(self.OPEN)
+
+    def release(self, probe: Optional[object]) -> None:
+        """End the call holding ``probe``; if it reported no outcome, the next caller probes."""
+        with self._lock:
+            if probe is not None and probe is self._probe:
+                self._probe = None
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def _set_state(self, state: str) -> None:
+        # Caller holds the lock
+        self.state = state
+        metrics.set_gauge("upstream_circuit_open", 0 if state == self.CLOSED else 1, provider=self.name)
+        metrics.inc("upstream_circuit_transitions_total", provider=self.name, state=state)
+
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_state_lock = threading.Lock()
+
+
+def get_bucket(provider: str, api_key: str = "") -> TokenBucket:
+    """Return the token bucket for ``provider`` and ``api_key``."""
+    key = (provider, hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16])
+    bucket = _buckets.get(key)
+    if bucket is None:
+        config = provider_config(provider)
+        with _state_lock:
+            bucket = _buckets.setdefault(
+                key, TokenBucket(float(config.get("rate_limit", 0)), float(config.get("burst", 1)))
+            )
+    return bucket
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """Return the circuit breaker for ``provider``."""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _state_lock:
+            breaker = _breakers.setdefault(
+                provider,
+                CircuitBreaker(provider, settings.UPSTREAM_BREAKER_THRESHOLD, settings.UPSTREAM_BREAKER_RESET),
+            )
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Return the state and failure count of each provider's breaker."""
+    with _state_lock:
+        breakers = list(_breakers.values())
+    return {b.name: {"state": b.state, "failures": b.failures} for b in breakers}
+
+
+def reset_state() -> None:
+    """Forget every bucket and breaker. Intended for benchmarks."""
+    with _state_lock:
+        _buckets.clear()
+        _breakers.clear()
+
+
+class deadline:
+    """Context manager limiting upstream calls made inside it to ``seconds``.
+
+    Nested deadlines never extend an outer, tighter one.
+    """
+
+    def __init__(self, seconds: Optional[float]) -> None:
+        self.seconds = seconds
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> "deadline":
+        if self.seconds:
+            at = time.monotonic() + self.seconds
+            current = _deadline.get()
+            self._token = _deadline.set(at if current is None else min(current, at))
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._token is not None:
+            _deadline.reset(self._token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current deadline, or None if there is none."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header (delta seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _api_key_of(headers: Dict[str, str]) -> str:
+    for name, value in (headers or {}).items():
+        if name.lower() in ("authorization", "xi-api-key"):
+            return value
+    return ""
+
+
+class _Attempts:
+    """Retry bookkeeping shared by the sync and async loops."""
+
+    def __init__(self, provider: str, headers: Dict[str, str], idempotent: bool) -> None:
+        self.provider = provider
+        self.idempotent = idempotent
+        self.bucket = get_bucket(provider, _api_key_of(headers))
+        self.breaker = get_breaker(provider)
+        self.probe: Optional[object] = None
+        self.attempt = 0
+
+    def _budget_check(self, wait: float) -> None:
+        remaining = remaining_budget()
+        if remaining is not None and wait >= remaining:
+            metrics.inc("upstream_deadline_exceeded_total", provider=self.provider)
+            raise DeadlineExceeded(f"{self.provider} call would exceed the request deadline")
+
+    def before_send(self) -> float:
+        """Check the breaker and reserve a token; return the wait before sending."""
+        self.breaker.release(self.probe)
+        self.probe = self.breaker.check()
+        self.attempt += 1
+        wait = self.bucket.reserve()
+        self._budget_check(wait)
+        if wait > 0:
+            metrics.observe("upstream_throttle_wait_seconds", wait, provider=self.provider)
+        return wait
+
+    def timeout(self) -> Any:
+        """Timeout for the next send: the client default capped by the deadline."""
+        remaining = remaining_budget()
+        if remaining is None:
+            return httpx.USE_CLIENT_DEFAULT
+        configured = min(settings.UPSTREAM_READ_TIMEOUT, settings.UPSTREAM_WRITE_TIMEOUT)
+        return httpx.Timeout(min(configured, remaining), connect=min(settings.UPSTREAM_CONNECT_TIMEOUT, remaining))
+
+    def _backoff(self, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, settings.UPSTREAM_BACKOFF_MAX)
+        ceiling = min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * 2 ** (self.attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def _retry_delay(self, reason: str, retry_after: Optional[float] = None) -> Optional[float]:
+        if self.attempt >= settings.UPSTREAM_MAX_ATTEMPTS:
+            return None
+        delay = self._backoff(retry_after)
+        remaining = remaining_budget()
+        if remaining is not None and delay >= remaining:
+            return None
+        metrics.inc("upstream_retries_total", provider=self.provider, reason=reason)
+        return delay
+
+    def after_response(self, resp: httpx.Response) -> Optional[float]:
+        """Return the delay before retrying, or None to hand ``resp`` back."""
+        status = resp.status_code
+        if status not in RETRY_STATUSES:
+            self.breaker.success()
+            return None
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if status == 429:
+            # Throttling is not an outage: the provider answered, so pause the key instead
+            self.breaker.success()
+            metrics.inc("upstream_throttled_total", provider=self.provider)
+            if retry_after:
+                self.bucket.pause(retry_after)
+            return self._retry_delay("429", retry_after)
+        self.breaker.failure()
+        if not self.idempotent:
+            return None
+        return self._retry_delay(str(status), retry_after)
+
+    def record(self, resp: httpx.Response) -> None:
+        """Account for the response to a call that is not retried."""
+        status = resp.status_code
+        if status == 429:
+            self.breaker.success()
+            metrics.inc("upstream_throttled_total", provider=self.provider)
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if retry_after:
+                self.bucket.pause(retry_after)
+        elif status in RETRY_STATUSES:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def record_error(self, error: Exception) -> None:
+        """Account for a transport error; raise :class:`DeadlineExceeded` if the deadline caused it."""
+        remaining = remaining_budget()
+        if isinstance(error, httpx.TimeoutException) and remaining is not None and remaining < 0.05:
+            # The timeout was the deadline, not a slow provider
+            metrics.inc("upstream_deadline_exceeded_total", provider=self.provider)
+            raise DeadlineExceeded(f"{self.provider} did not answer within the request deadline") from error
+        self.breaker.failure()
+
+    def after_error(self, error: Exception) -> float:
+        """Return the delay before retrying ``error``, or re-raise it."""
+        self.record_error(error)
+        if not (self.idempotent or isinstance(error, _NOT_SENT)):
+            raise error
+        delay = self._retry_delay(type(error).__name__)
+        if delay is None:
+            raise error
+        return delay
+
+    def finish(self) -> None:
+        """Release the breaker probe, if this call held it; always called last."""
+        self.breaker.release(self.probe)
+        self.probe = None
+
+
+def request(
+    provider: str, method: str, url: str, *, idempotent: bool = True, **kwargs: Any
+) -> httpx.Response:
+    """Send one provider request through the resilience layer.
+
+    Args:
+        provider: Key of ``settings.UPSTREAM_PROVIDERS``.
+        method: HTTP method.
+        url: Path relative to the provider's base URL.
+        idempotent: Whether the call may be repeated after the provider may
+            have received it.
+        **kwargs: Passed to ``httpx.Client.request``.
+
+    Returns:
+        The final response; the caller still calls ``raise_for_status``.
+
+    Raises:
+        UpstreamUnavailable: The circuit is open or the deadline ran out.
+        httpx.TransportError: The last attempt failed to connect or read.
+    """
+    attempts = _Attempts(provider, kwargs.get("headers"), idempotent)
+    client = get_client(provider)
+    try:
+        while True:
+            wait = attempts.before_send()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                resp = client.request(method, url, timeout=attempts.timeout(), **kwargs)
+            except httpx.TransportError as e:
+                delay = attempts.after_error(e)
+            else:
+                delay = attempts.after_response(resp)
+                if delay is None:
+                    return resp
+                resp.close()
+            time.sleep(delay)
+    finally:
+        attempts.finish()
+
+
+async def arequest(
+    provider: str, method: str, url: str, *, idempotent: bool = True, **kwargs: Any
+) -> httpx.Response:
+    """Async counterpart of :func:`request` using the per-loop async client."""
+    attempts = _Attempts(provider, kwargs.get("headers"), idempotent)
+    client = get_async_client(provider)
+    try:
+        while True:
+            wait = attempts.before_send()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                resp = await client.request(method, url, timeout=attempts.timeout(), **kwargs)
+            except httpx.TransportError as e:
+                delay = attempts.after_error(e)
+            else:
+                delay = attempts.after_response(resp)
+                if delay is None:
+                    return resp
+                await resp.aclose()
+            await asyncio.sleep(delay)
+    finally:
+        attempts.finish()
+
+
+class TurnDeadlineMiddleware:
+    """Give each request a budget of ``UPSTREAM_TURN_DEADLINE`` seconds.
+
+    Upstream calls made while handling the request share the budget; calls
+    made after the response is returned (streamed bodies, background
+    summaries) are not limited by it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Any) -> None:
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: Any) -> Any:
+        if self.is_async:
+            return self.__acall__(request)
+        with deadline(settings.UPSTREAM_TURN_DEADLINE):
+            return self.get_response(request)
+
+    async def __acall__(self, request: Any) -> Any:
+        with deadline(settings.UPSTREAM_TURN_DEADLINE):
+            return await self.get_response(request)
+
+
+@contextlib.contextmanager
+def stream(provider: str, method: str, url: str, **kwargs: Any) -> Iterator[httpx.Response]:
+    """Open a streamed provider response through the resilience layer.
+
+    The rate limit, circuit breaker and deadline apply as for
+    :func:`request`, but there is a single attempt. Transport errors while
+    the body is read count against the breaker like failed calls.
+
+    Args:
+        provider: Key of ``settings.UPSTREAM_PROVIDERS``.
+        method: HTTP method.
+        url: Path relative to the provider's base URL.
+        **kwargs: Passed to ``httpx.Client.stream``.
+
+    Yields:
+        The response, its body not yet read; the caller still calls
+        ``raise_for_status``.
+
+    Raises:
+        UpstreamUnavailable: The circuit is open or the deadline ran out.
+        httpx.TransportError: The connection failed or broke off.
+    """
+    attempts = _Attempts(provider, kwargs.get("headers"), idempotent=False)
+    try:
+        wait = attempts.before_send()
+        if wait > 0:
+            time.sleep(wait)
+        with get_client(provider).stream(method, url, timeout=attempts.timeout(), **kwargs) as resp:
+            attempts.record(resp)
+            yield resp
+    except httpx.TransportError as e:
+        attempts.record_error(e)
+        raise
+    finally:
+        attempts.finish()
+
+
+@contextlib.asynccontextmanager
+async def astream(provider: str, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+    """Async counterpart of :func:`stream` using the per-loop async client."""
+    attempts = _Attempts(provider, kwargs.get("headers"), idempotent=False)
+    try:
+        wait = attempts.before_send()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with get_async_client(provider).stream(method, url, timeout=attempts.timeout(), **kwargs) as resp:
+            attempts.record(resp)
+            yield resp
+    except httpx.TransportError as e:
+        attempts.record_error(e)
+        raise
+    finally:
+        attempts.finish()
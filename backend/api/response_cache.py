@@ -0,0 +1,226 @@
+"""Opt-in cache of first-turn rebuttals.
+
+Many debates open with the same handful of stances ("AI will take all
+jobs"). With an empty transcript the prompt is fully determined by the
+stance, the persona's system prompt and the model, so the rebuttal for one
+user can be served to the next in milliseconds instead of waiting seconds
+for a completion.
+
+Entries are grouped by *scope*: a hash of the model, persona, system prompt
+and format reminder. Editing ``build_persona_prompt`` therefore changes the
+scope and old entries are never served again; they age out of the LRU.
+Within a scope there are two tiers:
+
+exact
+    The stance after case, Unicode and punctuation normalisation.
+semantic (optional)
+    The nearest earlier stance by cosine similarity of a local lexical
+    embedding (words, word pairs and character trigrams), accepted above a
+    threshold. The embedding sees wording, not meaning, so keep the
+    threshold high: at the default of 0.9 a stance must share nearly all of
+    its wording, in the same order, with a cached one. Lookups go through an
+    inverted index over the embedding features, so only entries sharing
+    vocabulary with the stance are scored.
+
+The cache is per process, bounded by entry count (least recently used
+evicted first) and by a time-to-live.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from django.conf import settings
+
+from . import metrics
+
+Vector = Dict[str, float]
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Words too common to say anything about a stance's topic
+_STOPWORDS = frozenset(
+    "a an the is are was were be been will would should could can do does to of in on for and or but it "
+    "that this with as at by from all i we you they".split()
+)
+
+
+def normalize_stance(text: str) -> str:
+    """Return the exact-tier form of a stance: case folded, words joined by spaces."""
+    return " ".join(_WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold()))
+
+
+def embed(text: str) -> Vector:
+    """Embed a stance as an L2-normalised sparse vector.
+
+    Features are content words and adjacent word pairs (weight 1), which
+    keep word order and negation ("tabs over spaces" is not "spaces over
+    tabs"), plus the character trigrams of each word (weight 0.5), which
+    tolerate inflection and small typos.
+    """
+    vector: Vector = {}
+    words = normalize_stance(text).split()
+    for first, second in zip(words, words[1:]):
+        pair = f"{first} {second}"
+        vector[pair] = vector.get(pair, 0.0) + 1.0
+    for word in words:
+        if word in _STOPWORDS:
+            continue
+        vector[word] = vector.get(word, 0.0) + 1.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            gram = "~" + padded[i : i + 3]
+            vector[gram] = vector.get(gram, 0.0) + 0.5
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+
+def first_turn_scope(messages: List[Dict[str, Any]], persona: str, model: str) -> Optional[str]:
+    """Return the cache scope for a first-turn prompt, or None for later turns.
+
+    A first-turn prompt is the system prompt, the user's stance and the
+    format reminder, with no earlier history or summary.
+    """
+    if len(messages) != 3 or messages[1].get("role") != "user":
+        return None
+    scope = json.dumps(
+        {
+            "model": model,
+            "persona": persona,
+            "system": messages[0].get("content"),
+            "reminder": messages[2].get("content"),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(scope.encode("utf-8")).hexdigest()
+
+
+class _Entry(NamedTuple):
+    scope: str
+    stance: str
+    response: Dict[str, Any]
+    vector: Vector
+    expires: float
+
+
+class ResponseCache:
+    """Bounded LRU of model responses with exact and semantic lookup.
+
+    Args:
+        max_entries: Most responses kept across all scopes.
+        ttl: Seconds a response may be served after it was stored.
+        semantic: Whether to fall back to nearest-neighbour lookup.
+        threshold: Minimum cosine similarity for a semantic hit.
+        embedder: Text to sparse unit vector; :func:`embed` by default.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 86400,
+        semantic: bool = False,
+        threshold: float = 0.9,
+        embedder: Callable[[str], Vector] = embed,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self.embedder = embedder
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # (scope, feature) -> keys of entries whose vector has that feature
+        self._postings: Dict[Tuple[str, str], Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scope: str, stance: str) -> Optional[Dict[str, Any]]:
+        """Return a cached response for ``stance`` in ``scope``, or None."""
+        key = (scope, normalize_stance(stance))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                metrics.inc("response_cache_hits_total", tier="exact")
+                return entry.response
+        if self.semantic:
+            response = self._nearest(scope, stance, now)
+            if response is not None:
+                metrics.inc("response_cache_hits_total", tier="semantic")
+                return response
+        metrics.inc("response_cache_misses_total")
+        return None
+
+    def _nearest(self, scope: str, stance: str, now: float) -> Optional[Dict[str, Any]]:
+        vector = self.embedder(stance)
+        with self._lock:
+            scores: Dict[Tuple[str, str], float] = {}
+            for feature, weight in vector.items():
+                for key in self._postings.get((scope, feature), ()):
+                    scores[key] = scores.get(key, 0.0) + weight * self._entries[key].vector[feature]
+            for key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                if score < self.threshold:
+                    break
+                entry = self._entries[key]
+                if entry.expires < now:
+                    continue
+                self._entries.move_to_end(key)
+                metrics.observe("response_cache_similarity", score, buckets=(0.8, 0.85, 0.9, 0.95, 0.99, 1.0))
+                return entry.response
+        return None
+
+    def put(self, scope: str, stance: str, response: Dict[str, Any]) -> None:
+        """Store ``response`` for ``stance`` in ``scope``."""
+        key = (scope, normalize_stance(stance))
+        vector = self.embedder(stance) if self.semantic else {}
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(scope, key[1], response, vector, time.time() + self.ttl)
+            for feature in vector:
+                self._postings.setdefault((scope, feature), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                metrics.inc("response_cache_evictions_total")
+            metrics.set_gauge("response_cache_entries", len(self._entries))
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        # Caller holds the lock
+        entry = self._entries.pop(key)
+        for feature in entry.vector:
+            posting = self._postings.get((entry.scope, feature))
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self._postings[(entry.scope, feature)]
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+                    ttl=settings.RESPONSE_CACHE_TTL,
+                    semantic=settings.RESPONSE_CACHE_SEMANTIC,
+                    threshold=settings.RESPONSE_CACHE_SIMILARITY,
+                )
+    return _cache
@@ -0,0 +1,481 @@
+"""Session transcript storage for the debate endpoints.
+
+Transcripts used to live in a module-level dict, which was lost on restart,
+not shared between WSGI workers and never expired. The views now go through
+a :class:`SessionStore` chosen by ``settings.SESSION_STORE_BACKEND``:
+
+``memory``
+    :class:`MemorySessionStore` -- an in-process LRU with a time-to-live.
+    Fast, but private to one process; suitable for ``runserver`` and tests.
+``sqlite``
+    :class:`SQLiteSessionStore` -- a durable store in the SQLite database
+    from ``DATABASES`` (or ``SESSION_STORE_PATH``), shared by every worker
+    on the host. It runs in WAL mode so readers never block the writer.
+    Turns are rows tagged with the session's generation: resetting a
+    session bumps the generation and deletes the older rows, and
+    :meth:`~SessionStore.purge_expired` clears any that are left along with
+    idle sessions.
+
+Transcripts are lists of ``(role, text)`` tuples where ``role`` is
+``"user"`` or ``"assistant"``. Each session can also carry a
+:class:`Summary` of its oldest turns, maintained by ``api.context``.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+Turn = Tuple[str, str]
+
+
+class Summary(NamedTuple):
+    """Rolling summary of the first ``turns`` turns of a transcript.
+
+    ``generation`` identifies the transcript the summary was built from; it
+    changes when the session is reset, so a summary computed concurrently
+    with a reset is never stored against the new transcript.
+    """
+
+    text: str
+    turns: int
+    generation: int
+
+
+class SessionStore:
+    """Interface implemented by the session backends."""
+
+    def exists(self, session_id: str) -> bool:
+        """Return True if ``session_id`` is a live session."""
+        raise NotImplementedError
+
+    def create(self, session_id: Optional[str] = None) -> str:
+        """Create a session (with a new ID unless one is given) and return its ID."""
+        raise NotImplementedError
+
+    def append(self, session_id: str, role: str, text: str) -> None:
+        """Append one turn to the session's transcript, creating it if needed."""
+        raise NotImplementedError
+
+    def turns(self, session_id: str, start: int = 0, limit: Optional[int] = None) -> List[Turn]:
+        """Return up to ``limit`` turns of the transcript from turn ``start`` on (empty if unknown)."""
+        raise NotImplementedError
+
+    def iter_turns(self, session_id: str, start: int = 0, stop: Optional[int] = None, page: int = 200) -> Iterator[Turn]:
+        """Yield turns ``start`` to ``stop - 1`` (or to the end), reading ``page`` at a time."""
+        while stop is None or start < stop:
+            batch = self.turns(session_id, start, page if stop is None else min(page, stop - start))
+            yield from batch
+            if len(batch) < page:
+                return
+            start += len(batch)
+
+    def revision(self, session_id: str) -> Optional[Tuple[int, int]]:
+        """Return ``(generation, turn_count)`` for a live session, or None.
+
+        The pair changes whenever the transcript does, so it can serve as a
+        cache validator for exports.
+        """
+        raise NotImplementedError
+
+    def summary(self, session_id: str) -> Summary:
+        """Return the session's current summary (empty if none)."""
+        raise NotImplementedError
+
+    def set_summary(self, session_id: str, summary: Summary) -> bool:
+        """Store ``summary`` unless the session was reset or already has a newer one.
+
+        Returns:
+            True if the summary was stored.
+        """
+        raise NotImplementedError
+
+    def reset(self, session_id: str) -> bool:
+        """Clear the transcript; return False if the session does not exist."""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Drop sessions idle for longer than the TTL; return how many."""
+        return 0
+
+    def maybe_purge(self, interval: float = 600) -> None:
+        """Call :meth:`purge_expired` at most once every ``interval`` seconds."""
+        now = time.monotonic()
+        if now - getattr(self, "_last_purge", 0.0) >= interval:
+            self._last_purge = now
+            self.purge_expired()
+
+
+class _MemorySession:
+    __slots__ = ("turns", "touched", "generation", "summary")
+
+    def __init__(self) -> None:
+        self.turns: List[Turn] = []
+        self.touched = time.monotonic()
+        self.generation = 0
+        self.summary = Summary("", 0, 0)
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU session store with idle expiry.
+
+    Args:
+        max_sessions: Most sessions kept; the least recently used is dropped
+            when a new one would exceed this.
+        ttl: Seconds of inactivity after which a session expires.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 86400) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, _MemorySession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> Optional[_MemorySession]:
+        # Caller holds the lock
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched > self.ttl:
+            del self._sessions[session_id]
+            return None
+        session.touched = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _create(self, session_id: str) -> _MemorySession:
+        session = self._sessions[session_id] = _MemorySession()
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return self._get(session_id) is not None
+
+    def create(self, session_id: Optional[str] = None) -> str:
+        session_id = session_id or str(uuid.uuid4())
+        with self._lock:
+            if self._get(session_id) is None:
+                self._create(session_id)
+        return session_id
+
+    def append(self, session_id: str, role: str, text: str) -> None:
+        with self._lock:
+            session = self._get(session_id) or self._create(session_id)
+            session.turns.append((role, text))
+        self.maybe_purge()
+
+    def turns(self, session_id: str, start: int = 0, limit: Optional[int] = None) -> List[Turn]:
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return []
+            return session.turns[start:] if limit is None else session.turns[start : start + limit]
+
+    def revision(self, session_id: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            session = self._get(session_id)
+            return (session.generation, len(session.turns)) if session else None
+
+    def summary(self, session_id: str) -> Summary:
+        with self._lock:
+            session = self._get(session_id)
+            return session.summary if session else Summary("", 0, 0)
+
+    def set_summary(self, session_id: str, summary: Summary) -> bool:
+        with self._lock:
+            session = self._get(session_id)
+            if (
+                session is None
+                or session.generation != summary.generation
+                or session.summary.turns >= summary.turns
+            ):
+                return False
+            session.summary = summary
+            return True
+
+    def reset(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return False
+            session.turns = []
+            session.generation += 1
+            session.summary = Summary("", 0, session.generation)
+            return True
+
+    def purge_expired(self) -> int:
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if s.touched < cutoff]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devdebate_session (
+    id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devdebate_turn (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devdebate_turn_session
+    ON devdebate_turn (session_id, generation, id);
+CREATE INDEX IF NOT EXISTS devdebate_session_updated
+    ON devdebate_session (updated_at);
+CREATE TABLE IF NOT EXISTS devdebate_summary (
+    session_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    turns INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+"""
+
+# Create a session or mark it active. An expired session that has not been
+# purged yet starts a new generation so its old turns are not revived.
+_UPSERT_SESSION = (
+    "INSERT INTO devdebate_session (id, generation, created_at, updated_at) VALUES (?, 0, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    "generation = CASE WHEN updated_at < ? THEN generation + 1 ELSE generation END, "
+    "updated_at = excluded.updated_at"
+)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Durable session store backed by a SQLite file in WAL mode.
+
+    Each thread gets its own connection. Writes use ``BEGIN IMMEDIATE`` so
+    concurrent workers queue on the database lock (up to ``busy_timeout``)
+    instead of failing.
+
+    Args:
+        path: SQLite database file.
+        ttl: Seconds of inactivity after which :meth:`purge_expired` drops
+            a session and its turns.
+    """
+
+    def __init__(self, path: Path, ttl: float = 86400) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self._local = threading.local()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _generation(self, conn: sqlite3.Connection, session_id: str) -> Optional[int]:
+        row = conn.execute(
+            "SELECT generation, updated_at FROM devdebate_session WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def exists(self, session_id: str) -> bool:
+        return self._generation(self._connect(), session_id) is not None
+
+    def create(self, session_id: Optional[str] = None) -> str:
+        session_id = session_id or str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute(
+            _UPSERT_SESSION,
+            (session_id, now, now, now - self.ttl),
+        )
+        return session_id
+
+    def append(self, session_id: str, role: str, text: str) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                _UPSERT_SESSION,
+                (session_id, now, now, now - self.ttl),
+            )
+            conn.execute(
+                "INSERT INTO devdebate_turn (session_id, generation, role, text, created_at) "
+                "SELECT id, generation, ?, ?, ? FROM devdebate_session WHERE id = ?",
+                (role, text, now, session_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.maybe_purge()
+
+    def turns(self, session_id: str, start: int = 0, limit: Optional[int] = None) -> List[Turn]:
+        rows = self._connect().execute(
+            "SELECT t.role, t.text FROM devdebate_turn t "
+            "JOIN devdebate_session s ON s.id = t.session_id AND s.generation = t.generation "
+            "WHERE t.session_id = ? AND s.updated_at >= ? ORDER BY t.id LIMIT ? OFFSET ?",
+            (session_id, time.time() - self.ttl, -1 if limit is None else limit, start),
+        ).fetchall()
+        return [(role, text) for role, text in rows]
+
+    def iter_turns(self, session_id: str, start: int = 0, stop: Optional[int] = None, page: int = 200) -> Iterator[Turn]:
+        # Seek by row id after the first page, so each page costs the same
+        # however deep into the transcript it is
+        query = (
+            "SELECT t.id, t.role, t.text FROM devdebate_turn t "
+            "JOIN devdebate_session s ON s.id = t.session_id AND s.generation = t.generation "
+            "WHERE t.session_id = ? AND s.updated_at >= ? AND t.id > ? ORDER BY t.id LIMIT ? OFFSET ?"
+        )
+        last_id, offset = -1, start
+        while stop is None or start < stop:
+            limit = page if stop is None else min(page, stop - start)
+            rows = self._connect().execute(
+                query, (session_id, time.time() - self.ttl, last_id, limit, offset)
+            ).fetchall()
+            for _, role, text in rows:
+                yield role, text
+            if len(rows) < limit:
+                return
+            last_id, offset = rows[-1][0], 0
+            start += len(rows)
+
+    def revision(self, session_id: str) -> Optional[Tuple[int, int]]:
+        row = self._connect().execute(
+            "SELECT s.generation, (SELECT COUNT(*) FROM devdebate_turn t "
+            "WHERE t.session_id = s.id AND t.generation = s.generation) "
+            "FROM devdebate_session s WHERE s.id = ? AND s.updated_at >= ?",
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def summary(self, session_id: str) -> Summary:
+        row = self._connect().execute(
+            "SELECT s.generation, m.generation, m.turns, m.text FROM devdebate_session s "
+            "LEFT JOIN devdebate_summary m ON m.session_id = s.id "
+            "WHERE s.id = ? AND s.updated_at >= ?",
+            (session_id, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return Summary("", 0, 0)
+        generation, summary_generation, turns, text = row
+        if summary_generation != generation:
+            return Summary("", 0, generation)
+        return Summary(text, turns, generation)
+
+    def set_summary(self, session_id: str, summary: Summary) -> bool:
+        # Only if the session is still on the same generation and the stored
+        # summary (if any, for this generation) covers fewer turns.
+        cursor = self._connect().execute(
+            "INSERT INTO devdebate_summary (session_id, generation, turns, text) "
+            "SELECT id, generation, ?, ? FROM devdebate_session WHERE id = ? AND generation = ? "
+            "ON CONFLICT(session_id) DO UPDATE SET "
+            "generation = excluded.generation, turns = excluded.turns, text = excluded.text "
+            "WHERE devdebate_summary.generation != excluded.generation "
+            "OR devdebate_summary.turns < excluded.turns",
+            (summary.turns, summary.text, session_id, summary.generation),
+        )
+        return cursor.rowcount > 0
+
+    def reset(self, session_id: str) -> bool:
+        # The new generation hides the old turns at once; deleting them in
+        # the same transaction keeps a long-lived session from growing.
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "UPDATE devdebate_session SET generation = generation + 1, updated_at = ? "
+                "WHERE id = ? AND updated_at >= ?",
+                (now, session_id, now - self.ttl),
+            )
+            if cursor.rowcount:
+                for table in ("devdebate_turn", "devdebate_summary"):
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE session_id = ? "
+                        "AND generation < (SELECT generation FROM devdebate_session WHERE id = ?)",
+                        (session_id, session_id),
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        """Drop sessions idle past the TTL, and turns of earlier generations.
+
+        Earlier generations are left behind when an expired session that was
+        not purged yet is used again (see ``_UPSERT_SESSION``).
+        """
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("devdebate_turn", "devdebate_summary"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE session_id IN "
+                    "(SELECT id FROM devdebate_session WHERE updated_at < ?)",
+                    (cutoff,),
+                )
+                conn.execute(
+                    f"DELETE FROM {table} WHERE generation < "
+                    f"(SELECT s.generation FROM devdebate_session s WHERE s.id = {table}.session_id)"
+                )
+            purged = conn.execute("DELETE FROM devdebate_session WHERE updated_at < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return purged
+
+
+def sqlite_store_path() -> Path:
+    """Return the SQLite file for :class:`SQLiteSessionStore`.
+
+    Uses ``SESSION_STORE_PATH`` if set, otherwise the default database when
+    it is SQLite, otherwise ``sessions.sqlite3`` next to it.
+    """
+    if settings.SESSION_STORE_PATH:
+        return Path(settings.SESSION_STORE_PATH)
+    database = settings.DATABASES["default"]
+    if database["ENGINE"].endswith("sqlite3"):
+        return Path(database["NAME"])
+    return Path(settings.BASE_DIR) / "sessions.sqlite3"
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Return the process-wide session store selected in settings."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = settings.SESSION_STORE_BACKEND
+                if backend == "memory":
+                    _store = MemorySessionStore(settings.SESSION_STORE_MAX_SESSIONS, settings.SESSION_STORE_TTL)
+                elif backend == "sqlite":
+                    _store = SQLiteSessionStore(sqlite_store_path(), settings.SESSION_STORE_TTL)
+                else:
+                    raise ValueError(f"Unknown SESSION_STORE_BACKEND: {backend!r}")
+    return _store
@@ -0,0 +1,175 @@
+"""Coalescing of identical concurrent upstream calls ("single flight").
+
+When a classroom submits the same stance at once, or the front-end retries a
+request that is still running, each copy used to reach OpenAI or ElevenLabs
+on its own. A :class:`SingleFlight` group lets the first caller for a key
+make the call while later callers with the same key wait for its result;
+every waiter gets the same value, or the same exception. The key is usually
+:func:`payload_key` of the exact upstream request body, so only truly
+identical requests are merged.
+
+Both threads (WSGI views) and coroutines (ASGI views) can join the same
+call, since the shared result is a :class:`concurrent.futures.Future`.
+Cancellation is per waiter: a coroutine that is cancelled (for example
+because its client disconnected) stops waiting without disturbing the
+others. Only when every waiter of an async call has gone is the upstream
+request itself cancelled. A thread that owns a call always finishes it.
+
+Each group reports ``singleflight_calls_total`` (upstream calls made) and
+``singleflight_coalesced_total`` (callers that shared one) labelled with
+the group name.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+
+def payload_key(*parts: Any) -> str:
+    """Return a stable hash of ``parts`` (JSON-serialisable values or bytes)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(b"b")
+            digest.update(bytes(part))
+        else:
+            digest.update(b"j")
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _copy_state(shared: Future, waiter: asyncio.Future) -> None:
+    if waiter.done():
+        return
+    if shared.cancelled():
+        waiter.cancel()
+    elif shared.exception() is not None:
+        waiter.set_exception(shared.exception())
+    else:
+        waiter.set_result(shared.result())
+
+
+class _Call:
+    __slots__ = ("future", "waiters", "task")
+
+    def __init__(self) -> None:
+        self.future: Future = Future()
+        self.waiters = 1
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """A group of calls deduplicated by key.
+
+    Args:
+        name: Label for the group's metrics.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        """Number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
+
+    def _join(self, key: str) -> Tuple[_Call, bool]:
+        """Return the call for ``key`` and whether the caller must run it."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                metrics.inc("singleflight_coalesced_total", call=self.name)
+                return call, False
+            call = self._calls[key] = _Call()
+        metrics.inc("singleflight_calls_total", call=self.name)
+        return call, True
+
+    def _settle(self, key: str, call: _Call, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        if call.future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            call.future.cancel()
+        elif error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def _leave(self, key: str, call: _Call) -> None:
+        """Drop one async waiter; cancel the call if nobody is left."""
+        with self._lock:
+            call.waiters -= 1
+            abandoned = call.waiters == 0 and call.task is not None
+            if abandoned and self._calls.get(key) is call:
+                del self._calls[key]
+        if abandoned:
+            # The waiter may be on another thread's event loop
+            call.task.get_loop().call_soon_threadsafe(call.task.cancel)
+            metrics.inc("singleflight_cancelled_total", call=self.name)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """Run ``fn`` unless an identical call is in flight; return its result."""
+        call, owner = self._join(key)
+        if not owner:
+            return call.future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._settle(key, call, error=e)
+            raise
+        self._settle(key, call, result=result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of :meth:`do`; joins threaded callers too.
+
+        The owner runs ``fn`` in a separate task so that cancelling the
+        owner does not cancel the call for the other waiters.
+        """
+        call, owner = self._join(key)
+        if owner:
+            call.task = asyncio.ensure_future(self._run(key, call, fn))
+        # A private future per waiter: unlike asyncio.wrap_future, cancelling
+        # it does not cancel the shared one
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def wake(shared: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(_copy_state, shared, waiter)
+            except RuntimeError:
+                pass  # the waiter's loop has closed
+
+        call.future.add_done_callback(wake)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if not call.future.done():
+                self._leave(key, call)
+            raise
+
+    async def _run(self, key: str, call: _Call, fn: Callable[[], Awaitable[T]]) -> None:
+        try:
+            result = await fn()
+        except BaseException as e:
+            # Stored for the waiters rather than raised, so the task never
+            # logs "exception was never retrieved"
+            self._settle(key, call, error=e)
+            if not isinstance(e, (Exception, asyncio.CancelledError)):
+                raise
+            return
+        self._settle(key, call, result=result)
@@ -0,0 +1,333 @@
+"""Incremental extraction of structured fields from streamed model output.
+
+When the rebuttal is streamed, the model's JSON object arrives a few
+characters at a time. :class:`JsonFieldStream` scans those chunks as they
+arrive and yields the decoded text of one top-level string field (normally
+``rebuttal_text``) while the rest of the object is still being generated,
+so the front-end can render the rebuttal before the closing brace arrives.
+
+The scanner only tracks as much JSON structure as it needs: nesting depth,
+string boundaries, escapes and which key a top-level value belongs to.
+Anything before the first ``{`` (such as a stray code fence) is skipped.
+
+Once the completion ends, :func:`parse_json_object` decodes the whole
+object. It tolerates the ways model output goes wrong in practice: code
+fences and prose around the object, trailing commas, raw newlines inside
+strings, and a completion cut off by ``max_tokens`` halfway through, which
+is closed at the last point that still makes sense (keeping a cut-off
+string value up to its last character). The result says whether repairs
+were needed and which field was cut off, so the caller can ask the model to
+continue rather than regenerate. :func:`validate_rebuttal` then checks the
+object against the rebuttal schema.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class JsonFieldStream:
+    """Stream the value of one top-level string field of a JSON object.
+
+    Args:
+        field: Name of the top-level key whose string value should be
+            streamed.
+
+    Example::
+
+        stream = JsonFieldStream("rebuttal_text")
+        for chunk in chunks:
+            delta = stream.feed(chunk)
+            if delta:
+                send(delta)
+    """
+
+    def __init__(self, field: str = "rebuttal_text") -> None:
+        self.field = field
+        self.raw = ""
+        self.value = ""
+        self.complete = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_role = ""  # "key", "target" or "other"
+        self._key_chars: List[str] = []
+        self._last_key = ""
+        self._after_colon = False
+
+    def feed(self, chunk: str) -> str:
+        """Consume ``chunk`` and return newly decoded characters of the field.
+
+        Escape sequences split across chunks are held back until the next
+        call completes them.
+        """
+        self.raw += chunk
+        out: List[str] = []
+        buf = self.raw
+        pos = self._pos
+        size = len(buf)
+        while pos < size:
+            ch = buf[pos]
+            if self._in_string:
+                if ch == "\\":
+                    decoded, consumed = self._decode_escape(buf, pos)
+                    if consumed == 0:
+                        break  # wait for the rest of the escape sequence
+                    self._emit(decoded, out)
+                    pos += consumed
+                    continue
+                if ch == '"':
+                    self._end_string()
+                else:
+                    self._emit(ch, out)
+                pos += 1
+                continue
+            if ch == '"':
+                self._start_string()
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            elif ch == ":" and self._depth == 1:
+                self._after_colon = True
+            elif ch == "," and self._depth == 1:
+                self._after_colon = False
+            pos += 1
+        self._pos = pos
+        delta = "".join(out)
+        self.value += delta
+        return delta
+
+    def _start_string(self) -> None:
+        self._in_string = True
+        if self._depth != 1:
+            self._string_role = "other"
+        elif not self._after_colon:
+            self._string_role = "key"
+            self._key_chars = []
+        elif self._last_key == self.field and not self.complete:
+            self._string_role = "target"
+        else:
+            self._string_role = "other"
+
+    def _end_string(self) -> None:
+        self._in_string = False
+        if self._string_role == "key":
+            self._last_key = "".join(self._key_chars)
+        elif self._string_role == "target":
+            self.complete = True
+        self._string_role = ""
+
+    def _emit(self, text: str, out: List[str]) -> None:
+        if self._string_role == "target":
+            out.append(text)
+        elif self._string_role == "key":
+            self._key_chars.append(text)
+
+    @staticmethod
+    def _decode_escape(buf: str, pos: int):
+        """Decode the escape at ``buf[pos]``; return ``(text, consumed)``.
+
+        ``consumed`` is 0 when the sequence is not yet complete.
+        """
+        if pos + 1 >= len(buf):
+            return "", 0
+        kind = buf[pos + 1]
+        if kind != "u":
+            return _SIMPLE_ESCAPES.get(kind, kind), 2
+        if pos + 6 > len(buf):
+            return "", 0
+        try:
+            code = int(buf[pos + 2 : pos + 6], 16)
+        except ValueError:
+            return "", 6
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate: combine with the following low surrogate
+            if pos + 12 > len(buf):
+                return "", 0
+            if buf[pos + 6 : pos + 8] == "\\u":
+                try:
+                    low = int(buf[pos + 8 : pos + 12], 16)
+                except ValueError:
+                    low = 0
+                if 0xDC00 <= low < 0xE000:
+                    return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+            return "�", 6
+        return chr(code), 6
+
+
+_DECODER = json.JSONDecoder(strict=False)
+_SCALAR = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+
+
+class ParsedObject(NamedTuple):
+    """A JSON object recovered from model output."""
+
+    data: Dict[str, Any]
+    # The text was not a valid object as returned and had to be repaired
+    repaired: bool
+    # The object was cut off and had to be closed
+    truncated: bool
+    # Top-level key whose value was cut off, if any
+    open_field: Optional[str]
+
+
+def close_json(text: str, start: int = 0) -> Tuple[Optional[str], bool, Optional[str]]:
+    """Repair the JSON object starting at ``text[start]``.
+
+    The object is re-emitted token by token, dropping whitespace and
+    trailing commas. If the text ends inside a top-level string value (the
+    rebuttal text, say) the string is closed after its last complete
+    character; if it ends anywhere else, including inside a list item, the
+    output is cut back to the last complete value. Open containers are then
+    closed. Scanning stops at the end of the top-level object, or at the
+    first token that cannot be repaired.
+
+    Returns:
+        A tuple ``(json_text, truncated, open_field)``: the repaired object
+        (None if not even its opening brace survives), whether it had to be
+        closed, and the top-level key whose value was cut off.
+    """
+    out: List[str] = []
+    levels: List[List[str]] = []  # [closer, state] per open container
+    safe: Tuple[int, str] = (0, "")
+    top_key: Optional[str] = None
+    i, n = start, len(text)
+
+    def closers() -> str:
+        return "".join(level[0] for level in reversed(levels))
+
+    def value_done() -> None:
+        nonlocal safe
+        if levels:
+            levels[-1][1] = "next"
+        safe = (len(out), closers())
+
+    while i < n:
+        ch = text[i]
+        if ch in " \t\r\n":
+            i += 1
+            continue
+        if not levels and out:
+            break  # the top-level object is complete
+        state = levels[-1][1] if levels else "value"
+        if ch in "{[" and state == "value":
+            out.append(ch)
+            levels.append(["}", "key"] if ch == "{" else ["]", "value"])
+            safe = (len(out), closers())
+        elif levels and ch == levels[-1][0] and state in ("key", "value", "next"):
+            if out[-1] == ",":
+                out.pop()
+            out.append(ch)
+            levels.pop()
+            value_done()
+        elif ch == "," and state == "next":
+            out.append(ch)
+            levels[-1][1] = "key" if levels[-1][0] == "}" else "value"
+        elif ch == ":" and state == "colon":
+            out.append(ch)
+            levels[-1][1] = "value"
+        elif ch == '"' and state in ("key", "value"):
+            j = i + 1
+            while j < n and text[j] != '"':
+                if text[j] != "\\":
+                    j += 1
+                    continue
+                width = 6 if text[j + 1 : j + 2] == "u" else 2
+                if j + width > n:
+                    break  # the text ends inside an escape sequence
+                j += width
+            if j >= n or text[j] != '"':
+                if state == "key" or len(levels) != 1:
+                    break  # only a cut-off top-level value is worth keeping
+                out.append(text[i:j] + '"')
+                value_done()
+                return "".join(out) + closers(), True, top_key
+            token = text[i : j + 1]
+            out.append(token)
+            if state == "key":
+                levels[-1][1] = "colon"
+                if len(levels) == 1:
+                    top_key = _DECODER.decode(token)
+            else:
+                value_done()
+            i = j + 1
+            continue
+        else:
+            match = _SCALAR.match(text, i) if state == "value" else None
+            if match is None:
+                break
+            out.append(match.group())
+            value_done()
+            i = match.end()
+            continue
+        i += 1
+    if out and not levels:
+        return "".join(out), False, None
+    if not out:
+        return None, True, None
+    in_value = len(levels) > 1 or levels[0][1] == "value"
+    count, closing = safe
+    return "".join(out[:count]) + closing, True, top_key if in_value else None
+
+
+def parse_json_object(content: str) -> ParsedObject:
+    """Decode the JSON object in ``content``, repairing it if necessary.
+
+    Raises:
+        ValueError: If ``content`` has no JSON object, or what there is
+            cannot be repaired.
+    """
+    # remove possible code fences or formatting
+    cleaned = content.strip().strip("`")
+    start = cleaned.find("{")
+    if start == -1:
+        raise ValueError("Model did not return JSON")
+    try:
+        data, _ = _DECODER.raw_decode(cleaned, start)
+        if isinstance(data, dict):
+            return ParsedObject(data, False, False, None)
+    except ValueError:
+        pass
+    repaired, truncated, open_field = close_json(cleaned, start)
+    try:
+        data = _DECODER.decode(repaired) if repaired else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        raise ValueError("Model returned malformed JSON")
+    return ParsedObject(data, True, truncated, open_field)
+
+
+def validate_rebuttal(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Check a parsed rebuttal against the schema and normalise it.
+
+    ``rebuttal_text`` must be a non-empty string. ``bullets`` is coerced to
+    a list of non-empty strings (a lone string becomes one bullet, a missing
+    value an empty list). Other keys are kept as they are.
+
+    Raises:
+        ValueError: If ``rebuttal_text`` is missing or empty.
+    """
+    text = data.get("rebuttal_text")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Model response has no rebuttal_text")
+    bullets = data.get("bullets")
+    if bullets is None:
+        bullets = []
+    elif not isinstance(bullets, list):
+        bullets = [bullets]
+    bullets = [str(bullet).strip() for bullet in bullets if bullet is not None and str(bullet).strip()]
+    return {**data, "rebuttal_text": text.strip(), "bullets": bullets}
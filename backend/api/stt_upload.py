@@ -0,0 +1,348 @@
+"""Bounded, streaming handling of speech-to-text uploads.
+
+The ``stt`` view used to read the whole recording into memory and then build
+a second in-memory copy for the multipart request to Whisper. Here uploads
+are handled in pieces instead:
+
+* :class:`AudioUploadHandler` is a Django upload handler that writes the
+  ``file`` field to a spooled temporary file (kept in memory up to
+  ``STT_SPOOL_MEMORY_BYTES``, on disk beyond that). While the data arrives
+  it hashes it and checks it against ``STT_MAX_UPLOAD_BYTES`` and
+  ``STT_MAX_SECONDS``, so an oversized recording is rejected at the first
+  chunk over the limit instead of after the whole body has been read. The
+  open file is handed to httpx, which streams it to the provider in 64 KB
+  pieces.
+* :class:`ChunkedUpload` collects a recording that arrives as a series of
+  ``MediaRecorder`` chunks (one request each). The chunks are appended to a
+  file under ``STT_UPLOAD_DIR``, and the limits are checked on every chunk,
+  so a recording that runs too long is refused while the user is still
+  speaking. The state lives in files rather than in process memory, so the
+  chunks of one recording may reach different workers on the same host.
+
+Duration is known exactly for WAV (from its header). For other formats the
+client can declare it with the ``X-Audio-Duration`` header (seconds, as
+measured by the recorder). The size limit always applies.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from . import metrics
+
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Multipart framing allowed on top of the file itself
+_MULTIPART_SLACK = 64 * 1024
+
+# Upload sizes worth telling apart: a short phrase up to Whisper's 25 MB cap
+UPLOAD_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 32e6)
+
+
+class AudioRejected(ValueError):
+    """An upload broke one of the STT limits.
+
+    Attributes:
+        status: HTTP status to answer with (413 for size and duration).
+    """
+
+    def __init__(self, message: str, status: int = 413) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def wav_duration(header: bytes, total_size: Optional[int] = None) -> Optional[float]:
+    """Return the duration of a WAV file from its first bytes.
+
+    Uses the ``data`` chunk size when the header has one, otherwise
+    ``total_size`` (recorders that stream WAV often leave the size at 0).
+
+    Returns:
+        Seconds of audio, or None if ``header`` is not a PCM WAV header.
+    """
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    offset, byte_rate = 12, 0
+    while offset + 8 <= len(header):
+        chunk_id, size = header[offset : offset + 4], struct.unpack("<I", header[offset + 4 : offset + 8])[0]
+        if chunk_id == b"fmt " and offset + 16 <= len(header):
+            byte_rate = struct.unpack("<I", header[offset + 16 : offset + 20])[0]
+        elif chunk_id == b"data" and byte_rate:
+            if size in (0, 0xFFFFFFFF) and total_size:
+                size = total_size - offset - 8
+            return size / byte_rate
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def declared_duration(meta: Dict[str, Any]) -> Optional[float]:
+    """Read the client's ``X-Audio-Duration`` header from ``request.META``."""
+    try:
+        return float(meta.get("HTTP_X_AUDIO_DURATION", ""))
+    except ValueError:
+        return None
+
+
+def check_limits(size: int, duration: Optional[float]) -> None:
+    """Raise :class:`AudioRejected` if ``size`` or ``duration`` is over the limit."""
+    if size > settings.STT_MAX_UPLOAD_BYTES:
+        metrics.inc("stt_rejected_total", reason="size")
+        raise AudioRejected(f"Audio is larger than {settings.STT_MAX_UPLOAD_BYTES} bytes")
+    if duration is not None and duration > settings.STT_MAX_SECONDS:
+        metrics.inc("stt_rejected_total", reason="duration")
+        raise AudioRejected(f"Audio is longer than {settings.STT_MAX_SECONDS:g} seconds")
+
+
+def file_digest(fileobj: IO[bytes]) -> str:
+    """Return the SHA-256 of ``fileobj`` read from the start, leaving it at 0."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class UploadedAudio(UploadedFile):
+    """An uploaded recording plus what was learnt while receiving it.
+
+    Attributes:
+        sha256: Hex digest of the audio, for request coalescing.
+        duration: Seconds of audio if known.
+    """
+
+    def __init__(self, file: IO[bytes], name: str, content_type: str, size: int, sha256: str,
+                 duration: Optional[float]) -> None:
+        super().__init__(file, name, content_type, size)
+        self.sha256 = sha256
+        self.duration = duration
+
+
+class AudioUploadHandler(FileUploadHandler):
+    """Spool the ``file`` field to a bounded temporary file.
+
+    Install it on a request before ``request.FILES`` is first read. Other
+    file fields are skipped. When a limit is broken the upload is stopped
+    and the reason is kept in :attr:`error`.
+    """
+
+    field_name = "file"
+
+    def __init__(self, request: Any = None) -> None:
+        super().__init__(request)
+        self.error: Optional[AudioRejected] = None
+        self.declared = declared_duration(request.META) if request is not None else None
+        self._file: Optional[IO[bytes]] = None
+
+    def _reject(self, error: AudioRejected) -> None:
+        self.error = error
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Refuse on the Content-Length alone, before any of the body is read
+        try:
+            check_limits(max(0, (content_length or 0) - _MULTIPART_SLACK), self.declared)
+        except AudioRejected as e:
+            self._reject(e)
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != type(self).field_name:
+            return
+        self._file = tempfile.SpooledTemporaryFile(max_size=settings.STT_SPOOL_MEMORY_BYTES)
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._duration = self.declared
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._file is None:
+            return None
+        if len(self._head) < 4096:
+            self._head += raw_data[: 4096 - len(self._head)]
+            self._duration = wav_duration(self._head) or self._duration
+        try:
+            check_limits(start + len(raw_data), self._duration)
+        except AudioRejected as e:
+            self._file.close()
+            self._file = None
+            self._reject(e)
+        self._digest.update(raw_data)
+        self._file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self._file is None:
+            return None
+        fileobj, self._file = self._file, None
+        duration = wav_duration(self._head, file_size) or self._duration
+        try:
+            check_limits(file_size, duration)
+        except AudioRejected as e:
+            fileobj.close()
+            self.error = e
+            return None
+        fileobj.seek(0)
+        metrics.observe("stt_upload_bytes", file_size, buckets=UPLOAD_BUCKETS)
+        return UploadedAudio(
+            fileobj, self.file_name or "audio", self.content_type, file_size, self._digest.hexdigest(), duration
+        )
+
+
+def receive_audio(request: Any) -> UploadedAudio:
+    """Parse ``request``'s multipart body and return the ``file`` field.
+
+    Raises:
+        AudioRejected: The upload is missing (400) or over a limit (413).
+    """
+    handler = AudioUploadHandler(request)
+    request.upload_handlers = [handler]
+    audio = request.FILES.get("file")
+    if handler.error is not None:
+        raise handler.error
+    if not isinstance(audio, UploadedAudio):
+        raise AudioRejected("No audio file provided", status=400)
+    return audio
+
+
+def upload_dir() -> Path:
+    """Directory holding in-progress chunked uploads."""
+    path = Path(settings.STT_UPLOAD_DIR or Path(tempfile.gettempdir()) / "devdebate-stt")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class ChunkedUpload:
+    """A recording uploaded as a series of chunks.
+
+    Chunks must be sent one at a time and in order; ``seq`` numbers them
+    from 0. Re-sending the last chunk (a client retry) is acknowledged
+    without appending it twice, and a chunk whose request failed part way
+    can be sent again: the metadata records a chunk only once all of it has
+    been written, and the audio file is cut back to that length first.
+
+    Args:
+        upload_id: 32 hex characters, as returned by :meth:`create`.
+        root: Directory holding the upload's files.
+    """
+
+    def __init__(self, upload_id: str, root: Path) -> None:
+        self.upload_id = upload_id
+        self.audio_path = root / f"{upload_id}.audio"
+        self._meta_path = root / f"{upload_id}.json"
+        self.meta: Dict[str, Any] = {}
+
+    @classmethod
+    def create(cls, mime_type: str) -> "ChunkedUpload":
+        """Start a new upload, sweeping abandoned ones first."""
+        root = upload_dir()
+        sweep(root)
+        upload = cls(uuid.uuid4().hex, root)
+        upload.audio_path.touch()
+        upload.meta = {"mime_type": mime_type, "chunks": 0, "bytes": 0, "duration": None}
+        upload._save()
+        return upload
+
+    @classmethod
+    def open(cls, upload_id: str) -> Optional["ChunkedUpload"]:
+        """Return the upload ``upload_id``, or None if it is unknown or expired."""
+        if not _UPLOAD_ID_RE.match(upload_id or ""):
+            return None
+        upload = cls(upload_id, upload_dir())
+        try:
+            upload.meta = json.loads(upload._meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+        return upload
+
+    @property
+    def mime_type(self) -> str:
+        return self.meta["mime_type"]
+
+    @property
+    def size(self) -> int:
+        return self.meta["bytes"]
+
+    def _save(self) -> None:
+        tmp = self._meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.meta))
+        os.replace(tmp, self._meta_path)
+
+    def append(self, seq: int, chunks: Iterable[bytes], duration: Optional[float] = None) -> bool:
+        """Append one chunk, read from ``chunks``.
+
+        Args:
+            seq: The chunk's position in the recording.
+            chunks: The chunk's bytes, in pieces.
+            duration: Seconds recorded so far, as declared by the client.
+
+        Returns:
+            False if ``seq`` repeats the last chunk and nothing was appended.
+
+        Raises:
+            AudioRejected: ``seq`` is out of order (409) or the recording
+                went over a limit (413); an over-limit upload is discarded.
+        """
+        expected = self.meta["chunks"]
+        if seq == expected - 1:
+            return False
+        if seq != expected:
+            raise AudioRejected(f"Expected chunk {expected}, got {seq}", status=409)
+        first = expected == 0
+        size = self.meta["bytes"]
+        try:
+            with self.audio_path.open("r+b") as out:
+                # Drop what a failed attempt at this chunk left behind
+                out.truncate(size)
+                out.seek(size)
+                for piece in chunks:
+                    size += len(piece)
+                    check_limits(size, duration or self.meta["duration"])
+                    out.write(piece)
+            if first or self.meta.get("wav"):
+                with self.audio_path.open("rb") as f:
+                    measured = wav_duration(f.read(4096), size)
+                if measured is not None:
+                    self.meta["wav"] = True
+                    duration = measured
+            check_limits(size, duration)
+        except AudioRejected:
+            self.discard()
+            raise
+        self.meta.update(chunks=expected + 1, bytes=size, duration=duration or self.meta["duration"])
+        self._save()
+        metrics.inc("stt_chunks_total")
+        return True
+
+    def discard(self) -> None:
+        """Delete the upload's files."""
+        for path in (self.audio_path, self._meta_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def sweep(root: Path) -> int:
+    """Delete uploads untouched for ``STT_UPLOAD_TTL`` seconds; return how many."""
+    cutoff = time.time() - settings.STT_UPLOAD_TTL
+    removed = 0
+    for path in root.glob("*.json"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                ChunkedUpload(path.stem, root).discard()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
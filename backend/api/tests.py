@@ -0,0 +1,479 @@
+"""Tests for the api app. Run them with ``python manage.py test api``."""
+from __future__ import annotations
+
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+from unittest import mock
+
+import httpx
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import BANNED_TOPICS, Persona, async_views, audio_formats, jobs, resilience, response_cache, turns, views
+from .backends import PiperTts
+from .context import ContextWindow, count_message_tokens
+from .guardrails import TopicMatcher
+from .session_store import MemorySessionStore, SQLiteSessionStore, Turn
+from .stt_upload import ChunkedUpload
+
+
+class BannedTopicsTests(SimpleTestCase):
+    """The built-in blocklist through :class:`api.guardrails.TopicMatcher`."""
+
+    def setUp(self) -> None:
+        self.matcher = TopicMatcher(BANNED_TOPICS)
+
+    def test_baseline_examples_stay_blocked(self) -> None:
+        # Blocked when the list was matched as case-insensitive substrings
+        for stance in (
+            "Self-harm is a personal choice.",
+            "Self-harming should be decriminalised.",
+            "Violent acts are sometimes justified.",
+            "Violent action is the only answer.",
+            "Illicit drugs should be legal.",
+            "Explosives should be sold in shops.",
+            "Everyone should learn to hack into their neighbour's wifi.",
+            "Writing malware is a legitimate career.",
+        ):
+            with self.subTest(stance=stance):
+                self.assertIsNotNone(self.matcher.search(stance))
+
+    def test_obfuscated_terms_are_blocked(self) -> None:
+        for stance in ("selfharm is fine", "SELF  HARM", "s3lf_h4rm", "m@lware", "expl\u200bosives", "Explosivés"):
+            with self.subTest(stance=stance):
+                self.assertIsNotNone(self.matcher.search(stance))
+
+    def test_unrelated_words_pass(self) -> None:
+        for stance in ("Remote work is better for everyone.", "The explosion of remote work", "Hacking is a craft."):
+            with self.subTest(stance=stance):
+                self.assertIsNone(self.matcher.search(stance))
+
+    def test_reports_the_matching_term(self) -> None:
+        self.assertEqual(self.matcher.search("selfharming"), "self-harm*")
+        self.assertEqual(TopicMatcher(["gun show"]).search("two gunshows"), "gun show")
+
+
+class ContextWindowTests(SimpleTestCase):
+    """Rebuttal prompts over a long debate, built as ``/api/rebuttal`` does."""
+
+    STANCE = "Code review slows delivery more than it improves quality, so teams should replace it with pairing. "
+    REBUTTAL = "Pairing spreads knowledge, but who reviews the pair's blind spots when both share them? "
+
+    def setUp(self) -> None:
+        self.store = MemorySessionStore(100, 3600)
+        patcher = mock.patch("api.session_store._store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def play(self, summarize: Any, turns: int = 200) -> Tuple[str, List[int]]:
+        """Play ``turns`` turns of one debate; return the session and each prompt's size."""
+        window = ContextWindow(
+            self.store,
+            summarize,
+            max_tokens=settings.CONTEXT_MAX_TOKENS,
+            keep_turns=settings.CONTEXT_KEEP_TURNS,
+            summary_batch=settings.CONTEXT_SUMMARY_BATCH,
+            model=settings.CONTEXT_TOKENIZER_MODEL,
+        )
+        sid = self.store.create()
+        sizes = []
+        with mock.patch("api.context._window", window):
+            for turn in range(turns):
+                messages = views.open_turn(sid, f"{self.STANCE * 3}({turn})", Persona.SOCRATES)
+                # The persona prompt and the format reminder come on top of the history budget
+                fixed = count_message_tokens([messages[0], messages[-1]], settings.CONTEXT_TOKENIZER_MODEL)
+                size = count_message_tokens(messages, settings.CONTEXT_TOKENIZER_MODEL)
+                self.assertLessEqual(size, settings.CONTEXT_MAX_TOKENS + fixed, f"turn {turn}")
+                sizes.append(size)
+                views.record_rebuttal(sid, {"rebuttal_text": self.REBUTTAL * 3, "bullets": []})
+                # Let the background summariser keep pace, as it would between real turns
+                deadline = time.monotonic() + 5
+                while window.pending and time.monotonic() < deadline:
+                    time.sleep(0.001)
+        history = [{"role": role, "content": text} for role, text in self.store.turns(sid)]
+        # Replaying the whole debate would have been far over budget
+        self.assertGreater(count_message_tokens(history), 2 * settings.CONTEXT_MAX_TOKENS)
+        return sid, sizes
+
+    def test_prompt_stays_bounded_over_200_turns(self) -> None:
+        def summarize(previous: str, turns: List[Turn]) -> str:
+            return (previous + " " + " ".join(text[:40] for _, text in turns))[-600:]
+
+        sid, sizes = self.play(summarize)
+        self.assertGreater(self.store.summary(sid).turns, 300)
+        # The prompt stopped growing once the budget was reached
+        self.assertLess(max(sizes[100:]), max(sizes[:50]) + 200)
+
+    def test_prompt_stays_bounded_when_summaries_fail(self) -> None:
+        def summarize(previous: str, turns: List[Turn]) -> str:
+            raise RuntimeError("summariser unavailable")
+
+        with self.assertLogs("api.context", "ERROR"):
+            self.play(summarize, turns=60)
+
+
+class SQLiteSessionStoreTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SQLiteSessionStore(Path(self.tmp.name, "sessions.sqlite3"), ttl=60)
+
+    def tearDown(self) -> None:
+        self.store._connect().close()
+        self.tmp.cleanup()
+
+    def stored_turns(self) -> int:
+        return self.store._connect().execute("SELECT COUNT(*) FROM devdebate_turn").fetchone()[0]
+
+    def test_reset_deletes_the_old_turns(self) -> None:
+        sid = self.store.create()
+        for _ in range(3):
+            self.store.append(sid, "user", "Remote work is better.")
+            self.store.append(sid, "ai", "Is it, though?")
+            self.assertTrue(self.store.reset(sid))
+        self.store.append(sid, "user", "Cities should ban cars.")
+        self.assertEqual(self.store.turns(sid), [("user", "Cities should ban cars.")])
+        self.assertEqual(self.stored_turns(), 1)
+
+    def test_purge_drops_generations_left_by_expiry(self) -> None:
+        sid = self.store.create()
+        self.store.append(sid, "user", "Remote work is better.")
+        # Expired but not purged yet: the next turn starts a new generation
+        self.store._connect().execute("UPDATE devdebate_session SET updated_at = ?", (time.time() - 120,))
+        self.store.append(sid, "user", "Cities should ban cars.")
+        self.assertEqual(self.stored_turns(), 2)
+        self.store.purge_expired()
+        self.assertEqual(self.stored_turns(), 1)
+        self.assertEqual(self.store.turns(sid), [("user", "Cities should ban cars.")])
+
+
+class PiperTtsTests(SimpleTestCase):
+    def setUp(self) -> None:
+        # The worker processes only start with the first synthesis, which is mocked
+        self.backend = PiperTts("voice.onnx", "ffmpeg")
+        self.addCleanup(self.backend.pool.shutdown)
+
+    def test_accepts_every_format_it_advertises(self) -> None:
+        for name in self.backend.output_formats:
+            with self.subTest(format=name), mock.patch.object(self.backend.pool, "run") as run:
+                self.backend.synthesize("Hello.", "Rachel", name)
+                self.assertEqual(run.call_args.args[2], audio_formats.get_format(name).encode)
+        self.assertIn("-b:a", self.backend.encode_args())
+
+    async def test_async_synthesis_takes_a_format(self) -> None:
+        with mock.patch.object(self.backend.pool, "arun", mock.AsyncMock(return_value=b"ogg")) as arun:
+            self.assertEqual(await self.backend.asynthesize("Hello.", "Rachel", "opus"), b"ogg")
+        self.assertEqual(arun.call_args.args[2], audio_formats.get_format("opus").encode)
+        with self.assertRaises(ValueError):
+            await self.backend.asynthesize("Hello.", "Rachel", "mp3_22050_32")
+
+
+class ChunkedUploadTests(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = override_settings(STT_UPLOAD_DIR=tmp.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def test_retried_chunk_replaces_a_partial_one(self) -> None:
+        upload = ChunkedUpload.create("audio/webm")
+        upload.append(0, [b"first-"])
+
+        def disconnect() -> Iterator[bytes]:
+            yield b"sec"
+            raise OSError("client went away")
+
+        with self.assertRaises(OSError):
+            ChunkedUpload.open(upload.upload_id).append(1, disconnect())
+        retried = ChunkedUpload.open(upload.upload_id)
+        self.assertTrue(retried.append(1, [b"second"]))
+        self.assertFalse(retried.append(1, [b"second"]))
+        self.assertEqual(retried.audio_path.read_bytes(), b"first-second")
+        self.assertEqual(retried.size, 12)
+
+
+class JobQueueTests(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.queue = jobs.JobQueue(Path(tmp.name, "jobs.sqlite3"))
+        self.addCleanup(lambda: self.queue._connect().close())
+
+    def test_claim_never_starts_a_job_before_it_was_queued(self) -> None:
+        def submit() -> None:
+            # A job submitted while the runner is on its way to the write lock
+            self.queue.submit("tts", "fake", {"text": "Hello"})
+
+        with mock.patch.object(self.queue, "requeue_expired", side_effect=submit):
+            job = self.queue.claim({"fake": 1}, "worker")
+        self.assertIsNotNone(job)
+        self.assertGreaterEqual(job.started_at, job.created_at)
+
+    def test_callbacks_do_not_hold_the_runner(self) -> None:
+        delivering = threading.Event()
+        released = threading.Event()
+
+        def deliver(job: jobs.Job) -> bool:
+            delivering.set()
+            return released.wait(5)
+
+        runner = jobs.JobRunner(self.queue, {"tts": lambda job: {"ok": True}}, {"fake": 1})
+        self.addCleanup(runner.stop, 0)
+        self.addCleanup(released.set)
+        self.queue.submit("tts", "fake", {"text": "Hello"}, callback_url="http://hooks.test/done")
+        with mock.patch("api.jobs.deliver_callback", deliver):
+            started = time.monotonic()
+            runner.run(self.queue.claim({"fake": 1}, runner.worker))
+            # The runner is free again while the callback is still being delivered
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertTrue(delivering.wait(5))
+
+
+class TurnQueueTests(SimpleTestCase):
+    """One turn per session at a time, in :class:`api.turns.TurnQueue`."""
+
+    def setUp(self) -> None:
+        self.queue = turns.TurnQueue(max_waiting=1, timeout=0.2)
+
+    def test_new_turn_supersedes_the_waiting_one(self) -> None:
+        running = self.queue.begin("s1")
+        waiting = self.queue.enter("s1")
+        newest = self.queue.enter("s1")
+        with self.assertRaises(turns.TurnRejected) as rejected:
+            self.queue.acquire(waiting)
+        self.assertEqual(rejected.exception.status, 409)
+        self.queue.release(running)
+        self.queue.acquire(newest)
+        self.queue.release(newest)
+        self.assertEqual(self.queue.pending("s1"), 0)
+
+    def test_queued_turns_wait_in_line(self) -> None:
+        running = self.queue.begin("s1")
+        waiting = self.queue.enter("s1", queue=True)
+        with self.assertRaises(turns.TurnRejected) as full:
+            self.queue.enter("s1", queue=True)
+        self.assertEqual(full.exception.status, 429)
+        # Other sessions are not held up
+        self.queue.release(self.queue.begin("s2"))
+        self.queue.release(running)
+        self.queue.acquire(waiting)
+        self.queue.release(waiting)
+
+    def test_turn_times_out_behind_a_running_one(self) -> None:
+        running = self.queue.begin("s1")
+        with self.assertRaises(turns.TurnRejected) as timed_out:
+            self.queue.begin("s1", queue=True)
+        self.assertEqual(timed_out.exception.status, 503)
+        self.queue.release(running)
+        self.assertEqual(self.queue.pending("s1"), 0)
+
+
+@override_settings(CHAT_BACKEND="fake", FAKE_BACKEND_LATENCY=0)
+class PanelTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.store = MemorySessionStore(100, 60)
+        self.queue = turns.TurnQueue(max_waiting=2, timeout=0.2)
+        for patcher in (
+            mock.patch("api.session_store._store", self.store),
+            mock.patch("api.turns._queue", self.queue),
+            mock.patch.dict("api.backends._backends", clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_panel(self, body: dict) -> dict:
+        request = RequestFactory().post("/api/panel", json.dumps(body), content_type="application/json")
+        return json.loads(views.panel(request).content)
+
+    def test_continued_seat_waits_for_its_session(self) -> None:
+        sid = self.store.create()
+        running = self.queue.begin(sid)
+        try:
+            payload = self.post_panel(
+                {"stances": ["Cities should ban cars.", "Remote work is better."], "sessionIds": [sid]}
+            )
+        finally:
+            self.queue.release(running)
+        first, second = payload["results"]
+        self.assertEqual((first["status"], first["sessionId"]), (503, sid))
+        # The rejected seat did not touch the transcript
+        self.assertEqual(self.store.turns(sid), [])
+        self.assertNotIn("error", second)
+        self.assertEqual(self.queue.pending(sid), 0)
+
+    def test_continued_seat_appends_to_its_session(self) -> None:
+        sid = self.store.create()
+        payload = self.post_panel({"stances": ["Cities should ban cars."], "sessionIds": [sid]})
+        self.assertEqual(payload["results"][0]["sessionId"], sid)
+        self.assertEqual([role for role, _ in self.store.turns(sid)], ["user", "assistant"])
+
+
+def on_event_loop() -> bool:
+    """Whether the caller runs on an event loop's thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class LoopCheckingStore(MemorySessionStore):
+    """Records whether each session lookup ran on an event loop's thread."""
+
+    def __init__(self) -> None:
+        super().__init__(100, 60)
+        self.on_loop: List[bool] = []
+
+    def _get(self, session_id: str) -> Any:
+        self.on_loop.append(on_event_loop())
+        return super()._get(session_id)
+
+    def _create(self, session_id: str) -> Any:
+        self.on_loop.append(on_event_loop())
+        return super()._create(session_id)
+
+
+@override_settings(CHAT_BACKEND="fake", FAKE_BACKEND_LATENCY=0)
+class AsyncViewsTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.store = LoopCheckingStore()
+        for patcher in (
+            mock.patch("api.session_store._store", self.store),
+            mock.patch("api.turns._queue", turns.TurnQueue()),
+            mock.patch.dict("api.backends._backends", clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def post(self, view: Any, body: dict) -> dict:
+        request = RequestFactory().post("/", json.dumps(body), content_type="application/json")
+        response = await view(request)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    async def test_session_store_runs_off_the_event_loop(self) -> None:
+        sid = (await self.post(async_views.rebuttal, {"stance": "Cities should ban cars."}))["sessionId"]
+        await self.post(async_views.respond, {"message": "They should.", "session_id": sid})
+        await self.post(async_views.panel, {"stances": ["Remote work is better."], "sessionIds": [sid]})
+        await self.post(async_views.reset_memory, {"sessionId": sid})
+        self.assertTrue(self.store.on_loop)
+        self.assertNotIn(True, self.store.on_loop)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    async def test_response_cache_runs_off_the_event_loop(self) -> None:
+        on_loop: List[bool] = []
+
+        def embed(text: str) -> Dict[str, float]:
+            on_loop.append(on_event_loop())
+            return response_cache.embed(text)
+
+        cache = response_cache.ResponseCache(semantic=True, embedder=embed)
+        with mock.patch("api.async_views.get_response_cache", lambda: cache):
+            for _ in range(2):
+                await self.post(async_views.rebuttal, {"stance": "Cities should ban cars."})
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(on_loop)
+        self.assertNotIn(True, on_loop)
+
+
+@override_settings(UPSTREAM_BREAKER_THRESHOLD=2)
+class ResilienceStreamTests(SimpleTestCase):
+    """Streamed completions go through the breaker and deadline, without retries."""
+
+    def setUp(self) -> None:
+        self.calls = 0
+        resilience.reset_state()
+        self.addCleanup(resilience.reset_state)
+        transport = httpx.MockTransport(self.outage)
+        clients = (
+            mock.patch("api.resilience.get_client", lambda provider: httpx.Client(transport=transport)),
+            mock.patch("api.resilience.get_async_client", lambda provider: httpx.AsyncClient(transport=transport)),
+        )
+        for patcher in clients:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def outage(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        return httpx.Response(503)
+
+    def test_open_circuit_stops_streams(self) -> None:
+        for _ in range(2):
+            with resilience.stream("openai", "POST", "http://upstream.test/chat") as resp:
+                self.assertEqual(resp.status_code, 503)
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            with resilience.stream("openai", "POST", "http://upstream.test/chat"):
+                pass
+        # One attempt per stream, none once the circuit opened
+        self.assertEqual(self.calls, 2)
+
+    async def test_async_stream_respects_the_deadline(self) -> None:
+        with resilience.deadline(0.01):
+            await asyncio.sleep(0.02)
+            with self.assertRaises(resilience.DeadlineExceeded):
+                async with resilience.astream("openai", "POST", "http://upstream.test/chat"):
+                    pass
+        self.assertEqual(self.calls, 0)
+
+
+@override_settings(UPSTREAM_BREAKER_THRESHOLD=2, UPSTREAM_BREAKER_RESET=0.01, UPSTREAM_BACKOFF_BASE=0.001)
+class CircuitProbeTests(SimpleTestCase):
+    """The call let through a half-open circuit always settles or hands on the probe."""
+
+    URL = "http://upstream.test/chat"
+
+    def setUp(self) -> None:
+        self.statuses: List[int] = []
+        resilience.reset_state()
+        self.addCleanup(resilience.reset_state)
+        clients = (
+            mock.patch(
+                "api.resilience.get_client", lambda provider: httpx.Client(transport=httpx.MockTransport(self.answer))
+            ),
+            mock.patch(
+                "api.resilience.get_async_client",
+                lambda provider: httpx.AsyncClient(transport=httpx.MockTransport(self.aanswer)),
+            ),
+        )
+        for patcher in clients:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def answer(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(self.statuses.pop(0))
+
+    async def aanswer(self, request: httpx.Request) -> httpx.Response:
+        if not self.statuses:
+            await asyncio.sleep(10)  # a provider that never answers
+        return self.answer(request)
+
+    def open_circuit(self) -> None:
+        self.statuses += [503, 503]
+        for _ in range(2):
+            resilience.request("openai", "POST", self.URL, idempotent=False)
+        self.assertEqual(resilience.get_breaker("openai").state, resilience.CircuitBreaker.OPEN)
+        time.sleep(0.02)
+
+    def test_throttled_probe_closes_the_circuit(self) -> None:
+        self.open_circuit()
+        # The probe is throttled, then its own retry goes through
+        self.statuses += [429, 200]
+        self.assertEqual(resilience.request("openai", "POST", self.URL).status_code, 200)
+        self.assertEqual(resilience.get_breaker("openai").state, resilience.CircuitBreaker.CLOSED)
+
+    async def test_cancelled_probe_hands_on_the_probe(self) -> None:
+        await asyncio.to_thread(self.open_circuit)
+        probe = asyncio.ensure_future(resilience.arequest("openai", "POST", self.URL))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        self.statuses.append(200)
+        resp = await resilience.arequest("openai", "POST", self.URL)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resilience.get_breaker("openai").state, resilience.CircuitBreaker.CLOSED)
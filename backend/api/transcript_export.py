@@ -0,0 +1,164 @@
+"""Streaming transcript exports.
+
+The transcript download used to build the whole file in memory before
+sending a byte. The generators here read the transcript from the session
+store a page at a time and yield the encoded export in chunks of about
+``CHUNK_BYTES``, so memory per download stays flat however long the debate.
+
+Three formats are supported (see :data:`FORMATS`): plain text in the
+original ``User:`` / ``Opponent:`` layout, JSON lines with one object per
+turn, and Markdown. :func:`iter_zip` bundles a transcript with the
+synthesised audio of the opponent's turns, taken from the TTS cache, into a
+zip archive written on the fly (entries use data descriptors, so no part of
+the archive has to be seeked back to).
+
+Which turns to export (``start`` and ``stop``) and where cached audio lives
+are decided by the caller; this module only knows about the session store
+interface.
+"""
+from __future__ import annotations
+
+import io
+import json
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from .session_store import SessionStore
+
+# Bytes buffered before a chunk is handed to the response
+CHUNK_BYTES = 64 * 1024
+# Turns read from the session store per query
+PAGE_TURNS = 200
+
+# format -> (content type, file extension)
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "md": ("text/markdown; charset=utf-8", "md"),
+}
+
+IndexedTurn = Tuple[int, str, str]
+
+
+def iter_turns(store: SessionStore, session_id: str, start: int, stop: int) -> Iterator[IndexedTurn]:
+    """Yield ``(index, role, text)`` for turns ``start`` to ``stop - 1``, a page at a time."""
+    for index, (role, text) in enumerate(store.iter_turns(session_id, start, stop, PAGE_TURNS), start):
+        yield index, role, text
+
+
+def format_turn(fmt: str, index: int, role: str, text: str) -> str:
+    """Render one turn in export format ``fmt``."""
+    if fmt == "jsonl":
+        return json.dumps({"index": index, "role": role, "text": text}, ensure_ascii=False) + "\n"
+    speaker = "User" if role == "user" else "Opponent"
+    if fmt == "md":
+        return f"**{speaker}:** {text}\n\n"
+    return f"{speaker}: {text}\n"
+
+
+def iter_lines(turns: Iterator[IndexedTurn], fmt: str, session_id: str, start: int = 0) -> Iterator[str]:
+    """Yield the export of ``turns`` line by line.
+
+    A Markdown export starting at the first turn gets a title, so pages
+    fetched later can be appended to it as they are.
+    """
+    if fmt == "md" and start == 0:
+        yield f"# Debate transcript\n\nSession `{session_id}`\n\n"
+    for index, role, text in turns:
+        yield format_turn(fmt, index, role, text)
+
+
+def iter_chunks(lines: Iterator[str]) -> Iterator[bytes]:
+    """Encode ``lines`` as UTF-8 and regroup them into chunks of about ``CHUNK_BYTES``."""
+    buffer: List[bytes] = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _zip_entry(name: str, compress_type: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable file object that collects what ``zipfile`` writes to it."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> List[bytes]:
+        """Return what was written since the last call (nothing if empty)."""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return [data] if data else []
+
+
+def iter_zip(
+    lines: Iterator[str],
+    transcript_name: str,
+    audio: Iterator[Tuple[str, List[Path]]],
+) -> Iterator[bytes]:
+    """Stream a zip archive of the transcript and its audio.
+
+    Args:
+        lines: The transcript export, as from :func:`iter_lines`.
+        transcript_name: File name of the transcript inside the archive.
+        audio: ``(name, paths)`` pairs; the files in ``paths`` (MP3 segments,
+            which can be concatenated) are stored as one entry ``name``.
+
+    Yields:
+        The archive in chunks. MP3 entries are stored uncompressed since
+        they would not shrink.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        with archive.open(_zip_entry(transcript_name, zipfile.ZIP_DEFLATED), "w") as entry:
+            for chunk in iter_chunks(lines):
+                entry.write(chunk)
+                yield from sink.drain()
+        for name, paths in audio:
+            with archive.open(_zip_entry(name, zipfile.ZIP_STORED), "w") as entry:
+                for path in paths:
+                    try:
+                        with path.open("rb") as source:
+                            while True:
+                                data = source.read(CHUNK_BYTES)
+                                if not data:
+                                    break
+                                entry.write(data)
+                                yield from sink.drain()
+                    except FileNotFoundError:
+                        # Evicted from the cache since it was looked up
+                        continue
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def audio_entries(
+    turns: Iterator[IndexedTurn], find_audio: Callable[[str], List[Path]]
+) -> Iterator[Tuple[str, List[Path]]]:
+    """Name the cached audio of each opponent turn, skipping turns with none."""
+    for index, role, text in turns:
+        if role == "user":
+            continue
+        paths = find_audio(text)
+        if paths:
+            yield f"audio/{index:04d}.mp3", paths
@@ -0,0 +1,203 @@
+"""Content-addressed cache for synthesised speech.
+
+Every TTS request used to write a new random-named MP3, even when the same
+text had been voiced moments earlier (transcript replays, canned persona
+lines). Here audio is stored under a SHA-256 of everything that affects the
+output -- text, voice, model and voice settings -- so identical requests
+resolve to the same file and only the first one reaches the provider.
+
+The cache keeps an in-memory LRU index of the files in its directory,
+rebuilt from disk (ordered by modification time) when the process starts.
+Hits refresh a file's mtime, so recency survives restarts. When the total
+size exceeds ``max_bytes`` the least recently used files are deleted.
+Concurrent requests for the same key are coalesced through a
+:class:`~api.singleflight.SingleFlight` group: one caller synthesises while
+the others wait for its result.
+
+Each worker process keeps its own index over the shared directory. A file
+evicted by another worker is treated as a miss and synthesised again.
+
+Every output format of ``api.audio_formats`` is cached in the same
+directory and budget; a key covers the format, and the format's extension
+is passed alongside it (the cache's own ``extension`` when omitted).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from . import instrument, metrics
+from .singleflight import SingleFlight
+
+_NAME_RE = re.compile(r"^[0-9a-f]{64}\.\w+$")
+
+
+def cache_key(voice_id: str, payload: Dict[str, Any], audio_format: str = "mp3") -> str:
+    """Return the cache key for a synthesis request.
+
+    Args:
+        voice_id: The provider voice.
+        payload: The provider request body (text, model and voice settings).
+        audio_format: Output format name, so different formats never collide.
+    """
+    canonical = json.dumps(
+        {"voice_id": voice_id, "payload": payload, "format": audio_format}, sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TtsCache:
+    """Size-bounded LRU cache of audio files keyed by content hash.
+
+    Args:
+        root: Directory holding the cached files.
+        max_bytes: Total size above which old entries are evicted.
+        extension: File extension of entries stored without one.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, extension: str = "mp3") -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.total_bytes = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._flight = SingleFlight("tts")
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self) -> None:
+        if not self.root.is_dir():
+            return
+        entries = []
+        for path in self.root.iterdir():
+            if not _NAME_RE.match(path.name):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self.total_bytes += size
+        metrics.set_gauge("tts_cache_bytes", self.total_bytes)
+
+    def path_for(self, key: str, extension: Optional[str] = None) -> Path:
+        return self.root / f"{key}.{extension or self.extension}"
+
+    def url_for(self, key: str, extension: Optional[str] = None) -> str:
+        relative = self.path_for(key, extension).relative_to(Path(settings.MEDIA_ROOT))
+        return f"{settings.MEDIA_URL}{relative.as_posix()}"
+
+    def lookup(self, key: str, extension: Optional[str] = None) -> Optional[Path]:
+        """Return the cached file for ``key`` and mark it recently used."""
+        path = self.path_for(key, extension)
+        with self._lock:
+            if path.name not in self._index:
+                return None
+            if not path.exists():
+                # Evicted by another worker process
+                self.total_bytes -= self._index.pop(path.name)
+                return None
+            self._index.move_to_end(path.name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def store(self, key: str, audio: bytes, extension: Optional[str] = None) -> Path:
+        """Write ``audio`` under ``key`` atomically and evict if over budget."""
+        with instrument.span("disk"):
+            self.root.mkdir(parents=True, exist_ok=True)
+            path = self.path_for(key, extension)
+            tmp = path.with_name(f".{key}.{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(audio)
+            os.replace(tmp, path)
+        with self._lock:
+            self.total_bytes += len(audio) - self._index.pop(path.name, 0)
+            self._index[path.name] = len(audio)
+            self._evict()
+        return path
+
+    def _evict(self) -> None:
+        evicted = 0
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            evicted += size
+            try:
+                (self.root / name).unlink()
+            except OSError:
+                pass
+        if evicted:
+            metrics.inc("tts_cache_evicted_bytes_total", evicted)
+        metrics.set_gauge("tts_cache_bytes", self.total_bytes)
+        metrics.set_gauge("tts_cache_entries", len(self._index))
+
+    def fetch(
+        self, key: str, produce: Callable[[], bytes], extension: Optional[str] = None
+    ) -> Tuple[Path, bool]:
+        """Return the file for ``key``, calling ``produce`` on a miss.
+
+        Returns:
+            ``(path, hit)`` where ``hit`` is False if this call or a
+            concurrent one had to synthesise the audio.
+        """
+        path = self.lookup(key, extension)
+        if path is not None:
+            metrics.inc("tts_cache_hits_total")
+            return path, True
+
+        def miss() -> Path:
+            # A call that finished between our lookup and joining stored it
+            path = self.lookup(key, extension)
+            if path is not None:
+                return path
+            metrics.inc("tts_cache_misses_total")
+            return self.store(key, produce(), extension)
+
+        return self._flight.do(key, miss), False
+
+    async def afetch(
+        self, key: str, produce: Callable[[], Awaitable[bytes]], extension: Optional[str] = None
+    ) -> Tuple[Path, bool]:
+        """Async counterpart of :meth:`fetch`; coalesces with threaded callers."""
+        path = self.lookup(key, extension)
+        if path is not None:
+            metrics.inc("tts_cache_hits_total")
+            return path, True
+
+        async def miss() -> Path:
+            path = self.lookup(key, extension)
+            if path is not None:
+                return path
+            metrics.inc("tts_cache_misses_total")
+            audio = await produce()
+            return await asyncio.to_thread(self.store, key, audio, extension)
+
+        return await self._flight.ado(key, miss), False
+
+
+_cache: Optional[TtsCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TtsCache:
+    """Return the process-wide TTS cache configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TtsCache(Path(settings.TTS_CACHE_DIR), settings.TTS_CACHE_MAX_BYTES)
+    return _cache
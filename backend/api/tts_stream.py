@@ -0,0 +1,183 @@
+"""Sentence-chunked speech synthesis for streaming TTS responses.
+
+Synthesising a whole rebuttal before returning anything means the client
+waits for the slowest part of the pipeline before playback can start. The
+helpers here split the text into sentences, synthesise several of them at
+once with bounded parallelism, and hand back the audio strictly in order as
+soon as each segment (and every segment before it) is ready. The first
+sentence is usually short, so audio can start after one small request.
+
+The synthesis function is passed in by the caller, which keeps this module
+independent of any particular provider; ``api.views`` wires it to
+ElevenLabs. Both a thread-based iterator (WSGI) and an async iterator (ASGI)
+are provided. :class:`SentenceBuffer` splits text that is still being
+generated, so speech can start before the rebuttal is complete.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Deque, Iterator, List, Tuple
+
+# Sentence ends: terminal punctuation, optional closing quotes/brackets, whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+
+Segment = Tuple[int, str, bytes]
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Break an overlong sentence at clause boundaries, then at spaces."""
+    parts: List[str] = []
+    current = ""
+    for clause in _CLAUSE_END.split(sentence):
+        candidate = f"{current} {clause}".strip()
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            parts.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        current = clause
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sentences(text: str, max_chars: int = 250, min_chars: int = 20) -> List[str]:
+    """Split ``text`` into speakable segments.
+
+    Sentences shorter than ``min_chars`` are merged into the following one so
+    that interjections like "No." do not cost a round trip of their own, and
+    sentences longer than ``max_chars`` are broken at clause boundaries.
+
+    Args:
+        text: The text to split.
+        max_chars: Longest segment to send in one synthesis request.
+        min_chars: Shortest segment worth synthesising on its own.
+
+    Returns:
+        The segments in reading order. Joining them with spaces gives back
+        the original text modulo whitespace.
+    """
+    segments: List[str] = []
+    pending = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        pending = f"{pending} {sentence}".strip()
+        if len(pending) < min_chars:
+            continue
+        segments.extend(_split_long(pending, max_chars) if len(pending) > max_chars else [pending])
+        pending = ""
+    if pending:
+        if segments and len(segments[-1]) + len(pending) < max_chars:
+            segments[-1] = f"{segments[-1]} {pending}"
+        else:
+            segments.append(pending)
+    return segments
+
+
+class SentenceBuffer:
+    """Cut streamed text into segments as soon as each one is complete.
+
+    Text fed in is held until a sentence boundary has been seen and at least
+    ``min_chars`` are waiting; then everything up to the last boundary is
+    split as :func:`split_sentences` would. Unpunctuated runs longer than
+    ``max_chars`` are cut at clause boundaries or spaces. :meth:`flush`
+    returns whatever is left once the stream ends.
+    """
+
+    def __init__(self, max_chars: int = 250, min_chars: int = 20) -> None:
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.text = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add ``text``; return the segments it completed (often none)."""
+        self.text += text
+        cut = 0
+        for match in _SENTENCE_END.finditer(self.text):
+            cut = match.end()
+        if cut and len(self.text[:cut].strip()) >= self.min_chars:
+            ready, self.text = self.text[:cut], self.text[cut:]
+            return split_sentences(ready, self.max_chars, self.min_chars)
+        if len(self.text) > self.max_chars * 2:
+            # No sentence end in sight: keep the last part, it may continue
+            trailing = self.text[len(self.text.rstrip()):]
+            parts = _split_long(self.text.strip(), self.max_chars)
+            self.text = parts.pop() + trailing
+            return parts
+        return []
+
+    def flush(self) -> List[str]:
+        """Return the segments for the remaining text and empty the buffer."""
+        rest, self.text = self.text, ""
+        return split_sentences(rest, self.max_chars, self.min_chars)
+
+
+def iter_synthesized(
+    segments: List[str], synthesize: Callable[[str], bytes], parallelism: int = 3
+) -> Iterator[Segment]:
+    """Synthesise ``segments`` on worker threads and yield them in order.
+
+    At most ``parallelism`` segments are in flight; a new one is started
+    each time the oldest is yielded. Closing the iterator early (for example
+    when the client disconnects) cancels segments that have not started.
+
+    Yields:
+        Tuples ``(index, segment_text, audio_bytes)``.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="tts-segment")
+    pending: Deque[Tuple[int, str, Future]] = deque()
+    queue = iter(enumerate(segments))
+
+    def submit_next() -> None:
+        for index, segment in queue:
+            pending.append((index, segment, pool.submit(synthesize, segment)))
+            return
+
+    try:
+        for _ in range(max(1, parallelism)):
+            submit_next()
+        while pending:
+            index, segment, future = pending.popleft()
+            audio = future.result()
+            submit_next()
+            yield index, segment, audio
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_synthesized(
+    segments: List[str], synthesize: Callable[[str], Awaitable[bytes]], parallelism: int = 3
+) -> AsyncIterator[Segment]:
+    """Async counterpart of :func:`iter_synthesized` using tasks."""
+    pending: Deque[Tuple[int, str, asyncio.Task]] = deque()
+    queue = iter(enumerate(segments))
+
+    def submit_next() -> None:
+        for index, segment in queue:
+            pending.append((index, segment, asyncio.ensure_future(synthesize(segment))))
+            return
+
+    try:
+        for _ in range(max(1, parallelism)):
+            submit_next()
+        while pending:
+            index, segment, task = pending.popleft()
+            audio = await task
+            submit_next()
+            yield index, segment, audio
+    finally:
+        for _, _, task in pending:
+            task.cancel()
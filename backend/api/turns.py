@@ -0,0 +1,386 @@
+"""Per-session ordering of debate turns.
+
+A turn appends the user's stance to the transcript, asks the model and
+appends the rebuttal. Two turns of one session running at once could
+interleave those writes and would both pay for a full completion. Turns now
+take their session's slot in a :class:`TurnQueue` first:
+
+* Only one turn per session runs at a time; later ones wait, in order.
+* A new turn **supersedes** the turns still waiting in its session. They are
+  cancelled before reaching the model and answered ``409``. Clients that
+  want every turn answered send ``"queue": true`` instead. At most
+  ``TURN_QUEUE_MAX`` turns then wait per session (``429`` beyond that).
+* A turn waits at most ``TURN_QUEUE_TIMEOUT`` seconds for the slot (``503``).
+
+Client disconnects end the running turn's upstream work. Under ASGI,
+Django cancels the view (or the streaming body), and the cancellation
+reaches the awaited httpx request. Under WSGI a streamed rebuttal is
+closed when writing to the client fails, which closes the upstream
+stream. A blocking, non-streamed call cannot be interrupted and runs to
+completion.
+
+Cancelled turns are counted in ``turns_cancelled_total{reason,stage}``:
+
+* ``reason`` is ``superseded`` or ``disconnected``.
+* ``stage`` is ``queued``, ``running`` or ``streaming``.
+
+The tokens they did not spend go in ``chat_tokens_saved_total{kind}``. A
+turn cancelled while queued saves its prompt (estimated from the session's
+last prompt) and a typical completion. A stream cut short saves the rest
+of a typical completion. The typical completion is a moving average of
+finished turns.
+
+The slots are per process. Debates whose requests are spread over
+several workers are ordered within each worker only; pin sessions to one
+worker (or run one ASGI process) for strict ordering.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import metrics
+from .context import count_tokens
+
+QUEUED, RUNNING, STREAMING = "queued", "running", "streaming"
+SUPERSEDED, DISCONNECTED = "superseded", "disconnected"
+
+# Starting estimate of a rebuttal's completion tokens, refined as turns finish
+DEFAULT_COMPLETION_TOKENS = 150.0
+
+
+class TurnRejected(Exception):
+    """A turn that will not run: superseded (409), queue full (429) or timed out (503)."""
+
+    def __init__(self, message: str, status: int) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class Turn:
+    """One debate turn holding, or waiting for, its session's slot."""
+
+    def __init__(self, session_id: str) -> None:
+        self.session_id = session_id
+        self.queued_at = time.monotonic()
+        self.stage = QUEUED
+        self.cancel_reason = ""
+        self.prompt_tokens = 0
+        self.finished = False
+        self._output: List[str] = []
+        self._granted = threading.Event()
+        self._futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def superseded(self) -> bool:
+        return self.cancel_reason == SUPERSEDED
+
+    def _wake(self) -> None:
+        # Caller holds the queue lock
+        self._granted.set()
+        for loop, future in self._futures:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._futures.clear()
+
+    def supersede(self) -> None:
+        """Mark the turn as replaced by a newer one, before cancelling it."""
+        self.cancel_reason = SUPERSEDED
+
+    def on_text(self, text: str) -> None:
+        """Record completion text received for this turn."""
+        self._output.append(text)
+
+    @property
+    def completion_tokens(self) -> int:
+        """Completion tokens received so far."""
+        if not self._output:
+            return 0
+        return count_tokens("".join(self._output), settings.CONTEXT_TOKENIZER_MODEL)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Session:
+    __slots__ = ("running", "waiting", "prompt_tokens")
+
+    def __init__(self) -> None:
+        self.running: Optional[Turn] = None
+        self.waiting: Deque[Turn] = deque()
+        self.prompt_tokens = 0
+
+
+class TurnQueue:
+    """Slots for the sessions with turns in flight in this process.
+
+    Args:
+        max_waiting: Turns that may wait per session when queueing.
+        timeout: Seconds a turn waits for its slot.
+    """
+
+    def __init__(self, max_waiting: int = 2, timeout: float = 45) -> None:
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.completion_estimate = DEFAULT_COMPLETION_TOKENS
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+
+    def enter(self, session_id: str, queue: bool = False) -> Turn:
+        """Register a turn for ``session_id``; it may still have to wait.
+
+        Args:
+            queue: Wait behind earlier turns instead of superseding the
+                ones still waiting.
+
+        Raises:
+            TurnRejected: If ``queue`` is set and the session's queue is full.
+        """
+        turn = Turn(session_id)
+        superseded: List[Turn] = []
+        with self._lock:
+            session = self._sessions.setdefault(session_id, _Session())
+            if not queue:
+                superseded = list(session.waiting)
+                session.waiting.clear()
+            elif len(session.waiting) >= self.max_waiting:
+                raise TurnRejected("Too many turns queued for this session", 429)
+            for old in superseded:
+                old.cancel_reason = SUPERSEDED
+                old._wake()
+            if session.running is None:
+                session.running = turn
+                turn.stage = RUNNING
+                turn._granted.set()
+            else:
+                session.waiting.append(turn)
+            self._update_gauge()
+        return turn
+
+    def begin(self, session_id: str, queue: bool = False) -> Turn:
+        """Register a turn and block until it holds its session's slot.
+
+        Raises:
+            TurnRejected: See :meth:`enter` and :meth:`acquire`.
+        """
+        turn = self.enter(session_id, queue)
+        self.acquire(turn)
+        return turn
+
+    async def abegin(self, session_id: str, queue: bool = False) -> Turn:
+        """Async counterpart of :meth:`begin`."""
+        turn = self.enter(session_id, queue)
+        await self.aacquire(turn)
+        return turn
+
+    def acquire(self, turn: Turn) -> None:
+        """Block until ``turn`` holds its session's slot.
+
+        Raises:
+            TurnRejected: If the turn was superseded or timed out; it has
+                been released.
+        """
+        turn._granted.wait(self.timeout)
+        self._check_granted(turn)
+
+    async def aacquire(self, turn: Turn) -> None:
+        """Async counterpart of :meth:`acquire`; waits without a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if not turn._granted.is_set():
+                turn._futures.append((loop, future))
+            else:
+                future.set_result(None)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self.release(turn, DISCONNECTED)
+            raise
+        self._check_granted(turn)
+
+    def _check_granted(self, turn: Turn) -> None:
+        metrics.observe("turn_queue_wait_seconds", time.monotonic() - turn.queued_at)
+        if turn.superseded:
+            self.release(turn)
+            raise TurnRejected("Superseded by a newer turn in this session", 409)
+        if not turn._granted.is_set():
+            self.release(turn)
+            metrics.inc("turns_queue_timeouts_total")
+            raise TurnRejected("An earlier turn in this session is still running", 503)
+
+    def set_prompt(self, turn: Turn, prompt_tokens: int) -> None:
+        """Record the prompt size of a turn that is about to call the model."""
+        turn.prompt_tokens = prompt_tokens
+        with self._lock:
+            session = self._sessions.get(turn.session_id)
+            if session is not None:
+                session.prompt_tokens = prompt_tokens
+
+    def release(self, turn: Turn, cancel_reason: str = "") -> None:
+        """Give up ``turn``'s slot (or place in line) and account for it.
+
+        Args:
+            cancel_reason: ``disconnected`` if the client went away before
+                the turn finished; superseded turns are already marked.
+        """
+        with self._lock:
+            if turn.finished:
+                return
+            turn.finished = True
+            if cancel_reason and not turn.cancel_reason:
+                turn.cancel_reason = cancel_reason
+            session = self._sessions.get(turn.session_id)
+            last_prompt = session.prompt_tokens if session is not None else 0
+            if session is not None:
+                if session.running is turn:
+                    session.running = session.waiting.popleft() if session.waiting else None
+                    if session.running is not None:
+                        session.running.stage = RUNNING
+                        session.running._wake()
+                elif turn in session.waiting:
+                    session.waiting.remove(turn)
+                if session.running is None and not session.waiting:
+                    del self._sessions[turn.session_id]
+            self._update_gauge()
+        if turn.cancel_reason:
+            self._count_cancelled(turn, last_prompt)
+        elif turn.prompt_tokens:
+            completion_tokens = turn.completion_tokens
+            if completion_tokens:
+                # Moving average of completed rebuttals, for the savings estimate
+                self.completion_estimate += 0.1 * (completion_tokens - self.completion_estimate)
+
+    def _count_cancelled(self, turn: Turn, last_prompt: int) -> None:
+        metrics.inc("turns_cancelled_total", reason=turn.cancel_reason, stage=turn.stage)
+        if turn.stage == QUEUED:
+            if last_prompt:
+                metrics.inc("chat_tokens_saved_total", last_prompt, kind="prompt")
+            metrics.inc("chat_tokens_saved_total", round(self.completion_estimate), kind="completion")
+        elif turn.prompt_tokens:
+            # The prompt was sent; whatever had not been generated is saved
+            remaining = self.completion_estimate - turn.completion_tokens
+            if remaining > 0:
+                metrics.inc("chat_tokens_saved_total", round(remaining), kind="completion")
+
+    def _update_gauge(self) -> None:
+        # Caller holds the lock
+        metrics.set_gauge("turns_waiting", sum(len(s.waiting) for s in self._sessions.values()))
+
+    def pending(self, session_id: str) -> int:
+        """Turns of ``session_id`` running or waiting in this process."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return 0
+            return len(session.waiting) + (session.running is not None)
+
+
+@contextmanager
+def holding(queue: TurnQueue, turn: Turn) -> Iterator[Turn]:
+    """Release ``turn`` when the block exits, unless it was handed to a :class:`TurnStream`."""
+    try:
+        yield turn
+    finally:
+        if turn.stage != STREAMING:
+            queue.release(turn)
+
+
+@asynccontextmanager
+async def aholding(queue: TurnQueue, turn: Turn) -> AsyncIterator[Turn]:
+    """Async counterpart of :func:`holding`; a cancelled block counts as a disconnect."""
+    try:
+        yield turn
+    except asyncio.CancelledError:
+        queue.release(turn, DISCONNECTED)
+        raise
+    finally:
+        if turn.stage != STREAMING:
+            queue.release(turn)
+
+
+class TurnStream:
+    """Streaming body that holds its turn until the last event is sent.
+
+    Django registers :meth:`close` as a resource closer. It runs when the
+    response is closed, including when the server gave up on a client that
+    went away. It releases the turn (as a disconnect if the events were not
+    all sent) and closes ``events``, which closes the upstream stream.
+    """
+
+    def __init__(self, queue: TurnQueue, turn: Turn, events: Iterator[Any]) -> None:
+        self.queue = queue
+        self.turn = turn
+        self.events = events
+        turn.stage = STREAMING
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            yield from self.events
+        except GeneratorExit:
+            self.close()
+            raise
+        self.queue.release(self.turn)
+
+    def close(self) -> None:
+        self.queue.release(self.turn, DISCONNECTED)
+        close = getattr(self.events, "close", None)
+        if close is not None:
+            close()
+
+
+class AsyncTurnStream:
+    """Async counterpart of :class:`TurnStream`.
+
+    Under ASGI a client disconnect cancels the task sending the body; the
+    ``CancelledError`` raised in ``events`` releases the turn.
+    """
+
+    def __init__(self, queue: TurnQueue, turn: Turn, events: AsyncIterator[Any]) -> None:
+        self.queue = queue
+        self.turn = turn
+        self.events = events
+        turn.stage = STREAMING
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        try:
+            async for event in self.events:
+                yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            self.queue.release(self.turn, DISCONNECTED)
+            raise
+        self.queue.release(self.turn)
+
+    def close(self) -> None:
+        self.queue.release(self.turn, DISCONNECTED)
+
+
+_queue: Optional[TurnQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_turn_queue() -> TurnQueue:
+    """Return the process-wide turn queue configured from settings."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = TurnQueue(settings.TURN_QUEUE_MAX, settings.TURN_QUEUE_TIMEOUT)
+    return _queue
+
+
+def describe(error: TurnRejected, session_id: str) -> Dict[str, Any]:
+    """JSON body for a rejected turn."""
+    body: Dict[str, Any] = {"error": str(error), "sessionId": session_id}
+    if error.status == 409:
+        body["superseded"] = True
+    return body
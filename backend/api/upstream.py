@@ -0,0 +1,303 @@
+"""Shared, pooled HTTP clients for the upstream AI providers.
+
+Creating a fresh ``httpx.Client`` for every call means a new TCP and TLS
+handshake on every debate turn. This module keeps one long-lived client per
+provider instead, so keep-alive connections are reused across requests and
+threads. Clients are created lazily on first use and are rebuilt
+automatically in a forked worker process.
+
+Pool limits, per-phase timeouts and the provider base URLs are read from
+Django settings (see the ``UPSTREAM_*`` entries in ``devdebate/settings.py``).
+HTTP/2 is negotiated for providers that have it enabled, but only when the
+optional ``h2`` package is installed (``pip install httpx[http2]``).
+
+:func:`open_connections` makes the handshakes ahead of the first call, for
+the warm-up phase (``api.warmup``). Call :func:`close_clients` to release
+pooled connections; it is registered with :mod:`atexit` so connections are
+closed cleanly on interpreter shutdown.
+
+The asynchronous views use :func:`get_async_client` instead. An
+``httpx.AsyncClient`` is tied to the event loop it was first used on, so one
+client is kept per provider per loop; the ASGI entry point closes them from
+its lifespan shutdown handler via :func:`aclose_clients`.
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, MutableMapping, Optional
+
+import httpx
+from django.conf import settings
+
+_clients: Dict[str, httpx.Client] = {}
+_client_pid: Optional[int] = None
+_lock = threading.Lock()
+
+# Async clients are keyed by event loop, then provider
+_async_clients: MutableMapping[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]] = (
+    weakref.WeakKeyDictionary()
+)
+
+# Per-provider request counters, reported alongside the pool stats
+_request_counts: Dict[str, int] = {}
+_created_at: Dict[str, float] = {}
+
+
+def http2_available() -> bool:
+    """Return True if the optional ``h2`` package needed for HTTP/2 is installed."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def provider_config(provider: str) -> Dict[str, Any]:
+    """Return the configuration dict for ``provider`` from settings.
+
+    Raises:
+        KeyError: If the provider is not listed in ``UPSTREAM_PROVIDERS``.
+    """
+    return settings.UPSTREAM_PROVIDERS[provider]
+
+
+def _build_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        read=settings.UPSTREAM_READ_TIMEOUT,
+        write=settings.UPSTREAM_WRITE_TIMEOUT,
+        pool=settings.UPSTREAM_POOL_TIMEOUT,
+    )
+
+
+def _build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _count_request(provider: str):
+    def hook(request: httpx.Request) -> None:
+        _request_counts[provider] = _request_counts.get(provider, 0) + 1
+
+    return hook
+
+
+def _create_client(provider: str) -> httpx.Client:
+    config = provider_config(provider)
+    return httpx.Client(
+        base_url=config["base_url"],
+        http2=bool(config.get("http2")) and http2_available(),
+        timeout=_build_timeout(),
+        limits=_build_limits(),
+        event_hooks={"request": [_count_request(provider)]},
+    )
+
+
+class _GatedAsyncClient(httpx.AsyncClient):
+    """An ``AsyncClient`` that caps the number of requests handed to its pool.
+
+    httpcore rescans its whole wait queue against every pooled connection
+    whenever a connection is released, so letting thousands of coroutines
+    queue inside the pool makes each request cost grow with the backlog.
+    Waiting on a semaphore first keeps that queue no longer than the pool.
+    """
+
+    def __init__(self, *args: Any, max_in_flight: int, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._gate = asyncio.Semaphore(max_in_flight)
+
+    async def send(self, request: httpx.Request, **kwargs: Any) -> httpx.Response:
+        async with self._gate:
+            return await super().send(request, **kwargs)
+
+
+def _create_async_client(provider: str) -> httpx.AsyncClient:
+    config = provider_config(provider)
+
+    async def hook(request: httpx.Request) -> None:
+        _request_counts[provider] = _request_counts.get(provider, 0) + 1
+
+    return _GatedAsyncClient(
+        max_in_flight=settings.UPSTREAM_MAX_CONNECTIONS,
+        base_url=config["base_url"],
+        http2=bool(config.get("http2")) and http2_available(),
+        timeout=_build_timeout(),
+        limits=_build_limits(),
+        event_hooks={"request": [hook]},
+    )
+
+
+def get_client(provider: str) -> httpx.Client:
+    """Return the shared client for ``provider``, creating it if necessary.
+
+    The returned client is thread-safe and must not be closed by callers.
+
+    Args:
+        provider: A key of ``settings.UPSTREAM_PROVIDERS`` such as
+            ``"openai"`` or ``"elevenlabs"``.
+
+    Returns:
+        A pooled ``httpx.Client`` whose ``base_url`` points at the provider.
+    """
+    global _client_pid
+    pid = os.getpid()
+    client = _clients.get(provider)
+    if client is not None and _client_pid == pid:
+        return client
+    with _lock:
+        if _client_pid != pid:
+            # Connections inherited across a fork must not be shared with
+            # the parent process; drop them without closing the sockets.
+            _clients.clear()
+            _created_at.clear()
+            _client_pid = pid
+        client = _clients.get(provider)
+        if client is None:
+            client = _create_client(provider)
+            _clients[provider] = client
+            _created_at[provider] = time.time()
+        return client
+
+
+def close_clients() -> None:
+    """Close every pooled client and release its connections."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _created_at.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_clients)
+
+
+def get_async_client(provider: str) -> httpx.AsyncClient:
+    """Return the shared async client for ``provider`` on the running loop.
+
+    Must be called from a coroutine. Like :func:`get_client`, the returned
+    client is shared and must not be closed by callers.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = {}
+        _async_clients[loop] = clients
+    client = clients.get(provider)
+    if client is None:
+        client = _create_async_client(provider)
+        clients[provider] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    """Close the async clients that belong to the running event loop."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+def open_connections(provider: str, count: int = 1) -> int:
+    """Open up to ``count`` keep-alive connections to ``provider`` ahead of use.
+
+    Each connection is opened by a ``HEAD`` of the base URL; the answer does
+    not matter, only the TCP and TLS handshakes it pays for. The requests
+    run at once, so the pool keeps ``count`` connections (one for HTTP/2,
+    which multiplexes). Failures are not raised: an unreachable provider
+    must not stop a worker from starting.
+
+    Returns:
+        How many of the requests got an answer.
+    """
+    client = get_client(provider)
+
+    def head(_: int) -> bool:
+        try:
+            client.head("")
+        except httpx.HTTPError:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, count), thread_name_prefix="upstream-warm") as pool:
+        return sum(pool.map(head, range(max(1, count))))
+
+
+async def aopen_connections(provider: str, count: int = 1) -> int:
+    """Async counterpart of :func:`open_connections` for the running loop's client."""
+    client = get_async_client(provider)
+
+    async def head() -> bool:
+        try:
+            await client.head("")
+        except httpx.HTTPError:
+            return False
+        return True
+
+    return sum(await asyncio.gather(*(head() for _ in range(max(1, count)))))
+
+
+def _connection_stats(client: httpx.Client) -> Dict[str, int]:
+    """Inspect the connection pool behind ``client``.
+
+    httpx does not expose pool statistics publicly, so this reads the
+    underlying httpcore pool defensively and returns zeros if its layout
+    changes.
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    stats = {"connections": len(connections), "idle": 0, "active": 0, "http2": 0}
+    for conn in connections:
+        try:
+            if conn.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["active"] += 1
+            info = conn.info()
+            if "HTTP/2" in info:
+                stats["http2"] += 1
+        except Exception:
+            continue
+    return stats
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Return a JSON-serialisable snapshot of every provider's client pool."""
+    limits = _build_limits()
+    providers: Dict[str, Any] = {}
+    for provider in settings.UPSTREAM_PROVIDERS:
+        client = _clients.get(provider)
+        entry: Dict[str, Any] = {
+            "open": client is not None,
+            "requests": _request_counts.get(provider, 0),
+        }
+        if client is not None:
+            entry.update(_connection_stats(client))
+            entry["age_seconds"] = round(time.time() - _created_at.get(provider, time.time()), 1)
+        async_clients = [c[provider] for c in list(_async_clients.values()) if provider in c]
+        if async_clients:
+            entry["async"] = [_connection_stats(c) for c in async_clients]
+        providers[provider] = entry
+    return {
+        "http2_available": http2_available(),
+        "limits": {
+            "max_connections": limits.max_connections,
+            "max_keepalive_connections": limits.max_keepalive_connections,
+            "keepalive_expiry": limits.keepalive_expiry,
+        },
+        "providers": providers,
+    }
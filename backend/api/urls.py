@@ -6,17 +6,37 @@ to‑text (STT) and memory reset. All endpoints are prefixed with ``/api/`` as
 defined in ``devdebate/urls.py``.
 
 Each view is defined in ``api.views``. If you add new functionality you
-should register the corresponding path here.
+should register the corresponding path here. When ``settings.ASYNC_VIEWS``
+is enabled (the default under ``devdebate.asgi``) the debate endpoints are
+served by the coroutine views in ``api.async_views`` instead.
 """
 
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+debate_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("rebuttal", views.rebuttal, name="rebuttal"),
-    path("tts", views.tts, name="tts"),
-    path("stt", views.stt, name="stt"),
-    path("reset", views.reset_memory, name="reset"),
-    path("download", views.download_transcript, name="download_transcript"),
+    path("rebuttal", debate_views.rebuttal, name="rebuttal"),
+    path("tts", debate_views.tts, name="tts"),
+    path("tts/formats", views.tts_formats, name="tts_formats"),
+    path("personas", views.personas, name="personas"),
+    path("stt", debate_views.stt, name="stt"),
+    # Recording uploaded in MediaRecorder chunks
+    path("stt/chunks", debate_views.stt_chunk, name="stt_chunk"),
+    path("reset", debate_views.reset_memory, name="reset"),
+    path("download", debate_views.download_transcript, name="download_transcript"),
+    # Combined rebuttal + TTS turn used by the React front-end
+    path("v1/debate/respond", debate_views.respond, name="respond"),
+    # Several personas (or stances) answered concurrently
+    path("panel", debate_views.panel, name="panel"),
+    # Background TTS/STT jobs (see api/jobs.py)
+    path("jobs", views.job_stats, name="job_stats"),
+    path("jobs/tts", debate_views.tts_job, name="tts_job"),
+    path("jobs/stt", debate_views.stt_job, name="stt_job"),
+    path("jobs/<str:job_id>", debate_views.job_status, name="job_status"),
+    path("stats", views.stats, name="stats"),
+    path("upstream/stats", views.upstream_stats, name="upstream_stats"),
 ]
\ No newline at end of file
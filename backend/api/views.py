@@ -11,50 +11,125 @@ Features:
       a selected persona.
     * Convert generated text to speech via the ElevenLabs API.
     * Transcribe uploaded audio to text via OpenAI's Whisper API.
-    * Maintain simple in‑memory session transcripts for a single running
-      server process.
+    * Maintain session transcripts in a pluggable store (``api.session_store``)
+      that can persist them and share them between worker processes.
     * Provide a way to reset session memory and download the transcript.
+    * Answer a full voice turn (rebuttal plus audio) in a single request via
+      the ``respond`` endpoint used by the React front-end.
+    * Stream rebuttal text to the client as Server-Sent Events while the
+      model is still generating it.
+    * Stream synthesised speech sentence by sentence so playback can start
+      before the whole rebuttal has been voiced.
+    * Keep prompts within a token budget on long debates by summarising
+      older turns in the background (``api.context``).
+    * Optionally serve first-turn rebuttals for repeated stances from a
+      response cache (``api.response_cache``).
+    * Share one upstream call between identical concurrent requests
+      (``api.singleflight``).
+    * Recover rebuttals from malformed or cut-off model output, finishing a
+      truncated rebuttal with a short continuation request
+      (``api.structured``).
+    * Ask several personas (or one persona about several stances) at once
+      in ``panel`` mode, running the completions concurrently
+      (``api.fanout``).
+    * Time each phase of a turn (``api.instrument``) and expose every metric
+      in the Prometheus format at ``/metrics``.
+    * Serve the generated audio under ``MEDIA_URL`` with byte ranges,
+      ETags and immutable caching, or through the front proxy
+      (``api.media``).
+    * Queue speech synthesis and transcription as background jobs with
+      status polling and completion callbacks (``api.jobs``).
+    * Run one turn per session at a time, superseding stale queued turns,
+      and stop upstream work for clients that went away (``api.turns``).
+    * Negotiate compact speech formats (low-bitrate MP3, Opus, PCM) with
+      the client, from the provider or transcoded (``api.audio_formats``).
+    * Trim silence from recordings and downsample them before
+      transcription (``api.audio_prep``).
 
-Note: This implementation includes calls to external APIs but does not
-perform any local audio processing. To run it successfully you must
-configure ``OPENAI_API_KEY`` and ``ELEVENLABS_API_KEY`` environment variables
-and ensure network connectivity. For hackathon purposes the code serves as
-an instructive template and may require adaptation in your environment.
+Note: Besides calling external APIs, the backend processes audio locally:
+
+    * recordings are decoded to 16 kHz mono, trimmed of silence and
+      re-encoded before transcription (``api.audio_prep``), which needs
+      ``numpy``, and ``ffmpeg`` for anything but WAV;
+    * speech is transcoded into formats the TTS backend does not produce
+      (``api.audio_formats``) with ``ffmpeg``.
+
+Each step is skipped, or its formats not offered, when its dependency is
+missing; the in-process Piper voice (``api.backends``) also needs
+``ffmpeg`` to encode MP3. With the default backends you must configure
+``OPENAI_API_KEY`` and ``ELEVENLABS_API_KEY`` environment variables and
+ensure network connectivity. For hackathon purposes the code serves as an
+instructive template and may require adaptation in your environment.
 """
 from __future__ import annotations
 
+import base64
+import contextlib
+import hashlib
 import io
 import json
 import os
 import re
+import shutil
+import time
 import uuid
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import IO, Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-import httpx
 from django.conf import settings
-from django.http import FileResponse, HttpRequest, JsonResponse
+from django.http import FileResponse, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header, parse_etags
 from django.views.decorators.csrf import csrf_exempt
-from dotenv import load_dotenv
 
-from . import BANNED_TOPICS, Persona
+from . import (
+    PERSONA_ALIASES,
+    Persona,
+    audio_formats,
+    audio_prep,
+    instrument,
+    jobs,
+    media,
+    metrics,
+    resilience,
+    transcript_export,
+    turns,
+)
+from .audio_formats import AudioFormat
+from .backends import get_backend
+from .context import TOKEN_BUCKETS, ContextWindow, count_message_tokens, get_context_window
+from .fanout import iter_completed
+from .guardrails import get_guardrail
+from .persona_assets import get_bundle as get_persona_bundle
+from .response_cache import first_turn_scope, get_response_cache
+from .session_store import Turn, get_session_store
+from .singleflight import SingleFlight, payload_key
+from .stt_upload import AudioRejected, ChunkedUpload, declared_duration, file_digest, receive_audio
+from .structured import JsonFieldStream, ParsedObject, parse_json_object, validate_rebuttal
+from .tts_cache import cache_key
+from .tts_cache import get_cache as get_tts_cache
+from .tts_stream import iter_synthesized, split_sentences
+from .upstream import pool_stats
 
-# Load env variables if not already loaded (important in case runserver loads settings before views)
-load_dotenv()
+RESPONSE_WORD_LIMIT = 130
 
-# In‑memory session storage
-# Maps session identifiers (strings) to a list of tuples (role, text)
-sessions: Dict[str, List[Tuple[str, str]]] = {}
+# Identical concurrent upstream calls share one request (see api.singleflight).
+# TTS is coalesced by the audio cache.
+chat_flight = SingleFlight("openai_chat")
+whisper_flight = SingleFlight("openai_whisper")
 
-RESPONSE_WORD_LIMIT = 130
+# Longest client-supplied session identifier accepted by ``adopt_session``
+MAX_SESSION_ID_LENGTH = 128
+
+BLOCKED_REASON = "The provided stance contains disallowed content."
 
 
 def ensure_session(session_id: Optional[str]) -> str:
     """Ensure there is a session ID and associated transcript list.
 
     If the provided ``session_id`` is None or not present in the session
-    dictionary then a new unique ID is generated. The sessions dict is
-    updated accordingly.
+    store then a new session with a unique ID is created.
 
     Args:
         session_id: Optional externally supplied session identifier.
@@ -62,24 +137,36 @@ def ensure_session(session_id: Optional[str]) -> str:
     Returns:
         A valid session identifier.
     """
-    if session_id and session_id in sessions:
+    store = get_session_store()
+    if session_id and isinstance(session_id, str) and store.exists(session_id):
         return session_id
-    new_id = str(uuid.uuid4())
-    sessions[new_id] = []
-    return new_id
+    return store.create()
+
 
+def adopt_session(session_id: Optional[str]) -> str:
+    """Use a client-generated session ID, creating its transcript if needed.
 
+    The React front-end generates its own session ID and keeps it in local
+    storage, so unlike :func:`ensure_session` an unknown ID is registered
+    rather than replaced. Missing or oversized IDs get a fresh one.
+    """
+    if not session_id or not isinstance(session_id, str) or len(session_id) > MAX_SESSION_ID_LENGTH:
+        return ensure_session(None)
+    return get_session_store().create(session_id)
+
+
+@instrument.timed("guardrail")
 def is_banned(content: str) -> bool:
     """Check if the given content contains banned topics.
 
-    This uses a case‑insensitive substring match on the list of banned
-    keywords defined in ``api.__init__.BANNED_TOPICS``.
+    Matches the keywords in ``api.__init__.BANNED_TOPICS`` (plus the
+    optional ``BANNED_TOPICS_FILE``) as whole words after Unicode and
+    leetspeak normalisation; see ``api.guardrails``.
     """
-    lowered = content.lower()
-    return any(keyword.lower() in lowered for keyword in BANNED_TOPICS)
+    return get_guardrail().match(content) is not None
 
 
-def build_persona_prompt(persona: Persona) -> str:
+def build_persona_prompt(persona: Persona, challenge: bool = False) -> str:
     """Compose the system prompt for the selected persona.
 
     The system prompt instructs the language model on how to behave. It
@@ -88,62 +175,236 @@ def build_persona_prompt(persona: Persona) -> str:
 
     Args:
         persona: One of the defined personas from ``api.Persona``.
+        challenge: Whether the user asked to be challenged harder ("Challenge
+            Me" in the front-end).
 
     Returns:
         A complete system prompt for the language model.
     """
-    return (
+    prompt = (
         f"You are {persona.name.replace('_', ' ').title()}. "
         f"{persona.system_description} "
         "Your job is to play devil's advocate: always argue the opposite of the user's stance. "
         "Be concise (under 130 words) and return JSON with keys 'rebuttal_text' and 'bullets'."
     )
+    if challenge:
+        prompt += (
+            " The user has asked to be challenged: attack the weakest premise of their "
+            "argument directly and finish with one pointed question they must answer."
+        )
+    return prompt
+
+
+def chat_request_body(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the chat completions body for a rebuttal.
+
+    Shared by the synchronous and asynchronous paths so both send exactly
+    the same request to the chat backend (see ``api.backends``).
+    """
+    return {
+        "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
+        "messages": messages,
+        "temperature": 0.6,
+        "response_format": {"type": "json_object"},
+        "max_tokens": 300,
+    }
+
+
+def backend_span(kind: str, backend: Any, model: str = "") -> Any:
+    """Time one call to an inference backend as phase ``kind`` of the request.
+
+    The duration is also recorded in ``upstream_request_seconds`` by
+    provider and model. ``model`` is the model named in the request, used
+    when the backend does not pin its own.
+    """
+    model_id = backend.model_id
+    if model and ":" not in model_id:
+        model_id = f"{model_id}:{model}"
+    provider, _, model_name = model_id.partition(":")
+    return instrument.span(
+        kind, desc=model_id, metric="upstream_request_seconds", kind=kind, provider=provider, model=model_name
+    )
+
+
+def read_model_output(content: str) -> Optional[ParsedObject]:
+    """Parse a rebuttal completion, repairing it if needed (see ``api.structured``).
+
+    Returns:
+        The recovered object, or None if ``content`` has no usable JSON.
+    """
+    try:
+        return parse_json_object(content)
+    except ValueError:
+        return None
+
+
+def needs_continuation(parsed: Optional[ParsedObject]) -> bool:
+    """Whether a completion was cut off before its rebuttal text was finished.
+
+    A reply cut off in the bullets is used as it is (minus the unfinished
+    bullet) rather than paying for another request.
+    """
+    if not settings.CHAT_CONTINUATION or parsed is None or not parsed.truncated:
+        return False
+    return parsed.open_field == "rebuttal_text" or not parsed.data.get("rebuttal_text")
+
+
+def continuation_request_body(body: Dict[str, Any], partial: str) -> Dict[str, Any]:
+    """Build a request asking the model to finish the cut-off reply ``partial``.
+
+    Only the missing tail is generated, which costs far fewer tokens than
+    regenerating the whole rebuttal. ``body`` is the original request.
+    """
+    messages = body["messages"] + [
+        {"role": "assistant", "content": partial},
+        {
+            "role": "user",
+            "content": (
+                "Your reply was cut off. Continue it from the exact character where it "
+                "stopped, without repeating anything or adding code fences, so that "
+                "appending your text completes the JSON object."
+            ),
+        },
+    ]
+    return {
+        "model": body["model"],
+        "messages": messages,
+        "temperature": body["temperature"],
+        "max_tokens": settings.CHAT_CONTINUATION_MAX_TOKENS,
+    }
+
+
+def accept_model_output(parsed: Optional[ParsedObject], continued: bool = False) -> Dict[str, Any]:
+    """Validate a parsed completion against the rebuttal schema.
+
+    Counts the outcome in ``model_json_parse_total``: ``ok`` (valid as
+    returned), ``repaired``, ``continued`` (finished by a continuation
+    request) or ``failed``.
+
+    Raises:
+        ValueError: If no valid rebuttal could be recovered.
+    """
+    try:
+        if parsed is None:
+            raise ValueError("Model did not return JSON")
+        model_response = validate_rebuttal(parsed.data)
+    except ValueError:
+        metrics.inc("model_json_parse_total", outcome="failed")
+        raise
+    outcome = "continued" if continued else "repaired" if parsed.repaired else "ok"
+    metrics.inc("model_json_parse_total", outcome=outcome)
+    return model_response
+
+
+def complete_rebuttal(backend: Any, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Run ``body`` on the chat ``backend`` and parse the rebuttal.
+
+    If the completion was cut off inside the rebuttal text (``max_tokens``
+    ran out), one continuation request finishes it. Should that fail, the
+    repaired partial rebuttal is used.
+    """
+    with backend_span("chat", backend, body["model"]):
+        content = backend.complete(body)
+    parsed = read_model_output(content)
+    if not needs_continuation(parsed):
+        return accept_model_output(parsed)
+    try:
+        with backend_span("chat", backend, body["model"]):
+            content += backend.complete(continuation_request_body(body, content))
+    except Exception:
+        metrics.inc("chat_continuation_errors_total")
+        return accept_model_output(parsed)
+    return accept_model_output(read_model_output(content) or parsed, continued=True)
 
 
 def call_openai_chat(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Call the OpenAI chat completions API to generate a rebuttal.
+    """Generate a rebuttal with the configured chat backend.
 
-    You must set the ``OPENAI_API_KEY`` environment variable. If the key is
-    not set or the request fails, this function raises an exception.
+    With the default backend this calls the OpenAI chat completions API and
+    needs the ``OPENAI_API_KEY`` environment variable. If the key is not set
+    or the request fails, this function raises an exception.
 
     Args:
         messages: A list of message dicts following the format required by
             OpenAI's chat completions API.
 
     Returns:
-        The parsed JSON response from the model. Assumes the model responds
-        with a JSON object containing 'rebuttal_text' and 'bullets'.
-    """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not configured")
-    model = os.getenv("OPENAI_MODEL", "gpt-4o")
-    with httpx.Client(timeout=60) as client:
-        resp = client.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}"},
-            json={
-                "model": model,
-                "messages": messages,
-                "temperature": 0.6,
-                "response_format": {"type": "json_object"},
-                "max_tokens": 300,
-            },
-        )
-        resp.raise_for_status()
-        content = resp.json()["choices"][0]["message"]["content"]
-        # remove possible code fences or formatting
-        cleaned = content.strip().strip("`")
-        # find JSON inside string
-        start = cleaned.find("{")
-        end = cleaned.rfind("}")
-        if start == -1 or end == -1:
-            raise ValueError("Model did not return JSON")
-        data = json.loads(cleaned[start : end + 1])
-        return data
+        The model's JSON object, validated to contain 'rebuttal_text' and
+        'bullets' (see :func:`complete_rebuttal`).
+    """
+    backend = get_backend("chat")
+    body = chat_request_body(messages)
+
+    def call() -> Dict[str, Any]:
+        return complete_rebuttal(backend, body)
+
+    # Waiters share the parsed dict; copy it so callers can't affect each other
+    return dict(chat_flight.do(payload_key(backend.model_id, body), call))
+
+
+def stream_chat(body: Dict[str, Any]) -> Iterator[str]:
+    """Stream the chat completion for ``body``, yielding content deltas as they arrive.
+
+    Backends that cannot stream yield the whole completion at once.
+    """
+    backend = get_backend("chat")
+    with backend_span("chat", backend, body["model"]):
+        yield from backend.stream(body)
 
 
-def call_elevenlabs_tts(text: str, voice_id: str = "Rachel") -> str:
+def stream_openai_chat(messages: List[Dict[str, Any]]) -> Iterator[str]:
+    """Stream a rebuttal, using the same request as :func:`call_openai_chat`."""
+    yield from stream_chat(chat_request_body(messages))
+
+
+def summarize_turns(previous: str, turns: List[Turn]) -> str:
+    """Fold ``turns`` into the running debate summary ``previous``.
+
+    Called by the context window on its background thread, never while a
+    client is waiting.
+
+    Returns:
+        The updated summary as plain text.
+    """
+    transcript = "\n".join(f"{'User' if role == 'user' else 'Opponent'}: {text}" for role, text in turns)
+    limit = settings.CONTEXT_SUMMARY_MAX_TOKENS
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You maintain a running summary of a debate between a user and a devil's advocate. "
+                "Merge the new exchanges into the existing summary. Keep each side's main claims, "
+                "concessions and unanswered questions; drop pleasantries and repetition. "
+                f"Reply with the updated summary only, in under {limit * 3 // 4} words."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Existing summary:\n{previous or '(none)'}\n\nNew exchanges:\n{transcript}",
+        },
+    ]
+    body = {
+        "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
+        "messages": messages,
+        "temperature": 0.2,
+        "max_tokens": limit,
+    }
+    backend = get_backend("chat")
+    with backend_span("summary", backend, body["model"]):
+        return backend.complete(body).strip()
+
+
+def context_window() -> ContextWindow:
+    """Return the context window used to build rebuttal prompts."""
+    return get_context_window(get_session_store(), summarize_turns)
+
+
+def tts_cache_key(text: str, voice_id: str, audio_format: str = "mp3") -> str:
+    """Return the TTS cache key for ``text`` spoken by ``voice_id`` in ``audio_format``."""
+    return cache_key(voice_id, get_backend("tts").cache_payload(text), audio_format)
+
+
+def call_elevenlabs_tts(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> str:
     """Call the ElevenLabs API to convert text to speech.
 
     Returns the URL to the saved audio file relative to MEDIA_URL. The
@@ -151,111 +412,180 @@ def call_elevenlabs_tts(text: str, voice_id: str = "Rachel") -> str:
     the front‑end, prefix the returned path with the origin of your Django
     server.
 
+    Audio is cached by content (see ``api.tts_cache``), so repeating the
+    same text with the same voice and settings returns the existing file
+    without calling the provider.
+
     Args:
         text: The text to convert to speech.
         voice_id: The ID of the ElevenLabs voice to use. See the ElevenLabs
             documentation for available voices. Defaults to ``Rachel``.
+        audio_format: Name of the output format (see ``api.audio_formats``).
 
     Returns:
         The relative URL of the generated audio file.
     """
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-    if not api_key:
-        raise RuntimeError("ELEVENLABS_API_KEY not configured")
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    payload = {
-        "text": text,
-        "model_id": os.getenv("ELEVENLABS_MODEL", "eleven_monolingual_v1"),
-        "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
-    }
-    headers = {
-        "xi-api-key": api_key,
-        "accept": "audio/mpeg",
-        "content-type": "application/json",
-    }
-    with httpx.Client(timeout=60) as client:
-        r = client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        # Save mp3
-        tts_dir = Path(settings.MEDIA_ROOT) / "tts"
-        tts_dir.mkdir(parents=True, exist_ok=True)
-        filename = f"{uuid.uuid4().hex}.mp3"
-        file_path = tts_dir / filename
-        file_path.write_bytes(r.content)
-        # Return relative URL (MEDIA_URL ensures correct prefix)
-        return f"{settings.MEDIA_URL}tts/{filename}"
-
-
-def call_openai_whisper(audio_bytes: bytes, mime_type: str) -> str:
-    """Call the OpenAI Whisper API to transcribe audio.
+    cache = get_tts_cache()
+    key = tts_cache_key(text, voice_id, audio_format)
+    extension = audio_formats.get_format(audio_format).extension
+    bundled = get_persona_bundle().lookup(key, extension)
+    if bundled is not None:
+        return get_persona_bundle().url_for(bundled)
+    cache.fetch(key, lambda: synthesize_speech(text, voice_id, audio_format), extension)
+    # Return relative URL (MEDIA_URL ensures correct prefix)
+    return cache.url_for(key, extension)
+
+
+def cached_speech(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> bytes:
+    """Return the audio for ``text`` in ``audio_format`` through the TTS cache.
+
+    Persona stock lines come from the prebuilt bundle (``api.persona_assets``).
+    """
+    key = tts_cache_key(text, voice_id, audio_format)
+    extension = audio_formats.get_format(audio_format).extension
+    path = get_persona_bundle().lookup(key, extension)
+    if path is None:
+        path, _ = get_tts_cache().fetch(key, lambda: synthesize_speech(text, voice_id, audio_format), extension)
+    return path.read_bytes()
+
+
+def synthesize_speech(text: str, voice_id: str = "Rachel", audio_format: str = "mp3") -> bytes:
+    """Synthesise ``text`` with the TTS backend and return it in ``audio_format``.
+
+    Formats the backend does not encode itself, or refuses, are transcoded
+    from the MP3 of the same text, taken from the TTS cache when present.
+    """
+    backend = get_backend("tts")
+    fmt = audio_formats.get_format(audio_format)
+    if fmt is audio_formats.MP3:
+        with backend_span("tts", backend):
+            return audio_formats.produced(fmt, backend.synthesize(text, voice_id), "native")
+    output_format = audio_formats.native_format(backend, fmt)
+    if output_format:
+        try:
+            with backend_span("tts", backend):
+                audio = backend.synthesize(text, voice_id, output_format)
+            return audio_formats.produced(fmt, audio, "native")
+        except Exception as e:
+            if not audio_formats.refuse_native(backend, fmt, e):
+                raise
+    mp3 = cached_speech(text, voice_id)
+    return audio_formats.produced(fmt, audio_formats.transcode(mp3, fmt), "transcoded", mp3)
+
+
+def whisper_key(audio: Union[bytes, IO[bytes]], mime_type: str, digest: Optional[str] = None) -> str:
+    """Coalescing key for a transcription; hashes ``audio`` unless ``digest`` is given."""
+    if digest is None:
+        digest = hashlib.sha256(audio).hexdigest() if isinstance(audio, bytes) else file_digest(audio)
+    return payload_key(get_backend("stt").model_id, digest, mime_type)
+
+
+def call_openai_whisper(audio: Union[bytes, IO[bytes]], mime_type: str, digest: Optional[str] = None) -> str:
+    """Transcribe audio with the configured STT backend (OpenAI Whisper by default).
 
     Args:
-        audio_bytes: Binary audio data.
+        audio: Binary audio data, or a seekable file holding it.
         mime_type: The MIME type of the audio (e.g. 'audio/webm').
+        digest: SHA-256 of the audio if already known, to avoid re-reading
+            it for request coalescing.
 
     Returns:
         The transcript as a string.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not configured for STT")
-    with httpx.Client(timeout=60) as client:
-        files = {
-            "file": ("audio", audio_bytes, mime_type),
-            "model": (None, "whisper-1"),
-        }
-        resp = client.post(
-            "https://api.openai.com/v1/audio/transcriptions",
-            headers={"Authorization": f"Bearer {api_key}"},
-            files=files,
-        )
-        resp.raise_for_status()
-        return resp.json().get("text", "")
+    backend = get_backend("stt")
 
+    def call() -> str:
+        with backend_span("stt", backend):
+            return backend.transcribe(audio, mime_type)
 
-@csrf_exempt
-def rebuttal(request: HttpRequest) -> JsonResponse:
-    """Generate a rebuttal for the provided stance and persona.
+    return whisper_flight.do(whisper_key(audio, mime_type, digest), call)
 
-    Expects a JSON payload with keys ``stance``, ``persona`` and
-    optional ``sessionId``. If no session ID is provided, a new one is
-    created automatically. The view checks for banned topics in the user
-    stance and returns an error if found. Otherwise it calls the language
-    model to obtain a rebuttal and stores both the user's stance and the
-    rebuttal in the session transcript.
+
+def transcribe(audio: IO[bytes], mime_type: str, digest: Optional[str] = None) -> str:
+    """Transcribe a recording, cleaned up first by :mod:`api.audio_prep` when possible."""
+    with instrument.span("stt_prep"):
+        prepared = audio_prep.prepare(audio, mime_type)
+    if prepared is not None:
+        return call_openai_whisper(prepared.audio, prepared.mime_type)
+    return call_openai_whisper(audio, mime_type, digest)
+
+
+def upstream_error_response(error: Exception) -> JsonResponse:
+    """Map a failed upstream call to an error response.
+
+    Calls refused by the resilience layer become ``503`` with a
+    ``Retry-After`` header (or ``504`` when the request's deadline ran out),
+    so clients can back off; anything else stays a ``500``.
     """
-    if request.method != "POST":
-        return JsonResponse({"error": "POST required"}, status=405)
+    if isinstance(error, resilience.DeadlineExceeded):
+        return JsonResponse({"error": str(error)}, status=504)
+    if isinstance(error, resilience.UpstreamUnavailable):
+        resp = JsonResponse({"error": str(error)}, status=503)
+        if error.retry_after is not None:
+            resp["Retry-After"] = str(max(1, round(error.retry_after)))
+        return resp
+    return JsonResponse({"error": str(error)}, status=500)
+
+
+def turn_rejected_response(error: turns.TurnRejected, sid: str) -> JsonResponse:
+    """Answer a turn that will not run (superseded, queue full or timed out)."""
+    response = JsonResponse(turns.describe(error, sid), status=error.status)
+    if error.status != 409:
+        response["Retry-After"] = "1"
+    return response
+
+
+@instrument.timed("parse")
+def parse_json_body(request: HttpRequest) -> Optional[Dict[str, Any]]:
+    """Decode the request body as a JSON object, or return None if invalid."""
     try:
         body = json.loads(request.body.decode("utf-8"))
     except Exception:
-        return JsonResponse({"error": "Invalid JSON"}, status=400)
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def parse_rebuttal_body(
+    body: Dict[str, Any],
+) -> Tuple[Optional[JsonResponse], str, Persona, Optional[str]]:
+    """Validate a rebuttal payload.
+
+    Returns:
+        A tuple ``(error, stance, persona, session_id)``. ``error`` is a
+        ready-made error response when the payload is rejected, otherwise
+        None.
+    """
     stance = (body.get("stance") or "").strip()
-    persona_str = (body.get("persona") or "socrates").lower()
     session_id = body.get("sessionId")
     if not stance:
-        return JsonResponse({"error": "Stance is required"}, status=400)
+        return JsonResponse({"error": "Stance is required"}, status=400), stance, Persona.SOCRATES, session_id
     # Check for banned topics
     if is_banned(stance):
-        return JsonResponse({"error": "The provided stance contains disallowed content."}, status=400)
+        return JsonResponse({"error": BLOCKED_REASON}, status=400), stance, Persona.SOCRATES, session_id
     # Validate persona
-    try:
-        persona = Persona(persona_str)
-    except ValueError:
-        persona = Persona.SOCRATES
-    # Ensure session exists
-    sid = ensure_session(session_id)
-    # Append user's message to transcript
-    sessions[sid].append(("user", stance))
+    persona = Persona.parse(body.get("persona"))
+    return None, stance, persona, session_id
+
+
+@instrument.timed("prompt")
+def build_rebuttal_messages(
+    sid: str, persona: Persona, challenge: bool = False, turn: Optional[turns.Turn] = None
+) -> List[Dict[str, Any]]:
+    """Build the chat messages for the next turn of session ``sid``.
+
+    The session transcript must already contain the user's latest stance.
+    History is limited to the context window's token budget; older turns
+    are represented by the session summary. The prompt size is recorded on
+    ``turn`` for the cancellation metrics.
+    """
     # Build prompt for OpenAI
-    system_prompt = build_persona_prompt(persona)
+    system_prompt = build_persona_prompt(persona, challenge)
     # Construct conversation messages: include previous messages for continuity
     messages: List[Dict[str, Any]] = [
         {"role": "system", "content": system_prompt},
     ]
-    # Append the transcript as alternating user/assistant messages
-    for role, text in sessions[sid]:
-        messages.append({"role": role, "content": text})
+    # Append the summary and recent transcript as alternating user/assistant messages
+    messages.extend(context_window().history(sid))
     # Append a new assistant instruction to ensure correct format
     messages.append(
         {
@@ -266,46 +596,463 @@ def rebuttal(request: HttpRequest) -> JsonResponse:
             ),
         }
     )
-    # Call language model
-    try:
+    prompt_tokens = count_message_tokens(messages, settings.CONTEXT_TOKENIZER_MODEL)
+    metrics.observe("rebuttal_prompt_tokens", prompt_tokens, buckets=TOKEN_BUCKETS)
+    if turn is not None:
+        turns.get_turn_queue().set_prompt(turn, prompt_tokens)
+    return messages
+
+
+def rebuttal_cache_scope(messages: List[Dict[str, Any]], persona: Optional[Persona]) -> Optional[str]:
+    """Return the response cache scope for ``messages``, or None if not cacheable.
+
+    Only first turns are cached, and only when ``RESPONSE_CACHE_ENABLED``
+    is set.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED or persona is None:
+        return None
+    model = f'{get_backend("chat").model_id}:{os.getenv("OPENAI_MODEL", "gpt-4o")}'
+    return first_turn_scope(messages, persona.value, model)
+
+
+def generate_rebuttal(messages: List[Dict[str, Any]], persona: Persona) -> Dict[str, Any]:
+    """Return the model response for ``messages``, from the response cache if possible."""
+    scope = rebuttal_cache_scope(messages, persona)
+    if scope is None:
+        return call_openai_chat(messages)
+    cache = get_response_cache()
+    stance = messages[1]["content"]
+    model_response = cache.get(scope, stance)
+    if model_response is None:
         model_response = call_openai_chat(messages)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
+        cache.put(scope, stance, model_response)
+    return model_response
+
+
+@instrument.timed("record")
+def open_turn(
+    sid: str, text: str, persona: Persona, challenge: bool = False, turn: Optional[turns.Turn] = None
+) -> List[Dict[str, Any]]:
+    """Append the user's ``text`` to session ``sid`` and build the turn's prompt."""
+    get_session_store().append(sid, "user", text)
+    return build_rebuttal_messages(sid, persona, challenge, turn)
+
+
+def record_rebuttal(sid: str, model_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Store the model's rebuttal in the transcript and build the response body."""
     rebuttal_text = model_response.get("rebuttal_text", "")
     bullets = model_response.get("bullets", [])
     # Append assistant's reply to transcript
-    sessions[sid].append(("assistant", rebuttal_text))
-    return JsonResponse({
+    get_session_store().append(sid, "assistant", rebuttal_text)
+    context_window().maybe_schedule(sid)
+    return {
         "rebuttal_text": rebuttal_text,
         "bullets": bullets,
         "sessionId": sid,
-    })
+    }
+
+
+def wants_event_stream(request: HttpRequest, body: Dict[str, Any]) -> bool:
+    """Whether the client asked for a Server-Sent Events response."""
+    return bool(body.get("stream")) or "text/event-stream" in request.headers.get("Accept", "")
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event with a JSON ``data`` field."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream_response(events: Any) -> StreamingHttpResponse:
+    """Wrap an (async) iterator of SSE strings in a streaming response."""
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class RebuttalStream:
+    """Turn streamed completion chunks for one turn into SSE events.
+
+    ``delta`` events carry new ``rebuttal_text`` characters as soon as the
+    incremental parser can decode them. When the upstream stream ends,
+    :meth:`finish` parses the whole object, appends the rebuttal to the
+    transcript and returns a ``done`` event with the same body as the
+    non-streaming endpoint plus ``ttft_ms``, the time from the start of the
+    request to the first streamed character. TTFT is also recorded in the
+    ``rebuttal_ttft_seconds`` histogram.
+
+    With a response cache scope (see :func:`rebuttal_cache_scope`) a cached
+    response is replayed by :meth:`cached_events`, and a fresh one is stored
+    by :meth:`finish`. If the stream was cut off mid-rebuttal,
+    :meth:`continuation` gives the request that finishes it; its chunks are
+    fed to :meth:`on_chunk` like the rest.
+
+    Events are built by ``make_event(name, data)``, :func:`sse_event` by
+    default; the WebSocket voice channel (``api.voice_ws``) passes its own.
+    Chunks are also passed to ``turn`` so a stream cut short can be
+    accounted for (see ``api.turns``).
+    """
+
+    def __init__(
+        self,
+        sid: str,
+        started: float,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        persona: Optional[Persona] = None,
+        make_event: Callable[[str, Dict[str, Any]], Any] = sse_event,
+        turn: Optional[turns.Turn] = None,
+    ) -> None:
+        self.sid = sid
+        self.turn = turn
+        self.make_event = make_event
+        self.started = started
+        self.messages = messages
+        self.continued = False
+        self.parser = JsonFieldStream("rebuttal_text")
+        self.ttft: Optional[float] = None
+        self.cache_scope = rebuttal_cache_scope(messages, persona) if messages else None
+        self.stance = messages[1]["content"] if self.cache_scope else ""
+
+    def cached_events(self) -> Optional[List[Any]]:
+        """Return the events replaying a cached response, or None on a miss."""
+        if self.cache_scope is None:
+            return None
+        model_response = get_response_cache().get(self.cache_scope, self.stance)
+        if model_response is None:
+            return None
+        self.cache_scope = None  # already cached
+        delta = self.on_chunk(json.dumps(model_response))
+        return ([delta] if delta else []) + [self.finish()]
+
+    def on_chunk(self, chunk: str) -> Any:
+        if self.turn is not None:
+            self.turn.on_text(chunk)
+        delta = self.parser.feed(chunk)
+        if not delta:
+            return None
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+            metrics.observe("rebuttal_ttft_seconds", self.ttft)
+        return self.make_event("delta", {"text": delta})
+
+    def continuation(self) -> Optional[Dict[str, Any]]:
+        """Return the continuation request body if the reply was cut off, else None."""
+        if not self.messages or not needs_continuation(read_model_output(self.parser.raw)):
+            return None
+        self.continued = True
+        return continuation_request_body(chat_request_body(self.messages), self.parser.raw)
+
+    def finish(self) -> Any:
+        try:
+            model_response = accept_model_output(read_model_output(self.parser.raw), self.continued)
+        except ValueError as e:
+            return self.fail(e)
+        if self.cache_scope is not None:
+            get_response_cache().put(self.cache_scope, self.stance, model_response)
+        payload = record_rebuttal(self.sid, model_response)
+        payload["ttft_ms"] = round(self.ttft * 1000, 1) if self.ttft is not None else None
+        metrics.observe("rebuttal_stream_seconds", time.perf_counter() - self.started)
+        return self.make_event("done", payload)
+
+    def fail(self, error: Exception) -> Any:
+        metrics.inc("rebuttal_stream_errors_total")
+        return self.make_event("error", {"error": str(error), "sessionId": self.sid})
+
+
+def stream_rebuttal_events(
+    sid: str,
+    messages: List[Dict[str, Any]],
+    started: float,
+    persona: Optional[Persona] = None,
+    make_event: Callable[[str, Dict[str, Any]], Any] = sse_event,
+    turn: Optional[turns.Turn] = None,
+) -> Iterator[Any]:
+    """Yield the SSE events (or ``make_event`` results) for a streamed rebuttal turn.
+
+    The upstream streams are closed as soon as this generator is, so a
+    client that goes away mid-rebuttal stops the completion.
+    """
+    state = RebuttalStream(sid, started, messages, persona, make_event, turn)
+    cached = state.cached_events()
+    if cached is not None:
+        yield from cached
+        return
+    try:
+        with contextlib.closing(stream_openai_chat(messages)) as chunks:
+            for chunk in chunks:
+                event = state.on_chunk(chunk)
+                if event:
+                    yield event
+    except Exception as e:
+        yield state.fail(e)
+        return
+    continuation = state.continuation()
+    if continuation is not None:
+        try:
+            with contextlib.closing(stream_chat(continuation)) as chunks:
+                for chunk in chunks:
+                    event = state.on_chunk(chunk)
+                    if event:
+                        yield event
+        except Exception:
+            metrics.inc("chat_continuation_errors_total")
+    yield state.finish()
 
 
 @csrf_exempt
-def tts(request: HttpRequest) -> JsonResponse:
+def rebuttal(request: HttpRequest) -> HttpResponse:
+    """Generate a rebuttal for the provided stance and persona.
+
+    Expects a JSON payload with keys ``stance``, ``persona`` and
+    optional ``sessionId``. If no session ID is provided, a new one is
+    created automatically. The view checks for banned topics in the user
+    stance and returns an error if found. Otherwise it calls the language
+    model to obtain a rebuttal and stores both the user's stance and the
+    rebuttal in the session transcript.
+
+    If the payload sets ``stream`` (or the client accepts
+    ``text/event-stream``) the rebuttal is streamed as Server-Sent Events:
+    ``delta`` events with partial ``rebuttal_text``, then a single ``done``
+    event with the full response, or ``error`` if generation fails.
+
+    Turns of one session run one at a time (see ``api.turns``). A new turn
+    supersedes those still waiting, which are answered ``409``. With
+    ``queue: true`` it waits in line instead.
+    """
+    started = time.perf_counter()
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    error, stance, persona, session_id = parse_rebuttal_body(body)
+    if error is not None:
+        return error
+    # Ensure session exists
+    sid = ensure_session(session_id)
+    queue = turns.get_turn_queue()
+    try:
+        turn = queue.begin(sid, bool(body.get("queue")))
+    except turns.TurnRejected as e:
+        return turn_rejected_response(e, sid)
+    with turns.holding(queue, turn):
+        # Append user's message to transcript
+        messages = open_turn(sid, stance, persona, turn=turn)
+        if wants_event_stream(request, body):
+            events = stream_rebuttal_events(sid, messages, started, persona, turn=turn)
+            return event_stream_response(turns.TurnStream(queue, turn, events))
+        # Call language model
+        try:
+            model_response = generate_rebuttal(messages, persona)
+        except Exception as e:
+            return upstream_error_response(e)
+        return JsonResponse(record_rebuttal(sid, model_response))
+
+
+class TtsStream:
+    """Shape in-order synthesised segments into a streaming TTS response.
+
+    In ``audio`` mode the segments are written back to back as one chunked
+    body, which only formats with a ``stream_mime`` allow: MP3 frames can
+    be concatenated, and PCM segments lose their WAV headers. In ``sse``
+    mode each segment becomes a ``segment`` event with its sequence number,
+    text and base64 audio file, followed by a ``done`` event. Time to first
+    audio is measured from the start of the request and recorded in the
+    ``tts_time_to_first_audio_seconds`` histogram.
+    """
+
+    def __init__(self, mode: str, started: float, audio_format: AudioFormat = audio_formats.MP3) -> None:
+        self.mode = mode
+        self.started = started
+        self.format = audio_format
+        self.ttfa: Optional[float] = None
+        self.segments = 0
+
+    def on_segment(self, index: int, text: str, audio: bytes) -> Any:
+        if self.ttfa is None:
+            self.ttfa = time.perf_counter() - self.started
+            metrics.observe("tts_time_to_first_audio_seconds", self.ttfa, mode=self.mode)
+        self.segments += 1
+        if self.mode == "audio":
+            return self.format.stream_chunk(audio)
+        return sse_event(
+            "segment",
+            {"seq": index, "text": text, "mime": self.format.mime, "audio": base64.b64encode(audio).decode("ascii")},
+        )
+
+    def finish(self) -> Optional[str]:
+        metrics.observe("tts_stream_seconds", time.perf_counter() - self.started, mode=self.mode)
+        if self.mode == "audio":
+            return None
+        ttfa_ms = round(self.ttfa * 1000, 1) if self.ttfa is not None else None
+        return sse_event("done", {"segments": self.segments, "ttfa_ms": ttfa_ms})
+
+    def fail(self, error: Exception) -> Optional[str]:
+        metrics.inc("tts_stream_errors_total", mode=self.mode)
+        if self.mode == "audio":
+            # Headers are already sent; ending the body early is all we can do
+            return None
+        return sse_event("error", {"error": str(error)})
+
+    def response(self, events: Any, segments: List[str]) -> StreamingHttpResponse:
+        if self.mode == "audio":
+            response = StreamingHttpResponse(events, content_type=self.format.stream_mime)
+            response["Cache-Control"] = "no-store"
+            response["X-Accel-Buffering"] = "no"
+        else:
+            response = event_stream_response(events)
+        response["X-TTS-Segments"] = str(len(segments))
+        response["X-Audio-Format"] = self.format.name
+        patch_vary_headers(response, ("Accept",))
+        return response
+
+
+def negotiate_audio_format(
+    request: HttpRequest, body: Dict[str, Any], mode: Optional[str] = None
+) -> Tuple[Optional[AudioFormat], Optional[JsonResponse]]:
+    """Pick the TTS output format from ``audioFormat`` or ``Accept``.
+
+    Returns:
+        ``(format, None)``, or ``(None, error response)``: 400 for an unknown
+        format name, 406 for one that cannot be produced or, in ``audio``
+        stream mode, cannot be streamed as one body.
+    """
+    try:
+        fmt = audio_formats.negotiate(
+            request.headers.get("Accept", ""), body.get("audioFormat"), get_backend("tts")
+        )
+    except audio_formats.FormatUnavailable as e:
+        return None, JsonResponse({"error": str(e)}, status=406)
+    except ValueError as e:
+        return None, JsonResponse({"error": str(e)}, status=400)
+    if mode == "audio" and not fmt.streamable:
+        error = f'{fmt.name} audio cannot be streamed as one body; use "format": "sse"'
+        return None, JsonResponse({"error": error}, status=406)
+    return fmt, None
+
+
+def tts_stream_mode(request: HttpRequest, body: Dict[str, Any]) -> Optional[str]:
+    """Return ``"audio"`` or ``"sse"`` if the client asked for streamed TTS."""
+    if body.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", ""):
+        return "sse"
+    if body.get("stream"):
+        return "audio"
+    return None
+
+
+def stream_tts_events(segments: List[str], voice_id: str, state: TtsStream) -> Iterator[Any]:
+    """Yield streaming TTS body chunks for ``segments``, in order."""
+    audio_format = state.format.name
+    try:
+        for index, text, audio in iter_synthesized(
+            segments,
+            lambda segment: cached_speech(segment, voice_id, audio_format),
+            settings.TTS_STREAM_PARALLELISM,
+        ):
+            yield state.on_segment(index, text, audio)
+    except Exception as e:
+        event = state.fail(e)
+        if event:
+            yield event
+        return
+    event = state.finish()
+    if event:
+        yield event
+
+
+@csrf_exempt
+def tts(request: HttpRequest) -> HttpResponse:
     """Convert text to speech via ElevenLabs.
 
     Expects JSON payload with a ``text`` key. Optionally accepts a
     ``voiceId`` key to select a specific ElevenLabs voice. Returns a
     JSON object with the relative audio URL. The front‑end should prefix
     this with the server origin when loading the audio.
+
+    With ``stream: true`` the text is split into sentences that are
+    synthesised concurrently and streamed back in order as one chunked
+    ``audio/mpeg`` body, so playback can start after the first sentence.
+    ``format: "sse"`` (or ``Accept: text/event-stream``) streams sequenced
+    ``segment`` events with base64 audio instead.
+
+    The audio format is negotiated from ``audioFormat`` or the ``Accept``
+    header (see ``api.audio_formats``) and reported as ``format`` and
+    ``mime`` in the JSON, or the ``X-Audio-Format`` header when streamed.
     """
+    started = time.perf_counter()
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=405)
-    try:
-        body = json.loads(request.body.decode("utf-8"))
-    except Exception:
+    body = parse_json_body(request)
+    if body is None:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
     text = (body.get("text") or "").strip()
     voice_id = body.get("voiceId", "Rachel")
     if not text:
         return JsonResponse({"error": "Text is required"}, status=400)
+    mode = tts_stream_mode(request, body)
+    fmt, error = negotiate_audio_format(request, body, mode)
+    if error:
+        return error
+    if mode:
+        segments = split_sentences(text, settings.TTS_SENTENCE_MAX_CHARS)
+        state = TtsStream(mode, started, fmt)
+        return state.response(stream_tts_events(segments, voice_id, state), segments)
     try:
-        audio_url = call_elevenlabs_tts(text, voice_id)
+        audio_url = call_elevenlabs_tts(text, voice_id, fmt.name)
+    except audio_formats.FormatUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=406)
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
-    return JsonResponse({"audio_url": audio_url})
+        return upstream_error_response(e)
+    return tts_url_response(audio_url, fmt)
+
+
+def tts_url_response(audio_url: str, fmt: AudioFormat) -> JsonResponse:
+    """Return the JSON answer of a non-streamed ``tts`` request."""
+    response = JsonResponse({"audio_url": audio_url, "format": fmt.name, "mime": fmt.mime})
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def personas(request: HttpRequest) -> JsonResponse:
+    """List the personas with their stock lines and the lines' audio.
+
+    ``audio_url`` is set for lines in the prebuilt bundle (see
+    ``api.persona_assets``), in ``audioFormat`` (default
+    ``TTS_AUDIO_FORMAT``) and the bundle's voice; it is null for lines
+    that would have to be synthesised, which ``/api/tts`` will do.
+    """
+    bundle = get_persona_bundle()
+    voice_id = bundle.manifest.get("voice_id", settings.PERSONA_ASSET_VOICE)
+    try:
+        fmt = audio_formats.get_format(request.GET.get("audioFormat", settings.TTS_AUDIO_FORMAT))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    aliases: Dict[str, List[str]] = {}
+    for alias, value in PERSONA_ALIASES.items():
+        aliases.setdefault(value, []).append(alias)
+    listed = []
+    for persona in Persona:
+        lines = {}
+        for kind, text in persona.stock_lines.items():
+            path = bundle.path(tts_cache_key(text, voice_id, fmt.name), fmt.extension)
+            lines[kind] = {"text": text, "audio_url": bundle.url_for(path) if path else None}
+        listed.append(
+            {
+                "id": persona.value,
+                "aliases": aliases.get(persona.value, []),
+                "description": persona.system_description,
+                "lines": lines,
+            }
+        )
+    return JsonResponse({"personas": listed, "voiceId": voice_id, "format": fmt.name, "bundled": len(bundle)})
+
+
+def tts_formats(request: HttpRequest) -> JsonResponse:
+    """Report each TTS audio format with the bytes per second of speech produced in it."""
+    return JsonResponse(
+        {"default": settings.TTS_AUDIO_FORMAT, "formats": audio_formats.report(get_backend("tts"))}
+    )
 
 
 @csrf_exempt
@@ -313,25 +1060,532 @@ def stt(request: HttpRequest) -> JsonResponse:
     """Transcribe uploaded audio via OpenAI Whisper.
 
     Accepts multipart/form-data where the audio is sent under the field
-    ``file``. Returns JSON with a ``transcript`` key. This endpoint is
+    ``file``. Returns JSON with a ``transcript`` key. The upload is spooled
+    to a temporary file and streamed on to Whisper (see
+    ``api/stt_upload.py``); recordings over the size or duration limit are
+    refused with ``413`` as soon as that is known. This endpoint is
     optional for hackathon purposes and can be removed if you only support
     text input.
     """
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=405)
-    # Expect a file named 'file'
-    audio_file = request.FILES.get("file")
-    if not audio_file:
-        return JsonResponse({"error": "No audio file provided"}, status=400)
-    mime_type = audio_file.content_type or "audio/webm"
     try:
-        audio_bytes = audio_file.read()
-        transcript = call_openai_whisper(audio_bytes, mime_type)
+        with instrument.span("upload"):
+            audio = receive_audio(request)
+    except AudioRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    try:
+        transcript = transcribe(audio.file, audio.content_type or "audio/webm", audio.sha256)
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
+        return upstream_error_response(e)
+    finally:
+        audio.close()
     return JsonResponse({"transcript": transcript})
 
 
+def receive_stt_chunk(request: HttpRequest) -> Tuple[Optional[JsonResponse], Optional[ChunkedUpload], str]:
+    """Append the chunk in ``request`` to its upload.
+
+    Returns:
+        ``(error, upload, mode)``: an error response if the chunk was
+        refused, otherwise the upload and ``"final"``, ``"partial"`` or ``""``
+        for what the client asked to be transcribed.
+    """
+    upload_id = request.GET.get("uploadId", "")
+    try:
+        seq = int(request.GET.get("seq", "0"))
+    except ValueError:
+        return JsonResponse({"error": "seq must be an integer"}, status=400), None, ""
+    if upload_id:
+        upload = ChunkedUpload.open(upload_id)
+        if upload is None:
+            return JsonResponse({"error": "Upload not found"}, status=404), None, ""
+    elif seq == 0:
+        upload = ChunkedUpload.create(request.content_type or "audio/webm")
+    else:
+        return JsonResponse({"error": "uploadId is required after the first chunk"}, status=400), None, ""
+    try:
+        upload.append(seq, iter(lambda: request.read(64 * 1024), b""), declared_duration(request.META))
+    except AudioRejected as e:
+        return JsonResponse({"error": str(e), "uploadId": upload.upload_id}, status=e.status), None, ""
+    mode = "final" if request.GET.get("final") == "1" else "partial" if request.GET.get("partial") == "1" else ""
+    return None, upload, mode
+
+
+def stt_chunk_payload(upload: ChunkedUpload, mode: str, text: str = "") -> Dict[str, Any]:
+    """Response body for a chunk; discards the upload once it is final."""
+    payload: Dict[str, Any] = {"uploadId": upload.upload_id, "received": upload.size}
+    if mode == "final":
+        upload.discard()
+        payload["transcript"] = text
+    elif mode == "partial":
+        payload["partial"] = text
+    return payload
+
+
+@csrf_exempt
+def stt_chunk(request: HttpRequest) -> JsonResponse:
+    """Receive one chunk of a recording and optionally transcribe it.
+
+    For browsers recording with ``MediaRecorder`` and a timeslice: each
+    ``dataavailable`` blob is POSTed as the raw request body, in order, with
+    ``?seq=0``, ``1``, ... and the ``uploadId`` returned for the first one.
+    An ``X-Audio-Duration`` header with the seconds recorded so far lets the
+    duration limit be enforced mid-recording. ``partial=1`` returns an
+    interim ``partial`` transcript of the audio so far; ``final=1`` marks the
+    last chunk and returns the ``transcript``. A final chunk whose
+    transcription fails can be re-sent with the same ``seq``.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    error, upload, mode = receive_stt_chunk(request)
+    if error is not None:
+        return error
+    text = ""
+    if mode:
+        try:
+            with upload.audio_path.open("rb") as audio:
+                text = transcribe(audio, upload.mime_type)
+        except Exception as e:
+            return upstream_error_response(e)
+    return JsonResponse(stt_chunk_payload(upload, mode, text))
+
+
+def run_tts_job(job: jobs.Job) -> Dict[str, Any]:
+    """Job handler: synthesise ``text`` as :func:`tts` does."""
+    return {"audio_url": call_elevenlabs_tts(job.payload["text"], job.payload["voiceId"])}
+
+
+def run_stt_job(job: jobs.Job) -> Dict[str, Any]:
+    """Job handler: transcribe the recording stored with the job."""
+    try:
+        with jobs.audio_path(job.id).open("rb") as audio:
+            return {"transcript": transcribe(audio, job.payload["mime"], job.payload["sha256"])}
+    finally:
+        jobs.discard_audio(job.id)
+
+
+JOB_HANDLERS: Dict[str, jobs.Handler] = {"tts": run_tts_job, "stt": run_stt_job}
+
+
+def job_queue() -> jobs.JobQueue:
+    """Return the job queue, starting this process's runner on first use.
+
+    Jobs are limited per provider, which for each kind is its configured
+    backend (``TTS_BACKEND``, ``STT_BACKEND``).
+    """
+    queue = jobs.get_job_queue()
+    if queue.runner is None:
+        queue.start(JOB_HANDLERS, {"tts": settings.TTS_BACKEND, "stt": settings.STT_BACKEND})
+    return queue
+
+
+def parse_job_options(data: Any) -> Tuple[int, str]:
+    """Read ``priority`` and ``callbackUrl`` from a job submission.
+
+    Raises:
+        ValueError: If the priority is not an integer in range or the
+            callback URL is not allowed.
+    """
+    try:
+        priority = int(data.get("priority") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("priority must be an integer")
+    if not jobs.MIN_PRIORITY <= priority <= jobs.MAX_PRIORITY:
+        raise ValueError(f"priority must be between {jobs.MIN_PRIORITY} and {jobs.MAX_PRIORITY}")
+    callback_url = data.get("callbackUrl") or ""
+    if callback_url:
+        jobs.check_callback_url(callback_url)
+    return priority, callback_url
+
+
+def job_accepted(job: jobs.Job) -> JsonResponse:
+    """``202 Accepted`` for a queued job, pointing at its status endpoint."""
+    status_url = reverse("job_status", args=[job.id])
+    response = JsonResponse({**job.public(), "status_url": status_url}, status=202)
+    response["Location"] = status_url
+    return response
+
+
+def submit_tts_job(body: Dict[str, Any]) -> JsonResponse:
+    """Validate a TTS job request and queue it; shared with the async view."""
+    text = (body.get("text") or "").strip()
+    if not text:
+        return JsonResponse({"error": "Text is required"}, status=400)
+    try:
+        priority, callback_url = parse_job_options(body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    payload = {"text": text, "voiceId": body.get("voiceId", "Rachel")}
+    return job_accepted(job_queue().submit("tts", settings.TTS_BACKEND, payload, priority, callback_url))
+
+
+def submit_stt_job(request: HttpRequest, audio: Any) -> JsonResponse:
+    """Store ``audio`` with a new STT job and queue it; shared with the async view."""
+    try:
+        priority, callback_url = parse_job_options(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    queue = job_queue()
+    job_id = uuid.uuid4().hex
+    audio.file.seek(0)
+    with jobs.audio_path(job_id).open("wb") as stored:
+        shutil.copyfileobj(audio.file, stored)
+    payload = {"mime": audio.content_type or "audio/webm", "sha256": audio.sha256}
+    return job_accepted(queue.submit("stt", settings.STT_BACKEND, payload, priority, callback_url, job_id=job_id))
+
+
+@csrf_exempt
+def tts_job(request: HttpRequest) -> JsonResponse:
+    """Queue speech synthesis and return a job ID at once.
+
+    Takes the same ``text`` and ``voiceId`` as :func:`tts`, plus optional
+    ``priority`` (-10 to 10, higher runs first) and ``callbackUrl``. Answers
+    ``202`` with ``jobId`` and ``status_url``; the finished job's ``result``
+    holds the ``audio_url``.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    return submit_tts_job(body)
+
+
+@csrf_exempt
+def stt_job(request: HttpRequest) -> JsonResponse:
+    """Queue a transcription and return a job ID at once.
+
+    Takes the same multipart ``file`` as :func:`stt`, with optional
+    ``priority`` and ``callbackUrl`` form fields. The recording is kept on
+    disk until the job has run; the finished job's ``result`` holds the
+    ``transcript``.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        with instrument.span("upload"):
+            audio = receive_audio(request)
+    except AudioRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    try:
+        return submit_stt_job(request, audio)
+    finally:
+        audio.close()
+
+
+def job_wait_seconds(request: HttpRequest) -> Optional[float]:
+    """The ``wait`` query parameter, capped at ``JOB_MAX_WAIT``; None if invalid."""
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return None
+    return min(max(wait, 0.0), settings.JOB_MAX_WAIT)
+
+
+def job_status_response(job: Optional[jobs.Job]) -> JsonResponse:
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(job.public())
+
+
+def job_status(request: HttpRequest, job_id: str) -> JsonResponse:
+    """Report a job's status, and its ``result`` or ``error`` once finished.
+
+    With ``?wait=N`` the request is held until the job finishes or ``N``
+    seconds pass (at most ``JOB_MAX_WAIT``), so a client can long-poll
+    instead of polling repeatedly.
+    """
+    wait = job_wait_seconds(request)
+    if wait is None:
+        return JsonResponse({"error": "wait must be a number"}, status=400)
+    queue = job_queue()
+    return job_status_response(queue.wait(job_id, wait) if wait else queue.get(job_id))
+
+
+def job_stats(request: HttpRequest) -> JsonResponse:
+    """Report queued and running jobs and the oldest wait, per kind."""
+    return JsonResponse(job_queue().stats())
+
+
+def parse_respond_body(body: Dict[str, Any]) -> Tuple[str, Persona, str, bool]:
+    """Read a ``respond`` payload into ``(message, persona, session_id, challenge)``.
+
+    Accepts the front-end's snake_case keys as well as the ``stance`` and
+    ``sessionId`` names used by the other endpoints. The session is adopted
+    (created under the client's ID if new).
+    """
+    message = (body.get("message") or body.get("stance") or "").strip()
+    persona = Persona.parse(body.get("persona"))
+    session_id = adopt_session(body.get("session_id") or body.get("sessionId"))
+    challenge = bool(body.get("challenge"))
+    return message, persona, session_id, challenge
+
+
+def blocked_response(sid: str) -> JsonResponse:
+    """Response for a ``respond`` turn rejected by the banned-topic check."""
+    return JsonResponse({"reply_text": "", "blocked": True, "reason": BLOCKED_REASON, "session_id": sid})
+
+
+def respond_payload(sid: str, model_response: Dict[str, Any], audio_url: Optional[str]) -> Dict[str, Any]:
+    """Record the rebuttal and shape it as the front-end's ``DebateResponse``."""
+    turn = record_rebuttal(sid, model_response)
+    payload: Dict[str, Any] = {
+        "reply_text": turn["rebuttal_text"],
+        "claims": turn["bullets"],
+        "blocked": False,
+        "session_id": sid,
+    }
+    if audio_url:
+        payload["audio_url"] = audio_url
+    return payload
+
+
+@csrf_exempt
+def respond(request: HttpRequest) -> JsonResponse:
+    """Answer a full debate turn: rebuttal text and its audio in one request.
+
+    Expects a JSON payload with ``message``, ``persona``, ``session_id`` and
+    an optional ``challenge`` flag, as sent by the React front-end. The view
+    runs the banned-topic check, the chat completion and the TTS call in
+    sequence on the server, saving the client a second round trip before
+    playback can start. Blocked stances are reported with ``blocked: true``
+    rather than an error status. If speech synthesis fails the text is still
+    returned, just without an ``audio_url``. Turns of a session run one at
+    a time, as in :func:`rebuttal`.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    message, persona, sid, challenge = parse_respond_body(body)
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    if is_banned(message):
+        return blocked_response(sid)
+    queue = turns.get_turn_queue()
+    try:
+        turn = queue.begin(sid, bool(body.get("queue")))
+    except turns.TurnRejected as e:
+        return turn_rejected_response(e, sid)
+    with turns.holding(queue, turn):
+        messages = open_turn(sid, message, persona, challenge, turn)
+        try:
+            model_response = generate_rebuttal(messages, persona)
+        except Exception as e:
+            return upstream_error_response(e)
+        audio_url: Optional[str] = None
+        text = model_response.get("rebuttal_text", "")
+        if text:
+            try:
+                # Absolute, since the front-end may be served from another origin
+                audio_url = request.build_absolute_uri(call_elevenlabs_tts(text))
+            except Exception:
+                audio_url = None
+        return JsonResponse(respond_payload(sid, model_response, audio_url))
+
+
+class PanelSeat(NamedTuple):
+    """One rebuttal requested in a panel call (see :func:`panel`)."""
+
+    stance: str
+    persona: Persona
+    session_id: Optional[str] = None
+
+
+def parse_panel_body(body: Dict[str, Any]) -> Tuple[Optional[JsonResponse], List[PanelSeat]]:
+    """Validate a panel payload.
+
+    Accepts either a ``stance`` with a list of ``personas`` (every persona
+    answers the same stance) or a list of ``stances`` with one ``persona``
+    (one rebuttal per stance). An optional ``sessionIds`` list, in the same
+    order, continues existing debates; other seats start a new session.
+
+    Returns:
+        A tuple ``(error, seats)``. ``error`` is a ready-made error response
+        when the payload is rejected, otherwise None.
+    """
+    stances = body.get("stances")
+    personas = body.get("personas")
+    if isinstance(stances, list):
+        persona = Persona.parse(body.get("persona"))
+        pairs = [((stance if isinstance(stance, str) else "").strip(), persona) for stance in stances]
+    elif isinstance(personas, list):
+        stance = (body.get("stance") or "").strip()
+        pairs = [(stance, Persona.parse(p if isinstance(p, str) else None)) for p in personas]
+    else:
+        return JsonResponse({"error": "Either personas or stances must be a list"}, status=400), []
+    if not pairs:
+        return JsonResponse({"error": "At least one persona or stance is required"}, status=400), []
+    if len(pairs) > settings.PANEL_MAX_SEATS:
+        return JsonResponse({"error": f"At most {settings.PANEL_MAX_SEATS} rebuttals per panel"}, status=400), []
+    for stance, _ in pairs:
+        if not stance:
+            return JsonResponse({"error": "Stance is required"}, status=400), []
+        if is_banned(stance):
+            return JsonResponse({"error": BLOCKED_REASON}, status=400), []
+    session_ids = body.get("sessionIds")
+    if not isinstance(session_ids, list):
+        session_ids = []
+    seats = [
+        PanelSeat(stance, persona, session_ids[i] if i < len(session_ids) else None)
+        for i, (stance, persona) in enumerate(pairs)
+    ]
+    return None, seats
+
+
+def wants_json_lines(request: HttpRequest, body: Dict[str, Any]) -> bool:
+    """Whether the client asked for a streamed JSON lines response."""
+    return bool(body.get("stream")) or "application/x-ndjson" in request.headers.get("Accept", "")
+
+
+def json_line(data: Dict[str, Any]) -> str:
+    """Format one line of a JSON lines stream."""
+    return json.dumps(data) + "\n"
+
+
+def json_lines_response(lines: Any) -> StreamingHttpResponse:
+    """Wrap an (async) iterator of JSON lines in a streaming response."""
+    response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class Panel:
+    """Collect the rebuttals of one panel call as they complete.
+
+    Each seat is one independent turn of its session. The view runs
+    :meth:`run` (or ``api.async_views.run_panel_seat``) for every seat
+    concurrently (see ``api.fanout``). A seat first takes its session's turn slot, like
+    ``/api/rebuttal``, so a seat continuing a debate does not interleave
+    with another turn of that session; then it appends the stance, builds
+    the prompt, asks the model and records the rebuttal. Each outcome is
+    passed to :meth:`on_result`, which returns the seat's result: the same
+    body as ``/api/rebuttal`` plus ``index``, ``persona``, ``stance`` and
+    ``elapsed_ms``, or an ``error`` and HTTP-style ``status`` for a failed
+    seat. A failed seat does not affect the others.
+
+    Args:
+        queue: Seats wait behind earlier turns of their session instead of
+            superseding the ones still waiting (see ``api.turns``).
+    """
+
+    def __init__(self, seats: List[PanelSeat], started: float, queue: bool = False) -> None:
+        self.seats = seats
+        self.started = started
+        self.queue = queue
+        self.session_ids = [ensure_session(seat.session_id) for seat in seats]
+        self.results: List[Dict[str, Any]] = []
+        self.errors = 0
+        metrics.inc("panel_seats_total", len(seats))
+
+    def prepare(self, index: int, turn: turns.Turn) -> List[Dict[str, Any]]:
+        """Append seat ``index``'s stance to its session and build its prompt."""
+        return open_turn(self.session_ids[index], self.seats[index].stance, self.seats[index].persona, turn=turn)
+
+    def run(self, index: int) -> Dict[str, Any]:
+        """Take seat ``index``'s turn and return its recorded rebuttal.
+
+        Raises:
+            turns.TurnRejected: If the session's turn slot was not granted.
+        """
+        queue = turns.get_turn_queue()
+        turn = queue.begin(self.session_ids[index], self.queue)
+        with turns.holding(queue, turn):
+            model_response = generate_rebuttal(self.prepare(index, turn), self.seats[index].persona)
+            return record_rebuttal(self.session_ids[index], model_response)
+
+    def on_result(
+        self, index: int, rebuttal: Optional[Dict[str, Any]], error: Optional[BaseException]
+    ) -> Dict[str, Any]:
+        seat = self.seats[index]
+        result: Dict[str, Any] = {"index": index, "persona": seat.persona.value, "stance": seat.stance}
+        if error is None:
+            result.update(rebuttal)
+        else:
+            self.errors += 1
+            metrics.inc("panel_seat_errors_total")
+            if isinstance(error, turns.TurnRejected):
+                status = error.status
+            elif isinstance(error, Exception):
+                status = upstream_error_response(error).status_code
+            else:
+                status = 500
+            result.update({"error": str(error), "status": status, "sessionId": self.session_ids[index]})
+        result["elapsed_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        self.results.append(result)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        metrics.observe("panel_seconds", elapsed)
+        return {"count": len(self.seats), "errors": self.errors, "wall_ms": round(elapsed * 1000, 1)}
+
+    def response(self) -> JsonResponse:
+        """The aggregate response once every seat has a result.
+
+        The status is 200 if any seat succeeded, otherwise the status of the
+        first failure, so clients can back off from a provider outage.
+        """
+        results = sorted(self.results, key=lambda result: result["index"])
+        payload = {"results": results, **self.summary()}
+        status = results[0]["status"] if results and self.errors == len(results) else 200
+        return JsonResponse(payload, status=status)
+
+
+def stream_panel_lines(state: Panel, outcomes: Iterator[Tuple[int, Any, Optional[BaseException]]]) -> Iterator[str]:
+    """Yield one JSON line per seat as it completes, then a ``done`` line."""
+    for index, model_response, error in outcomes:
+        yield json_line(state.on_result(index, model_response, error))
+    yield json_line({"done": True, **state.summary()})
+
+
+@csrf_exempt
+def panel(request: HttpRequest) -> HttpResponse:
+    """Ask a panel of personas for rebuttals at once.
+
+    Expects a JSON payload with a ``stance`` and a list of ``personas``, or
+    a list of ``stances`` and one ``persona`` (see :func:`parse_panel_body`).
+    The completions run concurrently, at most ``PANEL_PARALLELISM`` at a
+    time, so a full panel takes about as long as its slowest member rather
+    than the sum of them. Each seat gets its own session, returned as its
+    ``sessionId`` so the debate can be continued through ``/api/rebuttal``.
+    Seats continuing a session through ``sessionIds`` take that session's
+    turn slot like ``/api/rebuttal`` does, honouring ``queue``; a rejected
+    seat reports ``409``, ``429`` or ``503``.
+
+    By default the response is one JSON object with the ``results`` in seat
+    order. If the payload sets ``stream`` (or the client accepts
+    ``application/x-ndjson``) each result is instead written as a JSON line
+    as soon as it completes, followed by a ``{"done": true, ...}`` line.
+    """
+    started = time.perf_counter()
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    body = parse_json_body(request)
+    if body is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    error, seats = parse_panel_body(body)
+    if error is not None:
+        return error
+    state = Panel(seats, started, bool(body.get("queue")))
+    outcomes = iter_completed(list(range(len(seats))), state.run, settings.PANEL_PARALLELISM)
+    if wants_json_lines(request, body):
+        return json_lines_response(stream_panel_lines(state, outcomes))
+    for index, model_response, failure in outcomes:
+        state.on_result(index, model_response, failure)
+    return state.response()
+
+
+def reset_session(session_id: Optional[str]) -> bool:
+    """Clear the transcript of ``session_id``; return False if it is unknown."""
+    if not session_id or not isinstance(session_id, str):
+        return False
+    return get_session_store().reset(session_id)
+
+
 @csrf_exempt
 def reset_memory(request: HttpRequest) -> JsonResponse:
     """Reset the session transcript.
@@ -341,35 +1595,141 @@ def reset_memory(request: HttpRequest) -> JsonResponse:
     """
     if request.method != "POST":
         return JsonResponse({"error": "POST required"}, status=405)
-    try:
-        body = json.loads(request.body.decode("utf-8"))
-    except Exception:
+    body = parse_json_body(request)
+    if body is None:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
     session_id = body.get("sessionId")
-    if not session_id or session_id not in sessions:
+    if not reset_session(session_id):
         return JsonResponse({"error": "Invalid session ID"}, status=400)
-    sessions[session_id] = []
     return JsonResponse({"message": "Session reset", "sessionId": session_id})
 
 
-def download_transcript(request: HttpRequest) -> FileResponse:
-    """Download the transcript for a session.
+def cached_audio_paths(text: str, voice_id: str = "Rachel") -> List[Path]:
+    """Return the cached MP3 files that voice ``text``, or [] if any is missing.
 
-    Accepts a query parameter ``sessionId`` and returns a plain text file
-    containing the conversation so far. If no session ID is provided or
-    the session does not exist, a 404 response is returned.
+    Speech is cached whole by ``/api/tts`` and ``respond``, and sentence by
+    sentence by streamed TTS; either layout is found, as are persona stock
+    lines in the prebuilt bundle. Nothing is synthesised.
     """
+    cache = get_tts_cache()
+
+    def cached(key: str) -> Optional[Path]:
+        path = get_persona_bundle().lookup(key) or cache.lookup(key)
+        if path is None and cache.path_for(key).exists():
+            path = cache.path_for(key)  # written by another worker
+        return path
+
+    whole = cached(tts_cache_key(text, voice_id))
+    if whole is not None:
+        return [whole]
+    segments = split_sentences(text, settings.TTS_SENTENCE_MAX_CHARS)
+    paths = [cached(tts_cache_key(segment, voice_id)) for segment in segments]
+    return paths if paths and all(paths) else []
+
+
+def transcript_response(request: HttpRequest) -> HttpResponse:
+    """Build the streamed transcript export described in :func:`download_transcript`."""
+    store = get_session_store()
     session_id = request.GET.get("sessionId")
-    if not session_id or session_id not in sessions:
+    revision = store.revision(session_id) if session_id else None
+    if revision is None:
         return FileResponse(io.BytesIO(b"Session not found"), content_type="text/plain", status=404)
-    transcript = sessions[session_id]
-    lines: List[str] = []
-    for role, text in transcript:
-        prefix = "User:" if role == "user" else "Opponent:"
-        lines.append(f"{prefix} {text}\n")
-    content = "".join(lines)
-    # Return as a text file
-    filename = f"transcript_{session_id}.txt"
-    response = FileResponse(io.BytesIO(content.encode("utf-8")), as_attachment=True, filename=filename)
-    response["Content-Type"] = "text/plain"
-    return response
\ No newline at end of file
+    fmt = request.GET.get("format", "txt")
+    if fmt not in transcript_export.FORMATS:
+        return JsonResponse({"error": f"format must be one of {', '.join(transcript_export.FORMATS)}"}, status=400)
+    try:
+        start = int(request.GET.get("start", 0))
+        limit = int(request.GET["limit"]) if "limit" in request.GET else None
+    except ValueError:
+        return JsonResponse({"error": "start and limit must be integers"}, status=400)
+    if start < 0 or (limit is not None and limit < 1):
+        return JsonResponse({"error": "start must be >= 0 and limit >= 1"}, status=400)
+    with_audio = request.GET.get("audio", "").lower() in ("1", "true", "yes")
+    generation, count = revision
+    # Stop at the turns present now, so the body matches its ETag
+    stop = count if limit is None else min(count, start + limit)
+    content_type, extension = transcript_export.FORMATS[fmt]
+    filename = f"transcript_{session_id}.{extension}"
+    turns = transcript_export.iter_turns(store, session_id, start, stop)
+    lines = transcript_export.iter_lines(turns, fmt, session_id, start)
+    if with_audio:
+        voice_id = request.GET.get("voiceId", "Rachel")
+        audio = transcript_export.audio_entries(
+            transcript_export.iter_turns(store, session_id, start, stop),
+            lambda text: cached_audio_paths(text, voice_id),
+        )
+        archive = transcript_export.iter_zip(lines, filename, audio)
+        response = StreamingHttpResponse(archive, content_type="application/zip")
+        filename = f"transcript_{session_id}.zip"
+    else:
+        # Only text exports get a validator: cached audio comes and goes
+        key = f"{session_id}:{generation}:{count}:{fmt}:{start}:{stop}"
+        etag = f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+        matches = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in matches or "*" in matches:
+            response = HttpResponse(status=304)
+        else:
+            response = StreamingHttpResponse(transcript_export.iter_chunks(lines), content_type=content_type)
+        response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    response["X-Transcript-Turns"] = str(count)
+    response["X-Next-Start"] = str(max(start, stop))
+    return response
+
+
+def download_transcript(request: HttpRequest) -> HttpResponse:
+    """Download the transcript for a session.
+
+    Accepts a query parameter ``sessionId`` and streams the conversation so
+    far. If no session ID is provided or the session does not exist, a 404
+    response is returned. Optional parameters:
+
+    * ``format``: ``txt`` (default), ``jsonl`` or ``md``.
+    * ``start`` and ``limit``: export only turns ``start`` to
+      ``start + limit - 1``. ``X-Next-Start`` in the response is the
+      ``start`` that fetches only turns added since, and
+      ``X-Transcript-Turns`` the number of turns in the transcript.
+    * ``audio=1``: return a zip archive with the transcript plus the cached
+      audio of each opponent turn (for ``voiceId``, default Rachel).
+
+    Text exports carry an ``ETag``; a request with a matching
+    ``If-None-Match`` gets ``304 Not Modified`` without a body.
+    """
+    return transcript_response(request)
+
+
+def serve_media(request: HttpRequest, path: str) -> HttpResponse:
+    """Serve a generated file from ``MEDIA_ROOT`` (mounted at ``MEDIA_URL``).
+
+    Supports ``Range`` requests so the front-end can seek in and replay
+    opponent audio without downloading it again, answers ``If-None-Match``
+    with ``304`` and marks TTS cache files as immutable. Under a WSGI server
+    with ``wsgi.file_wrapper`` the file is sent with ``sendfile``; with
+    ``MEDIA_OFFLOAD`` the front proxy sends it instead. See ``api.media``.
+    """
+    return media.media_response(request, path)
+
+
+def stats(request: HttpRequest) -> JsonResponse:
+    """Report the in-process metrics (see ``api.metrics``) as JSON."""
+    return JsonResponse(metrics.snapshot())
+
+
+def prometheus_metrics(request: HttpRequest) -> HttpResponse:
+    """Serve the in-process metrics in the Prometheus text format.
+
+    Mounted at ``/metrics``. Like ``/api/stats`` this reports the worker
+    process that answered; scrape each worker (or run one per container).
+    """
+    return HttpResponse(metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def upstream_stats(request: HttpRequest) -> JsonResponse:
+    """Report connection pool statistics for the upstream provider clients.
+
+    Useful for checking that keep-alive connections are being reused and
+    that the pool limits configured in settings are appropriate. The
+    ``circuits`` key reports each provider's circuit breaker.
+    """
+    return JsonResponse({**pool_stats(), "circuits": resilience.breaker_states()})
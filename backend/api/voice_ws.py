@@ -0,0 +1,488 @@
+"""Full-duplex voice debate over one WebSocket.
+
+A spoken turn used to take four HTTP requests: the recording to ``stt``, the
+transcript to ``rebuttal``, the rebuttal to ``tts`` and a GET for the MP3.
+:func:`websocket_application` (mounted by ``devdebate.asgi``) runs the whole
+turn over one long-lived connection at ``VOICE_WS_PATH``: the client streams
+its recording in and gets the transcript, the rebuttal text as it is
+generated and the synthesised audio back on the same socket. Each sentence
+is sent for synthesis as soon as the model has finished writing it, so
+audio starts long before the rebuttal is complete.
+
+Control messages are JSON text frames with a ``type``; audio travels in
+binary frames.
+
+Client to server:
+
+``start``
+    Begin a recording. Optional ``persona``, ``sessionId``, ``voiceId``,
+    ``challenge`` and ``mime`` (default ``audio/webm``) apply to this and
+    later turns.
+binary frames
+    The recording, in order (for example ``MediaRecorder`` blobs). Audio
+    without a ``start`` begins a recording with the current options.
+``stop``
+    The recording is complete; the turn starts.
+``text``
+    A typed turn: ``text`` is debated without transcription. Accepts the
+    same options as ``start``.
+``cancel``
+    Stop the turn in progress.
+``ack``
+    ``seq`` of the last audio segment the client has received.
+
+Server to client: ``ready``; then per turn ``transcript``, ``delta``
+(rebuttal text), ``rebuttal`` (the same body as ``/api/rebuttal`` plus
+``ttft_ms``), ``audio`` (a header with ``seq``, ``index``, ``text`` and
+``bytes``, immediately followed by one binary frame of MP3) and ``done``
+(with per-phase ``timings`` and ``first_audio_ms``, both in milliseconds
+from the end of the recording). A turn can instead end with ``blocked``,
+``cancelled`` or ``error``. Turn messages carry the ``turn`` number.
+
+Barge-in
+    A ``start``, ``text`` or ``cancel`` (or new audio) while a turn is in
+    progress cancels it, including its upstream requests and pending
+    synthesis, and answers ``cancelled``. The interrupted rebuttal is not
+    added to the transcript. Turns take their session's slot in
+    ``api.turns`` like HTTP turns do; an interrupted one is counted as
+    superseded.
+Backpressure
+    At most ``VOICE_WS_AUDIO_WINDOW`` bytes of audio are sent ahead of the
+    client's ``ack``; synthesis carries on, but sending waits. Clients that
+    do not acknowledge connect with ``?ack=0``. Recordings are held in
+    memory up to ``STT_SPOOL_MEMORY_BYTES``, then on disk, and refused past
+    ``STT_MAX_UPLOAD_BYTES``.
+
+Connections from browser origins other than the server's own and
+``CORS_ALLOWED_ORIGINS`` are refused. Needs an ASGI server with WebSocket
+support (uvicorn with ``websockets`` or ``wsproto``, daphne, hypercorn).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+
+from . import Persona, async_views, instrument, metrics, resilience, turns, views
+from .stt_upload import AudioRejected, check_limits
+from .tts_stream import SentenceBuffer
+
+# Latencies on the voice channel, from the end of the user's recording
+VOICE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+_open_connections = 0
+
+
+def origin_allowed(scope: Dict[str, Any]) -> bool:
+    """Whether the handshake's ``Origin`` may open the channel.
+
+    Browsers do not apply CORS to WebSockets, so it is checked here. Clients
+    that send no ``Origin`` (not browsers) are allowed.
+    """
+    headers = {name: value.decode("latin-1") for name, value in scope.get("headers", [])}
+    origin = headers.get(b"origin", "")
+    if not origin:
+        return True
+    return origin in settings.CORS_ALLOWED_ORIGINS or urlsplit(origin).netloc == headers.get(b"host")
+
+
+class AudioWindow:
+    """Audio sent but not yet acknowledged, bounded to ``limit`` bytes."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.unacked: Dict[int, int] = {}
+        self._changed = asyncio.Condition()
+
+    def _fits(self, size: int) -> bool:
+        # A segment larger than the window goes out once nothing is pending
+        return not self.unacked or sum(self.unacked.values()) + size <= self.limit
+
+    async def reserve(self, seq: int, size: int) -> None:
+        """Wait until ``size`` more bytes fit in the window, then claim them."""
+        async with self._changed:
+            if not self._fits(size):
+                metrics.inc("voice_ws_backpressure_waits_total")
+                await self._changed.wait_for(lambda: self._fits(size))
+            self.unacked[seq] = size
+
+    async def ack(self, seq: int) -> None:
+        """Release every segment up to and including ``seq``."""
+        async with self._changed:
+            for acked in [s for s in self.unacked if s <= seq]:
+                del self.unacked[acked]
+            self._changed.notify_all()
+
+    async def clear(self) -> None:
+        """Forget the audio of a cancelled turn."""
+        await self.ack(max(self.unacked, default=0))
+
+
+class Recording:
+    """One utterance as it arrives, spooled to disk when it grows large."""
+
+    def __init__(self, mime_type: str) -> None:
+        self.mime_type = mime_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=settings.STT_SPOOL_MEMORY_BYTES)
+        self.size = 0
+        self.rejected = False
+
+    def write(self, data: bytes) -> None:
+        """Append ``data``; raises :class:`AudioRejected` once over the size limit."""
+        if self.rejected:
+            return
+        try:
+            check_limits(self.size + len(data), None)
+        except AudioRejected:
+            self.rejected = True
+            raise
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _retrieve(task: "asyncio.Task[Any]") -> None:
+    """Cancel ``task``, or mark its exception retrieved so asyncio does not log it."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+class Speaker:
+    """Voice a rebuttal sentence by sentence while it is being generated.
+
+    :meth:`feed` takes rebuttal text as it streams in; every completed
+    sentence is synthesised right away (at most ``TTS_STREAM_PARALLELISM``
+    at once, through the TTS cache), and a sender task passes the audio to
+    the channel strictly in order.
+    """
+
+    def __init__(self, channel: "VoiceChannel", turn: int, started: float) -> None:
+        self.channel = channel
+        self.turn = turn
+        self.started = started
+        self.sentences = SentenceBuffer(settings.TTS_SENTENCE_MAX_CHARS)
+        self.slots = asyncio.Semaphore(max(1, settings.TTS_STREAM_PARALLELISM))
+        self.queue: "asyncio.Queue[Optional[Tuple[int, str, asyncio.Task[bytes]]]]" = asyncio.Queue()
+        self.tasks: List["asyncio.Task[bytes]"] = []
+        self.first_audio: Optional[float] = None
+        self.sender = asyncio.ensure_future(self._send_in_order())
+
+    def feed(self, text: str) -> None:
+        for segment in self.sentences.feed(text):
+            self._submit(segment)
+
+    def _submit(self, segment: str) -> None:
+        task = asyncio.ensure_future(self._synthesize(segment))
+        self.tasks.append(task)
+        self.queue.put_nowait((len(self.tasks) - 1, segment, task))
+
+    async def _synthesize(self, segment: str) -> bytes:
+        async with self.slots:
+            return await async_views.cached_speech(segment, self.channel.voice_id)
+
+    async def _send_in_order(self) -> None:
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            index, segment, task = item
+            audio = await task
+            await self.channel.send_audio(self.turn, index, segment, audio)
+            if self.first_audio is None:
+                self.first_audio = time.perf_counter() - self.started
+                metrics.observe("voice_ws_first_audio_seconds", self.first_audio, buckets=VOICE_BUCKETS)
+
+    async def finish(self) -> None:
+        """Voice what is left of the text and wait until all audio is sent."""
+        for segment in self.sentences.flush():
+            self._submit(segment)
+        self.queue.put_nowait(None)
+        await self.sender
+
+    def cancel(self) -> None:
+        _retrieve(self.sender)
+        for task in self.tasks:
+            _retrieve(task)
+
+
+def _event(name: str, data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    return name, data
+
+
+class VoiceChannel:
+    """State of one voice WebSocket: options, the recording and the turn in progress."""
+
+    def __init__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        self.receive = receive
+        self._send = send
+        self.send_lock = asyncio.Lock()
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        acknowledged = query.get("ack", ["1"])[0] not in ("0", "false", "no")
+        self.window = AudioWindow(settings.VOICE_WS_AUDIO_WINDOW) if acknowledged else None
+        self.session_id = ""
+        self.persona = Persona.parse(None)
+        self.voice_id = "Rachel"
+        self.challenge = False
+        self.mime_type = "audio/webm"
+        self.recording: Optional[Recording] = None
+        self.task: Optional["asyncio.Task[None]"] = None
+        self.slot: Optional[turns.Turn] = None
+        self.turns = 0
+        self.seq = 0
+
+    # -- sending --------------------------------------------------------------
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        text = json.dumps(data)
+        async with self.send_lock:
+            await self._send({"type": "websocket.send", "text": text})
+        metrics.inc("voice_ws_bytes_sent_total", len(text))
+
+    async def send_audio(self, turn: int, index: int, text: str, audio: bytes) -> None:
+        """Send one audio segment, waiting for room in the window first."""
+        self.seq += 1
+        seq = self.seq
+        if self.window is not None:
+            await self.window.reserve(seq, len(audio))
+        header = {"type": "audio", "turn": turn, "seq": seq, "index": index, "text": text}
+        header.update({"mime": "audio/mpeg", "bytes": len(audio)})
+        async with self.send_lock:
+            # Header and audio go out back to back
+            await self._send({"type": "websocket.send", "text": json.dumps(header)})
+            await self._send({"type": "websocket.send", "bytes": audio})
+        metrics.inc("voice_ws_bytes_sent_total", len(audio))
+
+    async def send_error(self, error: str, turn: Optional[int] = None, **fields: Any) -> None:
+        message: Dict[str, Any] = {"type": "error", "error": error, **fields}
+        if turn is not None:
+            message["turn"] = turn
+        with contextlib.suppress(Exception):  # the client may have gone
+            await self.send_json(message)
+
+    # -- receiving ------------------------------------------------------------
+
+    async def run(self) -> None:
+        """Handle messages until the client disconnects."""
+        await self.send_json({"type": "ready", "ack": self.window is not None})
+        while True:
+            message = await self.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                await self.on_audio(message["bytes"])
+            elif message.get("text") is not None:
+                await self.on_control(message["text"])
+
+    async def on_audio(self, data: bytes) -> None:
+        metrics.inc("voice_ws_bytes_received_total", len(data))
+        if self.recording is None:
+            await self.barge_in()
+            self.recording = Recording(self.mime_type)
+        try:
+            self.recording.write(data)
+        except AudioRejected as e:
+            await self.send_error(str(e), status=e.status)
+
+    async def on_control(self, text: str) -> None:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.send_error("Invalid JSON", status=400)
+            return
+        kind = data.get("type")
+        if kind == "ack":
+            if self.window is not None and isinstance(data.get("seq"), int):
+                await self.window.ack(data["seq"])
+        elif kind == "start":
+            await self.barge_in()
+            await self.configure(data)
+            self.discard_recording()
+            self.recording = Recording(self.mime_type)
+        elif kind == "stop":
+            recording, self.recording = self.recording, None
+            if recording is None:
+                await self.send_error("No recording in progress", status=400)
+            elif recording.rejected:
+                recording.close()
+            else:
+                self.begin(recording, "")
+        elif kind == "text":
+            await self.barge_in()
+            await self.configure(data)
+            message = (data.get("text") or "").strip() if isinstance(data.get("text"), str) else ""
+            if message:
+                self.begin(None, message)
+            else:
+                await self.send_error("Text is required", status=400)
+        elif kind == "cancel":
+            await self.barge_in()
+        else:
+            await self.send_error(f"Unknown message type: {kind!r}", status=400)
+
+    async def configure(self, data: Dict[str, Any]) -> None:
+        """Apply the turn options in a ``start`` or ``text`` message."""
+        if "persona" in data:
+            self.persona = Persona.parse(data.get("persona"))
+        if data.get("sessionId"):
+            self.session_id = await asyncio.to_thread(views.adopt_session, data["sessionId"])
+        if isinstance(data.get("voiceId"), str):
+            self.voice_id = data["voiceId"]
+        if isinstance(data.get("mime"), str):
+            self.mime_type = data["mime"]
+        if "challenge" in data:
+            self.challenge = bool(data["challenge"])
+
+    def discard_recording(self) -> None:
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    # -- turns ----------------------------------------------------------------
+
+    def begin(self, recording: Optional[Recording], text: str) -> None:
+        self.turns += 1
+        self.task = asyncio.ensure_future(self.run_turn(self.turns, recording, text))
+
+    async def barge_in(self) -> None:
+        """Cancel the turn in progress, if any, and tell the client."""
+        if self.task is None or self.task.done():
+            return
+        started = time.perf_counter()
+        if self.slot is not None:
+            self.slot.supersede()
+        self.task.cancel()
+        await asyncio.wait([self.task])
+        if self.window is not None:
+            await self.window.clear()
+        metrics.inc("voice_ws_barge_in_total")
+        metrics.observe("voice_ws_cancel_seconds", time.perf_counter() - started, buckets=instrument.PHASE_BUCKETS)
+        await self.send_json({"type": "cancelled", "turn": self.turns})
+
+    async def run_turn(self, turn: int, recording: Optional[Recording], text: str) -> None:
+        """Transcribe, rebut and voice one turn, sending each part as it is ready."""
+        started = time.perf_counter()
+        speaker: Optional[Speaker] = None
+        outcome = "error"
+        try:
+            with instrument.collect() as timings, resilience.deadline(settings.UPSTREAM_TURN_DEADLINE):
+                if recording is not None:
+                    recording.file.seek(0)
+                    text = (await async_views.transcribe(recording.file, recording.mime_type)).strip()
+                    await self.send_json({"type": "transcript", "turn": turn, "text": text})
+                if not text:
+                    outcome = "empty"
+                    await self.send_error("No speech was recognised", turn, status=422)
+                    return
+                if views.is_banned(text):
+                    outcome = "blocked"
+                    await self.send_json({"type": "blocked", "turn": turn, "reason": views.BLOCKED_REASON})
+                    return
+                if not self.session_id:
+                    self.session_id = await asyncio.to_thread(views.ensure_session, None)
+                sid = self.session_id
+                queue = turns.get_turn_queue()
+                # Waits for a turn of the same debate sent over HTTP, if any
+                self.slot = await queue.abegin(sid)
+                async with turns.aholding(queue, self.slot):
+                    messages = await asyncio.to_thread(
+                        views.open_turn, sid, text, self.persona, self.challenge, self.slot
+                    )
+                    speaker = Speaker(self, turn, started)
+                    events = async_views.stream_rebuttal_events(
+                        sid, messages, time.perf_counter(), self.persona, _event, self.slot
+                    )
+                    # Closed right away on barge-in, which ends the upstream stream
+                    async with contextlib.aclosing(events):
+                        async for name, data in events:
+                            if name == "delta":
+                                await self.send_json({"type": "delta", "turn": turn, "text": data["text"]})
+                                speaker.feed(data["text"])
+                            elif name == "done":
+                                await self.send_json({"type": "rebuttal", "turn": turn, **data})
+                            else:
+                                await self.send_error(data["error"], turn, sessionId=sid)
+                                return
+                try:
+                    await speaker.finish()
+                except Exception as e:
+                    # The text was delivered; only the voice is missing
+                    metrics.inc("voice_ws_tts_errors_total")
+                    await self.send_error(str(e), turn, stage="tts")
+                outcome = "done"
+                first_audio = speaker.first_audio
+                await self.send_json(
+                    {
+                        "type": "done",
+                        "turn": turn,
+                        "sessionId": sid,
+                        "timings": timings.as_dict(),
+                        "first_audio_ms": round(first_audio * 1000, 1) if first_audio is not None else None,
+                        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                    }
+                )
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except turns.TurnRejected as e:
+            outcome = "rejected"
+            await self.send_error(str(e), turn, status=e.status)
+        except Exception as e:
+            await self.send_error(str(e), turn, status=views.upstream_error_response(e).status_code)
+        finally:
+            if speaker is not None:
+                speaker.cancel()
+            if recording is not None:
+                recording.close()
+            metrics.inc("voice_ws_turns_total", outcome=outcome)
+            metrics.observe("voice_ws_turn_seconds", time.perf_counter() - started, buckets=VOICE_BUCKETS)
+
+    async def close(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.wait([self.task])
+        self.discard_recording()
+
+
+async def voice_channel(scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+    """ASGI application for one voice WebSocket connection."""
+    global _open_connections
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    if not origin_allowed(scope):
+        metrics.inc("voice_ws_rejected_total", reason="origin")
+        # Closing before accepting answers the handshake with 403
+        await send({"type": "websocket.close", "code": 1008})
+        return
+    await send({"type": "websocket.accept"})
+    channel = VoiceChannel(scope, receive, send)
+    _open_connections += 1
+    metrics.set_gauge("voice_ws_connections", _open_connections)
+    try:
+        await channel.run()
+    finally:
+        _open_connections -= 1
+        metrics.set_gauge("voice_ws_connections", _open_connections)
+        await channel.close()
+
+
+async def websocket_application(scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+    """Route WebSocket connections: the voice channel, or a refused handshake."""
+    if scope["path"] == settings.VOICE_WS_PATH:
+        await voice_channel(scope, receive, send)
+        return
+    await receive()  # websocket.connect
+    metrics.inc("voice_ws_rejected_total", reason="path")
+    await send({"type": "websocket.close", "code": 1000})
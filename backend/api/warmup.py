@@ -0,0 +1,168 @@
+"""Warm a worker up before it takes its first request.
+
+A fresh worker paid for everything it had not done yet on its first
+request. That included importing the views behind the lazily loaded URL
+configuration, opening the session store, guardrails and caches, loading
+the tokenizer, and the TCP and TLS handshakes of the first provider call.
+Persona stock lines were also synthesised on first use. :func:`warm_up`
+does this ahead of time, in steps:
+
+* ``urls``: import the URL configuration and every view module;
+* ``backends``: create the inference backends and load local models
+  (:func:`api.backends.warm_backends`);
+* ``stores``: open the session store, TTS cache, response cache and
+  guardrails, and load the tokenizer;
+* ``personas``: build each persona's system prompts and load the asset
+  bundle of pre-synthesised stock lines (``api.persona_assets``),
+  synthesising missing lines first if asked to;
+* ``connections``: open ``WARMUP_CONNECTIONS`` keep-alive connections to
+  each provider the configured backends call.
+
+Run it with ``python manage.py warmup``. That command checks the
+configuration and builds the asset bundle (``--build-assets``) at deploy
+time. Its connections and loaded state belong to its own process, though.
+To warm the serving workers themselves, set ``WARMUP_ON_BOOT``:
+``devdebate/wsgi.py`` then warms each WSGI process as it loads, and the
+ASGI lifespan startup warms the worker and opens its event loop's
+connections (:func:`awarm_up`). Under ``gunicorn --preload`` the
+connections opened before the fork are dropped in the workers; warm in a
+``post_fork`` hook instead.
+
+Each step's duration is recorded in the ``warmup_seconds`` histogram.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from django.conf import settings
+
+from . import Persona, metrics
+from .backends import get_backend, warm_backends
+from .upstream import aopen_connections, open_connections
+
+# Warm-up steps take from milliseconds (imports) to seconds (local models)
+WARMUP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def upstream_providers() -> List[str]:
+    """Return the ``UPSTREAM_PROVIDERS`` keys the configured backends call."""
+    providers = []
+    for kind in ("chat", "stt", "tts"):
+        provider = getattr(get_backend(kind), "provider", None)
+        if provider and provider not in providers:
+            providers.append(provider)
+    return providers
+
+
+def warm_urls() -> int:
+    from django.urls import get_resolver
+
+    return len(get_resolver().url_patterns)
+
+
+def warm_stores() -> Dict[str, Any]:
+    from .context import count_tokens
+    from .guardrails import get_guardrail
+    from .response_cache import get_response_cache
+    from .session_store import get_session_store
+    from .tts_cache import get_cache as get_tts_cache
+
+    get_session_store()
+    get_guardrail()
+    get_response_cache()
+    return {
+        "tts_cache_bytes": get_tts_cache().total_bytes,
+        "tokens": count_tokens("Warm up the tokenizer.", settings.CONTEXT_TOKENIZER_MODEL),
+    }
+
+
+def warm_personas(
+    build_assets: bool = False, force: bool = False, formats: Optional[Sequence[str]] = None
+) -> Dict[str, Any]:
+    from .persona_assets import get_bundle
+    from .views import build_persona_prompt, synthesize_speech, tts_cache_key
+
+    for persona in Persona:
+        build_persona_prompt(persona)
+        build_persona_prompt(persona, challenge=True)
+    bundle = get_bundle()
+    result: Dict[str, Any] = {"personas": len(Persona)}
+    if build_assets:
+        result.update(
+            bundle.build(
+                synthesize_speech,
+                tts_cache_key,
+                settings.PERSONA_ASSET_VOICE,
+                formats or settings.PERSONA_ASSET_FORMATS,
+                model_id=get_backend("tts").model_id,
+                force=force,
+            )
+        )
+    result["bundled"] = len(bundle)
+    return result
+
+
+def warm_connections() -> Dict[str, int]:
+    return {provider: open_connections(provider, settings.WARMUP_CONNECTIONS) for provider in upstream_providers()}
+
+
+def _step(report: Dict[str, Any], name: str, run: Callable[[], Any]) -> None:
+    started = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.observe("warmup_seconds", seconds, buckets=WARMUP_BUCKETS, step=name)
+        report[name] = {"seconds": round(seconds, 4)}
+    report[name]["result"] = result
+
+
+def warm_up(
+    build_assets: bool = False,
+    force: bool = False,
+    connections: bool = True,
+    formats: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """Run the warm-up steps in this process.
+
+    Args:
+        build_assets: Synthesise persona stock lines missing from the bundle.
+        force: With ``build_assets``, synthesise every line again.
+        connections: Open connections to the providers.
+        formats: Audio formats to build (default ``PERSONA_ASSET_FORMATS``).
+
+    Returns:
+        Each step's ``seconds`` and ``result``, in order.
+
+    Raises:
+        Exception: A step failed, for example a local model would not load.
+            Providers that cannot be reached are not an error.
+    """
+    report: Dict[str, Any] = {}
+    _step(report, "urls", warm_urls)
+    _step(report, "backends", warm_backends)
+    _step(report, "stores", warm_stores)
+    _step(report, "personas", lambda: warm_personas(build_assets, force, formats))
+    if connections:
+        _step(report, "connections", warm_connections)
+    return report
+
+
+async def awarm_up() -> Dict[str, Any]:
+    """Run :func:`warm_up` for an ASGI worker.
+
+    The synchronous steps run in a thread. The connections are opened by
+    the running event loop's async clients, which are the ones its
+    requests use.
+    """
+    report = await asyncio.to_thread(warm_up, connections=False)
+    providers = upstream_providers()
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(aopen_connections(p, settings.WARMUP_CONNECTIONS) for p in providers))
+    result = dict(zip(providers, counts))
+    seconds = time.perf_counter() - started
+    metrics.observe("warmup_seconds", seconds, buckets=WARMUP_BUCKETS, step="connections")
+    report["connections"] = {"seconds": round(seconds, 4), "result": result}
+    return report
@@ -0,0 +1,11 @@
+"""Benchmarks for the devdebate backend.
+
+Each module is a standalone script; run them from the ``backend`` directory,
+for example ``python -m benchmarks.bench_wsgi_vs_asgi``. None of them talk to
+the real providers: they start :class:`benchmarks.fake_upstream.FakeUpstream`
+and point the backend at it. ``benchmarks.recording`` can record real
+provider answers once and replay them in its place, and
+``benchmarks.bench_load`` load-tests the whole API against a saved baseline
+(``baselines/load.json``). ``benchmarks.bench_warmup`` compares the first
+requests of cold and warmed-up workers.
+"""
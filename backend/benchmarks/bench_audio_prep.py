@@ -0,0 +1,96 @@
+"""Measure what STT preprocessing saves on sample clips.
+
+Generates 48 kHz stereo WAV clips shaped like browser recordings (pauses
+before, between and after speech-like bursts over a low noise floor) and
+runs each through :func:`api.audio_prep.prepare` in the process pool,
+reporting bytes and seconds before and after and the time taken. Needs
+``numpy``; with ``ffmpeg`` on the ``PATH`` the output is Opus, otherwise
+16 kHz WAV.
+
+Usage::
+
+    python -m benchmarks.bench_audio_prep --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import sys
+import time
+import wave
+from typing import Any, Dict, List, Tuple
+
+from .common import setup_django, summarize
+
+RATE = 48000
+
+# (name, [(seconds, kind)]) where kind is "silence", "speech" or "quiet"
+CLIPS: List[Tuple[str, List[Tuple[float, str]]]] = [
+    ("pause_before_and_after", [(2.0, "silence"), (4.0, "speech"), (3.0, "silence")]),
+    ("long_pause_mid_sentence", [(1.0, "silence"), (3.0, "speech"), (4.0, "silence"), (3.0, "speech"), (1.0, "silence")]),
+    ("continuous_speech", [(8.0, "speech")]),
+    ("quiet_speaker", [(1.5, "silence"), (5.0, "quiet"), (1.5, "silence")]),
+]
+
+
+def make_clip(parts: List[Tuple[float, str]], seed: int = 0) -> bytes:
+    """Render ``parts`` as a 16-bit stereo WAV."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for seconds, kind in parts:
+        t = np.arange(int(seconds * RATE)) / RATE
+        signal = rng.normal(0, 0.001, len(t))
+        if kind != "silence":
+            # Syllable-rate amplitude modulation over a voiced harmonic series
+            voiced = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in range(1, 8))
+            envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, 1) ** 0.5
+            signal += (0.3 if kind == "speech" else 0.02) * envelope * voiced
+        pieces.append(signal)
+    mono = np.concatenate(pieces)
+    stereo = np.stack([mono, mono * 0.9], axis=1)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes((np.clip(stereo, -1, 1) * 32767).astype("<i2").tobytes())
+    return out.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django(SESSION_STORE_BACKEND="memory", STT_PREPROCESS="true")
+    from api import audio_prep, metrics
+
+    if not audio_prep.numpy_available():
+        sys.exit("numpy is required: pip install numpy")
+    report: Dict[str, Any] = {"encoder": "opus" if audio_prep.ffmpeg_path() else "wav", "clips": {}}
+    # Start the pool workers so the first clip does not pay for it
+    audio_prep.prepare(io.BytesIO(make_clip([(0.5, "speech")])), "audio/wav")
+    for name, parts in CLIPS:
+        clip = make_clip(parts)
+        timings, prepared = [], None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            prepared = audio_prep.prepare(io.BytesIO(clip), "audio/wav")
+            timings.append(time.perf_counter() - start)
+        seconds = sum(part[0] for part in parts)
+        report["clips"][name] = {
+            "bytes_in": len(clip),
+            "bytes_out": prepared.bytes_out if prepared else len(clip),
+            "seconds_in": seconds,
+            "seconds_out": round(prepared.seconds_out, 2) if prepared else seconds,
+            "prepare": summarize(timings),
+        }
+    report["bytes_saved_total"] = metrics.counter_value("stt_preprocess_bytes_saved_total")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
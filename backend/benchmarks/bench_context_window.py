@@ -0,0 +1,97 @@
+"""Check that rebuttal prompts stay bounded over a long debate.
+
+Plays ``--turns`` turns of one debate through ``POST /api/rebuttal`` against
+the fake upstream (which also answers the background summary requests) and
+records the prompt size of every turn from the ``rebuttal_prompt_tokens``
+metric. For comparison it also reports the size the prompt would have had
+if the whole transcript were replayed (without the short format reminder). Exits non-zero if any prompt exceeds
+the configured budget plus the fixed system and reminder messages.
+
+Usage::
+
+    python -m benchmarks.bench_context_window --turns 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from typing import List
+
+from .common import setup_django
+from .fake_upstream import FakeUpstream
+
+STANCES = [
+    "Remote work makes teams more productive.",
+    "Open offices kill deep focus and should be banned outright.",
+    "Code review slows delivery more than it improves quality, and most teams would ship better software "
+    "if they replaced it with pairing and strong automated tests.",
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency, chunk_delay=0).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+    )
+    from django.conf import settings
+    from django.test import Client
+
+    from api import Persona, metrics
+    from api.context import count_message_tokens
+    from api.session_store import get_session_store
+    from api.views import build_persona_prompt, context_window
+
+    client = Client()
+    sid = None
+    prompt: List[int] = []
+    replay: List[int] = []
+    for turn in range(args.turns):
+        metrics.reset()
+        body = {"stance": STANCES[turn % len(STANCES)], "persona": "socrates"}
+        if sid:
+            body["sessionId"] = sid
+        resp = client.post("/api/rebuttal", json.dumps(body), content_type="application/json")
+        assert resp.status_code == 200, resp.content
+        sid = resp.json()["sessionId"]
+        prompt.append(int(metrics.snapshot()["histograms"]["rebuttal_prompt_tokens"][""]["sum"]))
+        full = [{"role": "system", "content": build_persona_prompt(Persona.SOCRATES)}]
+        full += [{"role": r, "content": t} for r, t in get_session_store().turns(sid)[:-1]]
+        replay.append(count_message_tokens(full))
+        # Let the background summariser keep pace, as it would between real turns
+        deadline = time.monotonic() + 5
+        while context_window().pending and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    # System prompt plus the format reminder appended after the history
+    fixed = count_message_tokens([{"role": "system", "content": build_persona_prompt(Persona.SOCRATES)}]) + 50
+    bound = settings.CONTEXT_MAX_TOKENS + fixed
+    checkpoints = sorted({1, 10, 50, 100, args.turns} & set(range(1, args.turns + 1)))
+    print(
+        json.dumps(
+            {
+                "turns": args.turns,
+                "budget_tokens": settings.CONTEXT_MAX_TOKENS,
+                "bound_tokens": bound,
+                "max_prompt_tokens": max(prompt),
+                "total_prompt_tokens": sum(prompt),
+                "total_replay_tokens": sum(replay),
+                "per_turn": {n: {"prompt": prompt[n - 1], "full_replay": replay[n - 1]} for n in checkpoints},
+            },
+            indent=2,
+        )
+    )
+    if max(prompt) > bound:
+        sys.exit(f"prompt exceeded bound: {max(prompt)} > {bound}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measure banned-topic check cost as the blocklist grows.
+
+Generates synthetic blocklists of increasing size (one to three pseudo-words
+per term, like real phrases) and times a check of a typical clean stance
+with the compiled matcher and with the original per-keyword substring scan.
+The compiled matcher's per-request cost should stay roughly flat; the scan
+grows linearly with the list.
+
+Usage::
+
+    python -m benchmarks.bench_guardrails --sizes 10 100 1000 10000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import string
+import time
+from typing import Callable, Dict, List
+
+from .common import setup_django, summarize
+
+STANCE = (
+    "Remote work makes software teams more productive because engineers get long "
+    "uninterrupted blocks of focus time, skip the commute and can structure their "
+    "day around deep work instead of meetings. Companies that force everyone back "
+    "to the office are optimising for visibility rather than output, and they will "
+    "lose their best people to competitors who trust them."
+)
+
+
+def make_terms(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    terms = set()
+    while len(terms) < count:
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(rng.randint(1, 3))]
+        terms.add(" ".join(words))
+    return sorted(terms)
+
+
+def time_check(check: Callable[[str], object], runs: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        check(STANCE)
+        samples.append(time.perf_counter() - start)
+    result = summarize(samples)
+    return {
+        "count": result["count"],
+        "mean_us": round(sum(samples) / len(samples) * 1e6, 1),
+        "p99_ms": result["p99_ms"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_django()
+    from api.guardrails import TopicMatcher
+
+    results = {}
+    for size in args.sizes:
+        terms = make_terms(size)
+        start = time.perf_counter()
+        matcher = TopicMatcher(terms)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        def substring_scan(text: str, terms: List[str] = terms) -> bool:
+            lowered = text.lower()
+            return any(keyword.lower() in lowered for keyword in terms)
+
+        assert matcher.search(STANCE) is None
+        assert matcher.search(f"{STANCE} {terms[len(terms) // 2].upper()}.") is not None
+        results[size] = {
+            "compile_ms": round(compile_ms, 1),
+            "compiled": time_check(matcher.search, args.runs),
+            "substring_scan": time_check(substring_scan, max(1, args.runs // 10)),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""End-to-end load test of the HTTP API, checked against a baseline.
+
+Two child processes are started:
+
+* the providers: :class:`~benchmarks.fake_upstream.FakeUpstream`, or a
+  :class:`~benchmarks.recording.ReplayUpstream` of ``--fixture``;
+* the backend: Django's threaded WSGI server running the synchronous views.
+  It uses a memory session store and a scratch ``MEDIA_ROOT``, and runs in
+  its own process so its memory use can be measured.
+
+After ``--sessions`` unmeasured rebuttals have started the debates, each
+scenario drives one endpoint at ``--rps`` requests per second for
+``--duration`` seconds, after one second of warm-up:
+
+* ``rebuttal``: a debate turn, continuing one of ``--sessions`` debates;
+* ``tts``: synthesis of a rebuttal-sized text (unique, so the TTS cache
+  misses);
+* ``stt``: transcription of an MP3 upload (a distinct one each time);
+* ``download``: a transcript download;
+* ``reset``: a transcript reset.
+
+The load is open loop. Request ``i`` is sent ``i / rps`` seconds after the
+start whether or not earlier ones have finished, and its latency is counted
+from that moment. A server that falls behind therefore shows up in the
+percentiles instead of quietly lowering the request rate.
+
+The report gives, per scenario, the requests sent, the error rate (non-2xx
+answers and transport failures), the throughput of successful requests,
+latency percentiles, and the backend's peak and final resident set size.
+With ``--baseline`` it is compared with a saved report:
+
+* p95 and p99 latency may grow, and throughput and memory may fall or grow,
+  by at most ``--tolerance``. Latency may also always grow by ``--slack-ms``,
+  so millisecond-scale endpoints do not fail on scheduling noise;
+* the error rate may grow by at most one percentage point.
+
+Any regression is listed and the run exits with status 1.
+``--write-baseline`` saves the report as the new baseline. Baselines hold
+the run parameters; comparing runs made with different ones only warns.
+
+Usage::
+
+    python -m benchmarks.bench_load --baseline benchmarks/baselines/load.json
+    python -m benchmarks.bench_load --rps 50 --fixture fixtures/upstream.jsonl --write-baseline /tmp/load.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from .common import BACKEND_DIR, rss_bytes, setup_django, start_wsgi_server, summarize
+from .fake_upstream import FAKE_MP3, REBUTTAL, FakeUpstream
+
+SCENARIOS = ("rebuttal", "tts", "stt", "download", "reset")
+
+STANCES = [
+    "Remote work is better for everyone.",
+    "Cities should ban private cars from their centres.",
+    "Social media has done more harm than good.",
+    "Nuclear power is the safest path to a low-carbon grid.",
+]
+
+# Report fields compared with the baseline, and whether lower is better
+LIMITS = {"p95_ms": True, "p99_ms": True, "throughput_rps": False, "rss_peak_mb": True}
+
+Request = Callable[[httpx.Client, int], httpx.Response]
+
+
+def serve(upstream: str) -> None:
+    """Run the backend under test until terminated (the ``--serve`` child)."""
+    media_root = tempfile.mkdtemp(prefix="bench-load-media-")
+    setup_django(
+        OPENAI_BASE_URL=upstream,
+        ELEVENLABS_BASE_URL=upstream,
+        SESSION_STORE_BACKEND="memory",
+        DEVDEBATE_ASYNC_VIEWS="false",
+    )
+    from django.conf import settings
+
+    settings.MEDIA_ROOT = media_root
+    settings.TTS_CACHE_DIR = Path(media_root, "tts")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server = start_wsgi_server()
+        print(f"Backend listening on {server.server_port}", flush=True)
+        threading.Event().wait()
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def start_backend(upstream: str) -> Tuple[subprocess.Popen, str]:
+    """Start the ``--serve`` child; return it and its base URL."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_load", "--serve", "--upstream", upstream],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    port = int(process.stdout.readline().split()[-1])
+    return process, f"http://127.0.0.1:{port}"
+
+
+class SessionPool:
+    """Debates the load test continues, each used by one turn at a time.
+
+    Turns of one session are serialised by the backend (``api.turns``), so
+    handing a session to two requests at once would measure queueing, not
+    the turn itself.
+    """
+
+    def __init__(self) -> None:
+        self.all: List[str] = []
+        self._free: Deque[str] = deque()
+        self._lock = threading.Lock()
+
+    def checkout(self) -> Optional[str]:
+        with self._lock:
+            return self._free.popleft() if self._free else None
+
+    def checkin(self, session_id: Optional[str]) -> None:
+        if not session_id:
+            return
+        with self._lock:
+            if session_id not in self.all:
+                self.all.append(session_id)
+            self._free.append(session_id)
+
+    def any(self, i: int) -> str:
+        return self.all[i % len(self.all)]
+
+
+def scenario_requests(sessions: SessionPool, audio: bytes) -> Dict[str, Request]:
+    def rebuttal(client: httpx.Client, i: int) -> httpx.Response:
+        sid = sessions.checkout()
+        body = {"stance": STANCES[i % len(STANCES)], "persona": "socrates"}
+        if sid:
+            body["sessionId"] = sid
+        try:
+            response = client.post("/api/rebuttal", json=body)
+        except Exception:
+            sessions.checkin(sid)
+            raise
+        sessions.checkin(response.json().get("sessionId") if response.status_code == 200 else sid)
+        return response
+
+    text = REBUTTAL["rebuttal_text"]
+    return {
+        "rebuttal": rebuttal,
+        "tts": lambda client, i: client.post("/api/tts", json={"text": f"{text} ({i})"}),
+        # A distinct upload each time, so identical concurrent ones are not coalesced
+        "stt": lambda client, i: client.post(
+            "/api/stt", files={"file": ("turn.mp3", audio + i.to_bytes(4, "big"), "audio/mpeg")}
+        ),
+        "download": lambda client, i: client.get("/api/download", params={"sessionId": sessions.any(i)}),
+        "reset": lambda client, i: client.post("/api/reset", json={"sessionId": sessions.any(i)}),
+    }
+
+
+class RssSampler:
+    """Sample a process's resident set size in the background."""
+
+    def __init__(self, pid: int, interval: float = 0.1) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_bytes(pid) or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes(self.pid) or 0)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def megabytes(size: Optional[int]) -> Optional[float]:
+    return round(size / 1e6, 1) if size else None
+
+
+def run_scenario(
+    base_url: str, request: Request, rps: float, duration: float, max_in_flight: int, pid: int
+) -> Dict[str, Any]:
+    """Send ``rps * duration`` requests on an open-loop schedule; return the stats."""
+    total = max(1, int(rps * duration))
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    finished: List[float] = []
+    local = threading.local()
+
+    def one(i: int, scheduled: float) -> None:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = httpx.Client(base_url=base_url, timeout=60)
+        try:
+            status = request(client, i).status_code
+        except Exception:
+            status = 0
+        now = time.perf_counter()
+        statuses[status] += 1
+        if 200 <= status < 300:
+            latencies.append(now - scheduled)
+            finished.append(now)
+
+    with RssSampler(pid) as rss, ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(one, i, scheduled)
+    elapsed = (max(finished) if finished else time.perf_counter()) - start
+    errors = total - len(latencies)
+    return {
+        "sent": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        **summarize(latencies),
+        "rss_peak_mb": megabytes(rss.peak),
+        "rss_end_mb": megabytes(rss_bytes(pid)),
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, slack_ms: float = 0.0) -> List[str]:
+    """Return the regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        current = report["scenarios"].get(name)
+        if current is None:
+            continue
+        for field, lower_is_better in LIMITS.items():
+            old, new = base.get(field), current.get(field)
+            if not old or new is None:
+                continue
+            limit = old * (1 + tolerance) if lower_is_better else old * (1 - tolerance)
+            if field.endswith("_ms"):
+                limit = max(limit, old + slack_ms)
+            if (new > limit) if lower_is_better else (new < limit):
+                regressions.append(f"{name}: {field} {round(new, 1)} vs baseline {old} (limit {round(limit, 1)})")
+        if current["error_rate"] > base.get("error_rate", 0) + 0.01:
+            regressions.append(f"{name}: error_rate {current['error_rate']} vs baseline {base.get('error_rate', 0)}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated, run in this order")
+    parser.add_argument("--rps", type=float, default=10, help="target requests per second per scenario")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="client threads")
+    parser.add_argument("--sessions", type=int, default=20, help="debates created before measuring")
+    parser.add_argument("--fixture", help="replay this recording instead of canned answers")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up for --fixture")
+    parser.add_argument("--latency", type=float, default=0.25, help="upstream latency (added when replaying)")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="log-normal sigma of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests answered 503")
+    parser.add_argument("--baseline", help="fail if the run regresses against this report")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative change")
+    parser.add_argument("--slack-ms", type=float, default=50, help="latency growth always allowed")
+    parser.add_argument("--write-baseline", help="save the report here")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.upstream)
+        return
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    options = {"latency": args.latency, "latency_sigma": args.latency_sigma, "error_rate": args.error_rate}
+    audio = FAKE_MP3
+    if args.fixture:
+        from .recording import ReplayUpstream
+
+        upstream: FakeUpstream = ReplayUpstream(args.fixture, args.speed, **options)
+        recorded_audio = upstream.recorded.get("tts")
+        if recorded_audio:
+            audio = recorded_audio[0].body
+    else:
+        upstream = FakeUpstream(**options)
+    upstream.start_process()
+    backend, base_url = start_backend(upstream.base_url)
+    params = {
+        key: getattr(args, key)
+        for key in ("rps", "duration", "sessions", "latency", "latency_sigma", "error_rate", "speed")
+    }
+    params["fixture"] = os.path.basename(args.fixture) if args.fixture else None
+    report: Dict[str, Any] = {"params": params, "scenarios": {}}
+    try:
+        sessions = SessionPool()
+        requests = scenario_requests(sessions, audio)
+        warm_up = run_scenario(base_url, requests["rebuttal"], args.sessions, 1, args.sessions, backend.pid)
+        if not sessions.all:
+            raise SystemExit(f"Warm-up failed: {warm_up['statuses']}")
+        report["rss_start_mb"] = megabytes(rss_bytes(backend.pid))
+        for name in scenarios:
+            # Unmeasured: fills connection pools and starts worker processes
+            run_scenario(base_url, requests[name], 5, 1, args.max_in_flight, backend.pid)
+            report["scenarios"][name] = run_scenario(
+                base_url, requests[name], args.rps, args.duration, args.max_in_flight, backend.pid
+            )
+            print(f"{name}: {json.dumps(report['scenarios'][name])}", file=sys.stderr, flush=True)
+    finally:
+        backend.terminate()
+        backend.wait()
+        upstream.stop()
+    print(json.dumps(report, indent=2))
+
+    if args.write_baseline:
+        Path(args.write_baseline).write_text(json.dumps(report, indent=2) + "\n")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("params") != params:
+            print(f"warning: baseline was run with {json.dumps(baseline.get('params'))}", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Measure concurrent fetches of generated audio from ``/media/``.
+
+A threaded WSGI server (Django's ``runserver`` server, on a real socket)
+serves ``--files`` MP3-sized files of ``--size`` bytes from a temporary
+``MEDIA_ROOT``. ``--concurrency`` client threads then make ``--requests``
+requests in each scenario, comparing ``api.media`` with Django's
+``django.views.static.serve`` (mounted at ``/baseline/`` for the run):
+
+* ``full``: download a whole file, as the first play of a turn does;
+* ``seek``: fetch the last ``--seek-bytes``, as seeking near the end of a
+  turn does (``static.serve`` ignores ``Range`` and sends everything);
+* ``revalidate``: a conditional GET for a file the client already has
+  (``If-None-Match`` here, ``If-Modified-Since`` for ``static.serve``);
+* ``offload``: ``MEDIA_OFFLOAD=x-accel-redirect``, measuring only Django's
+  part; nginx would then send the bytes.
+
+The report gives requests and megabytes per second plus latency
+percentiles for each.
+
+Usage::
+
+    python -m benchmarks.bench_media --requests 2000 --concurrency 32
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+from .common import setup_django, start_wsgi_server, summarize
+
+urlpatterns: List[Any] = []
+
+
+def run_scenario(
+    base_url: str, requests: int, concurrency: int, request: Callable[[httpx.Client, int], httpx.Response]
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    received = [0]
+    local = threading.local()
+
+    def one(i: int) -> None:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = httpx.Client(base_url=base_url)
+        start = time.perf_counter()
+        resp = request(client, i)
+        latencies.append(time.perf_counter() - start)
+        assert resp.status_code in (200, 206, 304), resp.status_code
+        received[0] += len(resp.content)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": round(requests / elapsed, 1),
+        "mb_per_s": round(received[0] / elapsed / 1e6, 1),
+        "bytes_per_request": received[0] // requests,
+        **summarize(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size", type=int, default=400_000, help="bytes per file (about 25 s of 128 kbps MP3)")
+    parser.add_argument("--seek-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp(prefix="bench-media-")
+    setup_django(SESSION_STORE_BACKEND="memory", DEVDEBATE_ASYNC_VIEWS="false")
+    from django.conf import settings
+    from django.urls import re_path
+    from django.views import static
+
+    import devdebate.urls
+
+    settings.MEDIA_ROOT = media_root
+    settings.ROOT_URLCONF = __name__
+    urlpatterns[:] = [
+        re_path(r"^baseline/(?P<path>.+)$", static.serve, {"document_root": media_root}),
+        *devdebate.urls.urlpatterns,
+    ]
+    names = []
+    for i in range(args.files):
+        name = f"{i:064x}.mp3"
+        with open(os.path.join(media_root, name), "wb") as file:
+            file.write(os.urandom(args.size))
+        names.append(name)
+
+    server = start_wsgi_server()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    validators = {}
+    with httpx.Client(base_url=base_url) as client:
+        for name in names:
+            media = client.get(f"/media/{name}")
+            baseline = client.get(f"/baseline/{name}")
+            validators[name] = (media.headers["ETag"], baseline.headers["Last-Modified"])
+
+    def file_for(i: int) -> str:
+        return names[i % len(names)]
+
+    seek = {"Range": f"bytes=-{args.seek_bytes}"}
+    scenarios: Dict[str, Callable[[httpx.Client, int], httpx.Response]] = {
+        "full_static_serve": lambda c, i: c.get(f"/baseline/{file_for(i)}"),
+        "full_media": lambda c, i: c.get(f"/media/{file_for(i)}"),
+        "seek_static_serve": lambda c, i: c.get(f"/baseline/{file_for(i)}", headers=seek),
+        "seek_media": lambda c, i: c.get(f"/media/{file_for(i)}", headers=seek),
+        "revalidate_static_serve": lambda c, i: c.get(
+            f"/baseline/{file_for(i)}", headers={"If-Modified-Since": validators[file_for(i)][1]}
+        ),
+        "revalidate_media": lambda c, i: c.get(
+            f"/media/{file_for(i)}", headers={"If-None-Match": validators[file_for(i)][0]}
+        ),
+    }
+    report: Dict[str, Any] = {"files": args.files, "size": args.size, "concurrency": args.concurrency}
+    try:
+        for label, request in scenarios.items():
+            report[label] = run_scenario(base_url, args.requests, args.concurrency, request)
+        settings.MEDIA_OFFLOAD = "x-accel-redirect"
+        report["offload_media"] = run_scenario(
+            base_url, args.requests, args.concurrency, lambda c, i: c.get(f"/media/{file_for(i)}")
+        )
+    finally:
+        server.shutdown()
+        shutil.rmtree(media_root, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Compare the old and tolerant parsers on damaged rebuttal completions.
+
+Builds a corpus from a few well-formed rebuttals: each one as returned, in
+a code fence, surrounded by prose, with a trailing comma, with a raw
+newline in the text, and cut off at every ``--step`` characters (what
+``max_tokens`` does). Each sample goes through the previous
+strip-fences-and-``json.loads`` parser and through
+:func:`api.views.read_model_output` plus schema validation. The
+report gives, per kind of damage, how many samples each parser turned
+into a rebuttal, how many would get a continuation request, and the
+parse time.
+
+Usage::
+
+    python -m benchmarks.bench_model_json --step 5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+from .common import setup_django
+
+REBUTTALS = [
+    {
+        "rebuttal_text": (
+            "Lowering tuition sounds generous, but someone still pays: taxpayers, or students "
+            "through larger classes and fewer services. Cheaper seats also raise demand, so "
+            "the crowding you hoped to fix gets worse. Why not target aid at those who need it?"
+        ),
+        "bullets": [
+            "Someone still pays, through taxes or cuts.",
+            "Cheaper price, demand surge, overcrowding.",
+            "Targeted aid beats blanket cuts.",
+        ],
+    },
+    {
+        "rebuttal_text": (
+            "Remote work saves the commute, yet it quietly erodes mentoring and the \"chance\" "
+            "encounters that build careers — especially for juniors who learn by overhearing."
+        ),
+        "bullets": ["Mentoring suffers.", "Serendipity is lost.", "Juniors pay the price."],
+    },
+    {
+        "rebuttal_text": "Is a café with no Wi-Fi really a café? Habits adapt; the data 📈 says so.",
+        "bullets": ["Habits adapt."],
+    },
+]
+
+
+def old_parse(content: str) -> Dict[str, Any]:
+    """The parser ``api.views`` used before the tolerant one."""
+    cleaned = content.strip().strip("`")
+    start = cleaned.find("{")
+    end = cleaned.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError("Model did not return JSON")
+    return json.loads(cleaned[start : end + 1])
+
+
+def corpus(step: int) -> List[Tuple[str, str]]:
+    samples: List[Tuple[str, str]] = []
+    for rebuttal in REBUTTALS:
+        text = json.dumps(rebuttal, ensure_ascii=False)
+        samples.append(("valid", text))
+        samples.append(("fenced", f"```json\n{json.dumps(rebuttal, indent=2)}\n```"))
+        samples.append(("prose", f"Here is my answer:\n{text}\nHope that helps!"))
+        samples.append(("trailing_comma", text[:-1] + ",}"))
+        samples.append(("raw_newline", text.replace(". ", ".\n", 1)))
+        opening = len('{"rebuttal_text": "')
+        for cut in range(opening + 1, len(text), step):
+            samples.append(("truncated", text[:cut]))
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--step", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django(SESSION_STORE_BACKEND="memory")
+    from api import views
+    from api.structured import validate_rebuttal
+
+    report: Dict[str, Dict[str, Any]] = {}
+    timings = {"old": 0.0, "tolerant": 0.0}
+    for kind, sample in corpus(args.step):
+        row = report.setdefault(kind, {"samples": 0, "old_ok": 0, "tolerant_ok": 0, "would_continue": 0})
+        row["samples"] += 1
+        start = time.perf_counter()
+        try:
+            old_parse(sample)
+            row["old_ok"] += 1
+        except ValueError:
+            pass
+        timings["old"] += time.perf_counter() - start
+        start = time.perf_counter()
+        parsed = views.read_model_output(sample)
+        try:
+            if parsed is not None:
+                validate_rebuttal(parsed.data)
+                row["tolerant_ok"] += 1
+        except ValueError:
+            pass
+        timings["tolerant"] += time.perf_counter() - start
+        row["would_continue"] += int(views.needs_continuation(parsed))
+    total = sum(row["samples"] for row in report.values())
+    print(
+        json.dumps(
+            {
+                "kinds": report,
+                "samples": total,
+                "old_ok": sum(row["old_ok"] for row in report.values()),
+                "tolerant_ok": sum(row["tolerant_ok"] for row in report.values()),
+                "mean_parse_us": {name: round(seconds / total * 1e6, 1) for name, seconds in timings.items()},
+            },
+            indent=2,
+            ensure_ascii=False,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
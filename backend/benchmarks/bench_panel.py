@@ -0,0 +1,99 @@
+"""Compare a three-persona panel with three sequential rebuttal calls.
+
+Against a fake upstream with ``--latency`` seconds (plus up to ``--jitter``)
+per completion, each run asks Socrates, Karen 2.0 and Professor Logic about
+the same stance, first with one ``POST /api/rebuttal`` per persona and then
+with a single ``POST /api/panel``, buffered and streamed as JSON lines. The
+stream also reports when the first result arrived. Pass ``--async`` to drive
+the coroutine views.
+
+Usage::
+
+    python -m benchmarks.bench_panel --runs 5 --latency 0.4 --jitter 0.3
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+from .common import setup_django, summarize
+from .fake_upstream import FakeUpstream
+
+PERSONAS = ["socrates", "karen2.0", "professorlogic"]
+
+
+async def content(resp: Any) -> bytes:
+    """Read a (possibly streamed, possibly async) test client response."""
+    if not resp.streaming:
+        return resp.content
+    if hasattr(resp.streaming_content, "__aiter__"):
+        return b"".join([chunk async for chunk in resp.streaming_content])
+    return b"".join(resp.streaming_content)
+
+
+async def run(client: Any, use_async: bool, stance: str) -> Dict[str, float]:
+    async def post(path: str, body: Dict[str, Any]) -> Any:
+        data = json.dumps(body)
+        if use_async:
+            return await client.post(path, data, content_type="application/json")
+        return await asyncio.to_thread(client.post, path, data, content_type="application/json")
+
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    for persona in PERSONAS:
+        resp = await post("/api/rebuttal", {"stance": stance, "persona": persona})
+        assert resp.status_code == 200, resp.content
+    timings["sequential"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resp = await post("/api/panel", {"stance": stance, "personas": PERSONAS})
+    assert resp.status_code == 200 and not json.loads(resp.content)["errors"], resp.content
+    timings["panel"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resp = await post("/api/panel", {"stance": stance, "personas": PERSONAS, "stream": True})
+    lines = [json.loads(line) for line in (await content(resp)).splitlines()]
+    assert lines[-1]["done"] and not lines[-1]["errors"], lines
+    timings["panel_stream"] = time.perf_counter() - start
+    timings["panel_stream_first"] = lines[0]["elapsed_ms"] / 1000
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.4)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency, jitter=args.jitter).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        DEVDEBATE_ASYNC_VIEWS="true" if args.use_async else "false",
+    )
+    from django.test import AsyncClient, Client
+
+    client = AsyncClient() if args.use_async else Client()
+    samples: Dict[str, List[float]] = {}
+    for i in range(args.runs):
+        # A new stance each run so nothing is coalesced or cached
+        timings = asyncio.run(run(client, args.use_async, f"Remote work beats the office, take {i}"))
+        for name, seconds in timings.items():
+            samples.setdefault(name, []).append(seconds)
+    report = {
+        "mode": "asgi" if args.use_async else "wsgi",
+        "latency": args.latency,
+        "jitter": args.jitter,
+        **{name: summarize(values) for name, values in samples.items()},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Exercise retries, rate limiting and the circuit breaker against faults.
+
+Three scenarios run against the fake upstream:
+
+``flaky``
+    A share of upstream requests fail with 429 (with ``Retry-After``) or
+    503. Debate turns are sent with retries disabled and then enabled, and
+    the share of turns that succeed is compared.
+``throttle``
+    ``--clients`` turns are fired at once with OpenAI limited to
+    ``--rate`` requests per second; the upstream sees them spread out
+    instead of in one burst.
+``outage``
+    The upstream fails every request. Once the breaker opens, turns fail
+    fast with ``503`` and ``Retry-After`` instead of each waiting for its
+    own retries, and the upstream stops receiving requests.
+
+Usage::
+
+    python -m benchmarks.bench_resilience --turns 100 --throttle-rate 0.2 --error-rate 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from typing import Any, Dict, List
+
+from .common import setup_django
+from .fake_upstream import FakeUpstream
+
+
+def send_turns(count: int, concurrent: bool = False) -> List[Any]:
+    """POST ``count`` distinct first turns; return the responses."""
+    from django.test import Client
+
+    responses: List[Any] = [None] * count
+
+    def one(index: int) -> None:
+        body = json.dumps({"stance": f"Remote work is better, argument {index}", "persona": "socrates"})
+        responses[index] = Client().post("/api/rebuttal", body, content_type="application/json")
+
+    if not concurrent:
+        for index in range(count):
+            one(index)
+        return responses
+    threads = [threading.Thread(target=one, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def flaky(upstream: FakeUpstream, turns: int) -> Dict[str, Any]:
+    from django.test import override_settings
+
+    from api import metrics, resilience
+
+    result: Dict[str, Any] = {}
+    for attempts in (1, 3):
+        resilience.reset_state()
+        metrics.reset()
+        before = upstream.requests
+        with override_settings(UPSTREAM_MAX_ATTEMPTS=attempts):
+            responses = send_turns(turns)
+        ok = sum(1 for r in responses if r.status_code == 200)
+        result[f"max_attempts_{attempts}"] = {
+            "succeeded": f"{ok}/{turns}",
+            "upstream_requests": upstream.requests - before,
+            "retries": sum(
+                metrics.counter_value("upstream_retries_total", provider="openai", reason=reason)
+                for reason in ("429", "503")
+            ),
+        }
+    return result
+
+
+def throttle(upstream: FakeUpstream, clients: int, rate: float) -> Dict[str, Any]:
+    from django.conf import settings
+    from django.test import override_settings
+
+    from api import resilience
+
+    providers = {name: dict(config) for name, config in settings.UPSTREAM_PROVIDERS.items()}
+    providers["openai"].update(rate_limit=rate, burst=1)
+    resilience.reset_state()
+    start = time.perf_counter()
+    with override_settings(UPSTREAM_PROVIDERS=providers):
+        responses = send_turns(clients, concurrent=True)
+    return {
+        "clients": clients,
+        "rate_limit": rate,
+        "succeeded": sum(1 for r in responses if r.status_code == 200),
+        "wall_seconds": round(time.perf_counter() - start, 2),
+        "expected_min_seconds": round((clients - 1) / rate, 2),
+    }
+
+
+def outage(upstream: FakeUpstream, turns: int) -> Dict[str, Any]:
+    from api import resilience
+
+    resilience.reset_state()
+    upstream.outage = True
+    before = upstream.requests
+    latencies = []
+    statuses: Dict[int, int] = {}
+    retry_after = None
+    for response_index in range(turns):
+        start = time.perf_counter()
+        response = send_turns(1)[0]
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        retry_after = response.get("Retry-After") or retry_after
+    upstream.outage = False
+    return {
+        "turns": turns,
+        "statuses": statuses,
+        "upstream_requests": upstream.requests - before,
+        "first_turn_ms": round(latencies[0] * 1000, 1),
+        "last_turn_ms": round(latencies[-1] * 1000, 1),
+        "retry_after": retry_after,
+        "circuits": resilience.breaker_states(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--throttle-rate", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=0.1,
+        seed=1,
+    ).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        UPSTREAM_BACKOFF_BASE="0.05",
+        UPSTREAM_BREAKER_THRESHOLD="5",
+        UPSTREAM_BREAKER_RESET="30",
+    )
+    report = {"flaky": flaky(upstream, args.turns)}
+    upstream.throttle_rate = upstream.error_rate = 0.0
+    report["throttle"] = throttle(upstream, args.clients, args.rate)
+    report["outage"] = outage(upstream, 20)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
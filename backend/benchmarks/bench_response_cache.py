@@ -0,0 +1,72 @@
+"""Compare first-turn rebuttal latency with and without the response cache.
+
+Opens ``--debates`` new debates against the fake upstream, each with a
+stance drawn from a small pool of popular openings (some rephrased), and
+reports latency for cache misses and for exact and semantic hits.
+
+Usage::
+
+    python -m benchmarks.bench_response_cache --latency 1.0 --debates 40
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Dict, List
+
+from .common import setup_django, summarize
+from .fake_upstream import FakeUpstream
+
+STANCES = [
+    "AI will take all jobs",
+    "AI will take all the jobs!",
+    "Remote work is better than the office",
+    "remote work is better than the office.",
+    "Social media should be banned for kids",
+    "Social media should be banned for all kids",
+    "Tabs are better than spaces",
+    "Nuclear power is the only realistic path to net zero",
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--debates", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake chat completion latency in seconds")
+    parser.add_argument("--no-semantic", action="store_true", help="exact tier only")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        RESPONSE_CACHE_ENABLED="true",
+        RESPONSE_CACHE_SEMANTIC="false" if args.no_semantic else "true",
+    )
+    from django.test import Client
+
+    from api import metrics
+
+    client = Client()
+    rng = random.Random(0)
+    samples: Dict[str, List[float]] = {"miss": [], "exact": [], "semantic": []}
+    for _ in range(args.debates):
+        before = {tier: metrics.counter_value("response_cache_hits_total", tier=tier) for tier in ("exact", "semantic")}
+        body = {"stance": rng.choice(STANCES), "persona": rng.choice(["socrates", "karen2.0"])}
+        start = time.perf_counter()
+        resp = client.post("/api/rebuttal", json.dumps(body), content_type="application/json")
+        elapsed = time.perf_counter() - start
+        assert resp.status_code == 200, resp.content
+        outcome = "miss"
+        for tier, count in before.items():
+            if metrics.counter_value("response_cache_hits_total", tier=tier) > count:
+                outcome = tier
+        samples[outcome].append(elapsed)
+    print(json.dumps({outcome: summarize(values) for outcome, values in samples.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure session store throughput and lookup latency.
+
+Populates each backend with ``--sessions`` sessions (two turns each), then
+times appends from several threads and single-session transcript lookups,
+the two operations every debate request performs. The SQLite store uses a
+temporary file so the project database is never touched.
+
+Usage::
+
+    python -m benchmarks.bench_session_store --sessions 100000 --threads 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from .common import setup_django, summarize
+
+
+def populate(store, count: int) -> List[str]:
+    ids = [f"bench-{i}" for i in range(count)]
+    for sid in ids:
+        store.append(sid, "user", "Tabs are better than spaces.")
+        store.append(sid, "assistant", "Consistency matters more than the character.")
+    return ids
+
+
+def measure(store, ids: List[str], threads: int, ops: int) -> Dict[str, object]:
+    per_thread = max(1, ops // threads)
+
+    def appender() -> None:
+        rng = random.Random()
+        for _ in range(per_thread):
+            store.append(rng.choice(ids), "user", "One more point.")
+
+    workers = [threading.Thread(target=appender) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    lookups: List[float] = []
+    rng = random.Random(0)
+    for _ in range(ops):
+        sid = rng.choice(ids)
+        t0 = time.perf_counter()
+        store.turns(sid)
+        lookups.append(time.perf_counter() - t0)
+    return {
+        "appends_per_sec": round(per_thread * threads / elapsed, 1),
+        "lookup": summarize(lookups),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+    from api.session_store import MemorySessionStore, SQLiteSessionStore
+
+    results: Dict[str, object] = {}
+    memory = MemorySessionStore(max_sessions=args.sessions * 2)
+    results["memory"] = measure(memory, populate(memory, args.sessions), args.threads, args.ops)
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteSessionStore(Path(tmp) / "sessions.sqlite3")
+        results["sqlite"] = measure(sqlite, populate(sqlite, args.sessions), args.threads, args.ops)
+    print(json.dumps({"sessions": args.sessions, "threads": args.threads, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Show identical concurrent requests sharing one upstream call.
+
+Fires ``--clients`` simultaneous first-turn ``POST /api/rebuttal`` requests
+with the same stance (a classroom opening the same debate) and counts the
+requests that reached the fake upstream. Runs the threaded views unless
+``--async`` is given, in which case the coroutine views are driven from
+one event loop.
+
+Usage::
+
+    python -m benchmarks.bench_singleflight --clients 30 --latency 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from .common import setup_django
+from .fake_upstream import FakeUpstream
+
+BODY = json.dumps({"stance": "AI will take all jobs", "persona": "socrates"})
+
+
+def run_threads(clients: int) -> None:
+    from django.test import Client
+
+    barrier = threading.Barrier(clients)
+
+    def one() -> None:
+        client = Client()
+        barrier.wait()
+        resp = client.post("/api/rebuttal", BODY, content_type="application/json")
+        assert resp.status_code == 200, resp.content
+
+    threads = [threading.Thread(target=one) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+async def run_async(clients: int) -> None:
+    from django.test import AsyncClient
+
+    async def one() -> None:
+        resp = await AsyncClient().post("/api/rebuttal", BODY, content_type="application/json")
+        assert resp.status_code == 200, resp.content
+
+    await asyncio.gather(*(one() for _ in range(clients)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        DEVDEBATE_ASYNC_VIEWS="true" if args.use_async else "false",
+    )
+    from api import metrics
+
+    start = time.perf_counter()
+    if args.use_async:
+        asyncio.run(run_async(args.clients))
+    else:
+        run_threads(args.clients)
+    elapsed = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "mode": "asgi" if args.use_async else "wsgi",
+                "clients": args.clients,
+                "upstream_requests": upstream.requests,
+                "coalesced": metrics.counter_value("singleflight_coalesced_total", call="openai_chat"),
+                "wall_seconds": round(elapsed, 3),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Measure the memory the STT endpoint needs per upload.
+
+Sends a ``--megabytes`` recording to ``/api/stt`` and reports the peak
+Python allocation while the view runs, next to the old approach of reading
+the upload into memory and posting the bytes. It then uploads the same
+recording in ``MediaRecorder``-sized chunks through ``/api/stt/chunks`` and
+shows an over-long recording being refused mid-stream.
+
+The fake upstream runs in a child process so its buffering is not counted.
+
+Usage::
+
+    python -m benchmarks.bench_stt_upload --megabytes 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+from .common import setup_django
+from .fake_upstream import FakeUpstream
+
+
+def peak_during(fn: Callable[[], Any]) -> Tuple[Any, float]:
+    """Run ``fn``; return its result and peak traced allocation in MB."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 1e6
+
+
+def multipart_request(audio: bytes):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import RequestFactory
+
+    upload = SimpleUploadedFile("speech.webm", audio, content_type="audio/webm")
+    return RequestFactory().post("/api/stt", {"file": upload})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=20)
+    parser.add_argument("--chunk-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=0.0).start_process()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        STT_UPLOAD_DIR=tempfile.mkdtemp(prefix="bench-stt-"),
+        STT_MAX_SECONDS="60",
+    )
+    from django.test import Client
+
+    from api import views
+
+    audio = os.urandom(int(args.megabytes * 1e6))
+    report: Dict[str, Any] = {"upload_mb": args.megabytes}
+    try:
+        request = multipart_request(audio)
+        response, peak = peak_during(lambda: views.stt(request))
+        assert response.status_code == 200, response.content
+        report["streamed_peak_mb"] = round(peak, 2)
+
+        request = multipart_request(audio)
+
+        def buffered() -> str:
+            # What the view used to do: whole upload in memory, then posted as bytes
+            data = request.FILES["file"].read()
+            return views.call_openai_whisper(data, "audio/webm")
+
+        _, peak = peak_during(buffered)
+        report["buffered_peak_mb"] = round(peak, 2)
+
+        client = Client()
+        chunk = args.chunk_kb * 1024
+        pieces = [audio[i : i + chunk] for i in range(0, len(audio), chunk)]
+        start = time.perf_counter()
+        upload_id = ""
+        for seq, piece in enumerate(pieces):
+            final = "&final=1" if seq == len(pieces) - 1 else ""
+            resp = client.post(
+                f"/api/stt/chunks?seq={seq}&uploadId={upload_id}{final}", piece, content_type="audio/webm"
+            )
+            assert resp.status_code == 200, resp.content
+            upload_id = resp.json()["uploadId"]
+        report["chunked"] = {
+            "chunks": len(pieces),
+            "seconds": round(time.perf_counter() - start, 3),
+            "transcript": resp.json()["transcript"],
+        }
+
+        # One-second chunks with the recorder's running duration: refused at 61s
+        upload_id, status, seq = "", 200, 0
+        while status == 200:
+            resp = client.post(
+                f"/api/stt/chunks?seq={seq}&uploadId={upload_id}",
+                b"\x00" * 4000,
+                content_type="audio/webm",
+                HTTP_X_AUDIO_DURATION=str(seq + 1),
+            )
+            status = resp.status_code
+            upload_id = resp.json()["uploadId"]
+            seq += 1
+        report["over_long"] = {"refused_at_chunk": seq - 1, "status": status, "error": resp.json()["error"]}
+    finally:
+        upstream.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure memory and time of transcript downloads on a long debate.
+
+Fills a throwaway SQLite session store with ``--turns`` turns and downloads
+the transcript three ways:
+
+* the previous implementation (load every turn, join, encode, ``BytesIO``);
+* ``GET /api/download`` as a streamed export, consumed chunk by chunk;
+* a revalidation with ``If-None-Match``, answered ``304`` without a body.
+
+Peak memory is measured with ``tracemalloc``.
+
+Usage::
+
+    python -m benchmarks.bench_transcript_export --turns 20000
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+from .common import setup_django
+
+TEXT = (
+    "Lowering tuition sounds generous, but someone still pays: taxpayers, or students through "
+    "larger classes and fewer services. Cheaper seats also raise demand, so the crowding gets worse. "
+)
+
+
+def measure(run: Callable[[], Any]) -> Tuple[Any, Dict[str, float]]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": round(elapsed, 3), "peak_mb": round(peak / 2**20, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    setup_django(SESSION_STORE_BACKEND="sqlite", SESSION_STORE_PATH=str(Path(tmp.name) / "sessions.sqlite3"))
+    from django.test import Client
+
+    from api.session_store import get_session_store
+
+    store = get_session_store()
+    session_id = store.create()
+    conn = store._connect()
+    conn.executemany(
+        "INSERT INTO devdebate_turn (session_id, generation, role, text, created_at) VALUES (?, 0, ?, ?, ?)",
+        [(session_id, "user" if i % 2 == 0 else "assistant", f"{i}: {TEXT}", time.time()) for i in range(args.turns)],
+    )
+
+    def old_download() -> int:
+        lines = []
+        for role, text in store.turns(session_id):
+            prefix = "User:" if role == "user" else "Opponent:"
+            lines.append(f"{prefix} {text}\n")
+        buffer = io.BytesIO("".join(lines).encode("utf-8"))
+        return len(buffer.getvalue())
+
+    client = Client()
+    # Warm up URL resolution and middleware so they are not counted
+    client.get("/api/download", {"sessionId": store.create()})
+
+    def streamed_download() -> Tuple[int, str]:
+        response = client.get("/api/download", {"sessionId": session_id})
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        return size, response["ETag"]
+
+    old_size, old = measure(old_download)
+    (new_size, etag), new = measure(streamed_download)
+    status, revalidate = measure(
+        lambda: client.get("/api/download", {"sessionId": session_id}, HTTP_IF_NONE_MATCH=etag).status_code
+    )
+    assert old_size == new_size, (old_size, new_size)
+    print(
+        json.dumps(
+            {
+                "turns": args.turns,
+                "transcript_mb": round(new_size / 2**20, 2),
+                "buffered": old,
+                "streamed": new,
+                "revalidated": {"status": status, **revalidate},
+            },
+            indent=2,
+        )
+    )
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
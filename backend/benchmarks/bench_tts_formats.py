@@ -0,0 +1,94 @@
+"""Report the bytes per second of speech of each TTS audio format.
+
+Each sample line is synthesised in every format of ``api.audio_formats``
+through :func:`api.views.synthesize_speech`, the path ``/api/tts`` takes on
+a cache miss: natively when the backend offers the format, otherwise
+transcoded from its MP3 with ``ffmpeg``. The report gives, per format, how
+it was produced, its size against the seconds of speech, the implied
+bitrate, the saving against the default MP3, and the time to produce it.
+
+By default the deterministic ``fake`` backend is used; its silence is
+constant-bitrate, so the figures show the container and bitrate overhead
+but not how well a codec compresses real speech. ``--live`` calls the
+TTS backend configured in ``.env`` instead, which costs provider credit::
+
+    python -m benchmarks.bench_tts_formats --runs 3
+    python -m benchmarks.bench_tts_formats --live --runs 1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .common import setup_django, summarize
+from .fake_upstream import REBUTTAL
+from .recording import STANCES
+
+SAMPLES = [REBUTTAL["rebuttal_text"], *STANCES]
+
+
+def measure(fmt: Any, runs: int) -> Dict[str, Any]:
+    from api import audio_formats, views
+
+    size = 0
+    seconds = 0.0
+    timings: List[float] = []
+    for run in range(runs):
+        for text in SAMPLES:
+            # Vary the text so neither cache answers in place of the backend
+            text = f"{text} ({run})"
+            start = time.perf_counter()
+            audio = views.synthesize_speech(text, "Rachel", fmt.name)
+            timings.append(time.perf_counter() - start)
+            size += len(audio)
+            length = audio_formats.speech_seconds(audio, fmt)
+            seconds += length if length is not None else audio_formats.mp3_seconds(views.cached_speech(text))
+    return {
+        "bytes": size,
+        "seconds": round(seconds, 2),
+        "bytes_per_second": round(size / seconds, 1) if seconds else None,
+        "kbps": round(size * 8 / seconds / 1000, 1) if seconds else None,
+        "produce": summarize(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="passes over the sample lines")
+    parser.add_argument("--live", action="store_true", help="use the configured TTS provider, not the fake")
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp(prefix="bench-tts-formats-")
+    setup_django(**({} if args.live else {"TTS_BACKEND": "fake", "FAKE_BACKEND_LATENCY": "0"}))
+    from django.conf import settings
+
+    from api import audio_formats
+    from api.backends import get_backend
+
+    settings.MEDIA_ROOT = media_root
+    settings.TTS_CACHE_DIR = Path(media_root, "tts")
+    backend = get_backend("tts")
+    try:
+        results: Dict[str, Dict[str, Any]] = {}
+        for fmt in audio_formats.FORMATS.values():
+            if not audio_formats.available(fmt, backend):
+                results[fmt.name] = {"via": "unavailable (needs ffmpeg)"}
+                continue
+            results[fmt.name] = measure(fmt, args.runs)
+            results[fmt.name]["via"] = audio_formats.report(backend)[fmt.name]["via"]
+        baseline = results["mp3"]["bytes_per_second"]
+        for name, result in results.items():
+            if result.get("bytes_per_second") and baseline:
+                result["vs_mp3"] = f'{result["bytes_per_second"] / baseline:.0%}'
+            print(json.dumps({"format": name, "backend": backend.name, **result}))
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
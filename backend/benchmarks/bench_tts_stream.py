@@ -0,0 +1,66 @@
+"""Measure time to first audio for buffered versus sentence-streamed TTS.
+
+The fake upstream's TTS latency grows with the length of the text, as the
+real provider's does. The buffered run times ``POST /api/tts`` until its JSON
+response (the client would still have to fetch the MP3); the streamed runs
+time the first audio chunk of ``stream: true`` (chunked MP3) and
+``format: "sse"`` responses.
+
+Usage::
+
+    python -m benchmarks.bench_tts_stream --runs 20 --char-latency 0.004
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+from .common import setup_django, summarize
+from .fake_upstream import REBUTTAL, FakeUpstream
+
+
+def measure(client, payload: Dict[str, object], runs: int) -> Dict[str, object]:
+    first: List[float] = []
+    total: List[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        resp = client.post("/api/tts", json.dumps(payload), content_type="application/json")
+        assert resp.status_code == 200, resp
+        if resp.streaming:
+            chunks = iter(resp.streaming_content)
+            next(chunks)
+            first.append(time.perf_counter() - start)
+            for _ in chunks:
+                pass
+        else:
+            first.append(time.perf_counter() - start)
+        total.append(time.perf_counter() - start)
+    return {"first_audio": summarize(first), "complete": summarize(total)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.15, help="fixed TTS latency in seconds")
+    parser.add_argument("--char-latency", type=float, default=0.004, help="TTS seconds per character")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency, tts_char_latency=args.char_latency).start()
+    setup_django(OPENAI_BASE_URL=upstream.base_url, ELEVENLABS_BASE_URL=upstream.base_url)
+    from django.test import Client
+
+    client = Client()
+    text = REBUTTAL["rebuttal_text"]
+    results = {
+        "buffered": measure(client, {"text": text}, args.runs),
+        "stream_audio": measure(client, {"text": text, "stream": True}, args.runs),
+        "stream_sse": measure(client, {"text": text, "stream": True, "format": "sse"}, args.runs),
+    }
+    for mode, result in results.items():
+        print(json.dumps({"mode": mode, **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Compare a voice turn over HTTP requests with the WebSocket voice channel.
+
+Against a fake upstream (``--latency`` seconds per call, streamed chat
+pieces every ``--chunk-delay`` seconds, synthesis time growing with the
+text), each run takes one spoken turn two ways, measured from the end of
+the user's recording:
+
+* the HTTP chain the front-end uses today: ``POST /api/stt`` with the
+  recording, ``POST /api/rebuttal``, ``POST /api/tts``, then a GET of the
+  MP3 (read from the TTS cache here, as nginx would serve it);
+* ``/ws/voice``: the recording was already streamed while it was being
+  spoken, so only ``stop`` is sent; the transcript, rebuttal deltas and
+  audio come back on the same socket.
+
+Both run in-process against ``devdebate.asgi.application``; ``--rtt``
+seconds of client-server round trip are simulated, one per HTTP request
+and half a round trip per WebSocket message in each direction. The report
+gives time to first audio and to the end of the turn, plus how long a
+barge-in (``cancel`` right after the first rebuttal delta) takes to be
+confirmed.
+
+Usage::
+
+    python -m benchmarks.bench_voice_ws --runs 5 --latency 0.2 --rtt 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import time
+import wave
+from typing import Any, Callable, Dict, List, Optional
+
+from .common import setup_django, summarize
+from .fake_upstream import FakeUpstream
+
+
+def recording(seconds: float = 3.0, rate: int = 16000) -> bytes:
+    """A silent mono WAV of ``seconds``."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(int(seconds * rate) * 2))
+    return buffer.getvalue()
+
+
+class WebSocketClient:
+    """Drive an ASGI WebSocket application in-process.
+
+    Every message is delivered ``one_way`` seconds after it was sent, in
+    order, in both directions.
+    """
+
+    def __init__(self, app: Callable[..., Any], path: str, one_way: float) -> None:
+        self.app = app
+        self.path = path
+        self.one_way = one_way
+        self.to_server: asyncio.Queue = asyncio.Queue()
+        self.to_client: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    def _deliver(self, queue: asyncio.Queue, message: Dict[str, Any]) -> None:
+        if self.one_way:
+            asyncio.get_running_loop().call_later(self.one_way, queue.put_nowait, message)
+        else:
+            queue.put_nowait(message)
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        self._deliver(self.to_client, message)
+
+    async def connect(self) -> None:
+        scope = {"type": "websocket", "path": self.path, "query_string": b"", "headers": [], "subprotocols": []}
+        self.task = asyncio.ensure_future(self.app(scope, self.to_server.get, self._send))
+        self._deliver(self.to_server, {"type": "websocket.connect"})
+        accepted = await self.to_client.get()
+        assert accepted["type"] == "websocket.accept", accepted
+
+    def send_json(self, data: Dict[str, Any]) -> None:
+        self._deliver(self.to_server, {"type": "websocket.receive", "text": json.dumps(data)})
+
+    def send_bytes(self, data: bytes) -> None:
+        self._deliver(self.to_server, {"type": "websocket.receive", "bytes": data})
+
+    async def receive(self) -> Any:
+        """Next text message as a dict, or the bytes of a binary one."""
+        message = await self.to_client.get()
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return json.loads(message["text"])
+
+    async def close(self) -> None:
+        self._deliver(self.to_server, {"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+async def websocket_turn(client: WebSocketClient, audio: bytes, voice_id: str) -> Dict[str, float]:
+    client.send_json({"type": "start", "mime": "audio/wav", "voiceId": voice_id})
+    # Streamed while the user speaks, before the clock starts
+    for start in range(0, len(audio), 16384):
+        client.send_bytes(audio[start : start + 16384])
+    started = time.perf_counter()
+    client.send_json({"type": "stop"})
+    timings: Dict[str, float] = {}
+    while True:
+        message = await client.receive()
+        if isinstance(message, bytes):
+            timings.setdefault("first_audio", time.perf_counter() - started)
+            continue
+        if message["type"] == "audio":
+            client.send_json({"type": "ack", "seq": message["seq"]})
+        elif message["type"] == "done":
+            timings["done"] = time.perf_counter() - started
+            return timings
+        elif message["type"] in ("error", "cancelled", "blocked"):
+            raise RuntimeError(message)
+
+
+async def websocket_barge_in(client: WebSocketClient, voice_id: str) -> float:
+    """Seconds from ``cancel`` (sent at the first delta) to ``cancelled``."""
+    client.send_json({"type": "text", "text": "Cities should ban cars downtown.", "voiceId": voice_id})
+    cancelled_at = 0.0
+    while True:
+        message = await client.receive()
+        if isinstance(message, bytes):
+            continue
+        if message["type"] == "delta" and not cancelled_at:
+            cancelled_at = time.perf_counter()
+            client.send_json({"type": "cancel"})
+        elif message["type"] == "cancelled":
+            return time.perf_counter() - cancelled_at
+        elif message["type"] in ("done", "error"):
+            raise RuntimeError(f"turn was not cancelled: {message}")
+
+
+async def http_turn(client: Any, audio: bytes, voice_id: str, rtt: float, media_root: Any) -> Dict[str, float]:
+    async def hop(request: Any) -> Any:
+        await asyncio.sleep(rtt / 2)
+        response = await request
+        await asyncio.sleep(rtt / 2)
+        return response
+
+    started = time.perf_counter()
+    upload = io.BytesIO(audio)
+    upload.name = "turn.wav"
+    resp = await hop(client.post("/api/stt", {"file": upload}))
+    assert resp.status_code == 200, resp.content
+    transcript = json.loads(resp.content)["transcript"]
+    resp = await hop(client.post("/api/rebuttal", json.dumps({"stance": transcript}), content_type="application/json"))
+    assert resp.status_code == 200, resp.content
+    text = json.loads(resp.content)["rebuttal_text"]
+    resp = await hop(
+        client.post("/api/tts", json.dumps({"text": text, "voiceId": voice_id}), content_type="application/json")
+    )
+    assert resp.status_code == 200, resp.content
+    audio_url = json.loads(resp.content)["audio_url"]
+    # GET /media/...: the first byte arrives a round trip later
+    await asyncio.sleep(rtt)
+    data = await asyncio.to_thread((media_root / audio_url.split("/media/", 1)[1]).read_bytes)
+    assert data
+    elapsed = time.perf_counter() - started
+    return {"first_audio": elapsed, "done": elapsed}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from django.conf import settings
+    from django.test import AsyncClient
+
+    from devdebate.asgi import application
+
+    audio = recording()
+    client = AsyncClient()
+    samples: Dict[str, List[float]] = {}
+
+    def add(prefix: str, timings: Dict[str, float]) -> None:
+        for name, seconds in timings.items():
+            samples.setdefault(f"{prefix}_{name}", []).append(seconds)
+
+    for i in range(args.runs + 1):
+        # A new voice each run so every turn synthesises afresh
+        voice_id = f"bench-{time.time_ns()}"
+        http = await http_turn(client, audio, f"{voice_id}-http", args.rtt, settings.MEDIA_ROOT)
+        socket = WebSocketClient(application, settings.VOICE_WS_PATH, args.rtt / 2)
+        await socket.connect()
+        assert (await socket.receive())["type"] == "ready"
+        ws = await websocket_turn(socket, audio, f"{voice_id}-ws")
+        barge_in = await websocket_barge_in(socket, f"{voice_id}-barge")
+        await socket.close()
+        if i == 0:
+            continue  # warm-up: imports, connection pools
+        add("http", http)
+        add("websocket", ws)
+        samples.setdefault("barge_in", []).append(barge_in)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per upstream call")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed chat pieces")
+    parser.add_argument("--tts-char-latency", type=float, default=0.002, help="extra TTS seconds per character")
+    parser.add_argument("--rtt", type=float, default=0.05, help="client-server round trip, seconds")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(
+        latency=args.latency, chunk_delay=args.chunk_delay, tts_char_latency=args.tts_char_latency
+    ).start()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        SESSION_STORE_BACKEND="memory",
+        STT_PREPROCESS="false",
+        DEVDEBATE_ASYNC_VIEWS="true",
+    )
+    report = asyncio.run(run(args))
+    print(json.dumps({"latency": args.latency, "rtt": args.rtt, **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
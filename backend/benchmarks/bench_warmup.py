@@ -0,0 +1,170 @@
+"""Compare the first requests of a cold worker with those of a warmed-up one.
+
+Each run boots a fresh backend process (``devdebate.wsgi``, as a WSGI
+server loads it) and times its first and second ``/api/rebuttal`` and
+``/api/tts`` requests; the TTS text is a persona's stock greeting. The
+``cold`` worker starts as before. The ``warm`` worker boots with
+``WARMUP_ON_BOOT`` (see ``api.warmup``) and a persona asset bundle built
+beforehand, as ``manage.py warmup --build-assets`` would at deploy time.
+Both talk to a local fake upstream whose ``--connect-latency`` stands in for
+the TCP and TLS handshakes of a new provider connection. Boot time is
+measured from spawning the process to it listening, so the warm worker's
+boot includes its warm-up.
+
+Usage::
+
+    python -m benchmarks.bench_warmup --runs 5
+    python -m benchmarks.bench_warmup --runs 5 --connect-latency 0.15 --latency 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from .common import BACKEND_DIR, setup_django, start_wsgi_server, summarize
+from .fake_upstream import FakeUpstream
+
+STANCES = ["Remote work is better for everyone.", "Cities should ban private cars from their centres."]
+REQUESTS = ("rebuttal_first", "rebuttal_second", "tts_first", "tts_second")
+
+
+def configure(upstream: str, media_root: str, warm: bool) -> None:
+    """Set Django up against the fake upstream with media under ``media_root``."""
+    setup_django(
+        OPENAI_BASE_URL=upstream,
+        ELEVENLABS_BASE_URL=upstream,
+        SESSION_STORE_BACKEND="memory",
+        DEVDEBATE_ASYNC_VIEWS="false",
+        WARMUP_ON_BOOT="true" if warm else "false",
+        PERSONA_ASSETS_DIR=str(Path(media_root, "persona")),
+        JOB_UPLOAD_DIR=str(Path(media_root, "jobs")),
+    )
+    from django.conf import settings
+
+    settings.MEDIA_ROOT = media_root
+    settings.TTS_CACHE_DIR = Path(media_root, "tts")
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Run the backend under test until terminated (the ``--serve`` child)."""
+    configure(args.upstream, args.media_root, args.warm)
+    from devdebate.wsgi import application
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = start_wsgi_server(app=application)
+    print(f"Backend listening on {server.server_port}", flush=True)
+    threading.Event().wait()
+
+
+def build(args: argparse.Namespace) -> None:
+    """Build the persona asset bundle under ``--media-root`` (the ``--build`` child)."""
+    configure(args.upstream, args.media_root, warm=False)
+    from api.warmup import warm_personas
+
+    print(json.dumps(warm_personas(build_assets=True)), flush=True)
+
+
+def child(flag: str, upstream: str, media_root: str, warm: bool = False) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "benchmarks.bench_warmup", flag, "--upstream", upstream, "--media-root", media_root]
+    if warm:
+        cmd.append("--warm")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+
+
+def run_once(upstream: str, media_root: str, warm: bool, greeting: str, index: int) -> Tuple[float, Dict[str, float]]:
+    """Boot one backend and time its first requests; return boot seconds and request seconds."""
+    start = time.perf_counter()
+    process = child("--serve", upstream, media_root, warm)
+    try:
+        port = int(process.stdout.readline().split()[-1])
+        boot = time.perf_counter() - start
+        timings: Dict[str, float] = {}
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}/api", timeout=60) as client:
+            for name, path, body in (
+                ("rebuttal_first", "/rebuttal", {"stance": f"{STANCES[0]} ({index})", "persona": "socrates"}),
+                ("rebuttal_second", "/rebuttal", {"stance": f"{STANCES[1]} ({index})", "persona": "socrates"}),
+                ("tts_first", "/tts", {"text": greeting}),
+                ("tts_second", "/tts", {"text": greeting}),
+            ):
+                started = time.perf_counter()
+                resp = client.post(path, json=body)
+                timings[name] = time.perf_counter() - started
+                assert resp.status_code == 200, resp.text
+    finally:
+        process.terminate()
+        process.wait()
+    return boot, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="processes booted per mode")
+    parser.add_argument("--latency", type=float, default=0.25, help="fake upstream seconds per response")
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.1, help="fake upstream seconds for a new connection"
+    )
+    parser.add_argument("--tts-char-latency", type=float, default=0.002, help="extra TTS seconds per character")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--build", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--warm", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    parser.add_argument("--media-root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+    if args.build:
+        build(args)
+        return
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    from api import Persona
+
+    greeting = Persona.SOCRATES.stock_lines["greeting"]
+    upstream = FakeUpstream(
+        latency=args.latency, connect_latency=args.connect_latency, tts_char_latency=args.tts_char_latency
+    ).start_process()
+    bundle_root = tempfile.mkdtemp(prefix="bench-warmup-bundle-")
+    boots: Dict[str, List[float]] = {"cold": [], "warm": []}
+    samples: Dict[str, Dict[str, List[float]]] = {mode: {name: [] for name in REQUESTS} for mode in boots}
+    try:
+        builder = child("--build", upstream.base_url, bundle_root)
+        built = json.loads(builder.stdout.readline())
+        builder.wait()
+        print(json.dumps({"bundle": built}))
+        for index in range(args.runs):
+            # Alternate the modes so drift on the machine affects both alike
+            for mode in ("cold", "warm"):
+                media_root = tempfile.mkdtemp(prefix="bench-warmup-media-")
+                try:
+                    if mode == "warm":
+                        shutil.copytree(Path(bundle_root, "persona"), Path(media_root, "persona"))
+                    boot, timings = run_once(upstream.base_url, media_root, mode == "warm", greeting, index)
+                finally:
+                    shutil.rmtree(media_root, ignore_errors=True)
+                boots[mode].append(boot)
+                for name, seconds in timings.items():
+                    samples[mode][name].append(seconds)
+    finally:
+        upstream.stop()
+        shutil.rmtree(bundle_root, ignore_errors=True)
+    for mode in boots:
+        report = {"mode": mode, "runs": args.runs, "boot_ms": summarize(boots[mode])["mean_ms"]}
+        for name in REQUESTS:
+            report[name] = summarize(samples[mode][name])
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Compare the WSGI (threaded) and ASGI (async) request paths under load.
+
+Both runs send the same number of ``/api/rebuttal`` requests against a local
+fake upstream that answers after ``--latency`` seconds. The WSGI run uses
+the synchronous views with a fixed pool of worker threads, mirroring a
+threaded WSGI server; the ASGI run uses the coroutine views with every
+request in flight at once. Each mode runs in its own subprocess so the
+``ASYNC_VIEWS`` setting and the URL configuration are fresh.
+
+Usage::
+
+    python -m benchmarks.bench_wsgi_vs_asgi --requests 2000 --concurrency 1000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from .common import BACKEND_DIR, setup_django, summarize
+from .fake_upstream import FakeUpstream
+
+BODY = json.dumps({"stance": "Remote work is better for everyone.", "persona": "socrates"})
+
+
+def run_wsgi(requests: int, workers: int) -> Dict[str, object]:
+    from django.test import Client
+
+    latencies: List[float] = []
+
+    def one(_: int) -> None:
+        start = time.perf_counter()
+        resp = Client().post("/api/rebuttal", BODY, content_type="application/json")
+        assert resp.status_code == 200, resp.content
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return {"mode": "wsgi", "workers": workers, "elapsed_s": round(elapsed, 2),
+            "rps": round(requests / elapsed, 1), **summarize(latencies)}
+
+
+def run_asgi(requests: int, concurrency: int) -> Dict[str, object]:
+    from django.test import AsyncClient
+
+    latencies: List[float] = []
+
+    async def main() -> float:
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one() -> None:
+            async with gate:
+                start = time.perf_counter()
+                resp = await client.post("/api/rebuttal", BODY, content_type="application/json")
+                assert resp.status_code == 200, resp.content
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(main())
+    return {"mode": "asgi", "concurrency": concurrency, "elapsed_s": round(elapsed, 2),
+            "rps": round(requests / elapsed, 1), **summarize(latencies)}
+
+
+def child(args: argparse.Namespace) -> None:
+    upstream = FakeUpstream(latency=args.latency).start_process()
+    setup_django(
+        OPENAI_BASE_URL=upstream.base_url,
+        ELEVENLABS_BASE_URL=upstream.base_url,
+        DEVDEBATE_ASYNC_VIEWS="True" if args.mode == "asgi" else "False",
+        # Let requests queue for a pooled connection instead of timing out
+        UPSTREAM_POOL_TIMEOUT="120",
+    )
+    try:
+        if args.mode == "asgi":
+            result = run_asgi(args.requests, args.concurrency)
+        else:
+            result = run_wsgi(args.requests, args.workers)
+    finally:
+        upstream.stop()
+    print(json.dumps(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500, help="in-flight requests for ASGI")
+    parser.add_argument("--workers", type=int, default=16, help="WSGI worker threads")
+    parser.add_argument("--latency", type=float, default=0.25, help="fake upstream latency in seconds")
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        child(args)
+        return
+    for mode in ("wsgi", "asgi"):
+        cmd = [sys.executable, "-m", "benchmarks.bench_wsgi_vs_asgi", "--mode", mode]
+        for name in ("requests", "concurrency", "workers", "latency"):
+            cmd += [f"--{name}", str(getattr(args, name))]
+        out = subprocess.run(cmd, cwd=BACKEND_DIR, check=True, capture_output=True, text=True)
+        print(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Helpers shared by the benchmark scripts."""
+from __future__ import annotations
+
+import os
+import statistics
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(**env: str) -> None:
+    """Configure Django for a benchmark run.
+
+    ``env`` entries are exported before settings are imported so they take
+    precedence over values in ``.env``.
+    """
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "devdebate.settings")
+    os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "*")
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "bench-key")
+    os.environ.update(env)
+    import django
+
+    django.setup()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the ``pct`` percentile (0-100) of ``samples`` by nearest rank."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples: Iterable[float]) -> Dict[str, float]:
+    """Return count, mean and p50/p95/p99 for latency samples in seconds."""
+    values = list(samples)
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+    }
+
+
+def start_wsgi_server(port: int = 0, app: Any = None) -> Any:
+    """Start Django's threaded WSGI server on ``port`` (0 picks one); return it.
+
+    Call after :func:`setup_django`. ``app`` defaults to a new Django
+    handler. Request logging is silenced.
+    """
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadedWSGIServer(("127.0.0.1", port), Handler)
+    server.set_app(app or WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    """Return the resident set size of process ``pid`` (default: this one).
+
+    Read from ``/proc``, so None on platforms without it.
+    """
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
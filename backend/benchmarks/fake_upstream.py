@@ -0,0 +1,397 @@
+"""A local fake of the OpenAI and ElevenLabs endpoints used by devdebate.
+
+The server speaks just enough HTTP/1.1 (keep-alive, ``Content-Length`` and
+chunked request bodies) to stand in for the real providers in benchmarks.
+It is built on ``asyncio`` so it can hold thousands of concurrent
+connections without becoming the bottleneck it is meant to measure.
+
+Point the backend at it with ``OPENAI_BASE_URL`` and ``ELEVENLABS_BASE_URL``::
+
+    python benchmarks/fake_upstream.py --port 9100 --latency 0.25
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 \\
+    ELEVENLABS_BASE_URL=http://127.0.0.1:9100/v1 python manage.py runserver
+
+or embed it in a benchmark with :class:`FakeUpstream`. Faults can be
+injected to exercise the retry and circuit-breaker code: a share of requests
+answered with ``429`` and ``Retry-After`` or with ``503``, random extra
+latency, or a full outage (set :attr:`FakeUpstream.outage`). Latency is fixed
+by default; ``--latency-sigma`` draws it from a log-normal distribution
+with a median of ``--latency`` instead, giving the long tail real providers
+have. ``--connect-latency`` delays the first request on each connection,
+standing in for the TCP and TLS handshakes a new connection to a real
+provider costs.
+
+Canned answers can be replaced by recorded ones; see
+:mod:`benchmarks.recording`.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+REBUTTAL = {
+    "rebuttal_text": (
+        "That sounds convincing until you look at who pays for it. Every benefit "
+        "you describe has a cost somebody else carries. Are you sure the trade is "
+        "worth it? History suggests the opposite."
+    ),
+    "bullets": ["Costs move, they do not vanish.", "Incentives change behaviour."],
+}
+
+# Plain-text completion returned when JSON output was not requested (the
+# background summariser)
+SUMMARY = (
+    "The user argues their stance repeatedly; the opponent questions who bears "
+    "the costs and whether history supports the claim. No concessions so far."
+)
+
+# A quarter of a second of silent MP3 (128 kbps, 44.1 kHz) after an ID3 tag
+FAKE_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + (b"\xff\xfb\x90\x64" + bytes(413)) * 10
+
+
+class FakeUpstream:
+    """Serve canned provider responses after a configurable delay.
+
+    Args:
+        latency: Seconds to wait before answering each request (the time to
+            first byte for streamed responses).
+        host: Interface to bind.
+        port: Port to bind; 0 picks a free port.
+        chunk_delay: Seconds between pieces of a streamed response.
+        tts_char_latency: Extra seconds per character of text sent to the
+            TTS endpoint, so synthesis time grows with the text like the
+            real provider's.
+        throttle_rate: Share of requests answered ``429`` with a
+            ``Retry-After`` of ``retry_after`` seconds.
+        error_rate: Share of requests answered ``503``.
+        jitter: Up to this many seconds of random extra latency.
+        retry_after: ``Retry-After`` value sent with injected 429s.
+        seed: Seed for the fault-injection random generator.
+        latency_sigma: When set, each latency is ``latency`` times a
+            log-normal variate with this sigma (so ``latency`` is the median).
+        connect_latency: Extra seconds before answering the first request
+            on a connection.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        chunk_delay: float = 0.02,
+        tts_char_latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        jitter: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+        latency_sigma: float = 0.0,
+        connect_latency: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.retry_after = retry_after
+        # While True every request fails with 503
+        self.outage = False
+        self.faults = 0
+        self._random = random.Random(seed)
+        self.chunk_delay = chunk_delay
+        self.tts_char_latency = tts_char_latency
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.connections = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "FakeUpstream":
+        """Run the server on a background thread and return once it listens."""
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-upstream", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def command(self) -> List[str]:
+        """Return the command line that runs this server in a child process."""
+        return [
+            sys.executable, "-m", "benchmarks.fake_upstream", "--host", self.host, "--port", str(self.port),
+            "--latency", str(self.latency), "--latency-sigma", str(self.latency_sigma),
+            "--chunk-delay", str(self.chunk_delay), "--tts-char-latency", str(self.tts_char_latency),
+            "--throttle-rate", str(self.throttle_rate), "--error-rate", str(self.error_rate),
+            "--jitter", str(self.jitter), "--retry-after", str(self.retry_after),
+            "--connect-latency", str(self.connect_latency),
+        ]
+
+    def start_process(self) -> "FakeUpstream":
+        """Run the server in a child process so it does not share our GIL."""
+        if not self.port:
+            import socket
+
+            with socket.socket() as sock:
+                sock.bind((self.host, 0))
+                self.port = sock.getsockname()[1]
+        self._process = subprocess.Popen(
+            self.command(),
+            cwd=Path(__file__).resolve().parent.parent,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self._process.stdout.readline()
+        return self
+
+    def stop(self) -> None:
+        process = getattr(self, "_process", None)
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def serve_forever(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Fake upstream listening on {self.base_url}", flush=True)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b"".join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", "0")))
+        return method, path, headers, body
+
+    def delay_for(self, path: str, body: bytes) -> float:
+        """Seconds to wait before answering a request."""
+        delay = self.latency
+        if self.latency_sigma:
+            delay *= self._random.lognormvariate(0, self.latency_sigma)
+        if self.tts_char_latency and "/text-to-speech/" in path and body:
+            delay += self.tts_char_latency * len(json.loads(body).get("text", ""))
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        return delay
+
+    def fault(self) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """Return an injected ``(status, headers, body)`` failure, if any."""
+        if self.outage or (self.error_rate and self._random.random() < self.error_rate):
+            self.faults += 1
+            return 503, {}, b'{"error": "service unavailable"}'
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            self.faults += 1
+            return 429, {"retry-after": f"{self.retry_after:g}"}, b'{"error": "rate limited"}'
+        return None
+
+    def respond(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, str, Union[bytes, List[bytes]]]:
+        """Return ``(status, content_type, body)`` for a request.
+
+        A list body is streamed with chunked transfer encoding, one piece
+        every ``chunk_delay`` seconds. A ``(delay, piece)`` item is sent
+        ``delay`` seconds after the previous one instead.
+        """
+        if path.endswith("/chat/completions"):
+            request = json.loads(body) if body else {}
+            content = json.dumps(REBUTTAL) if "response_format" in request or not body else SUMMARY
+            if request.get("stream"):
+                return 200, "text/event-stream", self.stream_completion(content)
+            payload = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+            return 200, "application/json", json.dumps(payload).encode()
+        if path.endswith("/audio/transcriptions"):
+            return 200, "application/json", b'{"text": "Remote work is better for everyone."}'
+        if "/text-to-speech/" in path:
+            return self.speech(path)
+        return 404, "application/json", b'{"error": "not found"}'
+
+    @staticmethod
+    def speech(path: str) -> Tuple[int, str, bytes]:
+        """Answer a TTS request in its ``output_format``.
+
+        MP3 formats get the canned MP3 and PCM a second of silence; the
+        fake cannot encode anything else and refuses it as ElevenLabs
+        refuses formats outside the account's plan.
+        """
+        output_format = parse_qs(urlsplit(path).query).get("output_format", ["mp3_44100_128"])[0]
+        if output_format.startswith("mp3_"):
+            return 200, "audio/mpeg", FAKE_MP3
+        if output_format.startswith("pcm_") and output_format[4:].isdigit():
+            return 200, "audio/pcm", bytes(2 * int(output_format[4:]))
+        return 422, "application/json", b'{"detail": {"status": "invalid_output_format"}}'
+
+    @staticmethod
+    def stream_completion(content: str, piece: int = 12) -> List[bytes]:
+        """Split ``content`` into OpenAI-style streamed completion events."""
+        events = []
+        for start in range(0, len(content), piece):
+            chunk = {"choices": [{"delta": {"content": content[start : start + piece]}}]}
+            events.append(f"data: {json.dumps(chunk)}\n\n".encode())
+        events.append(b"data: [DONE]\n\n")
+        return events
+
+    async def _write(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        content_type: str,
+        payload,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if isinstance(payload, bytes):
+            extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} OK\r\n"
+                    f"content-type: {content_type}\r\n"
+                    f"{extra}"
+                    f"content-length: {len(payload)}\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            await writer.drain()
+            return
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\ncontent-type: {content_type}\r\ntransfer-encoding: chunked\r\n\r\n".encode()
+        )
+        for index, piece in enumerate(payload):
+            if isinstance(piece, tuple):
+                delay, piece = piece
+                if delay:
+                    await asyncio.sleep(delay)
+            elif index and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            writer.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        first = True
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                self.requests += 1
+                delay = self.connect_latency if first else 0.0
+                first = False
+                if request[0] == "HEAD":
+                    # Connection warm-up (api.upstream.open_connections)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    writer.write(b"HTTP/1.1 404 Not Found\r\ncontent-length: 0\r\n\r\n")
+                    await writer.drain()
+                    continue
+                delay += self.delay_for(request[1], request[3])
+                if delay:
+                    await asyncio.sleep(delay)
+                fault = self.fault()
+                if fault is not None:
+                    status, headers, payload = fault
+                    await self._write(writer, status, "application/json", payload, headers)
+                    continue
+                status, content_type, payload = self.respond(*request)
+                await self._write(writer, status, content_type, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def add_arguments(parser: argparse.ArgumentParser, latency: float = 0.25) -> None:
+    """Add the server, latency and fault-injection options to ``parser``."""
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=latency, help="seconds per response")
+    parser.add_argument(
+        "--latency-sigma", type=float, default=0.0, help="log-normal sigma; --latency is then the median"
+    )
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed pieces")
+    parser.add_argument("--tts-char-latency", type=float, default=0.0, help="extra TTS seconds per character")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 503")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with injected 429s")
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.0, help="extra seconds for the first request on a connection"
+    )
+
+
+def server_options(args: argparse.Namespace) -> Dict[str, object]:
+    """Return the :class:`FakeUpstream` keyword arguments parsed by :func:`add_arguments`."""
+    return {
+        "latency": args.latency,
+        "latency_sigma": args.latency_sigma,
+        "host": args.host,
+        "port": args.port,
+        "chunk_delay": args.chunk_delay,
+        "tts_char_latency": args.tts_char_latency,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "jitter": args.jitter,
+        "retry_after": args.retry_after,
+        "connect_latency": args.connect_latency,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeUpstream(**server_options(args))
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Record real provider traffic and replay it from a local server.
+
+The canned answers of :class:`~benchmarks.fake_upstream.FakeUpstream` are
+enough to load the request path, but not to reproduce what the providers
+really send back: the size of a rebuttal, the MP3 length, how a completion
+streams in and how long each call takes. This module captures that once and
+replays it as often as needed, without API keys or spend.
+
+``record`` makes live calls through the same code the views use:
+
+* :func:`api.views.call_openai_chat`, plus a streamed completion of the same
+  prompt;
+* :func:`api.views.call_elevenlabs_tts` on the rebuttal;
+* :func:`api.views.call_openai_whisper` on the synthesised audio.
+
+Every HTTP exchange of the pooled provider clients is written to a JSON
+Lines fixture. Each line holds the request kind, status, content type, time
+to first byte and body, and for streamed responses the body pieces with the
+gaps between them. Request bodies and headers, including the API keys, are
+not stored::
+
+    python -m benchmarks.recording record --out fixtures/upstream.jsonl --stances 5
+
+``replay`` serves a fixture in place of the providers. A request of a
+recorded kind gets the next recording of that kind, with a time to first
+byte drawn from those recorded and the original gaps between streamed
+pieces, scaled by ``--speed``. Latency and faults can be added with the
+usual :mod:`benchmarks.fake_upstream` options; kinds missing from the
+fixture fall back to the canned answers::
+
+    python -m benchmarks.recording replay --fixture fixtures/upstream.jsonl --port 9100 --error-rate 0.02
+
+``benchmarks.bench_load --fixture`` starts the replay server itself.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple, Union
+
+import httpx
+
+from .common import setup_django
+from .fake_upstream import FakeUpstream, add_arguments, server_options
+
+STANCES = [
+    "Remote work is better for everyone.",
+    "Cities should ban private cars from their centres.",
+    "Social media has done more harm than good.",
+    "Nuclear power is the safest path to a low-carbon grid.",
+    "Homework should be abolished in primary schools.",
+]
+
+# Response headers worth replaying; everything else is dropped
+KEPT_HEADERS = ("content-type", "retry-after")
+
+
+def request_kind(method: str, path: str, body: bytes = b"") -> str:
+    """Classify a provider request, the key recordings are matched on.
+
+    Chat completions are split by streaming and by JSON mode, since the
+    rebuttal and the background summary expect different answers.
+    """
+    if path.endswith("/chat/completions"):
+        request = json.loads(body) if body else {}
+        kind = "chat_json" if "response_format" in request else "chat_text"
+        return kind + "_stream" if request.get("stream") else kind
+    if path.endswith("/audio/transcriptions"):
+        return "stt"
+    if "/text-to-speech/" in path:
+        return "tts"
+    return f"{method.lower()} {path}"
+
+
+class Interaction(NamedTuple):
+    """One recorded request/response exchange."""
+
+    kind: str
+    status: int
+    headers: Dict[str, str]
+    ttfb: float
+    body: bytes
+    # (seconds since the previous piece, piece) for streamed responses
+    pieces: List[Tuple[float, bytes]]
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "status": self.status,
+            "headers": self.headers,
+            "ttfb": round(self.ttfb, 4),
+            "body": base64.b64encode(self.body).decode("ascii"),
+            "pieces": [[round(gap, 4), base64.b64encode(piece).decode("ascii")] for gap, piece in self.pieces],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Interaction":
+        return cls(
+            kind=data["kind"],
+            status=int(data["status"]),
+            headers=dict(data.get("headers") or {}),
+            ttfb=float(data.get("ttfb", 0.0)),
+            body=base64.b64decode(data.get("body", "")),
+            pieces=[(float(gap), base64.b64decode(piece)) for gap, piece in data.get("pieces") or []],
+        )
+
+
+def load_fixture(path: Union[str, Path]) -> List[Interaction]:
+    """Read the interactions recorded in ``path``."""
+    with open(path, encoding="utf-8") as file:
+        return [Interaction.from_json(json.loads(line)) for line in file if line.strip()]
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """Pass a response body through, noting when each piece arrives."""
+
+    def __init__(self, stream: Any, on_close: Any) -> None:
+        self.stream = stream
+        self.on_close = on_close
+        self.pieces: List[Tuple[float, bytes]] = []
+
+    def __iter__(self) -> Iterator[bytes]:
+        last = time.perf_counter()
+        for piece in self.stream:
+            now = time.perf_counter()
+            self.pieces.append((now - last, piece))
+            last = now
+            yield piece
+
+    def close(self) -> None:
+        self.stream.close()
+        self.on_close(self.pieces)
+
+
+class Recorder:
+    """Record the exchanges of the pooled provider clients (``api.upstream``).
+
+    Installed through the clients' public ``event_hooks``: the request hook
+    notes the start time and asks for an uncompressed body, and the response
+    hook wraps the body stream to time its pieces.
+    """
+
+    def __init__(self) -> None:
+        self.interactions: List[Interaction] = []
+        self._started: Dict[int, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def install(self, providers: Tuple[str, ...] = ("openai", "elevenlabs")) -> None:
+        from api.upstream import get_client
+
+        for provider in providers:
+            hooks = get_client(provider).event_hooks
+            hooks["request"].append(self.on_request)
+            hooks["response"].append(self.on_response)
+
+    def on_request(self, request: httpx.Request) -> None:
+        request.headers["Accept-Encoding"] = "identity"
+        path = request.url.path
+        body = request.read() if path.endswith("/chat/completions") else b""
+        self._started[id(request)] = (time.perf_counter(), request_kind(request.method, path, body))
+
+    def on_response(self, response: httpx.Response) -> None:
+        started, kind = self._started.pop(id(response.request))
+        ttfb = time.perf_counter() - started
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        streamed = response.headers.get("content-type", "").startswith("text/event-stream")
+
+        def on_close(pieces: List[Tuple[float, bytes]]) -> None:
+            body = b"".join(piece for _, piece in pieces)
+            with self._lock:
+                self.interactions.append(
+                    Interaction(kind, response.status_code, headers, ttfb, body, pieces if streamed else [])
+                )
+
+        response.stream = _TimedStream(response.stream, on_close)
+
+    def save(self, path: Union[str, Path]) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            for interaction in self.interactions:
+                file.write(json.dumps(interaction.to_json()) + "\n")
+        os.replace(tmp, path)
+
+
+def record(args: argparse.Namespace) -> None:
+    media_root = tempfile.mkdtemp(prefix="record-media-")
+    # The real providers, from .env; a memory store keeps the sessions local
+    setup_django(SESSION_STORE_BACKEND="memory")
+    from django.conf import settings
+
+    from api import Persona, views
+    from api.session_store import get_session_store
+
+    # Synthesise into a scratch directory so the TTS cache cannot answer
+    settings.MEDIA_ROOT = media_root
+    settings.TTS_CACHE_DIR = Path(media_root, "tts")
+    recorder = Recorder()
+    recorder.install()
+    calls = 0
+    try:
+        for index, stance in enumerate(STANCES[: args.stances]):
+            persona = list(Persona)[index % len(Persona)]
+            sid = get_session_store().create(None)
+            get_session_store().append(sid, "user", stance)
+            messages = views.build_rebuttal_messages(sid, persona)
+            model_response = views.call_openai_chat(messages)
+            list(views.stream_openai_chat(messages))
+            text = model_response.get("rebuttal_text", "")
+            url = views.call_elevenlabs_tts(text)
+            audio = Path(media_root, url[len(settings.MEDIA_URL) :]).read_bytes()
+            views.call_openai_whisper(audio, "audio/mpeg")
+            calls += 4
+            print(f"recorded turn {index + 1}: {stance}", flush=True)
+    finally:
+        recorder.save(args.out)
+        shutil.rmtree(media_root, ignore_errors=True)
+    kinds = sorted({interaction.kind for interaction in recorder.interactions})
+    print(f"{len(recorder.interactions)} exchanges ({calls} calls) of {', '.join(kinds)} saved to {args.out}")
+
+
+class ReplayUpstream(FakeUpstream):
+    """A :class:`FakeUpstream` answering with recorded interactions.
+
+    Args:
+        fixture: Path of a fixture written by ``record``.
+        speed: Divides recorded times to first byte and streaming gaps.
+        **options: :class:`FakeUpstream` options; their latency is added on
+            top of the recorded one.
+    """
+
+    def __init__(self, fixture: Union[str, Path], speed: float = 1.0, **options: Any) -> None:
+        options.setdefault("latency", 0.0)
+        super().__init__(**options)
+        self.fixture = str(fixture)
+        self.speed = speed
+        self.recorded: Dict[str, List[Interaction]] = {}
+        for interaction in load_fixture(fixture):
+            self.recorded.setdefault(interaction.kind, []).append(interaction)
+        self._next: Dict[str, int] = {}
+
+    def command(self) -> List[str]:
+        options = super().command()[3:]
+        return [
+            sys.executable, "-m", "benchmarks.recording", "replay",
+            "--fixture", self.fixture, "--speed", str(self.speed), *options,
+        ]
+
+    def delay_for(self, path: str, body: bytes) -> float:
+        recorded = self.recorded.get(request_kind("POST", path, body))
+        delay = super().delay_for(path, body)
+        if recorded:
+            delay += self._random.choice(recorded).ttfb / self.speed
+        return delay
+
+    def respond(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, str, Union[bytes, List[Any]]]:
+        kind = request_kind(method, path, body)
+        recorded = self.recorded.get(kind)
+        if not recorded:
+            return super().respond(method, path, headers, body)
+        index = self._next.get(kind, 0)
+        self._next[kind] = index + 1
+        interaction = recorded[index % len(recorded)]
+        content_type = interaction.headers.get("content-type", "application/octet-stream")
+        if interaction.pieces:
+            return interaction.status, content_type, [
+                (gap / self.speed if i else 0.0, piece) for i, (gap, piece) in enumerate(interaction.pieces)
+            ]
+        return interaction.status, content_type, interaction.body
+
+
+def replay(args: argparse.Namespace) -> None:
+    server = ReplayUpstream(args.fixture, args.speed, **server_options(args))
+    counts = {kind: len(recorded) for kind, recorded in server.recorded.items()}
+    # stdout's first line is the "listening" banner that start_process waits for
+    print(f"Replaying {json.dumps(counts)}", file=sys.stderr)
+    asyncio.run(server.serve_forever())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="record live provider calls")
+    record_parser.add_argument("--out", default="benchmarks/fixtures/upstream.jsonl")
+    record_parser.add_argument("--stances", type=int, default=3, help=f"debate turns to record (max {len(STANCES)})")
+    replay_parser = commands.add_parser("replay", help="serve a recorded fixture")
+    replay_parser.add_argument("--fixture", required=True)
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster")
+    add_arguments(replay_parser, latency=0.0)
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
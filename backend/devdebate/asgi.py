@@ -0,0 +1,73 @@
+"""
+ASGI config for devdebate project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with any ASGI server, for example::
+
+    uvicorn devdebate.asgi:application --workers 2
+
+Under ASGI the debate endpoints are served by the coroutine views in
+``api.async_views`` (set ``DEVDEBATE_ASYNC_VIEWS=False`` to opt out). The
+wrapper below also answers the ASGI lifespan protocol, which Django does not
+handle itself: on startup the inference backends are created and any local
+models loaded (see ``api.backends``), or with ``WARMUP_ON_BOOT`` the whole
+worker is warmed up (``api.warmup``), and the background job runner is
+started (``api.jobs``); on shutdown the runner hands its unfinished jobs
+back to the queue and pooled upstream clients are closed. WebSocket
+connections, which Django does not serve either, go to the voice channel in
+``api.voice_ws`` (``/ws/voice``).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application  # type: ignore
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "devdebate.settings")
+os.environ.setdefault("DEVDEBATE_ASYNC_VIEWS", "True")
+
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """Route lifespan events and WebSockets locally and everything else to Django."""
+    if scope["type"] == "websocket":
+        from api.voice_ws import websocket_application
+
+        await websocket_application(scope, receive, send)
+        return
+    if scope["type"] == "lifespan":
+        import asyncio
+
+        from django.conf import settings
+
+        from api.backends import warm_backends
+        from api.jobs import get_job_queue
+        from api.upstream import aclose_clients, close_clients
+        from api.views import job_queue
+        from api.warmup import awarm_up
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if settings.WARMUP_ON_BOOT:
+                        await awarm_up()
+                    else:
+                        await asyncio.to_thread(warm_backends)
+                    await asyncio.to_thread(job_queue)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                runner = get_job_queue().runner
+                if runner is not None:
+                    await asyncio.to_thread(runner.stop)
+                await aclose_clients()
+                close_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    await django_application(scope, receive, send)
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack (see ``api/instrument.py``)
+    "api.instrument.InstrumentMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -60,6 +62,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.resilience.TurnDeadlineMiddleware",
 ]
 
 ROOT_URLCONF = "devdebate.urls"
@@ -81,6 +84,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "devdebate.wsgi.application"
+ASGI_APPLICATION = "devdebate.asgi.application"
+
+# Serve the debate endpoints from the coroutine views in ``api/async_views.py``.
+# ``devdebate/asgi.py`` turns this on by default; under WSGI the synchronous
+# views are used.
+ASYNC_VIEWS: bool = os.getenv("DEVDEBATE_ASYNC_VIEWS", "False").lower() in ("1", "true", "yes")
 
 # Database
 # By default this uses SQLite for zero‑config ease of use. You can swap to
@@ -92,6 +101,62 @@ DATABASES = {
     }
 }
 
+# Debate session transcripts (see ``api/session_store.py``). "sqlite" keeps
+# them in the database above (or SESSION_STORE_PATH) so they survive restarts
+# and are shared between workers; "memory" keeps them in-process.
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "")
+SESSION_STORE_TTL = float(os.getenv("SESSION_STORE_TTL", str(7 * 24 * 3600)))
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "10000"))
+
+# Conversation context sent with each rebuttal (see ``api/context.py``):
+# token budget for history, turns always kept verbatim, and how many older
+# turns must accumulate before the background summary is refreshed.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "8"))
+CONTEXT_SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", "4"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "250"))
+CONTEXT_TOKENIZER_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+
+# Extra banned-topic terms, one per line, added to ``api.BANNED_TOPICS``. The
+# file is re-read when it changes (checked every RELOAD_INTERVAL seconds).
+BANNED_TOPICS_FILE = os.getenv("BANNED_TOPICS_FILE", "")
+BANNED_TOPICS_RELOAD_INTERVAL = float(os.getenv("BANNED_TOPICS_RELOAD_INTERVAL", "5"))
+
+# Opt-in cache of first-turn rebuttals (see ``api/response_cache.py``). The
+# semantic tier also serves near-identical stances above the similarity
+# threshold.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "False").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "False").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# Speech-to-text uploads (see ``api/stt_upload.py``). Whisper accepts files
+# up to 25 MB. Uploads are held in memory up to SPOOL_MEMORY_BYTES and on
+# disk beyond it; chunked uploads are kept in UPLOAD_DIR (default: a
+# ``devdebate-stt`` folder in the system temp directory) and deleted after
+# UPLOAD_TTL seconds without a new chunk.
+STT_MAX_UPLOAD_BYTES = int(os.getenv("STT_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+STT_MAX_SECONDS = float(os.getenv("STT_MAX_SECONDS", "300"))
+STT_SPOOL_MEMORY_BYTES = int(os.getenv("STT_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+STT_UPLOAD_DIR = os.getenv("STT_UPLOAD_DIR", "")
+STT_UPLOAD_TTL = float(os.getenv("STT_UPLOAD_TTL", "600"))
+
+# Silence trimming and resampling before transcription (see
+# ``api/audio_prep.py``; needs numpy, and ffmpeg for formats other than WAV).
+# Recordings over PREPROCESS_MAX_BYTES are sent as they are.
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "True").lower() in ("1", "true", "yes")
+STT_PREPROCESS_WORKERS = int(os.getenv("STT_PREPROCESS_WORKERS", "2"))
+STT_PREPROCESS_TIMEOUT = float(os.getenv("STT_PREPROCESS_TIMEOUT", "10"))
+STT_PREPROCESS_MAX_BYTES = int(os.getenv("STT_PREPROCESS_MAX_BYTES", str(10 * 1024 * 1024)))
+STT_PREPROCESS_BITRATE = os.getenv("STT_PREPROCESS_BITRATE", "24k")
+STT_FFMPEG = os.getenv("STT_FFMPEG", "")
+STT_VAD_MARGIN_DB = float(os.getenv("STT_VAD_MARGIN_DB", "12"))
+STT_VAD_FLOOR_DB = float(os.getenv("STT_VAD_FLOOR_DB", "-55"))
+STT_VAD_PADDING = float(os.getenv("STT_VAD_PADDING", "0.2"))
+STT_VAD_MAX_PAUSE = float(os.getenv("STT_VAD_MAX_PAUSE", "0.6"))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -122,6 +187,14 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 # Media files (for storing generated audio)
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# How MEDIA_URL is served (see ``api/media.py``). Files are sent by Django
+# with byte ranges unless MEDIA_OFFLOAD is "x-accel-redirect" (nginx, with
+# an internal location at MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or
+# "x-sendfile" (Apache/lighttpd). Content-addressed TTS files are cached as
+# immutable; anything else for MEDIA_CACHE_MAX_AGE seconds.
+MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").lower()
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", "3600"))
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -134,6 +207,165 @@ CORS_ALLOWED_ORIGINS: List[str] = [
 ]
 CORS_ALLOW_CREDENTIALS = True
 
+# Upstream HTTP clients (see ``api/upstream.py``). One pooled client is kept
+# per provider so keep-alive connections are reused between debate turns.
+# ``rate_limit`` (requests per second, 0 for none) and ``burst`` size the
+# per-key token bucket in ``api/resilience.py``.
+UPSTREAM_PROVIDERS = {
+    "openai": {
+        "base_url": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        "http2": os.getenv("OPENAI_HTTP2", "True").lower() in ("1", "true", "yes"),
+        "rate_limit": float(os.getenv("OPENAI_RATE_LIMIT", "0")),
+        "burst": float(os.getenv("OPENAI_BURST", "10")),
+    },
+    "elevenlabs": {
+        "base_url": os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io/v1"),
+        "http2": os.getenv("ELEVENLABS_HTTP2", "True").lower() in ("1", "true", "yes"),
+        "rate_limit": float(os.getenv("ELEVENLABS_RATE_LIMIT", "0")),
+        "burst": float(os.getenv("ELEVENLABS_BURST", "5")),
+    },
+    # Self-hosted OpenAI-compatible servers for the ``openai_compatible``
+    # backends (llama.cpp's llama-server, vLLM, a Whisper server, ...)
+    "local_llm": {
+        "base_url": os.getenv("LOCAL_LLM_BASE_URL", "http://127.0.0.1:8080/v1"),
+        "http2": False,
+        "rate_limit": 0.0,
+        "burst": 1.0,
+    },
+    "local_stt": {
+        "base_url": os.getenv("LOCAL_STT_BASE_URL", "http://127.0.0.1:8081/v1"),
+        "http2": False,
+        "rate_limit": 0.0,
+        "burst": 1.0,
+    },
+}
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "60"))
+UPSTREAM_WRITE_TIMEOUT = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "60"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5"))
+
+# Retries, circuit breaking and the per-request time budget for provider
+# calls (see ``api/resilience.py``).
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+UPSTREAM_TURN_DEADLINE = float(os.getenv("UPSTREAM_TURN_DEADLINE", "45"))
+
+# Turns of one session run one at a time (see ``api/turns.py``). With
+# ``queue: true`` up to TURN_QUEUE_MAX turns wait per session; any turn waits
+# at most TURN_QUEUE_TIMEOUT seconds for the one before it.
+TURN_QUEUE_MAX = int(os.getenv("TURN_QUEUE_MAX", "2"))
+TURN_QUEUE_TIMEOUT = float(os.getenv("TURN_QUEUE_TIMEOUT", str(UPSTREAM_TURN_DEADLINE)))
+
+# Rebuttals cut off by max_tokens mid-sentence are finished with one
+# continuation request of at most CHAT_CONTINUATION_MAX_TOKENS tokens
+# (see ``api.views.complete_rebuttal``).
+CHAT_CONTINUATION = os.getenv("CHAT_CONTINUATION", "True").lower() in ("1", "true", "yes")
+CHAT_CONTINUATION_MAX_TOKENS = int(os.getenv("CHAT_CONTINUATION_MAX_TOKENS", "200"))
+
+# Panel mode (``/api/panel``): most rebuttals per call, and how many of
+# them are generated at once.
+PANEL_MAX_SEATS = int(os.getenv("PANEL_MAX_SEATS", "8"))
+PANEL_PARALLELISM = int(os.getenv("PANEL_PARALLELISM", "4"))
+
+# Inference backend for each endpoint (see ``api/backends.py``): a registered
+# name or the dotted path of a backend class. "fake" answers instantly (or
+# after FAKE_BACKEND_LATENCY seconds) with canned output, for load tests.
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "openai")
+STT_BACKEND = os.getenv("STT_BACKEND", "openai")
+TTS_BACKEND = os.getenv("TTS_BACKEND", "elevenlabs")
+FAKE_BACKEND_LATENCY = float(os.getenv("FAKE_BACKEND_LATENCY", "0"))
+
+# Local models. LOCAL_LLM_MODEL is the model name for openai_compatible or a
+# GGUF path for llama_cpp; LOCAL_STT_MODEL a faster-whisper size or path;
+# LOCAL_TTS_MODEL a Piper ``.onnx`` voice. In-process models are loaded
+# once in each of LOCAL_MODEL_WORKERS processes (threads: 0 = library default).
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "")
+LOCAL_LLM_CONTEXT = int(os.getenv("LOCAL_LLM_CONTEXT", "4096"))
+LOCAL_STT_MODEL = os.getenv("LOCAL_STT_MODEL", "base.en")
+LOCAL_STT_DEVICE = os.getenv("LOCAL_STT_DEVICE", "cpu")
+LOCAL_STT_COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+LOCAL_STT_LANGUAGE = os.getenv("LOCAL_STT_LANGUAGE", "")
+LOCAL_TTS_MODEL = os.getenv("LOCAL_TTS_MODEL", "")
+LOCAL_MODEL_WORKERS = int(os.getenv("LOCAL_MODEL_WORKERS", "1"))
+LOCAL_MODEL_THREADS = int(os.getenv("LOCAL_MODEL_THREADS", "0"))
+
+# Request instrumentation (see ``api/instrument.py``): per-phase timings in a
+# Server-Timing response header, and opt-in profiling of requests that send
+# ``X-Profile: <PROFILE_TOKEN>`` (empty disables it). Reports are written to
+# PROFILE_DIR (default: a ``devdebate-profiles`` folder in the temp directory).
+SERVER_TIMING = os.getenv("SERVER_TIMING", "True").lower() in ("1", "true", "yes")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+# WebSocket voice channel (see ``api/voice_ws.py``, served by
+# ``devdebate/asgi.py``): its path, and how many bytes of audio may be sent
+# ahead of the client's acknowledgements.
+VOICE_WS_PATH = os.getenv("VOICE_WS_PATH", "/ws/voice")
+VOICE_WS_AUDIO_WINDOW = int(os.getenv("VOICE_WS_AUDIO_WINDOW", str(256 * 1024)))
+
+# Streaming TTS (see ``api/tts_stream.py``): how many sentences are
+# synthesised at once, and the longest segment sent in one request.
+TTS_STREAM_PARALLELISM = int(os.getenv("TTS_STREAM_PARALLELISM", "3"))
+TTS_SENTENCE_MAX_CHARS = int(os.getenv("TTS_SENTENCE_MAX_CHARS", "250"))
+
+# Content-addressed TTS audio cache (see ``api/tts_cache.py``). Must live
+# under MEDIA_ROOT so cached files can be served from MEDIA_URL.
+TTS_CACHE_DIR = MEDIA_ROOT / "tts"
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Negotiated TTS audio formats (see ``api/audio_formats.py``): the format
+# sent to clients that ask for none (mp3, mp3_low, opus, webm or pcm), and
+# the ffmpeg processes transcoding formats the TTS backend cannot produce.
+TTS_AUDIO_FORMAT = os.getenv("TTS_AUDIO_FORMAT", "mp3")
+TTS_TRANSCODE_WORKERS = int(os.getenv("TTS_TRANSCODE_WORKERS", "2"))
+TTS_TRANSCODE_TIMEOUT = float(os.getenv("TTS_TRANSCODE_TIMEOUT", "30"))
+
+# Pre-synthesised persona stock lines (see ``api/persona_assets.py``), built
+# by ``manage.py warmup --build-assets`` in each listed format and voice.
+# Must live under MEDIA_ROOT so the files can be served from MEDIA_URL.
+PERSONA_ASSETS_DIR = Path(os.getenv("PERSONA_ASSETS_DIR", str(MEDIA_ROOT / "persona")))
+PERSONA_ASSET_FORMATS: List[str] = [
+    f.strip() for f in os.getenv("PERSONA_ASSET_FORMATS", "mp3").split(",") if f.strip()
+]
+PERSONA_ASSET_VOICE = os.getenv("PERSONA_ASSET_VOICE", "Rachel")
+
+# Warm-up before the first request (see ``api/warmup.py``): run it when a
+# worker boots (``devdebate/wsgi.py``, the ASGI lifespan) and open this many
+# connections to each upstream provider in use.
+WARMUP_ON_BOOT = os.getenv("WARMUP_ON_BOOT", "False").lower() in ("1", "true", "yes")
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+
+# Background TTS/STT jobs (see ``api/jobs.py``). The queue lives in the
+# session store's SQLite file unless JOB_QUEUE_PATH is set. Recordings of
+# transcription jobs wait in JOB_UPLOAD_DIR (default: a
+# ``devdebate-job-uploads`` folder in the temp directory; point it at
+# persistent storage for queued jobs to survive a reboot). At most
+# JOB_PROVIDER_CONCURRENCY[provider] jobs of a provider run at once on this
+# host (JOB_DEFAULT_CONCURRENCY for providers not listed). Callbacks are
+# only sent to JOB_CALLBACK_HOSTS, signed with JOB_CALLBACK_SECRET if set.
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "")
+JOB_UPLOAD_DIR = os.getenv("JOB_UPLOAD_DIR", "")
+JOB_PROVIDER_CONCURRENCY = {
+    "elevenlabs": int(os.getenv("ELEVENLABS_JOB_CONCURRENCY", "4")),
+    "openai": int(os.getenv("OPENAI_JOB_CONCURRENCY", "4")),
+}
+JOB_DEFAULT_CONCURRENCY = int(os.getenv("JOB_DEFAULT_CONCURRENCY", "2"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+JOB_CALLBACK_HOSTS: List[str] = [h for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h]
+JOB_CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET", "")
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+
 """
 Messaging
 ---------
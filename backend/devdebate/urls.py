@@ -14,10 +14,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from api import async_views as api_async_views
+from api import views as api_views
+
+media_views = api_async_views if settings.ASYNC_VIEWS else api_views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
+    # Prometheus scrape endpoint, at the conventional path
+    path("metrics", api_views.prometheus_metrics, name="metrics"),
+    # Generated audio, with byte ranges (see api/media.py)
+    re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.+)$", media_views.serve_media, name="media"),
 ]
\ No newline at end of file
@@ -2,6 +2,14 @@
 WSGI config for devdebate project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Loading it has no side effects beyond Django's own set-up: the background job
+runner (see ``api/jobs.py``) starts with the first request each process
+serves, so management commands and ``gunicorn --preload`` never open the
+queue or start threads in the wrong process. With ``WARMUP_ON_BOOT`` each
+process is instead warmed up as it loads (see ``api/warmup.py``) and starts
+its runner straight away, so jobs queued before a restart resume without
+waiting for a request. Under ``--preload`` do that in a ``post_fork`` hook
+(``api.warmup.warm_up()`` and ``api.views.job_queue()``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/stable/howto/deployment/wsgi/
@@ -13,4 +21,22 @@ from django.core.wsgi import get_wsgi_application  # type: ignore
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "devdebate.settings")
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+from django.conf import settings  # noqa: E402
+from django.core.signals import request_started  # noqa: E402
+
+from api.views import job_queue  # noqa: E402
+from api.warmup import warm_up  # noqa: E402
+
+
+def start_job_runner(**kwargs):
+    """Start this process's job runner with its first request, then stop listening."""
+    request_started.disconnect(start_job_runner)
+    job_queue()
+
+
+if settings.WARMUP_ON_BOOT:
+    warm_up()
+    job_queue()
+else:
+    request_started.connect(start_job_runner)